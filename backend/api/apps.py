@@ -1,3 +1,5 @@
+import os
+
 from django.apps import AppConfig
 
 
@@ -5,3 +7,13 @@ class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
 
+    def ready(self):
+        if os.getenv("VERTEX_CASSETTE_MODE"):
+            from .services import cassette
+
+            cassette.install_from_env()
+        # Opt-in: start building the Google clients while the server binds its port
+        if os.getenv("WARMUP_ON_START", "false").lower() == "true":
+            from .services import warmup
+
+            warmup.start_background()
@@ -0,0 +1,209 @@
+"""Native async versions of the model-backed endpoints.
+
+Under ASGI (uvicorn) these views await Vertex, Speech/TTS and Firestore
+instead of parking a worker thread for the length of a Gemini call, so one
+worker can hold as many in-flight model calls as ``MODEL_MAX_CONCURRENCY``
+allows. They accept the same payloads and return the same JSON as the DRF
+views in ``views.py``; plain Django views are used because DRF's ``APIView``
+is sync-only.
+"""
+import asyncio
+import json
+import logging
+import math
+from typing import Any, Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .auth import OptionalFirebaseAuthentication
+from .serializers import VoiceQnASerializer
+from .services import admission, analysis, analysis_stream, context, documents, firestore, gcs, vertex
+
+logger = logging.getLogger(__name__)
+
+
+def _api_error(exc: APIException) -> JsonResponse:
+    resp = JsonResponse({"detail": str(exc.detail)}, status=exc.status_code)
+    wait = getattr(exc, "wait", None)
+    if wait:
+        resp["Retry-After"] = str(math.ceil(wait))
+    return resp
+
+
+async def _user_id(request) -> Optional[str]:
+    """Firebase uid when a valid bearer token is sent; anonymous otherwise, as in the sync views."""
+    if not request.META.get("HTTP_AUTHORIZATION", "").startswith("Bearer "):
+        return None
+    authenticated = await sync_to_async(OptionalFirebaseAuthentication().authenticate)(request)
+    return getattr(authenticated[0], "uid", None) if authenticated else None
+
+
+def _json_body(request) -> Dict[str, Any]:
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def _analysis_document(request, user_id: Optional[str], document_id: str):
+    """The document to analyze, or the error response."""
+    try:
+        document = await firestore.get_document_async(user_id, document_id)
+    except PermissionError:
+        return JsonResponse({"error": "Document not found"}, status=status.HTTP_404_NOT_FOUND)
+    if not document.get("gcsPath"):
+        return JsonResponse({"error": "Document path missing"}, status=status.HTTP_400_BAD_REQUEST)
+    return document
+
+
+async def _analysis_uri(document: Dict[str, Any]):
+    """The model-readable URI of the document (Word files are converted), or the error response."""
+    gcs_path, content_type = document["gcsPath"], document.get("contentType")
+    if not documents.is_word_document(gcs_path, content_type):
+        return gcs.path_to_uri(gcs_path)
+    try:
+        return await asyncio.to_thread(documents.analysis_uri, gcs_path, content_type)
+    except ImportError:
+        return JsonResponse(
+            {"error": "Word file conversion not available on server (python-docx missing)"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+
+@csrf_exempt
+@require_GET
+async def analyze(request, document_id: str):
+    try:
+        fields = analysis.parse_fields(request.GET.get("fields"))
+        language = analysis.parse_language(request.GET.get("language"))
+        user_id = await _user_id(request)
+        key = admission.user_key_for(user_id, request)
+        document = await _analysis_document(request, user_id, document_id)
+        if isinstance(document, JsonResponse):
+            return document
+        todo = analysis.missing(document, fields)
+        # The same content was analyzed before (a repeat upload)
+        if todo and await asyncio.to_thread(analysis.reuse, document_id, document):
+            todo = []
+        # Only parts that need the model are charged; stored answers are free
+        await admission.athrottle(key, cost=analysis.model_calls(document, fields, todo, language))
+        if todo:
+            gcs_uri = await _analysis_uri(document)
+            if isinstance(gcs_uri, JsonResponse):
+                return gcs_uri
+            # The selected calls are independent, so they run concurrently
+            await analysis.compute_async(document_id, document, gcs_uri, todo, key)
+        await analysis.translate_async(document_id, document, fields, language, key)
+    except APIException as e:
+        return _api_error(e)
+    except Exception as e:
+        logger.error(f"Async analysis failed for {document_id}: {str(e)}")
+        return JsonResponse({"error": "Analysis failed", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    body = analysis.result(document_id, document, fields, language)
+    tag = analysis.etag(body)
+    if analysis.not_modified(request.META.get("HTTP_IF_NONE_MATCH"), tag):
+        resp = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        resp = JsonResponse(body)
+    resp["ETag"] = tag
+    resp["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+@csrf_exempt
+@require_GET
+async def analyze_stream(request, document_id: str):
+    """Async ``analyze`` as server-sent events; see ``analysis_stream``."""
+    try:
+        user_id = await _user_id(request)
+        key = admission.user_key_for(user_id, request)
+        document = await _analysis_document(request, user_id, document_id)
+        if isinstance(document, JsonResponse):
+            return document
+        todo = analysis.missing(document, analysis.FIELDS)
+        if not todo or await asyncio.to_thread(analysis.reuse, document_id, document):
+            events = analysis_stream.stored_events(document_id, document)
+        else:
+            await admission.athrottle(key, cost=len(todo))
+            gcs_uri = await _analysis_uri(document)
+            if isinstance(gcs_uri, JsonResponse):
+                return gcs_uri
+            events = analysis_stream.astream(document_id, document, gcs_uri, key)
+    except APIException as e:
+        return _api_error(e)
+    resp = StreamingHttpResponse(events, content_type="text/event-stream")
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"
+    return resp
+
+
+@csrf_exempt
+@require_POST
+async def chat(request):
+    # Accept { "message": "..." } or { "messages": [...], "document_id"?: str }
+    data = _json_body(request)
+    messages = data.get("messages")
+    document_id = data.get("document_id")
+    if not messages:
+        message = (data.get("message") or "").strip()
+        if not message:
+            return JsonResponse({"error": "'message' is required"}, status=status.HTTP_400_BAD_REQUEST)
+        messages = [{"role": "user", "content": message}]
+
+    try:
+        user_id = await _user_id(request)
+        key = admission.user_key_for(user_id, request)
+        await admission.athrottle(key)
+        context_uri = None
+        if document_id:
+            try:
+                doc = await firestore.get_document_async(user_id, document_id)
+                context_uri = gcs.path_to_uri(doc.get("gcsPath") or "") or None
+            except PermissionError:
+                context_uri = None
+        with context.request_scope(priority=context.INTERACTIVE, user=key,
+                                   document=document_id if context_uri else None):
+            reply_text = await vertex.chat_with_gemini_async(messages, context_uri)
+    except APIException as e:
+        return _api_error(e)
+    except Exception as e:
+        logger.exception(f"Async chat failed: {str(e)}")
+        return JsonResponse({"error": "Failed to get reply from Vertex AI"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return JsonResponse({"reply": reply_text or ""})
+
+
+@csrf_exempt
+@require_POST
+async def voice_qna(request):
+    serializer = VoiceQnASerializer(data=_json_body(request))
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+    language = data.get("language", "en")
+    question = data.get("question", "")
+    audio_b64 = data.get("audio_base64", "")
+
+    try:
+        key = admission.user_key_for(await _user_id(request), request)
+        await admission.athrottle(key)
+        with context.request_scope(priority=context.INTERACTIVE, user=key):
+            if not question and audio_b64:
+                question = await vertex.stt_transcribe_async(audio_b64, language=language)
+            answer = await vertex.answer_question_async(context_uri="", question=question, language=language)
+            answer_audio_b64 = await vertex.tts_synthesize_async(answer, language=language)
+    except APIException as e:
+        return _api_error(e)
+
+    return JsonResponse({
+        "question": question,
+        "answer": answer,
+        "answer_audio_base64": answer_audio_b64,
+    })
@@ -1,19 +1,35 @@
 import json
+import logging
 import os
 from typing import Optional, Tuple
 
-import firebase_admin
-from firebase_admin import auth as fb_auth, credentials
 from rest_framework import authentication, exceptions
 
+logger = logging.getLogger(__name__)
+
 _initialized = False
+# Replacement for Firebase token verification (benchmarks only); see install_verifier()
+_verifier = None
+
+
+def install_verifier(verify=None) -> None:
+    """Verify bearer tokens with ``verify(token) -> claims`` instead of Firebase.
+
+    Only the offline benchmark server calls this. Call with no arguments to
+    restore Firebase verification.
+    """
+    global _verifier
+    _verifier = verify
 
 
 def _ensure_firebase_initialized() -> None:
     global _initialized
     if _initialized:
         return
-        
+    # Imported on first use so the admin SDK stays out of process startup
+    import firebase_admin
+    from firebase_admin import credentials
+
     creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     try:
         if creds_path and os.path.exists(creds_path):
@@ -37,11 +53,32 @@ class FirebaseAuthentication(authentication.BaseAuthentication):
             raise exceptions.AuthenticationFailed("Missing bearer token")
         token = auth_header.split(" ", 1)[1]
         try:
-            _ensure_firebase_initialized()
-            decoded = fb_auth.verify_id_token(token)
+            if _verifier is not None:
+                decoded = _verifier(token)
+            else:
+                _ensure_firebase_initialized()
+                from firebase_admin import auth as fb_auth
+
+                decoded = fb_auth.verify_id_token(token)
             uid = decoded.get("uid")
             user = type("FirebaseUser", (), {"uid": uid, "is_authenticated": True})()
             return user, None
         except Exception as exc:  # noqa: BLE001
             raise exceptions.AuthenticationFailed("Invalid Firebase token") from exc
 
+
+class OptionalFirebaseAuthentication(FirebaseAuthentication):
+    """Firebase auth for endpoints that also serve anonymous users.
+
+    No bearer token, or one that does not verify (e.g. expired), means
+    anonymous rather than a 401: the token only links the request to a user.
+    """
+
+    def authenticate(self, request) -> Optional[Tuple[object, None]]:
+        if not request.META.get("HTTP_AUTHORIZATION", "").startswith("Bearer "):
+            return None
+        try:
+            return super().authenticate(request)
+        except exceptions.AuthenticationFailed as exc:
+            logger.info(f"Ignoring invalid optional bearer token: {exc.__cause__ or exc}")
+            return None
@@ -0,0 +1,104 @@
+"""Local stand-in for Cloud Storage resumable uploads.
+
+``gcs.create_upload_session`` hands out URLs to this view when there is no
+Cloud Storage bucket (local dev, benchmark fakes). It follows the same
+protocol as a GCS resumable session, so clients need no special case:
+
+* ``PUT`` the whole file, or consecutive chunks with
+  ``Content-Range: bytes <first>-<last>/<total>``;
+* an unfinished upload answers ``308`` with ``Range: bytes=0-<last received>``;
+* ``PUT`` with ``Content-Range: bytes */<total>`` and no body asks how much
+  has been received, to resume after a dropped connection;
+* a chunk whose ``Content-Range`` does not match its length or the declared
+  size is rejected with ``400``.
+
+Chunks are streamed to the partial file as they are read, rather than through
+``request.body`` (capped by ``DATA_UPLOAD_MAX_MEMORY_SIZE``), so the client's
+8 MiB chunks are accepted.
+
+The finished file is written through ``gcs``. Partial uploads are kept in the
+temp directory; upload URLs expire after ``UPLOAD_SESSION_TTL_S``.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core import signing
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+
+from .services import gcs
+
+_CONTENT_RANGE = re.compile(r"bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)")
+_READ_BYTES = 1024 * 1024
+
+
+def _session_ttl() -> int:
+    return int(os.getenv("UPLOAD_SESSION_TTL_S", "86400"))
+
+
+def _partial_path(token: str) -> str:
+    folder = os.path.join(tempfile.gettempdir(), "legalease-uploads")
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, hashlib.sha256(token.encode()).hexdigest())
+
+
+def _incomplete(received: int) -> HttpResponse:
+    resp = HttpResponse(status=308)
+    if received:
+        resp["Range"] = f"bytes=0-{received - 1}"
+    return resp
+
+
+@csrf_exempt
+def resumable_upload(request, token: str):
+    if request.method != "PUT":
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED, headers={"Allow": "PUT"})
+    try:
+        session = signing.loads(token, salt=gcs.LOCAL_UPLOAD_SALT, max_age=_session_ttl())
+    except signing.BadSignature:
+        return JsonResponse({"error": "Invalid or expired upload URL"}, status=status.HTTP_404_NOT_FOUND)
+
+    size = session["size"]
+    partial = _partial_path(token)
+    received = os.path.getsize(partial) if os.path.exists(partial) else 0
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return JsonResponse({"error": "Invalid Content-Length"}, status=status.HTTP_400_BAD_REQUEST)
+    match = _CONTENT_RANGE.fullmatch(request.META.get("HTTP_CONTENT_RANGE", "").strip())
+    if match and match.group(1) is None:
+        return _incomplete(received)  # status query
+    first = int(match.group(1)) if match else 0
+    if match and (int(match.group(2)) - first + 1 != length
+                  or (match.group(3) != "*" and int(match.group(3)) != size)):
+        return JsonResponse({"error": "Content-Range does not match the body or the declared size"},
+                            status=status.HTTP_400_BAD_REQUEST)
+    if first != received:
+        # Out of step with what we have; the client resumes from the Range we report
+        return _incomplete(received)
+    if received + length > size:
+        return JsonResponse({"error": "More bytes than the declared size"}, status=status.HTTP_400_BAD_REQUEST)
+
+    with open(partial, "ab") as f:
+        written = 0
+        while written < length:
+            chunk = request.read(min(_READ_BYTES, length - written))
+            if not chunk:
+                break
+            f.write(chunk)
+            written += len(chunk)
+        if written != length:
+            # The connection dropped mid-chunk: keep only whole chunks, the client resumes from there
+            f.truncate(received)
+            return _incomplete(received)
+    received += length
+    if received < size:
+        return _incomplete(received)
+
+    with open(partial, "rb") as f:
+        gcs.upload_file(f, session["path"], session["type"])
+    os.remove(partial)
+    return JsonResponse({"name": session["path"], "size": size})
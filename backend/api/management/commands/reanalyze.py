@@ -0,0 +1,44 @@
+"""``manage.py reanalyze``: re-run the analysis of stored documents as a batch job."""
+import itertools
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services import analysis, batch, firestore
+
+
+class Command(BaseCommand):
+    help = ("Re-analyze stored documents with Vertex AI batch prediction (or the local stand-in runner) "
+            "and store the results over their current analyses.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fields", default=",".join(analysis.FIELDS),
+                            help="Comma-separated parts to recompute (default: all).")
+        parser.add_argument("--user", help="Only this user's documents.")
+        parser.add_argument("--category", help="Only documents in this category.")
+        parser.add_argument("--limit", type=int, help="At most this many documents.")
+        parser.add_argument("--model", help="Use this model for every part instead of the routed ones.")
+        parser.add_argument("--runner", choices=("vertex", "local"),
+                            help="Job runner (default: BATCH_RUNNER, or vertex when GCP is configured).")
+        parser.add_argument("--prefix", help="Storage prefix for the job files (default: BATCH_PREFIX/<timestamp>).")
+        parser.add_argument("--poll-interval", type=float, default=30.0, help="Seconds between job status checks.")
+        parser.add_argument("--timeout", type=float, default=24 * 3600.0, help="Give up waiting after this long.")
+
+    def handle(self, *args, **options):
+        try:
+            fields = analysis.parse_fields(options["fields"])
+        except analysis.InvalidFields as e:
+            raise CommandError(str(e.detail))
+        runner = batch.get_runner(options["runner"])
+
+        records = firestore.iter_documents(user_id=options["user"], category=options["category"])
+        if options["limit"]:
+            records = itertools.islice(records, options["limit"])
+        try:
+            stats = batch.run(records, fields, runner=runner, model=options["model"], prefix=options["prefix"],
+                              poll_interval=options["poll_interval"], timeout=options["timeout"],
+                              log=self.stdout.write)
+        except TimeoutError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {stats['updated']} of {stats['documents']} document(s) with {stats['requests']} request(s); "
+            f"{stats['failed']} failed, {stats['skipped']} skipped."))
@@ -0,0 +1,48 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .services import metrics
+
+
+class ServerTimingMiddleware:
+    """Collect per-stage timings for each request and report them in ``Server-Timing``.
+
+    Also records the request duration by route pattern (not raw path, to keep
+    the label set bounded) for the ``/metrics`` histogram.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        token = metrics.begin_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            entries = metrics.end_request(token)
+        return self._finish(request, response, entries, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        token = metrics.begin_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            entries = metrics.end_request(token)
+        return self._finish(request, response, entries, time.perf_counter() - start)
+
+    def _finish(self, request, response, entries, elapsed: float):
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match is not None else "unmatched"
+        metrics.REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=str(response.status_code))
+        response["Server-Timing"] = metrics.server_timing(entries, elapsed)
+        return response
@@ -1,11 +1,36 @@
 from rest_framework import serializers
 
+from .services import uploads
+
+CATEGORIES = ["Bank", "Health", "School/College", "Government", "Other"]
+
 
 class UploadSerializer(serializers.Serializer):
-    category = serializers.ChoiceField(choices=["Bank", "Health", "School/College", "Government", "Other"])
+    category = serializers.ChoiceField(choices=CATEGORIES)
     file = serializers.FileField()
 
 
+class UploadSessionSerializer(serializers.Serializer):
+    category = serializers.ChoiceField(choices=CATEGORIES)
+    filename = serializers.CharField(max_length=255)
+    content_type = serializers.CharField(max_length=255, default="application/octet-stream")
+    size = serializers.IntegerField(min_value=1)
+    sha256 = serializers.RegexField(r"^[0-9a-f]{64}$", required=False)
+    md5 = serializers.RegexField(r"^[A-Za-z0-9+/]{22}==$", required=False)  # base64, as storage reports it
+
+    def validate_size(self, value: int) -> int:
+        if value > uploads.max_bytes():
+            raise serializers.ValidationError(f"Files up to {uploads.max_bytes()} bytes are accepted.")
+        return value
+
+
+class DocumentListSerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    cursor = serializers.CharField(required=False)
+    category = serializers.ChoiceField(choices=CATEGORIES, required=False)
+    status = serializers.ChoiceField(choices=[uploads.PENDING, uploads.UPLOADED], required=False)
+
+
 class AnalyzeRequestSerializer(serializers.Serializer):
     document_id = serializers.CharField()
 
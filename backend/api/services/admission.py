@@ -0,0 +1,312 @@
+"""Admission control for model-backed endpoints.
+
+Two independent limits protect the shared Vertex quota:
+
+* a token bucket per user (or client IP when unauthenticated), applied by
+  ``ModelCallThrottle`` before the view runs;
+* a global cap on concurrent outbound model calls, taken by ``model_slot()``
+  around each Vertex/Speech/TTS request. Within a process the slots are
+  handed out by the priority scheduler (see ``scheduler.py``).
+
+Requests over either limit wait up to ``ADMISSION_QUEUE_TIMEOUT_MS`` and are
+then rejected with a 429 carrying ``Retry-After``. State lives in process by
+default; ``ADMISSION_BACKEND=cache`` keeps it in the Django cache instead so
+several workers share one budget (configure a shared ``CACHES`` backend such
+as Redis or Memcached for that to be meaningful).
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from . import context, metrics, scheduler
+
+
+class AdmissionRejected(Throttled):
+    default_detail = "Too many model requests. Please retry shortly."
+
+
+def _config() -> Dict[str, float]:
+    return {
+        "rate_per_minute": float(os.getenv("MODEL_RATE_PER_MINUTE", "20")),
+        "burst": float(os.getenv("MODEL_BURST", "10")),
+        "queue_timeout": int(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "2000")) / 1000,
+        "max_concurrency": int(os.getenv("MODEL_MAX_CONCURRENCY", "8")),
+    }
+
+
+class LocalBackend:
+    """In-process token buckets and concurrency counter."""
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._in_flight = 0
+
+    def take(self, key: str, rate_per_sec: float, burst: float, cost: float = 1) -> float:
+        """Consume ``cost`` tokens; return 0 on success or seconds until enough are available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate_per_sec)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._prune(now, rate_per_sec, burst)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate_per_sec if rate_per_sec > 0 else math.inf
+
+    def _prune(self, now: float, rate_per_sec: float, burst: float) -> None:
+        # Buckets that have refilled completely carry no state worth keeping
+        full = [k for k, (tokens, updated) in self._buckets.items() if tokens + (now - updated) * rate_per_sec >= burst]
+        for k in full:
+            del self._buckets[k]
+
+    def acquire(self, limit: int, timeout: float) -> Optional[str]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight >= limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            self._in_flight += 1
+        return "local"
+
+    def release(self, _token: str) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def in_flight(self) -> int:
+        return self._in_flight
+
+
+class CacheBackend:
+    """Shared state in the Django cache.
+
+    The bucket is approximated with a fixed window of ``burst`` requests per
+    ``burst / rate`` seconds, which only needs the atomic ``add``/``incr`` that
+    Redis and Memcached provide. Concurrency slots are counted the same way and
+    expire after ``SLOT_TTL`` seconds so a crashed worker cannot leak them.
+    """
+
+    SLOT_TTL = 300
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, alias: str = "default", prefix: str = "admission"):
+        from django.core.cache import caches
+
+        self._cache = caches[alias]
+        self._prefix = prefix
+
+    def take(self, key: str, rate_per_sec: float, burst: float, cost: float = 1) -> float:
+        window = burst / rate_per_sec if rate_per_sec > 0 else 60.0
+        now = time.time()
+        window_start = math.floor(now / window) * window
+        cache_key = f"{self._prefix}:bucket:{key}:{int(window_start)}"
+        self._cache.add(cache_key, 0, timeout=int(window) + 1)
+        used = self._cache.incr(cache_key, int(cost))
+        if used <= burst:
+            return 0.0
+        return window_start + window - now
+
+    def acquire(self, limit: int, timeout: float) -> Optional[str]:
+        key = f"{self._prefix}:in_flight"
+        deadline = time.monotonic() + timeout
+        while True:
+            self._cache.add(key, 0, timeout=self.SLOT_TTL)
+            if self._cache.incr(key) <= limit:
+                self._cache.touch(key, self.SLOT_TTL)
+                return uuid.uuid4().hex
+            self._cache.decr(key)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.POLL_INTERVAL)
+
+    def release(self, _token: str) -> None:
+        try:
+            self._cache.decr(f"{self._prefix}:in_flight")
+        except ValueError:
+            pass  # Counter expired while the call was running
+
+    def in_flight(self) -> int:
+        return int(self._cache.get(f"{self._prefix}:in_flight", 0))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                kind = os.getenv("ADMISSION_BACKEND", "local").lower()
+                _backend = CacheBackend() if kind == "cache" else LocalBackend()
+    return _backend
+
+
+def reset() -> None:
+    """Drop all admission state (used by tests and the benchmark harness)."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+    scheduler.reset()
+
+
+def user_key(request) -> str:
+    """Stable identity for quotas and fairness: Firebase uid, else client IP."""
+    return user_key_for(getattr(getattr(request, "user", None), "uid", None), request)
+
+
+def user_key_for(uid: Optional[str], request) -> str:
+    """``user_key`` for a uid resolved by the caller (async views, which DRF does not authenticate)."""
+    return f"user:{uid}" if uid else f"ip:{BaseThrottle().get_ident(request)}"
+
+
+@contextmanager
+def model_slot() -> Iterator[None]:
+    """Hold one of the outbound model-call slots for the duration of the block.
+
+    The slot is scheduled under the priority class and user of the current
+    request context, then counted against the (possibly shared) backend.
+    """
+    config = _config()
+    ctx = context.current()
+    sched = scheduler.get_scheduler()
+    try:
+        with metrics.stage("scheduler.wait"):
+            sched.acquire(ctx.priority, ctx.user or "anonymous")
+    except scheduler.SchedulerTimeout as e:
+        raise AdmissionRejected(wait=max(1, e.waited))
+    try:
+        backend = get_backend()
+        token = backend.acquire(int(config["max_concurrency"]), config["queue_timeout"])
+        if token is None:
+            raise AdmissionRejected(wait=max(1, config["queue_timeout"]))
+        try:
+            yield
+        finally:
+            backend.release(token)
+    finally:
+        sched.release(ctx.priority)
+
+
+@asynccontextmanager
+async def amodel_slot() -> AsyncIterator[None]:
+    """Coroutine version of ``model_slot`` for the async views."""
+    config = _config()
+    ctx = context.current()
+    sched = scheduler.get_scheduler()
+    try:
+        with metrics.stage("scheduler.wait"):
+            await sched.aacquire(ctx.priority, ctx.user or "anonymous")
+    except scheduler.SchedulerTimeout as e:
+        raise AdmissionRejected(wait=max(1, e.waited))
+    try:
+        backend = get_backend()
+        limit = int(config["max_concurrency"])
+        if isinstance(backend, LocalBackend):
+            # The scheduler already caps local concurrency, so this never waits
+            token = backend.acquire(limit, 0)
+        else:
+            token = await asyncio.to_thread(backend.acquire, limit, config["queue_timeout"])
+        if token is None:
+            raise AdmissionRejected(wait=max(1, config["queue_timeout"]))
+        try:
+            yield
+        finally:
+            backend.release(token)
+    finally:
+        sched.release(ctx.priority)
+
+
+def _take(key: str, cost: float) -> float:
+    """Take ``cost`` tokens for ``key``, sleeping while the wait is within the queue timeout.
+
+    Returns 0 once taken, else how long the caller should wait before retrying.
+    """
+    config = _config()
+    rate = config["rate_per_minute"] / 60
+    cost = min(cost, config["burst"])
+    backend = get_backend()
+    deadline = time.monotonic() + config["queue_timeout"]
+    while True:
+        wait = backend.take(key, rate, config["burst"], cost)
+        if wait <= 0:
+            return 0.0
+        if time.monotonic() + wait > deadline:
+            return wait if math.isfinite(wait) else 60.0
+        time.sleep(wait)
+
+
+def throttle(request, cost: float = 1) -> None:
+    """Apply the per-user token bucket from a sync view once its cost is known; raises ``AdmissionRejected``.
+
+    A cost of 0 (everything answered from storage) takes nothing.
+    """
+    if cost <= 0:
+        return
+    wait = _take(user_key(request), cost)
+    if wait:
+        raise AdmissionRejected(wait=wait)
+
+
+async def athrottle(key: str, cost: float = 1) -> None:
+    """Apply the token bucket of ``key`` (see ``user_key_for``) from an async view; raises ``AdmissionRejected``."""
+    if cost <= 0:
+        return
+    config = _config()
+    rate = config["rate_per_minute"] / 60
+    cost = min(cost, config["burst"])
+    backend = get_backend()
+    deadline = time.monotonic() + config["queue_timeout"]
+    while True:
+        if isinstance(backend, LocalBackend):
+            wait = backend.take(key, rate, config["burst"], cost)
+        else:
+            wait = await asyncio.to_thread(backend.take, key, rate, config["burst"], cost)
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise AdmissionRejected(wait=wait if math.isfinite(wait) else 60.0)
+        await asyncio.sleep(wait)
+
+
+class ModelCallThrottle(BaseThrottle):
+    """Per-user token bucket for endpoints that call the model.
+
+    Views may set ``model_call_cost`` when one request fans out into several
+    model calls; views whose cost depends on stored state call ``throttle``
+    themselves instead. A request that would have to wait less than the
+    queue timeout for tokens sleeps instead of being rejected.
+    """
+
+    def __init__(self):
+        self._wait: Optional[float] = None
+
+    def get_key(self, request) -> str:
+        return user_key(request)
+
+    def allow_request(self, request, view) -> bool:
+        wait = _take(self.get_key(request), getattr(view, "model_call_cost", 1))
+        if wait:
+            self._wait = wait
+            return False
+        return True
+
+    def wait(self) -> Optional[float]:
+        return self._wait
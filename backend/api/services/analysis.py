@@ -0,0 +1,274 @@
+"""Document analysis stored part by part on the document record.
+
+The analyze endpoints accept ``?fields=summary,risks,glossary`` (all three by
+default) and compute only the requested parts that are not stored yet, so a
+document card that needs the summary costs one model call instead of three.
+Each part is kept in its own field of the document record, along with the
+version change report, so a revisit is answered from the single document read
+the endpoint makes anyway. Complete analyses are also stored by content
+(``blobs``) for repeat uploads of the same file.
+
+``?language=hi|ta|te`` returns the analysis in that language. The document
+is analyzed once, in English; other languages are translations of the stored
+English parts by a cheap model (``vertex.translate_analysis``), kept per
+language on the record and, by content, in the blob index. Only the parts a
+language does not have yet are translated, so each additional language costs
+one small text call rather than a re-analysis. The change report stays in
+English.
+
+Responses carry an ``ETag`` of their content and honor ``If-None-Match``.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import blobs, clauses, context, firestore, glossary, longdoc, versions, vertex
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("summary", "risks", "glossary")
+
+# Document record field holding each part
+_STORED = {"summary": "analysisSummary", "risks": "analysisRisks", "glossary": "analysisGlossary"}
+_CHANGES = "analysisChanges"
+# Translated parts per language: {"hi": {"summary": ...}, ...}
+_TRANSLATIONS = "analysisTranslations"
+
+# Languages the analysis (and voice Q&A) can be given in
+LANGUAGES = {"en": "English", "hi": "Hindi", "ta": "Tamil", "te": "Telugu"}
+
+
+class InvalidFields(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = f"fields must be a comma-separated subset of {','.join(FIELDS)}."
+    default_code = "invalid_fields"
+
+
+def parse_fields(value: Optional[str]) -> Tuple[str, ...]:
+    """The parts selected by a ``fields`` query parameter, in canonical order."""
+    if not value:
+        return FIELDS
+    selected = {f.strip() for f in value.split(",") if f.strip()}
+    if not selected or selected - set(FIELDS):
+        raise InvalidFields()
+    return tuple(f for f in FIELDS if f in selected)
+
+
+class InvalidLanguage(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = f"language must be one of {','.join(LANGUAGES)}."
+    default_code = "invalid_language"
+
+
+def parse_language(value: Optional[str]) -> str:
+    if not value:
+        return "en"
+    if value not in LANGUAGES:
+        raise InvalidLanguage()
+    return value
+
+
+def missing(document: Dict[str, Any], fields: Iterable[str]) -> List[str]:
+    return [f for f in fields if _STORED[f] not in document]
+
+
+def result(document_id: str, document: Dict[str, Any], fields: Iterable[str],
+           language: str = "en") -> Dict[str, Any]:
+    """The response body for the stored parts of ``document``."""
+    body: Dict[str, Any] = {"document_id": document_id}
+    if language == "en":
+        for field in fields:
+            if _STORED[field] in document:
+                body[field] = document[_STORED[field]]
+    else:
+        translated = _translations(document, language)
+        body.update({f: translated[f] for f in fields if f in translated})
+        body["language"] = language
+    if document.get(_CHANGES) is not None:
+        body["changes"] = document[_CHANGES]
+    return body
+
+
+def save(document_id: str, document: Dict[str, Any], parts: Dict[str, Any],
+         changes: Optional[Dict[str, Any]] = None) -> None:
+    """Store computed ``parts`` (and the change report, once) on the document record."""
+    fields = {_STORED[f]: value for f, value in parts.items()}
+    if _CHANGES not in document:
+        fields[_CHANGES] = changes
+    document.update(fields)
+    try:
+        firestore.update_document(document_id, fields)
+    except Exception as e:
+        # Only costs a recomputation next time
+        logger.warning(f"Saving analysis of {document_id} failed: {e}")
+    if not missing(document, FIELDS):
+        blobs.save_derived(document.get("gcsPath") or "", "analysis",
+                           {f: document[_STORED[f]] for f in FIELDS})
+
+
+def replace(document_id: str, document: Dict[str, Any], parts: Dict[str, Any]) -> None:
+    """Store recomputed ``parts`` over the stored ones (bulk re-analysis).
+
+    Translations were made from the old English parts, so they are dropped.
+    """
+    stale = list(document.get(_TRANSLATIONS) or {})
+    if stale:
+        document[_TRANSLATIONS] = {}
+        try:
+            firestore.update_document(document_id, {_TRANSLATIONS: {}})
+        except Exception as e:
+            logger.warning(f"Dropping translations of {document_id} failed: {e}")
+        for language in stale:
+            blobs.save_derived(document.get("gcsPath") or "", f"analysis_{language}", None)
+    save(document_id, document, parts)
+
+
+def reuse(document_id: str, document: Dict[str, Any]) -> bool:
+    """Adopt the stored analysis of identical content (a repeat upload); True if there was one."""
+    shared = blobs.derived(document.get("gcsPath") or "", "analysis")
+    if not shared or any(f not in shared for f in FIELDS):
+        return False
+    changes = document.get(_CHANGES)
+    if _CHANGES not in document:
+        try:
+            _, changes = versions.compare(document, None)
+        except Exception as e:
+            logger.warning(f"Version comparison failed: {e}")
+    save(document_id, document, {f: shared[f] for f in FIELDS}, changes)
+    return True
+
+
+def _text_layer(document: Dict[str, Any], fields: Iterable[str]) -> Optional[str]:
+    """The document's text, read once for the parts that are worked out from it locally."""
+    if not {"risks", "glossary"} & set(fields):
+        return None
+    return longdoc.extract(document.get("gcsPath") or "", document.get("contentType"))
+
+
+def compute(document_id: str, document: Dict[str, Any], gcs_uri: str, fields: Iterable[str],
+            user: Optional[str]) -> None:
+    """Run the model for ``fields`` of ``document`` (whose model-readable file is ``gcs_uri``) and store them."""
+    fields = list(fields)
+    with context.request_scope(priority=context.ANALYSIS, user=user, document=document_id), longdoc.shared_limit():
+        # Long documents, and new versions of a document, are analyzed section by
+        # section in parallel; unchanged sections come from the section cache
+        long_text = longdoc.text_if_long(document.get("gcsPath") or "", document.get("contentType"), gcs_uri)
+        long_text, changes = versions.compare(document, long_text)
+        if long_text:
+            run = {"summary": longdoc.summarize, "risks": longdoc.analyze_risks,
+                   "glossary": glossary.extract_long_glossary}
+            parts = {f: run[f](long_text) for f in fields}
+        else:
+            # Risks are looked for in the clauses the local pre-filter picks, and known
+            # glossary terms come from the local dictionary, when there is a text layer
+            text = _text_layer(document, fields)
+            run = {"summary": vertex.summarize_document,
+                   "risks": lambda uri: clauses.analyze_risks(text, uri),
+                   "glossary": lambda uri: glossary.extract_glossary(text, uri)}
+            parts = {f: run[f](gcs_uri) for f in fields}
+    save(document_id, document, parts, changes)
+
+
+async def compute_async(document_id: str, document: Dict[str, Any], gcs_uri: str, fields: Iterable[str],
+                        user: Optional[str]) -> None:
+    """``compute`` for async views; the selected calls run concurrently."""
+    fields = list(fields)
+    with context.request_scope(priority=context.ANALYSIS, user=user, document=document_id), longdoc.shared_limit():
+        long_text = await longdoc.text_if_long_async(document.get("gcsPath") or "", document.get("contentType"), gcs_uri)
+        long_text, changes = await asyncio.to_thread(versions.compare, document, long_text)
+        if long_text:
+            run = {"summary": longdoc.summarize_async, "risks": longdoc.analyze_risks_async,
+                   "glossary": glossary.extract_long_glossary_async}
+            values = await asyncio.gather(*(run[f](long_text) for f in fields))
+        else:
+            text = await asyncio.to_thread(_text_layer, document, fields)
+            run = {"summary": vertex.summarize_document_async,
+                   "risks": lambda uri: clauses.analyze_risks_async(text, uri),
+                   "glossary": lambda uri: glossary.extract_glossary_async(text, uri)}
+            values = await asyncio.gather(*(run[f](gcs_uri) for f in fields))
+    await asyncio.to_thread(save, document_id, document, dict(zip(fields, values)), changes)
+
+
+def model_calls(document: Dict[str, Any], fields: Iterable[str], todo: Iterable[str], language: str) -> int:
+    """Model calls for a request: one per part in ``todo``, plus one unless ``fields`` are translated already."""
+    translated = _translations(document, language)
+    translating = language != "en" and any(f not in translated for f in fields)
+    return len(list(todo)) + translating
+
+
+def _translations(document: Dict[str, Any], language: str) -> Dict[str, Any]:
+    return dict((document.get(_TRANSLATIONS) or {}).get(language) or {})
+
+
+def _untranslated(document: Dict[str, Any], fields: Iterable[str], language: str) -> Tuple[Dict[str, Any], List[str]]:
+    """Stored translations of ``language`` (adopting those of identical content) and the fields still missing."""
+    translated = _translations(document, language)
+    todo = [f for f in fields if f not in translated and _STORED[f] in document]
+    if todo:
+        shared = blobs.derived(document.get("gcsPath") or "", f"analysis_{language}") or {}
+        translated.update({f: shared[f] for f in todo if f in shared})
+        todo = [f for f in todo if f not in translated]
+    return translated, todo
+
+
+def _save_translation(document_id: str, document: Dict[str, Any], language: str, translated: Dict[str, Any],
+                      store: bool = True) -> None:
+    # The whole map is written, as the dev store merges only top-level fields
+    translations = {**(document.get(_TRANSLATIONS) or {}), language: translated}
+    document[_TRANSLATIONS] = translations
+    if not store:
+        return
+    try:
+        firestore.update_document(document_id, {_TRANSLATIONS: translations})
+    except Exception as e:
+        logger.warning(f"Saving {language} analysis of {document_id} failed: {e}")
+    if all(f in translated for f in FIELDS):
+        blobs.save_derived(document.get("gcsPath") or "", f"analysis_{language}", translated)
+
+
+def translate(document_id: str, document: Dict[str, Any], fields: Iterable[str], language: str,
+              user: Optional[str]) -> None:
+    """Translate the stored English ``fields`` not yet available in ``language`` and store them."""
+    if language == "en":
+        return
+    translated, todo = _untranslated(document, fields, language)
+    if todo:
+        with context.request_scope(priority=context.ANALYSIS, user=user, document=document_id):
+            source = {f: document[_STORED[f]] for f in todo}
+            translated.update(vertex.translate_analysis(source, LANGUAGES[language]))
+    if translated != _translations(document, language):
+        # Without a model the "translation" is the English text: answer with it but keep nothing
+        _save_translation(document_id, document, language, translated, store=not todo or vertex._has_backend("model"))
+
+
+async def translate_async(document_id: str, document: Dict[str, Any], fields: Iterable[str], language: str,
+                          user: Optional[str]) -> None:
+    if language == "en":
+        return
+    translated, todo = await asyncio.to_thread(_untranslated, document, list(fields), language)
+    if todo:
+        with context.request_scope(priority=context.ANALYSIS, user=user, document=document_id):
+            source = {f: document[_STORED[f]] for f in todo}
+            translated.update(await vertex.translate_analysis_async(source, LANGUAGES[language]))
+    if translated != _translations(document, language):
+        await asyncio.to_thread(_save_translation, document_id, document, language, translated,
+                                not todo or vertex._has_backend("model"))
+
+
+def etag(body: Dict[str, Any]) -> str:
+    digest = hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def not_modified(if_none_match: Optional[str], tag: str) -> bool:
+    """Whether an ``If-None-Match`` header matches ``tag`` (weak comparison)."""
+    if not if_none_match:
+        return False
+    tags = parse_etags(if_none_match)
+    return "*" in tags or tag in (t.removeprefix("W/") for t in tags)
@@ -0,0 +1,370 @@
+"""Progressive document analysis for the streaming analyze endpoints.
+
+The summary, risks and glossary calls run concurrently with streamed model
+output. Risks and glossary terms are parsed incrementally (``jsonstream``) and
+each item is sent as a server-sent event as soon as it is complete, so the
+first risks reach the client while the model is still generating the rest:
+
+    event: risk
+    data: {"clause": "...", "risk": "High", "explanation": "..."}
+
+Events are ``summary``, ``risk``, ``term``, ``changes`` (new versions, see
+``versions``), ``error`` (one part failed; the others continue) and a final
+``done``. As in ``analysis``, risks are looked for in the candidate clauses the
+local pre-filter (``clauses``) picks from the text layer, when it picks a
+usable set, and the glossary comes from the local dictionary (``glossary``)
+when it finds terms there; the model only reads the whole file for the parts
+the text layer cannot answer. Long documents use the section-wise analysis of ``longdoc`` and
+send each part when it is finished. Parts already stored on the document (see
+``analysis``) are sent first and not recomputed; the parts computed here are
+stored the same way.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import queue
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from rest_framework.exceptions import APIException
+
+from . import analysis, clauses, context, glossary, jsonstream, longdoc, versions, vertex
+
+logger = logging.getLogger(__name__)
+
+Event = Tuple[str, Any]
+
+SUMMARY = "summary"
+RISK = "risk"
+TERM = "term"
+CHANGES = "changes"
+ERROR = "error"
+DONE = "done"
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _error(part: str, exc: BaseException) -> Event:
+    detail = str(exc.detail) if isinstance(exc, APIException) else "Analysis failed"
+    logger.error(f"Streaming analysis of {part} failed: {exc}")
+    return ERROR, {"part": part, "error": detail}
+
+
+def result_events(result: Dict[str, Any]) -> Iterator[Event]:
+    """Events for the parts present in an analysis result."""
+    if result.get("changes") is not None:
+        yield CHANGES, result["changes"]
+    if "summary" in result:
+        yield SUMMARY, {"summary": result["summary"]}
+    for item in result.get("risks") or []:
+        yield RISK, item
+    for item in result.get("glossary") or []:
+        yield TERM, item
+
+
+def stored_events(document_id: str, document: Dict[str, Any]) -> List[str]:
+    """The stream for a document whose analysis is stored completely."""
+    events = [sse(event, data) for event, data in result_events(analysis.result(document_id, document, analysis.FIELDS))]
+    return events + [sse(DONE, {"document_id": document_id})]
+
+
+class _Collector:
+    """Builds the computed parts from the events sent, to store them afterwards."""
+
+    def __init__(self, parts: List[str]):
+        empty = {"summary": "", "risks": [], "glossary": []}
+        self.parts: Dict[str, Any] = {part: empty[part] for part in parts}
+
+    def add(self, event: str, data: Any) -> None:
+        if event == SUMMARY:
+            self.parts["summary"] = data["summary"]
+        elif event == RISK:
+            self.parts["risks"].append(data)
+        elif event == TERM:
+            self.parts["glossary"].append(data)
+        elif event == ERROR:
+            self.parts.pop(data["part"], None)  # incomplete; computed again next time
+
+
+# --- Streamed model output ------------------------------------------------------
+
+def _items(event: str, parse: jsonstream.ArrayParser, text: str, clean: Callable[[Any], Optional[dict]],
+           sent: int, limit: int) -> Tuple[List[Event], int]:
+    out: List[Event] = []
+    for item in parse.feed(text):
+        cleaned = clean(item)
+        if cleaned is not None and sent < limit:
+            out.append((event, cleaned))
+            sent += 1
+    return out, sent
+
+
+def _fallback(event: str, text: str, clean_all: Callable[[str], List[dict]]) -> List[Event]:
+    # Output that was not a well-formed array as it streamed; parse it as the non-streaming path would
+    return [(event, item) for item in clean_all(text)]
+
+
+def _summary_stream(parts: List[object]) -> Iterator[Event]:
+    text = "".join(vertex._stream(parts, "vertex.summarize_document"))
+    yield SUMMARY, {"summary": text.strip()}
+
+
+def _array_stream(event: str, parts: List[object], op: str, clean: Callable[[Any], Optional[dict]],
+                  clean_all: Callable[[str], List[dict]], limit: int) -> Iterator[Event]:
+    parser = jsonstream.ArrayParser()
+    chunks: List[str] = []
+    sent = 0
+    # Read to the end even past ``limit`` so the call's usage is recorded
+    for chunk in vertex._stream(parts, op):
+        chunks.append(chunk)
+        events, sent = _items(event, parser, chunk, clean, sent, limit)
+        yield from events
+    if not sent:
+        yield from _fallback(event, "".join(chunks), clean_all)
+
+
+async def _asummary_stream(parts: List[object]) -> AsyncIterator[Event]:
+    text = "".join([chunk async for chunk in vertex._astream(parts, "vertex.summarize_document")])
+    yield SUMMARY, {"summary": text.strip()}
+
+
+async def _aarray_stream(event: str, parts: List[object], op: str, clean: Callable[[Any], Optional[dict]],
+                         clean_all: Callable[[str], List[dict]], limit: int) -> AsyncIterator[Event]:
+    parser = jsonstream.ArrayParser()
+    chunks: List[str] = []
+    sent = 0
+    async for chunk in vertex._astream(parts, op):
+        chunks.append(chunk)
+        events, sent = _items(event, parser, chunk, clean, sent, limit)
+        for ev in events:
+            yield ev
+    if not sent:
+        for ev in _fallback(event, "".join(chunks), clean_all):
+            yield ev
+
+
+def _local_inputs(document: Dict[str, Any], todo: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    """From the document's text layer: the candidate clauses for the risks call, and the text whose
+    glossary the dictionary answers; None where the model should read the whole file instead."""
+    text = analysis._text_layer(document, todo)
+    selected = clauses._selected(text) if "risks" in todo else None
+    terms_text = text if "glossary" in todo and glossary._local(text) is not None else None
+    return selected, terms_text
+
+
+def _risk_prompt(part: object, selected: Optional[str]) -> Tuple[List[object], str]:
+    if selected is None:
+        return [part, vertex.RISKS_PROMPT], "vertex.analyze_risks"
+    return [vertex.RISK_CLAUSES_PROMPT, selected], "vertex.analyze_risk_clauses"
+
+
+def _model_sources(part: object, gcs_uri: str, selected: Optional[str], terms_text: Optional[str]
+                   ) -> List[Tuple[str, Callable[[], Iterator[Event]]]]:
+    risk_parts, risk_op = _risk_prompt(part, selected)
+
+    def terms() -> Iterator[Event]:
+        if terms_text is None:
+            yield from _array_stream(TERM, [part, vertex.GLOSSARY_PROMPT], "vertex.extract_glossary",
+                                     vertex._glossary_item, vertex._clean_glossary, vertex.MAX_TERMS)
+            return
+        # Known terms come from the dictionary; only unknown ones wait for one short model call
+        for item in glossary.extract_glossary(terms_text, gcs_uri):
+            yield TERM, item
+
+    return [
+        ("summary", lambda: _summary_stream([part, vertex.SUMMARY_PROMPT])),
+        ("risks", lambda: _array_stream(RISK, risk_parts, risk_op,
+                                        vertex._risk_item, vertex._clean_risks, vertex.MAX_RISKS)),
+        ("glossary", terms),
+    ]
+
+
+def _amodel_sources(part: object, gcs_uri: str, selected: Optional[str], terms_text: Optional[str]
+                    ) -> List[Tuple[str, Callable[[], AsyncIterator[Event]]]]:
+    risk_parts, risk_op = _risk_prompt(part, selected)
+
+    async def terms() -> AsyncIterator[Event]:
+        if terms_text is None:
+            async for ev in _aarray_stream(TERM, [part, vertex.GLOSSARY_PROMPT], "vertex.extract_glossary",
+                                           vertex._glossary_item, vertex._clean_glossary, vertex.MAX_TERMS):
+                yield ev
+            return
+        for item in await glossary.extract_glossary_async(terms_text, gcs_uri):
+            yield TERM, item
+
+    return [
+        ("summary", lambda: _asummary_stream([part, vertex.SUMMARY_PROMPT])),
+        ("risks", lambda: _aarray_stream(RISK, risk_parts, risk_op,
+                                         vertex._risk_item, vertex._clean_risks, vertex.MAX_RISKS)),
+        ("glossary", terms),
+    ]
+
+
+# --- Finished parts (long documents, development mode) ----------------------------
+
+def _finished_sources(summarize: Callable[[], str], risks: Callable[[], List[dict]],
+                      glossary: Callable[[], List[dict]]) -> List[Tuple[str, Callable[[], Iterator[Event]]]]:
+    def summary_events() -> Iterator[Event]:
+        yield SUMMARY, {"summary": summarize()}
+
+    return [
+        ("summary", summary_events),
+        ("risks", lambda: ((RISK, item) for item in risks())),
+        ("glossary", lambda: ((TERM, item) for item in glossary())),
+    ]
+
+
+def _afinished_sources(summarize: Callable[[], Awaitable[str]], risks: Callable[[], Awaitable[List[dict]]],
+                       glossary: Callable[[], Awaitable[List[dict]]]):
+    async def summary_events():
+        yield SUMMARY, {"summary": await summarize()}
+
+    async def items(event: str, fetch: Callable[[], Awaitable[List[dict]]]):
+        for item in await fetch():
+            yield event, item
+
+    return [
+        ("summary", summary_events),
+        ("risks", lambda: items(RISK, risks)),
+        ("glossary", lambda: items(TERM, glossary)),
+    ]
+
+
+# --- Merging concurrent parts -----------------------------------------------------
+
+_FINISHED = object()
+
+
+def _merge(sources: List[Tuple[str, Callable[[], Iterator[Event]]]]) -> Iterator[Event]:
+    """Events of all sources in the order they are produced, each source in its own thread."""
+    events: "queue.Queue[Any]" = queue.Queue()
+    stop = threading.Event()
+
+    def run(part: str, source: Callable[[], Iterator[Event]]) -> None:
+        try:
+            for ev in source():
+                if stop.is_set():
+                    return  # the client went away; closing the stream releases the model slot
+                events.put(ev)
+        except Exception as e:
+            events.put(_error(part, e))
+        finally:
+            events.put(_FINISHED)
+
+    for part, source in sources:
+        # Each part runs in a copy of this request's context (priority, user, document)
+        threading.Thread(target=contextvars.copy_context().run, args=(run, part, source),
+                         name=f"analysis-stream-{part}", daemon=True).start()
+    remaining = len(sources)
+    try:
+        while remaining:
+            ev = events.get()
+            if ev is _FINISHED:
+                remaining -= 1
+                continue
+            yield ev
+    finally:
+        stop.set()
+
+
+async def _amerge(sources) -> AsyncIterator[Event]:
+    events: "asyncio.Queue[Any]" = asyncio.Queue()
+
+    async def run(part: str, source) -> None:
+        try:
+            async for ev in source():
+                await events.put(ev)
+        except Exception as e:
+            await events.put(_error(part, e))
+        finally:
+            await events.put(_FINISHED)
+
+    tasks = [asyncio.ensure_future(run(part, source)) for part, source in sources]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            ev = await events.get()
+            if ev is _FINISHED:
+                remaining -= 1
+                continue
+            yield ev
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# --- Entry points ----------------------------------------------------------------
+
+def _stored(document_id: str, document: Dict[str, Any], todo: List[str]) -> List[str]:
+    done = [f for f in analysis.FIELDS if f not in todo]
+    return [sse(event, data) for event, data in result_events(analysis.result(document_id, document, done))
+            if event != CHANGES]
+
+
+def stream(document_id: str, document: Dict[str, Any], gcs_uri: str, user: Optional[str]) -> Iterator[str]:
+    """Server-sent events analysing ``document`` (whose model-readable file is ``gcs_uri``)."""
+    todo = analysis.missing(document, analysis.FIELDS)
+    collector = _Collector(todo)
+    with context.request_scope(priority=context.ANALYSIS, user=user, document=document_id), longdoc.shared_limit():
+        try:
+            long_text = longdoc.text_if_long(document.get("gcsPath") or "", document.get("contentType"), gcs_uri)
+            long_text, changes = versions.compare(document, long_text)
+        except Exception as e:
+            yield sse(*_error("document", e))
+            yield sse(DONE, {"document_id": document_id})
+            return
+        if changes is not None:
+            yield sse(CHANGES, changes)
+        yield from _stored(document_id, document, todo)
+        if long_text:
+            sources = _finished_sources(lambda: longdoc.summarize(long_text),
+                                        lambda: longdoc.analyze_risks(long_text),
+                                        lambda: glossary.extract_long_glossary(long_text))
+        elif vertex._has_backend("model"):
+            sources = _model_sources(vertex._part_from_gcs_uri(gcs_uri), gcs_uri, *_local_inputs(document, todo))
+        else:
+            sources = _finished_sources(lambda: vertex.summarize_document(gcs_uri),
+                                        lambda: vertex.analyze_risks(gcs_uri),
+                                        lambda: vertex.extract_glossary(gcs_uri))
+        for event, data in _merge([(part, source) for part, source in sources if part in todo]):
+            collector.add(event, data)
+            yield sse(event, data)
+    analysis.save(document_id, document, collector.parts, changes)
+    yield sse(DONE, {"document_id": document_id})
+
+
+async def astream(document_id: str, document: Dict[str, Any], gcs_uri: str, user: Optional[str]) -> AsyncIterator[str]:
+    """Async version of ``stream`` for the ASGI endpoint."""
+    todo = analysis.missing(document, analysis.FIELDS)
+    collector = _Collector(todo)
+    with context.request_scope(priority=context.ANALYSIS, user=user, document=document_id), longdoc.shared_limit():
+        try:
+            long_text = await longdoc.text_if_long_async(document.get("gcsPath") or "", document.get("contentType"), gcs_uri)
+            long_text, changes = await asyncio.to_thread(versions.compare, document, long_text)
+        except Exception as e:
+            yield sse(*_error("document", e))
+            yield sse(DONE, {"document_id": document_id})
+            return
+        if changes is not None:
+            yield sse(CHANGES, changes)
+        for event in _stored(document_id, document, todo):
+            yield event
+        if long_text:
+            sources = _afinished_sources(lambda: longdoc.summarize_async(long_text),
+                                         lambda: longdoc.analyze_risks_async(long_text),
+                                         lambda: glossary.extract_long_glossary_async(long_text))
+        elif vertex._has_backend("model"):
+            selected, terms_text = await asyncio.to_thread(_local_inputs, document, todo)
+            sources = _amodel_sources(await vertex._apart_from_gcs_uri(gcs_uri), gcs_uri, selected, terms_text)
+        else:
+            sources = _afinished_sources(lambda: vertex.summarize_document_async(gcs_uri),
+                                         lambda: vertex.analyze_risks_async(gcs_uri),
+                                         lambda: vertex.extract_glossary_async(gcs_uri))
+        async for event, data in _amerge([(part, source) for part, source in sources if part in todo]):
+            collector.add(event, data)
+            yield sse(event, data)
+    await asyncio.to_thread(analysis.save, document_id, document, collector.parts, changes)
+    yield sse(DONE, {"document_id": document_id})
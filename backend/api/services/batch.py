@@ -0,0 +1,247 @@
+"""Bulk re-analysis through Vertex AI batch prediction.
+
+After a prompt or model change the whole corpus has to be analyzed again.
+Doing that through ``generate_content`` competes with live traffic for the
+online quota; a batch prediction job runs offline at its own pace (and
+price). ``run`` writes one request per (document content, part) as JSONL to
+storage, submits a job per model (each part uses the model its routing task
+would), polls until the jobs end, and stores the outputs over the documents'
+analyses with ``analysis.replace``. Documents sharing content share requests.
+
+The job runner is ``BATCH_RUNNER``: ``vertex`` submits
+``BatchPredictionJob``s and is the default when ``GCP_PROJECT_ID`` is set;
+``local`` answers the JSONL in-process with the installed model (or the
+development placeholders) and writes the output files the way Vertex does,
+so the pipeline runs end to end without Google. Driven by
+``manage.py reanalyze``.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from . import analysis, documents, gcs, routing, vertex
+
+logger = logging.getLogger(__name__)
+
+PROMPTS = {"summary": vertex.SUMMARY_PROMPT, "risks": vertex.RISKS_PROMPT, "glossary": vertex.GLOSSARY_PROMPT}
+TASKS = {"summary": routing.SUMMARY, "risks": routing.RISKS, "glossary": routing.GLOSSARY}
+_FIELD_OF_PROMPT = {prompt: field for field, prompt in PROMPTS.items()}
+
+# (model-readable URI, part) -> ids of the documents with that content
+Manifest = Dict[Tuple[str, str], List[str]]
+
+
+def request_line(gcs_uri: str, field: str) -> Dict[str, Any]:
+    """One batch input line: the ``GenerateContentRequest`` of the online call."""
+    file_part = {"fileData": {"fileUri": gcs_uri, "mimeType": vertex._get_mime_type(gcs_uri)}}
+    return {"request": {"contents": [{"role": "user", "parts": [file_part, {"text": PROMPTS[field]}]}]}}
+
+
+def _request_key(request: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    # Outputs echo their request, which is how they are matched back to documents
+    uri = field = None
+    for content in request.get("contents") or []:
+        for part in content.get("parts") or []:
+            uri = (part.get("fileData") or {}).get("fileUri", uri)
+            field = _FIELD_OF_PROMPT.get(part.get("text"), field)
+    return (uri, field) if uri and field else None
+
+
+def _response_text(line: Dict[str, Any]) -> Optional[str]:
+    """Model text of an output line; None when the request failed."""
+    if line.get("status"):
+        return None
+    candidates = (line.get("response") or {}).get("candidates") or []
+    if not candidates:
+        return None
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(p.get("text", "") for p in parts).strip()
+
+
+def _clean(field: str, text: str) -> Any:
+    if field == "risks":
+        return vertex._clean_risks(text or "[]")
+    if field == "glossary":
+        return vertex._clean_glossary(text or "[]")
+    return text
+
+
+class LocalJob:
+    """A finished stand-in job; the attributes used here mirror ``BatchPredictionJob``."""
+
+    def __init__(self, resource_name: str, output_location: str, error: Optional[str] = None):
+        self.resource_name = resource_name
+        self.output_location = output_location
+        self.error = error
+        self.has_ended = True
+        self.has_succeeded = error is None
+
+    def refresh(self) -> "LocalJob":
+        return self
+
+
+class LocalRunner:
+    """Answers batch input offline, one request at a time, and writes ``predictions.jsonl``."""
+
+    def submit(self, model: str, input_path: str, output_prefix: str) -> LocalJob:
+        lines = gcs.get_blob_bytes(input_path).decode("utf-8").splitlines()
+        out = [json.dumps(self._predict(model, json.loads(line))) for line in lines if line.strip()]
+        # Laid out like Vertex output: <prefix>/prediction-model-<id>/predictions.jsonl
+        output_location = f"{output_prefix}/prediction-model-{uuid.uuid4().hex[:8]}"
+        gcs.upload_bytes("\n".join(out).encode("utf-8"), f"{output_location}/predictions.jsonl", "application/jsonl")
+        return LocalJob(f"local/{model}/{uuid.uuid4().hex[:8]}", output_location)
+
+    def _predict(self, model: str, line: Dict[str, Any]) -> Dict[str, Any]:
+        request = line["request"]
+        try:
+            text = self._generate(model, request)
+        except Exception as e:
+            return {**line, "status": str(e)}
+        content = {"role": "model", "parts": [{"text": text}]}
+        return {**line, "status": "", "response": {"candidates": [{"content": content}]}}
+
+    @staticmethod
+    def _generate(model: str, request: Dict[str, Any]) -> str:
+        key = _request_key(request)
+        if key is None:
+            raise ValueError("Unrecognized request")
+        uri, field = key
+        if not vertex._has_backend("model"):
+            # Development mode: the placeholders of the online calls
+            run = {"summary": vertex.summarize_document, "risks": vertex.analyze_risks,
+                   "glossary": vertex.extract_glossary}
+            value = run[field](uri)
+            return value if isinstance(value, str) else json.dumps(value)
+        resp = vertex._get_model(model).generate_content([vertex._part_from_gcs_uri(uri), PROMPTS[field]])
+        return vertex._response_text(resp)
+
+
+class VertexRunner:
+    """Vertex AI batch prediction jobs."""
+
+    def submit(self, model: str, input_path: str, output_prefix: str):
+        from vertexai.batch_prediction import BatchPredictionJob  # type: ignore
+
+        # Initializes the SDK with the service account, as for online calls
+        vertex._live_model(model)
+        return BatchPredictionJob.submit(source_model=model, input_dataset=gcs.path_to_uri(input_path),
+                                         output_uri_prefix=gcs.path_to_uri(output_prefix))
+
+
+def get_runner(kind: Optional[str] = None):
+    default = "vertex" if os.getenv("GCP_PROJECT_ID") else "local"
+    kind = (kind or os.getenv("BATCH_RUNNER", default)).lower()
+    return VertexRunner() if kind == "vertex" else LocalRunner()
+
+
+def plan(records: Iterable[Dict[str, Any]], fields: Iterable[str], model: Optional[str] = None
+         ) -> Tuple[Dict[str, Manifest], Dict[str, Dict[str, Any]], int]:
+    """Requests per model for ``fields`` of ``records``, the records by id, and how many were skipped."""
+    routes = routing.routes_from_env()
+    manifests: Dict[str, Manifest] = defaultdict(lambda: defaultdict(list))
+    by_id: Dict[str, Dict[str, Any]] = {}
+    skipped = 0
+    fields = list(fields)
+    for record in records:
+        gcs_path = record.get("gcsPath")
+        if not gcs_path:
+            skipped += 1
+            continue
+        try:
+            # Word documents are read from their converted text, as online
+            gcs_uri = documents.analysis_uri(gcs_path, record.get("contentType"))
+        except Exception as e:
+            logger.warning(f"Skipping {record['id']}: {e}")
+            skipped += 1
+            continue
+        by_id[record["id"]] = record
+        for field in fields:
+            manifests[model or routes[TASKS[field]].primary][(gcs_uri, field)].append(record["id"])
+    return manifests, by_id, skipped
+
+
+def submit(runner, model: str, manifest: Manifest, prefix: str):
+    """Write the input JSONL for ``manifest`` and submit it; returns the job."""
+    lines = "\n".join(json.dumps(request_line(uri, field)) for uri, field in manifest)
+    input_path, _ = gcs.upload_bytes(lines.encode("utf-8"), f"{prefix}/{model}/input.jsonl", "application/jsonl")
+    job = runner.submit(model, input_path, f"{prefix}/{model}/output")
+    logger.info(f"Submitted batch job {getattr(job, 'resource_name', '')} for {len(manifest)} {model} requests")
+    return job
+
+
+def wait(jobs: List[Any], poll_interval: float, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        for job in jobs:
+            job.refresh()
+        if all(job.has_ended for job in jobs):
+            return
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Batch jobs still running after {timeout:.0f}s")
+        time.sleep(poll_interval)
+
+
+def read_output(output_location: str) -> Iterator[Dict[str, Any]]:
+    for path in gcs.list_paths(output_location):
+        if not path.endswith(".jsonl"):
+            continue
+        for line in gcs.get_blob_bytes(path).decode("utf-8").splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def ingest(manifest: Manifest, lines: Iterable[Dict[str, Any]], records: Dict[str, Dict[str, Any]]
+           ) -> Tuple[Set[str], int]:
+    """Store the outputs of one job over the analyses of the documents in ``manifest``.
+
+    Returns the ids of the documents updated and the number of (document, part) requests that failed.
+    """
+    results: Dict[str, Dict[str, Any]] = defaultdict(dict)
+    failed = 0
+    for line in lines:
+        key = _request_key(line.get("request") or {})
+        targets = manifest.get(key) if key else None
+        if not targets:
+            continue
+        text = _response_text(line)
+        if text is None:
+            logger.warning(f"Batch request for {key[1]} of {key[0]} failed: {line.get('status')}")
+            failed += len(targets)
+            continue
+        value = _clean(key[1], text)
+        for document_id in targets:
+            results[document_id][key[1]] = value
+    for document_id, parts in results.items():
+        analysis.replace(document_id, records[document_id], parts)
+    return set(results), failed
+
+
+def run(records: Iterable[Dict[str, Any]], fields: Iterable[str], runner=None, model: Optional[str] = None,
+        prefix: Optional[str] = None, poll_interval: float = 30, timeout: float = 24 * 3600,
+        log: Callable[[str], None] = logger.info) -> Dict[str, int]:
+    """Re-analyze ``fields`` of ``records`` with batch prediction; returns counts for the report."""
+    runner = runner or get_runner()
+    prefix = prefix or f"{os.getenv('BATCH_PREFIX', 'batch')}/{time.strftime('%Y%m%d-%H%M%S')}"
+    manifests, by_id, skipped = plan(records, fields, model)
+    stats = {"documents": len(by_id), "skipped": skipped, "requests": 0, "updated": 0, "failed": 0}
+    jobs = []
+    for model_name, manifest in manifests.items():
+        jobs.append((submit(runner, model_name, manifest, prefix), manifest))
+        stats["requests"] += len(manifest)
+    log(f"Submitted {len(jobs)} job(s) with {stats['requests']} request(s) for {stats['documents']} document(s)")
+    wait([job for job, _ in jobs], poll_interval, timeout)
+    updated: Set[str] = set()
+    for job, manifest in jobs:
+        if not job.has_succeeded:
+            log(f"Batch job {job.resource_name} failed: {job.error}")
+            stats["failed"] += sum(len(ids) for ids in manifest.values())
+            continue
+        ids, failed = ingest(manifest, read_output(job.output_location), by_id)
+        updated |= ids
+        stats["failed"] += failed
+    stats["updated"] = len(updated)
+    return stats
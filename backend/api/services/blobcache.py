@@ -0,0 +1,197 @@
+"""Bounded on-disk cache of downloaded storage objects.
+
+Text extraction, Word conversion and inline model parts
+(``VERTEX_USE_URI=false``) read whole objects. ``opened`` and ``mapped`` serve
+those reads from a local copy, so a hot document is downloaded once per
+machine rather than once per request, and ``mapped`` hands out a read-only
+memory map of it: the pages live in the OS page cache, shared by every worker,
+instead of in a ``bytes`` copy per request. Inline model parts use ``opened``:
+the SDK's request proto needs its own ``bytes``, so mapping first would only
+add a step before the same copy.
+
+Copies are keyed by object and generation. Content-addressed uploads
+(``blobs/sha256/...``) never change, so they are looked up without asking
+storage; any other object costs a metadata read to learn its current
+generation, and an overwritten object is downloaded again. The directory
+(``BLOB_CACHE_DIR``) is kept under ``BLOB_CACHE_MAX_BYTES`` by evicting the
+least recently used copies; a hit bumps the file's mtime, so workers sharing
+the directory share the recency too. ``BLOB_CACHE=false`` downloads to a
+temporary file on every read instead.
+"""
+import contextlib
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+from . import blobs, gcs, metrics, singleflight
+
+LOOKUPS = metrics.REGISTRY.counter(
+    "legalease_blob_cache_total",
+    "Whole-object storage reads served from a local copy (hit) or downloaded (miss), and evicted copies.", ("outcome",))
+
+_PARTIAL = ".part-"
+
+
+def _config() -> Tuple[bool, str, int]:
+    enabled = os.getenv("BLOB_CACHE", "true").lower() != "false"
+    directory = os.getenv("BLOB_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "legalease-blobs")
+    return enabled, directory, int(os.getenv("BLOB_CACHE_MAX_BYTES", str(1024 ** 3)))
+
+
+class _Cache:
+    """Files named by key in one directory, evicted by mtime."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None  # bytes on disk, learned on first insert
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def get(self, name: str) -> Optional[BinaryIO]:
+        """The cached copy, opened for reading and marked as recently used; None on a miss."""
+        path = self.path(name)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # evicted meanwhile; the open file stays readable
+        return f
+
+    def fill(self, name: str, gcs_path: str, generation: Optional[int]) -> bool:
+        """Download the object under ``name``; False when it is too large to keep."""
+        fd, partial = tempfile.mkstemp(prefix=_PARTIAL, dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                size = gcs.download_to_file(gcs_path, f, if_generation_match=generation)
+            if size > self.max_bytes:
+                return False
+            # Readers only ever see complete copies
+            os.replace(partial, self.path(name))
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self._grow(size)
+        return True
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith(_PARTIAL) or not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _grow(self, size: int) -> None:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(s for _, s, _ in self._entries())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Other workers add and evict too, so go by what is actually on disk
+        entries = sorted(self._entries())
+        total = sum(s for _, s, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                # Open copies stay readable until closed
+                os.remove(path)
+                LOOKUPS.inc(outcome="evicted")
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+
+_cache: Optional[_Cache] = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache() -> Optional[_Cache]:
+    global _cache
+    enabled, directory, max_bytes = _config()
+    if not enabled:
+        return None
+    if _cache is None or (_cache.directory, _cache.max_bytes) != (directory, max_bytes):
+        with _cache_lock:
+            if _cache is None or (_cache.directory, _cache.max_bytes) != (directory, max_bytes):
+                _cache = _Cache(directory, max_bytes)
+    return _cache
+
+
+def reset() -> None:
+    """Forget the cache configuration (used by tests); files on disk are kept."""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def _key(gcs_path: str) -> Tuple[str, Optional[int]]:
+    """Cache file name for the object's current content, and the generation it was keyed by."""
+    name = gcs.object_name(gcs_path)
+    generation = None
+    if not name.partition("/")[2].startswith(blobs.PREFIX):
+        generation = gcs.generation(gcs_path)
+    return hashlib.sha256(f"{name}#{generation}".encode()).hexdigest(), generation
+
+
+def _download(gcs_path: str) -> BinaryIO:
+    f = tempfile.TemporaryFile()
+    gcs.download_to_file(gcs_path, f)
+    f.seek(0)
+    return f
+
+
+@contextlib.contextmanager
+def opened(gcs_path: str) -> Iterator[BinaryIO]:
+    """The object's content as a read-only binary file."""
+    local = gcs.local_path(gcs_path)
+    cache = _get_cache() if local is None else None
+    if local is not None:
+        f = open(local, "rb")
+    elif cache is None:
+        f = _download(gcs_path)
+    else:
+        name, generation = _key(gcs_path)
+        f = cache.get(name)
+        if f is not None:
+            LOOKUPS.inc(outcome="hit")
+        else:
+            LOOKUPS.inc(outcome="miss")
+            # Concurrent misses for the same object share one download
+            kept = singleflight.do(f"blob:{name}", lambda: cache.fill(name, gcs_path, generation))
+            f = cache.get(name) if kept else None
+            if f is None:
+                f = _download(gcs_path)
+    with f:
+        yield f
+
+
+@contextlib.contextmanager
+def mapped(gcs_path: str) -> Iterator[Union[mmap.mmap, bytes]]:
+    """The object's content as a read-only memory map (``b""`` when empty)."""
+    with opened(gcs_path) as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            yield m
@@ -0,0 +1,190 @@
+"""Content-addressed storage for uploaded documents.
+
+Upload bodies are hashed (SHA-256) by ``HashingUploadHandler`` while Django
+copies them off the request, and stored once under
+``blobs/sha256/<ab>/<hash><ext>``. The ``blobs`` Firestore collection indexes
+stored content by hash, together with what was derived from it: the plain-text
+copy of a Word file (``textPath``) and the last analysis (``analysis``). A
+repeat upload of the same bytes only creates a new document record pointing at
+the existing blob, so it costs no storage writes, and analysing it costs no
+model calls. Whether content was already stored is kept internal (it is only
+counted in ``legalease_upload_blobs_total``): telling the uploader would tell
+them that someone else has uploaded the same file.
+"""
+import hashlib
+import logging
+import os
+import re
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+from . import firestore, gcs, metrics
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "blobs/sha256/"
+_EXTENSION = re.compile(r"\.[a-z0-9]{1,8}")
+
+UPLOADS = metrics.REGISTRY.counter(
+    "legalease_upload_blobs_total", "Uploads by whether their content was already stored.", ("outcome",))
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Computes each uploaded file's SHA-256 as its chunks pass to the next handler.
+
+    Install it first in ``request.upload_handlers``; it stores nothing itself.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests: Dict[str, str] = {}
+        self._hash = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self._hash.hexdigest()
+        return None
+
+
+def install_hashing(request) -> HashingUploadHandler:
+    """Hash files in ``request``'s upload; call before the body is parsed."""
+    handler = HashingUploadHandler(request)
+    request.upload_handlers.insert(0, handler)
+    return handler
+
+
+def digest(file_obj: BinaryIO, handler: Optional[HashingUploadHandler] = None, field: str = "file") -> str:
+    """SHA-256 of an uploaded file, from the upload handler when it saw the file."""
+    if handler is not None and field in handler.digests:
+        return handler.digests[field]
+    # Bodies not parsed by Django's multipart parser are hashed in a second pass
+    sha = hashlib.sha256()
+    for chunk in file_obj.chunks() if hasattr(file_obj, "chunks") else iter(lambda: file_obj.read(1 << 20), b""):
+        sha.update(chunk)
+    file_obj.seek(0)
+    return sha.hexdigest()
+
+
+class _HashingSink:
+    """Write-only file that keeps the SHA-256 and size of what is written, not the bytes."""
+
+    def __init__(self):
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.size
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        # A retried download rewinds to the start: begin the hash again
+        if offset or whence:
+            raise OSError("Only a rewind to the start is supported")
+        self.__init__()
+        return 0
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        return self.size
+
+
+def digest_stored(gcs_path: str) -> Tuple[str, int]:
+    """SHA-256 and size of a stored object, hashed as it streams in rather than read into memory.
+
+    Every byte crosses this process, so keep it off the request path.
+    """
+    sink = _HashingSink()
+    size = gcs.download_to_file(gcs_path, sink)  # type: ignore[arg-type]
+    return sink.sha.hexdigest(), size
+
+
+def blob_path(sha256: str, filename: str) -> str:
+    # Keep the extension: the model and text extraction fall back to it for the file type
+    ext = os.path.splitext(filename)[1].lower()
+    return f"{PREFIX}{sha256[:2]}/{sha256}{ext if _EXTENSION.fullmatch(ext) else ''}"
+
+
+def sha_of_path(gcs_path: str) -> Optional[str]:
+    if not gcs_path.startswith(PREFIX):
+        return None
+    return os.path.splitext(gcs_path.rsplit("/", 1)[-1])[0]
+
+
+def store(file_obj: BinaryIO, sha256: str, filename: str, content_type: str) -> Dict[str, Any]:
+    """Index entry for the file's content, uploading it only if it is not stored yet.
+
+    The entry has ``gcsPath``, ``publicUrl`` and ``size``.
+    """
+    existing = firestore.get_blob(sha256)
+    if existing and existing.get("gcsPath"):
+        UPLOADS.inc(outcome="duplicate")
+        return existing
+    path, public_url = gcs.upload_file(file_obj, blob_path(sha256, filename), content_type)
+    entry = {"gcsPath": path, "publicUrl": public_url, "size": getattr(file_obj, "size", None),
+             "contentType": content_type}
+    # Concurrent first uploads of the same content write the same path and entry
+    firestore.save_blob(sha256, entry)
+    UPLOADS.inc(outcome="new")
+    return entry
+
+
+def adopt(source_path: str, sha256: str, filename: str, content_type: str, size: int) -> Dict[str, Any]:
+    """``store`` for content already uploaded to ``source_path`` (direct uploads).
+
+    The object is copied within the bucket unless the content is already
+    stored. ``source_path`` is left in place: delete it with ``discard`` once
+    nothing points at it.
+    """
+    existing = firestore.get_blob(sha256)
+    if existing and existing.get("gcsPath"):
+        UPLOADS.inc(outcome="duplicate")
+        return existing
+    path, public_url = gcs.copy(source_path, blob_path(sha256, filename))
+    entry = {"gcsPath": path, "publicUrl": public_url, "size": size, "contentType": content_type}
+    firestore.save_blob(sha256, entry)
+    UPLOADS.inc(outcome="new")
+    return entry
+
+
+def discard(path: str) -> None:
+    """Delete an object that is no longer needed, logging rather than raising on failure."""
+    try:
+        gcs.delete(path)
+    except Exception as e:
+        # A lifecycle rule on staging/ cleans up what is left behind there
+        logger.warning(f"Failed to delete {path}: {e}")
+
+
+def derived(gcs_path: str, field: str) -> Optional[Any]:
+    """A stored artifact derived from content-addressed ``gcs_path``, if any."""
+    sha = sha_of_path(gcs_path)
+    if sha is None:
+        return None
+    try:
+        entry = firestore.get_blob(sha)
+    except Exception as e:
+        logger.warning(f"Blob index read failed for {sha}: {e}")
+        return None
+    return (entry or {}).get(field)
+
+
+def save_derived(gcs_path: str, field: str, value: Any) -> None:
+    sha = sha_of_path(gcs_path)
+    if sha is None:
+        return
+    try:
+        firestore.save_blob(sha, {field: value}, merge=True)
+    except Exception as e:
+        # Only costs a recomputation next time
+        logger.warning(f"Blob index write failed for {sha}: {e}")
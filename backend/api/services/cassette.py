@@ -0,0 +1,371 @@
+"""Record and replay model, Speech and TTS calls.
+
+With ``VERTEX_CASSETTE_MODE=record`` the live clients are wrapped so every
+call's request fingerprint, response (text and token usage, transcript, or
+audio) and latency are appended to a gzip-compressed JSONL cassette. With
+``VERTEX_CASSETTE_MODE=replay`` no Google client is created: calls are
+answered from the cassette after the recorded latency times
+``VERTEX_CASSETTE_LATENCY_SCALE`` (``0`` answers immediately).
+
+Requests are matched on a fingerprint of everything sent (prompt text, file
+URIs, inline data, language). ``VERTEX_CASSETTE_MATCH=loose`` falls back to
+the prompt text alone (the language alone for Speech/TTS), so traffic against
+other documents still gets a realistic answer. When a fingerprint was recorded
+several times, replay cycles through the recordings in order, which
+reproduces the latency spread. A request with no recording fails with
+``CassetteMiss``, surfaced to clients as a 502.
+
+Configuration (environment):
+
+* ``VERTEX_CASSETTE_MODE``: ``record``, ``replay`` or unset
+* ``VERTEX_CASSETTE_PATH``: cassette file (default ``vertex-cassette.jsonl.gz``)
+* ``VERTEX_CASSETTE_LATENCY_SCALE``: replay delay multiplier (default ``1``)
+* ``VERTEX_CASSETTE_MATCH``: ``exact`` (default) or ``loose``
+"""
+import asyncio
+import base64
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MODEL = "model"
+SPEECH = "speech"
+TTS = "tts"
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+def _plain(value: Any) -> Any:
+    """JSON-able form of a request object: str, Vertex ``Part`` or proto-plus message."""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, bytes):
+        return hashlib.sha256(value).hexdigest()
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    to_dict = getattr(value, "to_dict", None)
+    if callable(to_dict):
+        return _plain(to_dict())
+    message_to_dict = getattr(type(value), "to_dict", None)
+    if callable(message_to_dict):
+        return _plain(message_to_dict(value))
+    return repr(value)
+
+
+def _digest(kind: str, value: Any) -> str:
+    raw = json.dumps([kind, _plain(value)], sort_keys=True, default=repr)
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def _model_keys(parts: Any) -> Tuple[str, str]:
+    parts = parts if isinstance(parts, list) else [parts]
+    return _digest(MODEL, parts), _digest(MODEL, [p for p in parts if isinstance(p, str)])
+
+
+def _speech_keys(config: Any, audio: Any) -> Tuple[str, str]:
+    language = getattr(config, "language_code", "")
+    return _digest(SPEECH, [config, audio]), _digest(SPEECH, language)
+
+
+def _tts_keys(input: Any, voice: Any, audio_config: Any) -> Tuple[str, str]:
+    return _digest(TTS, [input, voice, audio_config]), _digest(TTS, getattr(voice, "language_code", ""))
+
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self._exact: Dict[str, List[dict]] = defaultdict(list)
+        self._loose: Dict[str, List[dict]] = defaultdict(list)
+        self._cursor: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        cassette = cls(path)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    cassette._index(json.loads(line))
+        logger.info(f"Loaded {len(cassette)} recorded calls from {path}")
+        return cassette
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._exact.values())
+
+    def _index(self, record: dict) -> None:
+        self._exact[record["key"]].append(record)
+        self._loose[record["loose"]].append(record)
+
+    def append(self, record: dict) -> None:
+        record = {"v": FORMAT_VERSION, **record}
+        # One gzip member per record, written under an exclusive lock, so
+        # several workers can record into the same file
+        data = gzip.compress((json.dumps(record, separators=(",", ":")) + "\n").encode())
+        with self._lock:
+            self._index(record)
+            with open(self.path, "ab") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(data)
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def lookup(self, kind: str, key: str, loose: str, allow_loose: bool) -> dict:
+        with self._lock:
+            index, match = self._exact, key
+            if not index.get(key) and allow_loose:
+                index, match = self._loose, loose
+            records = index.get(match)
+            if not records:
+                raise CassetteMiss(f"No recorded {kind} response for request {key}")
+            cursor = self._cursor[match]
+            self._cursor[match] = cursor + 1
+            return records[cursor % len(records)]
+
+    def stats(self) -> Dict[str, int]:
+        counts: Dict[str, int] = defaultdict(int)
+        for records in self._exact.values():
+            for record in records:
+                counts[record["kind"]] += 1
+        return dict(counts)
+
+
+# --- Response (de)serialisation ---------------------------------------------
+
+def _text(response: Any) -> str:
+    try:
+        return response.text or ""
+    except (AttributeError, ValueError):
+        # Blocked or empty candidates raise on .text
+        return ""
+
+
+def _usage(response: Any) -> Dict[str, int]:
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        name: int(getattr(usage, name, 0) or 0)
+        for name in ("prompt_token_count", "candidates_token_count", "total_token_count")
+    } if usage is not None else {}
+
+
+def _model_response(text: str, usage: Dict[str, int]) -> SimpleNamespace:
+    return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(**usage) if usage else None)
+
+
+# --- Recording ----------------------------------------------------------------
+
+class _Recorder:
+    def __init__(self, factory: Callable[[], Any], cassette: Cassette):
+        self._factory = factory
+        self.cassette = cassette
+
+    def _save(self, kind: str, keys: Tuple[str, str], started: float, response: Dict[str, Any]) -> None:
+        self.cassette.append({
+            "kind": kind,
+            "key": keys[0],
+            "loose": keys[1],
+            "latency": round(time.perf_counter() - started, 4),
+            "recorded_at": time.time(),
+            "response": response,
+        })
+
+
+class RecordingModel(_Recorder):
+    """Wraps the live model; ``factory`` returns it (it is created lazily)."""
+
+    def for_model(self, name: str) -> "RecordingModel":
+        # Routed calls: ``factory`` is vertex._live_model, which takes the model name
+        return RecordingModel(lambda: self._factory(name), self.cassette)
+
+    def generate_content(self, parts, **kwargs):
+        keys = _model_keys(parts)
+        model = self._factory()
+        started = time.perf_counter()
+        response = model.generate_content(parts, **kwargs)
+        if kwargs.get("stream"):
+            return self._record_stream(response, keys, started)
+        self._save(MODEL, keys, started, {"text": _text(response), "usage": _usage(response)})
+        return response
+
+    def _record_stream(self, chunks, keys, started) -> Iterator[Any]:
+        texts, last = [], None
+        for chunk in chunks:
+            texts.append(_text(chunk))
+            last = chunk
+            yield chunk
+        self._save(MODEL, keys, started, {"text": "".join(texts), "usage": _usage(last)})
+
+    async def generate_content_async(self, parts, **kwargs):
+        keys = _model_keys(parts)
+        model = await asyncio.to_thread(self._factory)
+        started = time.perf_counter()
+        response = await model.generate_content_async(parts, **kwargs)
+        if kwargs.get("stream"):
+            return self._arecord_stream(response, keys, started)
+        self._save(MODEL, keys, started, {"text": _text(response), "usage": _usage(response)})
+        return response
+
+    async def _arecord_stream(self, chunks, keys, started):
+        texts, last = [], None
+        async for chunk in chunks:
+            texts.append(_text(chunk))
+            last = chunk
+            yield chunk
+        self._save(MODEL, keys, started, {"text": "".join(texts), "usage": _usage(last)})
+
+    def count_tokens(self, parts, **kwargs):
+        return self._factory().count_tokens(parts, **kwargs)
+
+    async def count_tokens_async(self, parts, **kwargs):
+        model = await asyncio.to_thread(self._factory)
+        return await model.count_tokens_async(parts, **kwargs)
+
+
+class RecordingSpeechClient(_Recorder):
+    def recognize(self, config=None, audio=None, **kwargs):
+        keys = _speech_keys(config, audio)
+        client = self._factory()
+        started = time.perf_counter()
+        response = client.recognize(config=config, audio=audio, **kwargs)
+        transcripts = [r.alternatives[0].transcript for r in response.results if r.alternatives]
+        self._save(SPEECH, keys, started, {"transcripts": transcripts})
+        return response
+
+
+class RecordingTTSClient(_Recorder):
+    def synthesize_speech(self, input=None, voice=None, audio_config=None, **kwargs):
+        keys = _tts_keys(input, voice, audio_config)
+        client = self._factory()
+        started = time.perf_counter()
+        response = client.synthesize_speech(input=input, voice=voice, audio_config=audio_config, **kwargs)
+        self._save(TTS, keys, started, {"audio": base64.b64encode(response.audio_content).decode("ascii")})
+        return response
+
+
+# --- Replay ---------------------------------------------------------------------
+
+class _Replayer:
+    def __init__(self, cassette: Cassette, latency_scale: float = 1.0, loose: bool = False):
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+        self.loose = loose
+
+    def _record(self, kind: str, keys: Tuple[str, str]) -> dict:
+        return self.cassette.lookup(kind, keys[0], keys[1], self.loose)
+
+    def _delay(self, record: dict) -> float:
+        return max(0.0, float(record.get("latency", 0.0)) * self.latency_scale)
+
+
+class ReplayModel(_Replayer):
+    # Streamed replays split the text into this many chunks over the recorded latency
+    STREAM_CHUNKS = 8
+
+    def generate_content(self, parts, stream: bool = False, **_kwargs):
+        record = self._record(MODEL, _model_keys(parts))
+        if stream:
+            return self._stream(record)
+        time.sleep(self._delay(record))
+        return _model_response(record["response"]["text"], record["response"].get("usage", {}))
+
+    def _chunks(self, record: dict) -> List[str]:
+        text = record["response"]["text"]
+        size = max(1, -(-len(text) // self.STREAM_CHUNKS))
+        return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+    def _stream(self, record: dict) -> Iterator[SimpleNamespace]:
+        chunks = self._chunks(record)
+        usage = record["response"].get("usage", {})
+        for i, chunk in enumerate(chunks):
+            time.sleep(self._delay(record) / len(chunks))
+            yield _model_response(chunk, usage if i == len(chunks) - 1 else {})
+
+    async def generate_content_async(self, parts, stream: bool = False, **_kwargs):
+        record = self._record(MODEL, _model_keys(parts))
+        if stream:
+            return self._astream(record)
+        await asyncio.sleep(self._delay(record))
+        return _model_response(record["response"]["text"], record["response"].get("usage", {}))
+
+    async def _astream(self, record: dict):
+        chunks = self._chunks(record)
+        usage = record["response"].get("usage", {})
+        for i, chunk in enumerate(chunks):
+            await asyncio.sleep(self._delay(record) / len(chunks))
+            yield _model_response(chunk, usage if i == len(chunks) - 1 else {})
+
+    def count_tokens(self, parts, **_kwargs):
+        try:
+            usage = self._record(MODEL, _model_keys(parts))["response"].get("usage", {})
+            return SimpleNamespace(total_tokens=usage.get("prompt_token_count", 0))
+        except CassetteMiss:
+            text = "".join(p for p in (parts if isinstance(parts, list) else [parts]) if isinstance(p, str))
+            return SimpleNamespace(total_tokens=len(text) // 4)
+
+    async def count_tokens_async(self, parts, **kwargs):
+        return self.count_tokens(parts, **kwargs)
+
+
+class ReplaySpeechClient(_Replayer):
+    def recognize(self, config=None, audio=None, **_kwargs):
+        record = self._record(SPEECH, _speech_keys(config, audio))
+        time.sleep(self._delay(record))
+        results = [SimpleNamespace(alternatives=[SimpleNamespace(transcript=t)])
+                   for t in record["response"]["transcripts"]]
+        return SimpleNamespace(results=results)
+
+
+class ReplayTTSClient(_Replayer):
+    def synthesize_speech(self, input=None, voice=None, audio_config=None, **_kwargs):
+        record = self._record(TTS, _tts_keys(input, voice, audio_config))
+        time.sleep(self._delay(record))
+        return SimpleNamespace(audio_content=base64.b64decode(record["response"]["audio"]))
+
+
+def mode() -> str:
+    return os.getenv("VERTEX_CASSETTE_MODE", "").lower()
+
+
+def install_from_env() -> Optional[Cassette]:
+    """Install recording or replaying backends in ``vertex`` according to the environment."""
+    from . import vertex
+
+    current = mode()
+    if current in ("", "off"):
+        return None
+    path = os.getenv("VERTEX_CASSETTE_PATH", "vertex-cassette.jsonl.gz")
+    if current == "record":
+        cassette = Cassette(path)
+        vertex.install_backends(
+            model=RecordingModel(vertex._live_model, cassette),
+            speech_client=RecordingSpeechClient(vertex._live_speech_client, cassette),
+            tts_client=RecordingTTSClient(vertex._live_tts_client, cassette),
+        )
+        logger.info(f"Recording model, speech and TTS calls to {path}")
+        return cassette
+    if current == "replay":
+        cassette = Cassette.load(path)
+        scale = float(os.getenv("VERTEX_CASSETTE_LATENCY_SCALE", "1"))
+        loose = os.getenv("VERTEX_CASSETTE_MATCH", "exact").lower() == "loose"
+        vertex.install_backends(
+            model=ReplayModel(cassette, scale, loose),
+            speech_client=ReplaySpeechClient(cassette, scale, loose),
+            tts_client=ReplayTTSClient(cassette, scale, loose),
+        )
+        return cassette
+    raise ValueError(f"Unknown VERTEX_CASSETTE_MODE: {current}")
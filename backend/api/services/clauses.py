@@ -0,0 +1,253 @@
+"""Rule-based pre-filter for risk analysis.
+
+Most of a loan or insurance contract is boilerplate, yet ``analyze_risks``
+has the model read all of it. When the document has a text layer,
+``analyze_risks`` here splits it into clauses (``segment``), keeps the ones
+that mention a term from ``LEXICON`` (late fees, penalties, indemnity,
+auto-renewal, arbitration, foreclosure charges, ...), and sends only those,
+each prefixed by its section reference, to the model. Matching is one
+Aho-Corasick pass over the text, so the cost does not grow with the size of
+the lexicon.
+
+The whole file is still sent when the document has no text layer (scanned
+PDFs), when no clause matches, or when the candidates are not meaningfully
+smaller than the document (``CLAUSE_PREFILTER_MAX_RATIO``).
+``CLAUSE_PREFILTER=false`` turns the filter off. ``benchmarks.clauses``
+measures prompt size and latency against the full-document path.
+"""
+import asyncio
+import os
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import vertex
+
+# Terms that mark a clause as worth a risk review. Matched case-insensitively
+# at the start of a word; a trailing "*" also matches longer words
+# ("penalt*": penalty, penalties).
+LEXICON = (
+    # Fees and penalties
+    "late fee*", "late payment*", "late charge*", "penal interest", "penal charge*", "penalt*",
+    "default interest", "bounce charge*", "cheque bounce", "dishonour*", "processing fee*", "service charge*",
+    "non-refundable", "forfeit*", "liquidated damages",
+    # Prepayment and foreclosure
+    "foreclos*", "prepayment*", "pre-payment*", "part-payment*", "early repayment", "early termination",
+    # Interest
+    "floating rate", "variable rate", "interest rate*", "rate of interest", "compound*",
+    # Liability
+    "indemni*", "hold harmless", "limitation of liability", "liable", "liability", "consequential loss*",
+    # Renewal and termination
+    "auto-renew*", "auto renew*", "automatic renewal", "automatically renew*", "terminat*", "lock-in",
+    "lock in period", "notice period",
+    # Disputes
+    "arbitrat*", "jurisdiction", "governing law", "waive*", "class action",
+    # Security and recovery
+    "collateral", "guarantor*", "lien", "liens", "hypothecat*", "set-off", "set off", "repossess*",
+    "recovery agent*",
+    # One-sided changes
+    "sole discretion", "absolute discretion", "unilateral*", "without notice", "without prior notice",
+    "amend these terms", "vary the terms",
+    # Insurance
+    "exclusion*", "not covered", "waiting period", "co-payment", "copay*", "deductible*", "sub-limit*",
+    "pre-existing",
+    # Tenancy
+    "security deposit", "escalation", "maintenance charge*",
+    # Personal data
+    "credit bureau*", "credit information", "personal data",
+)
+
+# Clauses longer than this are split at sentence ends, so one long paragraph
+# does not carry a whole page into the prompt
+MAX_CLAUSE_CHARS = 1200
+
+_MARKER = re.compile(
+    r"^\s*(?:(?:section|clause|article)\s+(?P<named>[0-9IVXLC]+(?:\.\d+)*)"
+    r"|(?P<number>\d+(?:\.\d+)+\.?|\d+[.)])\s"
+    r"|\((?P<letter>[a-z]{1,3})\)\s)",
+    re.IGNORECASE,
+)
+_SENTENCE_END = re.compile(r"(?<=[.;])\s+")
+
+
+def enabled() -> bool:
+    return os.getenv("CLAUSE_PREFILTER", "true").lower() != "false"
+
+
+def max_ratio() -> float:
+    return float(os.getenv("CLAUSE_PREFILTER_MAX_RATIO", "0.8"))
+
+
+class Matcher:
+    """Aho-Corasick automaton over lower-case patterns, matched at word starts."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Per state: (pattern, whether it may end inside a word)
+        self._out: List[List[Tuple[str, bool]]] = [[]]
+        for pattern in patterns:
+            prefix = pattern.endswith("*")
+            self._add(pattern.rstrip("*").lower(), pattern, prefix)
+        self._link()
+
+    def _add(self, word: str, pattern: str, prefix: bool) -> None:
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((pattern, prefix))
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> Iterator[Tuple[int, str]]:
+        """(start offset, pattern) of every match in ``text``."""
+        lowered = text.lower()
+        state = 0
+        for i, ch in enumerate(lowered):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for pattern, prefix in self._out[state]:
+                length = len(pattern) - prefix
+                start = i - length + 1
+                if start > 0 and lowered[start - 1].isalnum():
+                    continue
+                if not prefix and i + 1 < len(lowered) and lowered[i + 1].isalnum():
+                    continue
+                yield start, pattern
+
+
+_matcher: Optional[Matcher] = None
+
+
+def get_matcher() -> Matcher:
+    global _matcher
+    if _matcher is None:
+        _matcher = Matcher(LEXICON)
+    return _matcher
+
+
+@dataclass(frozen=True)
+class Clause:
+    ref: str
+    text: str
+    terms: Tuple[str, ...] = ()
+
+
+def _blocks(text: str) -> Iterator[Tuple[Optional[re.Match], str]]:
+    # A block ends at a blank line or where the next numbered clause starts
+    lines: List[str] = []
+    marker = None
+    for line in text.splitlines():
+        starts = _MARKER.match(line)
+        if (starts or not line.strip()) and lines:
+            yield marker, " ".join(" ".join(lines).split())
+            lines, marker = [], None
+        if line.strip():
+            if not lines:
+                marker = starts
+                # The reference replaces the number in the prompt
+                line = line[starts.end():] if starts else line
+            lines.append(line.strip())
+    if lines:
+        yield marker, " ".join(" ".join(lines).split())
+
+
+def _split_long(text: str) -> List[str]:
+    if len(text) <= MAX_CLAUSE_CHARS:
+        return [text]
+    pieces, current = [], ""
+    for sentence in _SENTENCE_END.split(text):
+        if current and len(current) + len(sentence) + 1 > MAX_CLAUSE_CHARS:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    return pieces + ([current] if current else [])
+
+
+def segment(text: str) -> List[Clause]:
+    """Clauses of ``text`` in order, each with a section reference.
+
+    Numbered clauses ("4.2", "Clause 7", "(b)") use their number, lettered
+    items are qualified by the clause they belong to ("4(b)"), and
+    unnumbered paragraphs are counted within the current clause ("4 ¶2").
+    """
+    clauses: List[Clause] = []
+    section, paragraph = "", 0
+    for marker, block in _blocks(text):
+        if marker and (marker.group("named") or marker.group("number")):
+            section, paragraph = (marker.group("named") or marker.group("number")).rstrip(".)"), 0
+            ref = section
+        elif marker:
+            ref = f"{section}({marker.group('letter').lower()})" if section else f"({marker.group('letter').lower()})"
+        else:
+            paragraph += 1
+            ref = f"{section} ¶{paragraph}" if section else f"¶{paragraph}"
+        clauses.extend(Clause(ref, piece) for piece in _split_long(block) if piece)
+    return clauses
+
+
+def candidates(text: str, matcher: Optional[Matcher] = None) -> List[Clause]:
+    """The clauses of ``text`` that mention a lexicon term."""
+    matcher = matcher or get_matcher()
+    found = []
+    for clause in segment(text):
+        terms = tuple(sorted({pattern.rstrip("*") for _, pattern in matcher.find(clause.text)}))
+        if terms:
+            found.append(Clause(clause.ref, clause.text, terms))
+    return found
+
+
+def prompt_text(clauses: Iterable[Clause]) -> str:
+    return "\n\n".join(f"[{c.ref}] {c.text}" for c in clauses)
+
+
+def select(text: Optional[str]) -> Optional[str]:
+    """The candidate clauses of ``text`` to send instead of the whole document, or None to send it all."""
+    if not text:
+        return None
+    selected = prompt_text(candidates(text))
+    if not selected or len(selected) > max_ratio() * len(text):
+        return None
+    return selected
+
+
+def _selected(text: Optional[str]) -> Optional[str]:
+    if not enabled() or not vertex._has_backend("model"):
+        return None
+    return select(text)
+
+
+def analyze_risks(text: Optional[str], gcs_uri: str) -> List[Dict[str, str]]:
+    """``vertex.analyze_risks`` on the candidate clauses of ``text`` (the text layer) when there is a usable set,
+    else on the file."""
+    selected = _selected(text)
+    if selected is None:
+        return vertex.analyze_risks(gcs_uri)
+    return vertex.analyze_risk_clauses(selected)
+
+
+async def analyze_risks_async(text: Optional[str], gcs_uri: str) -> List[Dict[str, str]]:
+    selected = await asyncio.to_thread(_selected, text)
+    if selected is None:
+        return await vertex.analyze_risks_async(gcs_uri)
+    return await vertex.analyze_risk_clauses_async(selected)
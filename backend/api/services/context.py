@@ -0,0 +1,46 @@
+"""Per-request context shared between views and the service layer.
+
+Views describe who is asking and how urgent the work is with ``request_scope``;
+service code deep in the call stack (e.g. the model-call scheduler) reads it
+back with ``current()`` instead of threading extra arguments through every
+function. Context does not follow work handed to a thread pool on its own:
+submit with ``contextvars.copy_context().run`` to carry it across.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+from typing import Iterator, Optional
+
+INTERACTIVE = "interactive"
+ANALYSIS = "analysis"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, ANALYSIS, BACKGROUND)
+
+
+@dataclass(frozen=True)
+class RequestContext:
+    priority: str = INTERACTIVE
+    user: Optional[str] = None
+    document: Optional[str] = None  # document the work is about, for usage accounting
+
+
+_current: ContextVar[RequestContext] = ContextVar("legalease_request_context", default=RequestContext())
+
+
+def current() -> RequestContext:
+    return _current.get()
+
+
+@contextmanager
+def request_scope(**fields) -> Iterator[RequestContext]:
+    """Override fields of the current context for the duration of the block."""
+    priority = fields.get("priority")
+    if priority is not None and priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority class: {priority}")
+    ctx = replace(_current.get(), **fields)
+    token = _current.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current.reset(token)
+
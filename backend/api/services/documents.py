@@ -0,0 +1,89 @@
+"""Preparing stored documents for model analysis."""
+import io
+import tempfile
+from typing import BinaryIO, Optional, Union
+
+from . import blobcache, blobs, gcs, metrics
+
+WORD_CONTENT_TYPES = (
+    "application/msword",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+)
+
+
+def is_word_document(gcs_path: str, content_type: Optional[str]) -> bool:
+    return (content_type or "").lower() in WORD_CONTENT_TYPES or gcs_path.lower().endswith((".doc", ".docx"))
+
+
+def is_pdf(gcs_path: str, content_type: Optional[str]) -> bool:
+    return (content_type or "").lower() == "application/pdf" or gcs_path.lower().endswith(".pdf")
+
+
+def is_text(gcs_path: str, content_type: Optional[str]) -> bool:
+    return (content_type or "").lower().startswith("text/") or gcs_path.lower().endswith(".txt")
+
+
+@metrics.instrument("documents.docx_to_text")
+def docx_to_text(file_bytes: Union[bytes, BinaryIO]) -> str:
+    """Extract paragraph text with python-docx; raises ImportError when it is not installed.
+
+    Accepts the file's bytes or a seekable binary file.
+    """
+    from docx import Document  # type: ignore
+
+    if hasattr(file_bytes, "read"):
+        return "\n".join([p.text for p in Document(file_bytes).paragraphs])
+    # Write to temp and read via python-docx
+    with tempfile.NamedTemporaryFile(suffix=".docx", delete=True) as tmp:
+        tmp.write(file_bytes)
+        tmp.flush()
+        docx_doc = Document(tmp.name)
+        return "\n".join([p.text for p in docx_doc.paragraphs])
+
+
+@metrics.instrument("documents.pdf_to_text")
+def pdf_to_text(file_bytes: Union[bytes, BinaryIO]) -> str:
+    """Extract the text layer with pypdf; raises ImportError when it is not installed.
+
+    Accepts the file's bytes or a seekable binary file (or memory map). Scanned
+    PDFs without a text layer come back (nearly) empty.
+    """
+    from pypdf import PdfReader  # type: ignore
+
+    reader = PdfReader(file_bytes if hasattr(file_bytes, "read") else io.BytesIO(file_bytes))
+    return "\n\n".join((page.extract_text() or "") for page in reader.pages)
+
+
+def extract_text(gcs_path: str, content_type: Optional[str]) -> Optional[str]:
+    """Plain text of a stored PDF, Word or text file; None for other types."""
+    # Read through the local blob cache; the parsers work on the mapped file directly
+    if is_pdf(gcs_path, content_type):
+        with blobcache.mapped(gcs_path) as data:
+            return pdf_to_text(data)
+    if is_word_document(gcs_path, content_type):
+        with blobcache.opened(gcs_path) as f:
+            return docx_to_text(f)
+    if is_text(gcs_path, content_type):
+        with blobcache.mapped(gcs_path) as data:
+            return str(data, "utf-8", errors="replace")
+    return None
+
+
+def analysis_uri(gcs_path: str, content_type: Optional[str]) -> str:
+    """gs:// URI of the file the model should read.
+
+    Vertex cannot read Word files, so those are converted to plain text and
+    uploaded next to the original first; for content-addressed uploads the
+    converted copy is recorded in the blob index and reused.
+    """
+    if not is_word_document(gcs_path, content_type):
+        return gcs.path_to_uri(gcs_path)
+    converted = blobs.derived(gcs_path, "textPath")
+    if converted:
+        return gcs.path_to_uri(converted)
+    with blobcache.opened(gcs_path) as f:
+        text = docx_to_text(f)
+    converted_path = gcs_path.rsplit(".", 1)[0] + ".txt"
+    path, gcs_uri = gcs.upload_bytes(text.encode("utf-8"), converted_path, "text/plain")
+    blobs.save_derived(gcs_path, "textPath", path)
+    return gcs_uri
@@ -1,14 +1,28 @@
+import base64
+import itertools
+import json
+import logging
 import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from . import metrics, write_behind
+
+logger = logging.getLogger(__name__)
 
 _USE_GCP = bool(os.getenv("GCP_PROJECT_ID"))
+_client = None
 
 if _USE_GCP:
-    from google.cloud import firestore  # type: ignore
-    from google.oauth2 import service_account
+    # The Firestore SDK is imported when the first client is built, not at startup
+
+    def _credentials():
+        from google.oauth2 import service_account
 
-    def get_db():
         # Use explicit service account credentials (not default) and enforce expected SA email
         expected_email = "legal-service-acc@spry-shade-471512-s6.iam.gserviceaccount.com"
         creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
@@ -24,17 +38,46 @@ if _USE_GCP:
             raise PermissionError(
                 f"Unexpected service account: {getattr(credentials, 'service_account_email', 'unknown')}. Expected: {expected_email}"
             )
-        return firestore.Client(project=os.getenv("GCP_PROJECT_ID"), credentials=credentials)
+        return credentials
+
+    def _get_db():
+        # Reuse one client per process; building it re-reads the key file and opens a channel
+        global _client
+        if _client is None:
+            from google.cloud import firestore  # type: ignore
+
+            _client = firestore.Client(project=os.getenv("GCP_PROJECT_ID"), credentials=_credentials())
+        return _client
+
+    # Async clients are bound to the event loop that created them
+    _async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+    def _get_async_db():
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        client = _async_clients.get(loop)
+        if client is None:
+            from google.cloud import firestore  # type: ignore
+
+            client = firestore.AsyncClient(project=os.getenv("GCP_PROJECT_ID"), credentials=_credentials())
+            _async_clients[loop] = client
+        return client
 else:
-    _DB: Dict[str, Dict[str, Dict[str, Any]]] = {"documents": {}, "reminders": {}, "faqs": {}}
+    _DB: Dict[str, Dict[str, Dict[str, Any]]] = {
+        "documents": {}, "reminders": {}, "faqs": {}, "usage_users": {}, "usage_documents": {},
+        "section_analysis": {}, "blobs": {}, "glossary_terms": {}, "glossary_candidates": {},
+    }
+    _ids = itertools.count(1)
 
     class _DocRef:
         def __init__(self, collection: str, doc_id: str):
             self.collection = collection
             self.id = doc_id
 
-        def set(self, data: Dict[str, Any]):
-            _DB[self.collection][self.id] = data
+        def set(self, data: Dict[str, Any], merge: bool = False):
+            current = _DB[self.collection].get(self.id, {}) if merge else {}
+            _DB[self.collection][self.id] = {**current, **data}
 
         def get(self):
             class _Doc:
@@ -54,7 +97,8 @@ else:
 
         def document(self, doc_id: str | None = None):
             if doc_id is None:
-                doc_id = f"local-{len(_DB[self.name]) + 1}"
+                # Counter rather than len(): buffered writes are not in _DB yet
+                doc_id = f"local-{next(_ids)}"
             return _DocRef(self.name, doc_id)
 
         def order_by(self, *_args, **_kwargs):
@@ -74,58 +118,389 @@ else:
 
             return [_Doc(i, d) for i, d in _DB[self.name].items()]
 
+    class _Batch:
+        def __init__(self):
+            self._writes: List[tuple] = []
+
+        def set(self, ref: "_DocRef", data: Dict[str, Any]):
+            self._writes.append((ref, data))
+
+        def commit(self):
+            for ref, data in self._writes:
+                ref.set(data)
+            self._writes = []
+
     class _DBClient:
         def collection(self, name: str):
             return _Collection(name)
 
-    def get_db():
+        def batch(self):
+            return _Batch()
+
+    def _get_db():
         return _DBClient()
 
+    def _get_async_db():
+        raise RuntimeError("Firestore async client requires GCP_PROJECT_ID")
+
+
+# Stand-ins for the Firestore clients (benchmark fakes); see install_backends()
+_backends: Dict[str, Any] = {}
+
+
+def install_backends(db=None, async_db=None) -> None:
+    """Serve Firestore calls from the given clients instead of Firestore or the dev store.
+
+    ``db`` mirrors the sync client surface used here and ``async_db`` the
+    async one. Call with no arguments to restore the defaults.
+    """
+    _backends.clear()
+    for name, obj in (("db", db), ("async_db", async_db)):
+        if obj is not None:
+            _backends[name] = obj
+    _documents.clear()
+
+
+def get_db():
+    return _backends["db"] if "db" in _backends else _get_db()
+
+
+def get_async_db():
+    return _backends["async_db"] if "async_db" in _backends else _get_async_db()
+
+
+def _buffer() -> Optional[write_behind.WriteBehindBuffer]:
+    return write_behind.get_buffer(get_db)
 
+
+def _write(collection: str, data: Dict[str, Any]) -> str:
+    """Create a document with a client-generated id, through the write-behind buffer if enabled."""
+    db = get_db()
+    ref = db.collection(collection).document()
+    buffer = _buffer()
+    if buffer is not None:
+        buffer.enqueue(collection, ref.id, data)
+    else:
+        ref.set(data)
+    return ref.id
+
+
+@metrics.instrument("firestore.save_document_metadata")
 def save_document_metadata(user_id: str, data: Dict[str, Any]) -> str:
     try:
-        db = get_db()
-        ref = db.collection("documents").document()
-        ref.set({"userId": user_id, **data, "createdAt": datetime.utcnow()})
-        return ref.id
+        return _write("documents", {"userId": user_id, **data, "createdAt": datetime.utcnow()})
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Failed to save document metadata: {str(e)}")
         raise Exception(f"Failed to save document metadata. Please check Firestore permissions. Error: {str(e)}")
 
 
-def get_document(user_id: str, document_id: str) -> Dict[str, Any]:
-    db = get_db()
-    ref = db.collection("documents").document(document_id)
-    doc = ref.get()
-    data = doc.to_dict() or {}
+def _owned_document(user_id: str, document_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
     # Allow access in public/unauthenticated mode when user_id is None
     if not data:
         raise PermissionError("Document not found")
     if user_id and data.get("userId") != user_id:
         raise PermissionError("Document not found")
-    return {"id": doc.id, **data}
+    return {"id": document_id, **data}
+
+
+DOCUMENT_CACHE = metrics.REGISTRY.counter(
+    "legalease_document_cache_total",
+    "Document record lookups by cache outcome; each hit is a Firestore read avoided.", ("outcome",))
+
+
+def _document_cache_config() -> Tuple[float, int]:
+    return float(os.getenv("DOCUMENT_CACHE_TTL_S", "15")), int(os.getenv("DOCUMENT_CACHE_SIZE", "2048"))
+
+
+class _DocumentCache:
+    """Read-through cache of document records: LRU-bounded, entries expire after a TTL.
+
+    Writes through this module invalidate the record's entry, and a read that
+    overlapped any invalidation is not cached, so a worker sees its own writes
+    at once and other workers' within the TTL.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def enabled(self) -> bool:
+        # The dev store is in memory already
+        return (_USE_GCP or "db" in _backends) and _document_cache_config()[0] > 0
+
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, document_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(document_id)
+                DOCUMENT_CACHE.inc(outcome="hit")
+                return entry[1]
+            self._entries.pop(document_id, None)
+        DOCUMENT_CACHE.inc(outcome="miss")
+        return None
+
+    def put(self, document_id: str, data: Dict[str, Any], generation: int) -> None:
+        ttl, max_entries = _document_cache_config()
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[document_id] = (time.monotonic() + ttl, data)
+            self._entries.move_to_end(document_id)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, document_id: str) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(document_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
 
+_documents = _DocumentCache()
 
+
+@metrics.instrument("firestore.get_document")
+def get_document(user_id: str, document_id: str) -> Dict[str, Any]:
+    buffer = _buffer()
+    data = buffer.get("documents", document_id) if buffer is not None else None
+    cached = data is None and _documents.enabled()
+    if cached:
+        data = _documents.get(document_id)
+    if data is None:
+        generation = _documents.generation()
+        db = get_db()
+        doc = db.collection("documents").document(document_id).get()
+        data = doc.to_dict() or {}
+        if cached and data:
+            _documents.put(document_id, data, generation)
+    # Ownership is checked on every access, cached or not
+    return _owned_document(user_id, document_id, data)
+
+
+@metrics.instrument("firestore.get_document")
+async def get_document_async(user_id: str, document_id: str) -> Dict[str, Any]:
+    """``get_document`` for async views, using Firestore's native async client."""
+    if not (_USE_GCP or "async_db" in _backends):
+        return get_document(user_id, document_id)
+    buffer = _buffer()
+    data = buffer.get("documents", document_id) if buffer is not None else None
+    cached = data is None and _documents.enabled()
+    if cached:
+        data = _documents.get(document_id)
+    if data is None:
+        generation = _documents.generation()
+        doc = await get_async_db().collection("documents").document(document_id).get()
+        data = doc.to_dict() or {}
+        if cached and data:
+            _documents.put(document_id, data, generation)
+    return _owned_document(user_id, document_id, data)
+
+
+@metrics.instrument("firestore.update_document")
+def update_document(document_id: str, fields: Dict[str, Any]) -> None:
+    """Merge ``fields`` into a document record, including one still in the write-behind buffer."""
+    buffer = _buffer()
+    pending = buffer.get("documents", document_id) if buffer is not None else None
+    if pending is not None:
+        # The queued create is a full-document set; queue the merged document in its place
+        buffer.enqueue("documents", document_id, {**pending, **fields})
+        return
+    _documents.invalidate(document_id)
+    try:
+        get_db().collection("documents").document(document_id).set(fields, merge=True)
+    finally:
+        # Again once written, in case a read cached the old record meanwhile
+        _documents.invalidate(document_id)
+
+
+@metrics.instrument("firestore.find_latest_version")
+def find_latest_version(user_id: str, filename: str) -> Optional[Dict[str, Any]]:
+    """The highest-version document this user uploaded under ``filename``, if any."""
+    if not user_id:
+        # Anonymous uploads share the "None" owner; never link them to each other
+        return None
+    if _USE_GCP or "db" in _backends:
+        docs = get_db().collection("documents").where("userId", "==", user_id).where("filename", "==", filename).stream()
+        rows = [{"id": d.id, **(d.to_dict() or {})} for d in docs]
+    else:
+        rows = [{"id": i, **d} for i, d in _DB["documents"].items()
+                if d.get("userId") == user_id and d.get("filename") == filename]
+    # Direct uploads that were never completed are not versions
+    rows = [r for r in rows if r.get("status") != "pending"]
+    return max(rows, key=lambda r: (r.get("version") or 1, str(r.get("createdAt") or "")), default=None)
+
+
+# Fields returned by list_documents; the rest of a record (analysis results, paths) is not read
+LISTED_FIELDS = ["filename", "category", "contentType", "size", "status", "version", "createdAt", "analysisSummary"]
+
+
+def _encode_cursor(row: Dict[str, Any]) -> str:
+    created = row["createdAt"]
+    raw = json.dumps({"t": created.isoformat(), "id": row["id"]})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Raises ``ValueError`` for a cursor not made by ``_encode_cursor``."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(data["t"]), str(data["id"])
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+@metrics.instrument("firestore.list_documents")
+def list_documents(user_id: str, limit: int = 20, cursor: Optional[str] = None, category: Optional[str] = None,
+                   status: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of a user's documents, newest first, and the cursor of the next page (None on the last).
+
+    Pages continue after the last document of the previous one rather than
+    skipping an offset, so every page costs ``limit + 1`` reads however large
+    the library is. Served by the composite indexes in ``firestore.indexes.json``.
+    Records still in the write-behind buffer appear once it is flushed.
+    """
+    after = _decode_cursor(cursor) if cursor else None
+    if _USE_GCP or "db" in _backends:
+        collection = get_db().collection("documents")
+        query = collection.where("userId", "==", user_id)
+        if category:
+            query = query.where("category", "==", category)
+        if status:
+            query = query.where("status", "==", status)
+        # Document id breaks ties between records created in the same instant
+        query = query.order_by("createdAt", direction="DESCENDING").order_by("__name__", direction="DESCENDING")
+        if after:
+            query = query.start_after({"createdAt": after[0], "__name__": collection.document(after[1])})
+        docs = query.select(LISTED_FIELDS).limit(limit + 1).stream()
+        rows = [{"id": d.id, **(d.to_dict() or {})} for d in docs]
+    else:
+        rows = [{"id": i, **{f: d.get(f) for f in LISTED_FIELDS if f in d}} for i, d in _DB["documents"].items()
+                if d.get("userId") == user_id and (not category or d.get("category") == category)
+                and (not status or d.get("status") == status)]
+        rows.sort(key=lambda r: (r["createdAt"], r["id"]), reverse=True)
+        if after:
+            rows = [r for r in rows if (r["createdAt"], r["id"]) < after]
+        rows = rows[:limit + 1]
+    page = rows[:limit]
+    return page, (_encode_cursor(page[-1]) if len(rows) > limit else None)
+
+
+def iter_documents(user_id: Optional[str] = None, category: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Every document record (optionally one user's, or one category), streamed; for bulk jobs."""
+    if _USE_GCP or "db" in _backends:
+        query = get_db().collection("documents")
+        if user_id:
+            query = query.where("userId", "==", user_id)
+        if category:
+            query = query.where("category", "==", category)
+        for doc in query.stream():
+            yield {"id": doc.id, **(doc.to_dict() or {})}
+        return
+    for document_id, data in list(_DB["documents"].items()):
+        if (not user_id or data.get("userId") == user_id) and (not category or data.get("category") == category):
+            yield {"id": document_id, **data}
+
+
+@metrics.instrument("firestore.get_section_result")
+def get_section_result(key: str) -> Optional[Dict[str, Any]]:
+    """Cached model output for one document section (see ``longdoc``), keyed by content hash."""
+    doc = get_db().collection("section_analysis").document(key).get()
+    return doc.to_dict() or None
+
+
+@metrics.instrument("firestore.save_section_result")
+def save_section_result(key: str, data: Dict[str, Any]) -> None:
+    get_db().collection("section_analysis").document(key).set({**data, "createdAt": datetime.utcnow()})
+
+
+@metrics.instrument("firestore.list_glossary_terms")
+def list_glossary_terms() -> List[Dict[str, Any]]:
+    """Terms the model defined that were added to the local glossary (see ``glossary``)."""
+    return [doc.to_dict() or {} for doc in get_db().collection("glossary_terms").stream()]
+
+
+@metrics.instrument("firestore.save_glossary_term")
+def save_glossary_term(key: str, data: Dict[str, Any]) -> None:
+    get_db().collection("glossary_terms").document(key).set({**data, "createdAt": datetime.utcnow()})
+
+
+@metrics.instrument("firestore.add_glossary_sighting")
+def add_glossary_sighting(key: str, data: Dict[str, Any], source: str) -> List[str]:
+    """Record that document ``source`` got the model definition ``key``; returns every document that did."""
+    ref = get_db().collection("glossary_candidates").document(key)
+    if _USE_GCP and "db" not in _backends:
+        from google.cloud import firestore  # type: ignore
+
+        ref.set({**data, "sources": firestore.ArrayUnion([source]), "updatedAt": firestore.SERVER_TIMESTAMP},
+                merge=True)
+        return list((ref.get().to_dict() or {}).get("sources") or [])
+    # The dev store and benchmark fakes have no server-side array unions
+    current = ref.get().to_dict() or {}
+    sources = list(current.get("sources") or [])
+    if source not in sources:
+        sources.append(source)
+    ref.set({**current, **data, "sources": sources, "updatedAt": datetime.utcnow()})
+    return sources
+
+
+@metrics.instrument("firestore.get_blob")
+def get_blob(sha256: str) -> Optional[Dict[str, Any]]:
+    """Index entry for stored upload content (see ``blobs``), keyed by its SHA-256."""
+    doc = get_db().collection("blobs").document(sha256).get()
+    return doc.to_dict() or None
+
+
+@metrics.instrument("firestore.save_blob")
+def save_blob(sha256: str, data: Dict[str, Any], merge: bool = False) -> None:
+    fields = {**data, "updatedAt": datetime.utcnow()} if merge else {**data, "createdAt": datetime.utcnow()}
+    get_db().collection("blobs").document(sha256).set(fields, merge=merge)
+
+
+@metrics.instrument("firestore.upsert_reminder")
 def upsert_reminder(user_id: str, reminder: Dict[str, Any]) -> str:
     try:
-        db = get_db()
-        ref = db.collection("reminders").document()
-        ref.set({"userId": user_id, **reminder, "createdAt": datetime.utcnow()})
-        return ref.id
+        return _write("reminders", {"userId": user_id, **reminder, "createdAt": datetime.utcnow()})
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Failed to save reminder: {str(e)}")
         raise Exception(f"Failed to save reminder. Please check Firestore permissions. Error: {str(e)}")
 
 
+@metrics.instrument("firestore.add_usage")
+def add_usage(rows: Dict[Tuple[str, str], Dict[str, float]]) -> None:
+    """Add counter deltas to ``{(collection, doc_id): {field: delta}}`` in one batch."""
+    db = get_db()
+    if _USE_GCP and "db" not in _backends:
+        from google.cloud import firestore  # type: ignore
+
+        batch = db.batch()
+        for (collection, doc_id), deltas in rows.items():
+            fields = {field: firestore.Increment(value) for field, value in deltas.items()}
+            batch.set(db.collection(collection).document(doc_id),
+                      {**fields, "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+        batch.commit()
+        return
+    # The dev store and benchmark fakes have no server-side increments
+    for (collection, doc_id), deltas in rows.items():
+        ref = db.collection(collection).document(doc_id)
+        current = ref.get().to_dict() or {}
+        totals = {field: current.get(field, 0) + value for field, value in deltas.items()}
+        ref.set({**current, **totals, "updatedAt": datetime.utcnow()})
+
+
+@metrics.instrument("firestore.list_faq")
 def list_faq(limit: int = 20) -> List[Dict[str, Any]]:
-    if _USE_GCP:
+    if _USE_GCP or "db" in _backends:
         db = get_db()
         docs = (
-            db.collection("faqs").order_by("popularity", direction=firestore.Query.DESCENDING).limit(limit).stream()
+            db.collection("faqs").order_by("popularity", direction="DESCENDING").limit(limit).stream()
         )
         return [{"id": d.id, **(d.to_dict() or {})} for d in docs]
     else:
@@ -1,15 +1,50 @@
+import base64
+import hashlib
 import os
-from typing import BinaryIO, Tuple
-from google.cloud import storage  # type: ignore
+import shutil
+import threading
+from typing import BinaryIO, List, Optional, Tuple
 from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+
+from . import metrics, resilience
+
+_bucket = None
+_bucket_lock = threading.Lock()
+# Stand-in for the bucket (benchmark fakes); see install_backend()
+_backend = None
+
+
+def install_backend(bucket=None) -> None:
+    """Serve storage calls from ``bucket`` (``blob()``, ``name``, ``client``) instead of GCS.
+
+    Call with no arguments to restore the default.
+    """
+    global _backend
+    _backend = bucket
 
 
 def _use_gcp() -> bool:
-    return bool(os.getenv("GCP_PROJECT_ID") and os.getenv("GCS_BUCKET_NAME"))
+    return _backend is not None or bool(os.getenv("GCP_PROJECT_ID") and os.getenv("GCS_BUCKET_NAME"))
 
 
 def get_bucket():
+    if _backend is not None:
+        return _backend
+    # One storage client per process: building it re-reads the key file and opens
+    # a new HTTP session. The SDK is imported here so Django starts without it.
+    global _bucket
+    if _bucket is None:
+        with _bucket_lock:
+            if _bucket is None:
+                _bucket = _new_bucket()
+    return _bucket
+
+
+def _new_bucket():
     # Use explicit service account credentials (not default) and enforce expected SA email
+    from google.cloud import storage  # type: ignore
     from google.oauth2 import service_account
 
     expected_email = "legal-service-acc@spry-shade-471512-s6.iam.gserviceaccount.com"
@@ -35,26 +70,39 @@ def get_bucket():
     return client.bucket(get_bucket_name())
 
 
+@metrics.instrument("gcs.upload_file")
 def upload_file(file_obj: BinaryIO, destination_path: str, content_type: str) -> Tuple[str, str]:
     if not _use_gcp():
         # Save to local media for dev/test
         local_path = os.path.join(settings.MEDIA_ROOT, destination_path)
         os.makedirs(os.path.dirname(local_path), exist_ok=True)
         with open(local_path, "wb") as f:
-            f.write(file_obj.read())
+            data = file_obj.read()
+            f.write(data)
+        metrics.record_bytes("gcs.upload_file", len(data), "out")
         return destination_path, f"/media/{destination_path}"
 
     bucket = get_bucket()
     blob = bucket.blob(destination_path)
-    blob.upload_from_file(file_obj, content_type=content_type)
-    
+    start = file_obj.tell()
+
+    def attempt():
+        # Rewind so a retried upload sends the whole file again
+        file_obj.seek(start)
+        blob.upload_from_file(file_obj, content_type=content_type)
+
+    resilience.call("gcs.upload_file", attempt)
+    metrics.record_bytes("gcs.upload_file", file_obj.tell() - start, "out")
+
     # Keep files private - Vertex AI will access them using IAM permissions
     # This is the secure approach recommended by Google Cloud
     gcs_uri = f"gs://{bucket.name}/{blob.name}"
     return blob.name, gcs_uri
 
 
+@metrics.instrument("gcs.upload_bytes")
 def upload_bytes(data: bytes, destination_path: str, content_type: str) -> Tuple[str, str]:
+    metrics.record_bytes("gcs.upload_bytes", len(data), "out")
     if not _use_gcp():
         local_path = os.path.join(settings.MEDIA_ROOT, destination_path)
         os.makedirs(os.path.dirname(local_path), exist_ok=True)
@@ -64,31 +112,174 @@ def upload_bytes(data: bytes, destination_path: str, content_type: str) -> Tuple
 
     bucket = get_bucket()
     blob = bucket.blob(destination_path)
-    blob.upload_from_string(data, content_type=content_type)
+    resilience.call("gcs.upload_bytes", lambda: blob.upload_from_string(data, content_type=content_type))
     gcs_uri = f"gs://{bucket.name}/{blob.name}"
     return blob.name, gcs_uri
 
 
+LOCAL_UPLOAD_SALT = "legalease.local-upload"
+
+
+def _real_gcs() -> bool:
+    return _backend is None and _use_gcp()
+
+
+@metrics.instrument("gcs.create_upload_session")
+def create_upload_session(destination_path: str, content_type: str, size: int, origin: Optional[str] = None) -> str:
+    """URL the client uploads ``size`` bytes to with the resumable upload protocol.
+
+    On Cloud Storage this is a resumable session; the URL itself authorizes
+    the upload, so the client needs no credentials. Elsewhere (local dev,
+    benchmark fakes) it is the stand-in endpoint in ``api.local_storage``,
+    which speaks the same protocol and writes through this module.
+    """
+    if not _real_gcs():
+        token = signing.dumps({"path": destination_path, "type": content_type, "size": size}, salt=LOCAL_UPLOAD_SALT)
+        return reverse("local_upload", args=[token])
+    blob = get_bucket().blob(destination_path)
+    return resilience.call(
+        "gcs.create_upload_session",
+        lambda: blob.create_resumable_upload_session(content_type=content_type, size=size, origin=origin),
+    )
+
+
+@metrics.instrument("gcs.copy")
+def copy(source_path: str, destination_path: str) -> Tuple[str, str]:
+    """Copy an object within the bucket without passing its bytes through this process."""
+    if not _use_gcp():
+        source = os.path.join(settings.MEDIA_ROOT, source_path)
+        destination = os.path.join(settings.MEDIA_ROOT, destination_path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(source, destination)
+        return destination_path, f"/media/{destination_path}"
+    bucket = get_bucket()
+    resilience.call("gcs.copy", lambda: bucket.copy_blob(bucket.blob(source_path), bucket, destination_path))
+    return destination_path, f"gs://{bucket.name}/{destination_path}"
+
+
+@metrics.instrument("gcs.delete")
+def delete(path: str) -> None:
+    if not _use_gcp():
+        try:
+            os.remove(os.path.join(settings.MEDIA_ROOT, path))
+        except FileNotFoundError:
+            pass
+        return
+    blob = get_bucket().blob(path)
+    resilience.call("gcs.delete", blob.delete)
+
+
+@metrics.instrument("gcs.get_blob_bytes")
 def get_blob_bytes(gcs_path: str) -> bytes:
+    data = _read_blob(gcs_path)
+    metrics.record_bytes("gcs.get_blob_bytes", len(data), "in")
+    return data
+
+
+def _read_blob(gcs_path: str) -> bytes:
     if not _use_gcp():
         local_path = os.path.join(settings.MEDIA_ROOT, gcs_path)
         with open(local_path, "rb") as f:
             return f.read()
+    blob = _blob(gcs_path)
+    # Downloads are idempotent, so a slow one may be hedged with a second request
+    hedge_after = int(os.getenv("GCS_HEDGE_AFTER_MS", "0")) / 1000
+    return resilience.hedged("gcs.get_blob_bytes", blob.download_as_bytes, hedge_after)
+
+
+def _locate(gcs_path: str) -> Tuple[str, str]:
+    """(bucket name, object key) of a bucket-relative path or gs:// URI."""
+    if gcs_path.startswith("gs://"):
+        bucket_name, _, key = gcs_path[len("gs://"):].partition("/")
+        return bucket_name, key
+    return get_bucket().name, gcs_path
+
+
+def _blob(gcs_path: str):
     # gcs_path is like "uploads/..." or full "gs://bucket/key"
     bucket = get_bucket()
-    if gcs_path.startswith("gs://"):
-        # Strip bucket prefix
-        _, _, rest = gcs_path.partition("gs://")
-        bucket_name, _, key = rest.partition("/")
-        if bucket_name != bucket.name:
-            client = bucket.client  # type: ignore
-            b = client.bucket(bucket_name)
-            blob = b.blob(key)
-        else:
-            blob = bucket.blob(key)
+    bucket_name, key = _locate(gcs_path)
+    if bucket_name != bucket.name:
+        return bucket.client.bucket(bucket_name).blob(key)  # type: ignore
+    return bucket.blob(key)
+
+
+def object_name(gcs_path: str) -> str:
+    """``bucket/key`` identifying the object behind either form of path."""
+    if not _use_gcp():
+        return gcs_path
+    bucket_name, key = _locate(gcs_path)
+    return f"{bucket_name}/{key}"
+
+
+def local_path(gcs_path: str) -> Optional[str]:
+    """The file backing ``gcs_path`` when objects are stored on local disk (dev), else None."""
+    if _use_gcp():
+        return None
+    return os.path.join(settings.MEDIA_ROOT, gcs_path)
+
+
+@metrics.instrument("gcs.list")
+def list_paths(prefix: str) -> List[str]:
+    """Objects under ``prefix``, in the same form (bucket-relative or gs://) as the prefix."""
+    if not _use_gcp():
+        root = os.path.join(settings.MEDIA_ROOT, prefix)
+        found = []
+        for directory, _, files in os.walk(root):
+            found.extend(os.path.relpath(os.path.join(directory, f), settings.MEDIA_ROOT) for f in files)
+        return sorted(found)
+    bucket = get_bucket()
+    bucket_name, key = _locate(prefix)
+    source = bucket if bucket_name == bucket.name else bucket.client.bucket(bucket_name)  # type: ignore
+    names = resilience.call("gcs.list", lambda: [blob.name for blob in source.list_blobs(prefix=key)])
+    return [f"gs://{bucket_name}/{name}" if prefix.startswith("gs://") else name for name in names]
+
+
+@metrics.instrument("gcs.generation")
+def generation(gcs_path: str) -> Optional[int]:
+    """Current generation of the object; changes whenever it is overwritten."""
+    blob = _blob(gcs_path)
+    resilience.call("gcs.generation", blob.reload)
+    return blob.generation
+
+
+@metrics.instrument("gcs.stat")
+def stat(gcs_path: str) -> Tuple[int, Optional[str]]:
+    """Size and base64 MD5 of an object, from the metadata storage keeps (the bytes are not read)."""
+    if not _use_gcp():
+        # Local disk has no metadata service: hash the file where it lies
+        md5 = hashlib.md5()
+        with open(os.path.join(settings.MEDIA_ROOT, gcs_path), "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                md5.update(chunk)
+            size = f.tell()
+        return size, base64.b64encode(md5.digest()).decode("ascii")
+    blob = _blob(gcs_path)
+    resilience.call("gcs.stat", blob.reload)
+    # Composite objects have only a CRC32C, no MD5
+    return int(blob.size), blob.md5_hash
+
+
+@metrics.instrument("gcs.download_to_file")
+def download_to_file(gcs_path: str, file_obj: BinaryIO, if_generation_match: Optional[int] = None) -> int:
+    """Stream the object into ``file_obj`` without holding it in memory; returns its size."""
+    start = file_obj.tell()
+    if not _use_gcp():
+        with open(os.path.join(settings.MEDIA_ROOT, gcs_path), "rb") as f:
+            shutil.copyfileobj(f, file_obj)
     else:
-        blob = bucket.blob(gcs_path)
-    return blob.download_as_bytes()
+        blob = _blob(gcs_path)
+
+        def attempt():
+            # Rewind so a retried download does not append to a partial one
+            file_obj.seek(start)
+            file_obj.truncate()
+            blob.download_to_file(file_obj, if_generation_match=if_generation_match)
+
+        resilience.call("gcs.download_to_file", attempt)
+    size = file_obj.tell() - start
+    metrics.record_bytes("gcs.download_to_file", size, "in")
+    return size
 
 
 def get_bucket_name() -> str:
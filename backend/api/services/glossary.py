@@ -0,0 +1,323 @@
+"""Local dictionary of legal terms for glossary extraction.
+
+``vertex.extract_glossary`` has the model read a whole document to pick out
+terms like EMI, indemnity or lien, which we can define without it. The
+curated dictionary (``api/data/glossary.json``, versioned) is compiled into
+one Aho-Corasick matcher (``clauses.Matcher``) over every term and alias, and
+``extract_glossary`` runs it over the document's text layer, answering the
+terms it finds with their stored definitions. Only candidate terms it does
+not know (quoted defined terms and acronyms) go to the model, as a short list
+with a sentence of context each (``vertex.define_terms``). Definitions the
+model marks as general are only candidates (``glossary_candidates``) until
+the same definition has come back for ``GLOSSARY_LEARN_CONFIRMATIONS``
+different documents, so one upload cannot put a term in everyone's glossary.
+Confirmed definitions are stored in the ``glossary_terms`` collection and
+matched locally from then on; workers pick up each other's additions every
+``GLOSSARY_REFRESH_S``.
+
+Documents without a text layer, or where neither known nor candidate terms
+are found, are still read whole by the model. ``GLOSSARY_DICTIONARY=false``
+turns the dictionary off.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import clauses, firestore, longdoc, metrics, vertex
+
+logger = logging.getLogger(__name__)
+
+DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "glossary.json")
+
+# Unknown terms sent to the model per document, and the context given with each
+MAX_CANDIDATES = 15
+CONTEXT_CHARS = 240
+
+TERMS = metrics.REGISTRY.counter(
+    "legalease_glossary_terms_total",
+    "Glossary terms answered from the local dictionary (local) or defined by the model (model), terms added to "
+    "the dictionary (learned), and documents read whole by the model (fallback).", ("outcome",))
+
+# "Prepayment Charges" means ... / (the "Facility") / (hereinafter referred to as the "Lessee")
+_DEFINED = re.compile(
+    r"[\"“]([A-Z][\w&/'’ -]{1,48}?)[\"”]\s*(?:shall\s+)?(?:means?|refers?\s+to|includes?)\b"
+    r"|\((?:the\s+|hereinafter\s+(?:called|referred\s+to\s+as)\s+(?:the\s+)?)?[\"“]([A-Z][\w&/'’ -]{1,48}?)[\"”]\)"
+)
+_ACRONYM = re.compile(r"\b[A-Z][A-Z&]{1,6}(?=s?\b)")
+_ROMAN = re.compile(r"^[IVXLC]+$")
+# Capitalized words that are not terms: units, honorifics, company forms, and the
+# parties and subjects every agreement defines
+_NOT_TERMS = {
+    "inr", "rs", "usd", "mr", "mrs", "ms", "dr", "ltd", "pvt", "llp", "co", "no", "am", "pm", "or", "and", "the",
+    "of", "to", "in", "by", "on", "at", "if", "is", "id",
+    "agreement", "bank", "borrower", "borrowers", "lender", "company", "customer", "applicant", "insured", "insurer",
+    "policyholder", "proposer", "tenant", "landlord", "owner", "party", "parties", "loan", "facility", "policy",
+    "property", "premises", "schedule", "effective date", "due date",
+}
+
+
+def enabled() -> bool:
+    return os.getenv("GLOSSARY_DICTIONARY", "true").lower() != "false"
+
+
+def refresh_seconds() -> float:
+    return float(os.getenv("GLOSSARY_REFRESH_S", "300"))
+
+
+def confirmations() -> int:
+    return max(1, int(os.getenv("GLOSSARY_LEARN_CONFIRMATIONS", "3")))
+
+
+@dataclass(frozen=True)
+class Entry:
+    term: str
+    definition: str
+    aliases: Tuple[str, ...] = ()
+    common: bool = False  # drafting vocabulary, listed after the rest
+
+
+@dataclass(frozen=True)
+class Candidate:
+    term: str
+    context: str
+
+
+def _key(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+def _acronym(name: str) -> bool:
+    return name[:2].isupper()
+
+
+class Dictionary:
+    """Entries by lower-case name, and one matcher over all the names."""
+
+    def __init__(self, version: Any, entries: Iterable[Entry]):
+        self.version = version
+        self.entries: List[Entry] = []
+        self._by_key: Dict[str, Tuple[Entry, str]] = {}
+        for entry in entries:
+            names = [n for n in (entry.term, *entry.aliases) if _key(n) and _key(n) not in self._by_key]
+            if entry.term not in names:
+                continue  # a curated entry already has this name
+            self.entries.append(entry)
+            for name in names:
+                self._by_key[_key(name)] = (entry, name)
+        self._matcher = clauses.Matcher(self._by_key)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def knows(self, name: str) -> bool:
+        return _key(name) in self._by_key
+
+    def lookup(self, text: str) -> List[Entry]:
+        """Entries whose term or an alias occurs in ``text``, the most mentioned first."""
+        matches = []
+        for start, key in self._matcher.find(text):
+            entry, name = self._by_key[key]
+            # Acronyms only match in capitals ("EMI", not "emi")
+            if _acronym(name) and text[start:start + len(name)] != name:
+                continue
+            matches.append((start, start + len(key), entry))
+        found: Dict[str, List[int]] = {}
+        by_term: Dict[str, Entry] = {}
+        end = 0
+        # Keep the longest of overlapping matches: "joint and several liability" over "liability"
+        for start, stop, entry in sorted(matches, key=lambda m: (m[0], m[0] - m[1])):
+            if start < end:
+                continue
+            end = stop
+            found.setdefault(entry.term, [0, start])[0] += 1
+            by_term[entry.term] = entry
+        ranked = sorted(found, key=lambda t: (by_term[t].common, -found[t][0], found[t][1]))
+        return [by_term[t] for t in ranked]
+
+
+def _context(text: str, start: int, end: int) -> str:
+    """The sentence around ``text[start:end]``, at most ``CONTEXT_CHARS`` either side."""
+    lo = max(0, start - CONTEXT_CHARS)
+    left = max(text.rfind(sep, lo, start) for sep in ".;\n")
+    ends = [i for i in (text.find(sep, end, end + CONTEXT_CHARS) for sep in ".;\n") if i != -1]
+    right = min(ends) + 1 if ends else end + CONTEXT_CHARS
+    return " ".join(text[left + 1 if left != -1 else lo:right].split())
+
+
+def candidates(text: str, dictionary: "Dictionary") -> List[Candidate]:
+    """Terms of ``text`` that look like jargon but are not in ``dictionary``, the most mentioned first."""
+    counts: Dict[str, List[Any]] = {}
+    for m in _DEFINED.finditer(text):
+        term = " ".join((m.group(1) or m.group(2)).split())
+        if term.lower() in _NOT_TERMS:
+            continue
+        counts.setdefault(term, [0, m.start(), m.end()])[0] += 2  # defined on purpose: worth more than a mention
+    for m in _ACRONYM.finditer(text):
+        term = m.group(0)
+        if term.lower() in _NOT_TERMS or _ROMAN.match(term):
+            continue
+        # Headings in capitals are not acronyms: look for lower case on the same line
+        line_end = text.find("\n", m.end())
+        line = text[text.rfind("\n", 0, m.start()) + 1:line_end if line_end != -1 else len(text)]
+        if not any(ch.islower() for ch in line):
+            continue
+        counts.setdefault(term, [0, m.start(), m.end()])[0] += 1
+    found = [(term, c) for term, c in counts.items() if not dictionary.knows(term)]
+    found.sort(key=lambda item: (-item[1][0], item[1][1]))
+    return [Candidate(term, _context(text, start, end)) for term, (_, start, end) in found[:MAX_CANDIDATES]]
+
+
+def terms_text(unknown: Iterable[Candidate]) -> str:
+    return "\n\n".join(f"Term: {c.term}\nUsed in: {c.context}" for c in unknown)
+
+
+@lru_cache(maxsize=1)
+def _curated() -> Tuple[Any, Tuple[Entry, ...]]:
+    with open(DICTIONARY_PATH, encoding="utf-8") as f:
+        data = json.load(f)
+    entries = tuple(Entry(t["term"], t["definition"], tuple(t.get("aliases") or ()), bool(t.get("common")))
+                    for t in data["terms"])
+    return data["version"], entries
+
+
+def _learned() -> List[Entry]:
+    try:
+        rows = firestore.list_glossary_terms()
+    except Exception as e:
+        logger.warning(f"Reading learned glossary terms failed: {e}")
+        return []
+    return [Entry(r["term"], r["definition"]) for r in rows if r.get("term") and r.get("definition")]
+
+
+_dictionary: Optional[Dictionary] = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def get_dictionary() -> Dictionary:
+    """The curated dictionary plus learned terms, reloaded every ``GLOSSARY_REFRESH_S``."""
+    global _dictionary, _loaded_at
+    if _dictionary is None or time.monotonic() - _loaded_at >= refresh_seconds():
+        with _lock:
+            if _dictionary is None or time.monotonic() - _loaded_at >= refresh_seconds():
+                version, curated = _curated()
+                _dictionary = Dictionary(version, [*curated, *_learned()])
+                _loaded_at = time.monotonic()
+    return _dictionary
+
+
+def reset() -> None:
+    """Reload the dictionary on next use (used by tests)."""
+    global _dictionary
+    with _lock:
+        _dictionary = None
+
+
+def _doc_id(term: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", term.lower()).strip("-")
+
+
+def _confirmed(entry: Entry, source: str) -> bool:
+    """Record ``source`` as a document ``entry`` was defined for; True once enough different ones have been."""
+    digest = hashlib.sha256(_key(entry.definition).encode("utf-8")).hexdigest()[:16]
+    try:
+        sources = firestore.add_glossary_sighting(f"{_doc_id(entry.term)}-{digest}",
+                                                  {"term": entry.term, "definition": entry.definition}, source)
+    except Exception as e:
+        logger.warning(f"Recording glossary candidate {entry.term!r} failed: {e}")
+        return False
+    return len(set(sources)) >= confirmations()
+
+
+def learn(items: Iterable[Dict[str, Any]], source: str) -> int:
+    """Count model definitions given for document ``source``; returns how many were confirmed and added."""
+    global _dictionary
+    dictionary = get_dictionary()
+    new = [Entry(item["term"], item["definition"]) for item in items
+           if _doc_id(item["term"]) and not dictionary.knows(item["term"])]
+    new = [entry for entry in new if _confirmed(entry, source)]
+    for entry in new:
+        try:
+            firestore.save_glossary_term(_doc_id(entry.term), {
+                "term": entry.term, "definition": entry.definition, "dictionaryVersion": dictionary.version})
+        except Exception as e:
+            logger.warning(f"Saving glossary term {entry.term!r} failed: {e}")
+    if new:
+        with _lock:
+            _dictionary = Dictionary(dictionary.version, [*dictionary.entries, *new])
+        TERMS.inc(len(new), outcome="learned")
+    return len(new)
+
+
+def _local(text: Optional[str]) -> Optional[Tuple[List[Entry], List[Candidate]]]:
+    """Known entries and unknown candidates of ``text``; None when the model should read the document."""
+    if not enabled() or not text:
+        return None
+    dictionary = get_dictionary()
+    known = dictionary.lookup(text)
+    # Without a model there is no one to ask about unknown terms
+    unknown = candidates(text, dictionary) if vertex._has_backend("model") else []
+    if not known and not unknown:
+        return None
+    return known, unknown
+
+
+def _finish(text: str, known: List[Entry], unknown: List[Candidate], defined: List[Dict[str, Any]]
+            ) -> List[Dict[str, str]]:
+    asked = {_key(c.term) for c in unknown}
+    # Only terms that were asked about; the model sometimes adds its own
+    answered = [item for item in defined if _key(item["term"]) in asked]
+    if answered:
+        # Documents are told apart by content, so re-uploads of one file confirm nothing
+        learn((item for item in answered if item["general"]), hashlib.sha256(text.encode("utf-8")).hexdigest())
+    TERMS.inc(len(known), outcome="local")
+    TERMS.inc(len(answered), outcome="model")
+    novel = [{"term": item["term"], "definition": item["definition"]} for item in answered]
+    return (novel + [{"term": e.term, "definition": e.definition} for e in known])[:vertex.MAX_TERMS]
+
+
+def _extract(text: Optional[str], fallback: Callable[[], List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    local = _local(text)
+    if local is None:
+        TERMS.inc(outcome="fallback")
+        return fallback()
+    known, unknown = local
+    defined = vertex.define_terms(terms_text(unknown)) if unknown else []
+    return _finish(text, known, unknown, defined)
+
+
+async def _aextract(text: Optional[str], fallback: Callable[[], Awaitable[List[Dict[str, str]]]]
+                    ) -> List[Dict[str, str]]:
+    local = await asyncio.to_thread(_local, text)
+    if local is None:
+        TERMS.inc(outcome="fallback")
+        return await fallback()
+    known, unknown = local
+    defined = await vertex.define_terms_async(terms_text(unknown)) if unknown else []
+    return await asyncio.to_thread(_finish, text, known, unknown, defined)
+
+
+def extract_glossary(text: Optional[str], gcs_uri: str) -> List[Dict[str, str]]:
+    """``vertex.extract_glossary`` answered from the dictionary where it can; ``text`` is the text layer."""
+    return _extract(text, lambda: vertex.extract_glossary(gcs_uri))
+
+
+async def extract_glossary_async(text: Optional[str], gcs_uri: str) -> List[Dict[str, str]]:
+    return await _aextract(text, lambda: vertex.extract_glossary_async(gcs_uri))
+
+
+def extract_long_glossary(text: str) -> List[Dict[str, str]]:
+    """``longdoc.extract_glossary`` answered from the dictionary where it can."""
+    return _extract(text, lambda: longdoc.extract_glossary(text))
+
+
+async def extract_long_glossary_async(text: str) -> List[Dict[str, str]]:
+    return await _aextract(text, lambda: longdoc.extract_glossary_async(text))
@@ -0,0 +1,88 @@
+"""Incremental parsing of a JSON array arriving in pieces.
+
+Model output for risks and glossary terms is a JSON array, often wrapped in a
+Markdown fence. ``ArrayParser`` is fed the text as it streams in and returns
+each top-level element as soon as its closing brace has arrived, so callers
+can act on the first items long before the array is complete. Elements that
+are not valid JSON on their own are skipped, as ``vertex._parse_json_array``
+drops output it cannot parse.
+"""
+import json
+import logging
+from typing import Any, List
+
+logger = logging.getLogger(__name__)
+
+
+class ArrayParser:
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0  # next character of _buffer to scan
+        self._started = False
+        self.done = False
+        self._depth = 0  # nesting inside the current element
+        self._in_string = False
+        self._escaped = False
+        self._element_start = -1
+
+    def feed(self, text: str) -> List[Any]:
+        """Add streamed text; returns the elements completed by it."""
+        if self.done or not text:
+            return []
+        self._buffer += text
+        items: List[Any] = []
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if not self._started:
+                if ch == "[":
+                    self._started = True
+                i += 1
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+                if self._element_start < 0:
+                    self._element_start = i
+            elif ch in "[{":
+                if self._element_start < 0:
+                    self._element_start = i
+                self._depth += 1
+            elif ch in "]}":
+                if self._depth == 0:
+                    # End of the top-level array
+                    self._finish_element(buf, i, items)
+                    self.done = True
+                    break
+                self._depth -= 1
+            elif ch == "," and self._depth == 0:
+                self._finish_element(buf, i, items)
+            elif not ch.isspace() and self._element_start < 0:
+                self._element_start = i  # number, true/false/null
+            i += 1
+        # Drop what has been consumed so the buffer holds at most one element
+        keep = self._element_start if self._element_start >= 0 else i
+        self._buffer = buf[keep:]
+        self._pos = i - keep
+        if self._element_start >= 0:
+            self._element_start = 0
+        return items
+
+    def _finish_element(self, buf: str, end: int, items: List[Any]) -> None:
+        if self._element_start < 0:
+            return
+        raw = buf[self._element_start:end].strip()
+        self._element_start = -1
+        if not raw:
+            return
+        try:
+            items.append(json.loads(raw))
+        except ValueError:
+            logger.debug(f"Skipping unparseable array element: {raw[:80]}")
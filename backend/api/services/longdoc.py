@@ -0,0 +1,476 @@
+"""Map-reduce analysis for long documents.
+
+A single request over a long loan agreement is slow, can exceed the input cap
+(see ``tokens``) and runs on one model call. Above ``LONGDOC_THRESHOLD_TOKENS``
+the analyze endpoints instead extract the document's text, split it into
+sections of at most ``LONGDOC_CHUNK_TOKENS`` at paragraph breaks,
+and run the per-section prompts in parallel, at most ``LONGDOC_MAX_PARALLEL``
+at a time per document (the summary, risks and glossary maps of one analysis
+share the limit inside ``shared_limit()``). Section notes are then reduced to
+the usual 3-line summary (in more rounds if the notes themselves are long);
+section risks and glossary terms are merged and de-duplicated locally without
+another call.
+
+Wall-clock time is about ``ceil(sections / parallel)`` section calls plus one
+reduce call, rather than growing with the length of a single request.
+``text_if_long`` returns None for short documents, unsupported types and files
+without a text layer, which keep the single-request path. Section results are
+cached by content (``SECTION_CACHE``), which ``versions`` relies on to
+re-analyse only the changed sections of a new upload.
+"""
+import asyncio
+import contextvars
+import difflib
+import hashlib
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from . import documents, firestore, singleflight, tokens, vertex
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SECTION_SUMMARY_PROMPT = (
+    "You are a legal assistant. Below is one section of a longer legal document. List its obligations, "
+    "fees, penalties and important dates as at most 5 short bullet points in plain language. "
+    "Output only the bullet points."
+)
+REDUCE_SUMMARY_PROMPT = (
+    "You are a legal assistant. Below are notes on each section of one legal document, in order. "
+    "Provide a concise 3-line summary of the whole document in plain language. "
+    "Focus on obligations, fees, and important dates."
+)
+REDUCE_NOTES_PROMPT = (
+    "You are a legal assistant. Below are notes on consecutive sections of a legal document. "
+    "Merge them into at most 8 bullet points, keeping obligations, fees, penalties and dates."
+)
+SECTION_RISKS_PROMPT = (
+    "Identify risky clauses in this section of a legal document."
+    " Return STRICT JSON array of objects with keys: clause, risk (Low|Medium|High), explanation."
+    " Output ONLY the JSON array, no extra commentary. Keep at most 6 items."
+)
+SECTION_GLOSSARY_PROMPT = (
+    "From this section of a legal document, extract up to 10 domain-specific legal terms that may be confusing."
+    " Return STRICT JSON array with objects {term, definition} in plain language."
+    " Output ONLY the JSON array, no extra commentary."
+)
+
+RISK_ORDER = {"high": 0, "medium": 1, "low": 2}
+# Notes shrink each round (8 bullets per batch); the cap guards against a model that does not
+MAX_REDUCE_ROUNDS = 3
+MAX_RISKS = 6
+MAX_TERMS = 10
+# Clauses quoted from overlapping text rarely match exactly
+DUPLICATE_RATIO = 0.85
+
+_HEADING = re.compile(
+    r"^\s*(?:(?:section|clause|article|schedule|annexure|part)\s+[\w.]+|\d+(?:\.\d+)*[.)]\s+\S|[A-Z][A-Z0-9 ,&/\-]{4,}$)",
+    re.IGNORECASE,
+)
+_SENTENCE_END = re.compile(r"(?<=[.;:])\s+")
+
+
+def threshold_tokens() -> int:
+    return int(os.getenv("LONGDOC_THRESHOLD_TOKENS", "60000"))
+
+
+def chunk_tokens() -> int:
+    return int(os.getenv("LONGDOC_CHUNK_TOKENS", "12000"))
+
+
+def max_parallel() -> int:
+    return max(1, int(os.getenv("LONGDOC_MAX_PARALLEL", "4")))
+
+
+# --- Deciding and extracting --------------------------------------------------
+
+def extract(gcs_path: str, content_type: Optional[str]) -> Optional[str]:
+    """The document's text layer, or None if it cannot be extracted."""
+    try:
+        return documents.extract_text(gcs_path, content_type) or None
+    except Exception as e:
+        # Missing pypdf/python-docx or an unreadable file: fall back to a single request
+        logger.warning(f"Cannot extract text from {gcs_path}: {e}")
+        return None
+
+
+def is_long_text(text: Optional[str]) -> bool:
+    # Scanned documents have (almost) no text layer; the model reads those as files
+    return bool(text) and tokens.estimate_text(text) >= threshold_tokens() // 2
+
+
+def _load_text(gcs_path: str, content_type: Optional[str]) -> Optional[str]:
+    text = extract(gcs_path, content_type)
+    return text if is_long_text(text) else None
+
+
+def text_if_long(gcs_path: str, content_type: Optional[str], gcs_uri: str) -> Optional[str]:
+    """Extracted text when the document is over the threshold, else None."""
+    if not vertex._has_backend("model"):
+        return None
+    count = tokens.count_part(vertex._part_from_gcs_uri(gcs_uri), vertex._get_model)
+    if count is None or count <= threshold_tokens():
+        return None
+    return _load_text(gcs_path, content_type)
+
+
+async def text_if_long_async(gcs_path: str, content_type: Optional[str], gcs_uri: str) -> Optional[str]:
+    if not vertex._has_backend("model"):
+        return None
+    part = await vertex._apart_from_gcs_uri(gcs_uri)
+    count = await tokens.acount_part(part, vertex._aget_model)
+    if count is None or count <= threshold_tokens():
+        return None
+    return await asyncio.to_thread(_load_text, gcs_path, content_type)
+
+
+# --- Splitting ----------------------------------------------------------------
+
+def _blocks(text: str) -> List[str]:
+    """Paragraphs, with a new block at every heading-like line."""
+    blocks: List[str] = []
+    current: List[str] = []
+    for line in text.splitlines():
+        if not line.strip() or _HEADING.match(line):
+            if current:
+                blocks.append("\n".join(current))
+                current = []
+        if line.strip():
+            current.append(line.rstrip())
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def _split_long_block(block: str, max_chars: int) -> List[str]:
+    pieces: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_END.split(block):
+        while len(sentence) > max_chars:
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _is_anchor(piece: str) -> bool:
+    # ~1 in 8 paragraphs, chosen by content alone. Headings are not used: in
+    # numbered agreements nearly every paragraph is one, and boundaries would
+    # then depend on section size again.
+    return hashlib.sha1(" ".join(piece.split()).encode()).digest()[0] % 8 == 0
+
+
+def split_sections(text: str, max_tokens: Optional[int] = None) -> List[str]:
+    """Pack paragraphs into sections of at most ``max_tokens``.
+
+    A section ends before an anchor paragraph once it is a quarter full, so
+    boundaries depend only on nearby text: editing one clause changes the
+    sections around it, not every section after it. That keeps the
+    per-section cache useful across versions of a document.
+    """
+    max_chars = (max_tokens or chunk_tokens()) * tokens.CHARS_PER_TOKEN
+    sections: List[str] = []
+    current: List[str] = []
+    size = 0
+    for block in _blocks(text):
+        pieces = [block] if len(block) <= max_chars else _split_long_block(block, max_chars)
+        for piece in pieces:
+            if current and (size + len(piece) + 2 > max_chars or (_is_anchor(piece) and size >= max_chars // 4)):
+                sections.append("\n\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 2
+    if current:
+        sections.append("\n\n".join(current))
+    return sections
+
+
+def section_key(section: str) -> str:
+    return hashlib.sha256(section.encode()).hexdigest()
+
+
+# --- Running sections in parallel ---------------------------------------------
+
+class _Limit:
+    def __init__(self, size: int):
+        self.threads = threading.BoundedSemaphore(size)
+        self.tasks = asyncio.Semaphore(size)
+
+
+_limit: contextvars.ContextVar[Optional[_Limit]] = contextvars.ContextVar("legalease_longdoc_limit", default=None)
+
+
+@contextmanager
+def shared_limit() -> Iterator[None]:
+    """Run every section map inside the block under one ``max_parallel()`` limit.
+
+    An analysis maps the summary, risks and glossary of a document at the same
+    time; without this each map would get the full limit to itself.
+    """
+    token = _limit.set(_Limit(max_parallel()))
+    try:
+        yield
+    finally:
+        _limit.reset(token)
+
+
+def _current_limit() -> _Limit:
+    return _limit.get() or _Limit(max_parallel())
+
+
+def _limited(fn: Callable[[], T]) -> T:
+    with _current_limit().threads:
+        return fn()
+
+
+async def _alimited(fn: Callable[[], Awaitable[T]]) -> T:
+    async with _current_limit().tasks:
+        return await fn()
+
+
+def _map(fn: Callable[[str], T], items: List[str]) -> List[T]:
+    limit = _current_limit()
+
+    def run(item: str) -> T:
+        with limit.threads:
+            return fn(item)
+
+    if len(items) <= 1:
+        return [run(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_parallel(), len(items)), thread_name_prefix="longdoc") as pool:
+        # Each call runs in a copy of this request's context (priority, user, document)
+        futures = [pool.submit(contextvars.copy_context().run, run, item) for item in items]
+        return [f.result() for f in futures]
+
+
+async def _amap(fn: Callable[[str], Awaitable[T]], items: List[str]) -> List[T]:
+    semaphore = _current_limit().tasks
+
+    async def run(item: str) -> T:
+        async with semaphore:
+            return await fn(item)
+
+    return list(await asyncio.gather(*(run(item) for item in items)))
+
+
+def _section_parts(prompt: str, section: str) -> List[object]:
+    return [prompt, f"Section text:\n{section}"]
+
+
+def _note_batches(notes: List[str]) -> List[str]:
+    return split_sections("\n\n".join(n for n in notes if n), chunk_tokens())
+
+
+# --- Per-section cache --------------------------------------------------------
+# Model output per (prompt, section text), in Firestore, so re-analysing a
+# document or a new version of it only calls the model for changed sections
+# (and for the final summary only if some section's notes changed).
+
+def _cache_key(kind: str, prompt: str, section: str) -> str:
+    digest = hashlib.sha256(f"{prompt}\0{section}".encode()).hexdigest()
+    return f"{kind}-{digest}"
+
+
+def _cache_enabled() -> bool:
+    return os.getenv("SECTION_CACHE", "true").lower() != "false"
+
+
+def _cache_get(key: str) -> Optional[Any]:
+    if not _cache_enabled():
+        return None
+    try:
+        hit = firestore.get_section_result(key)
+    except Exception as e:
+        logger.warning(f"Section cache read failed: {e}")
+        return None
+    return hit.get("result") if hit else None
+
+
+def _cache_put(key: str, result: Any) -> None:
+    if not _cache_enabled():
+        return
+    try:
+        firestore.save_section_result(key, {"result": result})
+    except Exception as e:
+        logger.warning(f"Section cache write failed: {e}")
+
+
+def _cached(kind: str, prompt: str, section: str, compute: Callable[[], T]) -> T:
+    key = _cache_key(kind, prompt, section)
+    hit = _cache_get(key)
+    if hit is not None:
+        return hit
+
+    def run() -> T:
+        result = compute()
+        _cache_put(key, result)
+        return result
+
+    # Concurrent analyses of the same section (a repeated request) share one model call
+    return singleflight.do(singleflight.fingerprint("longdoc", key), run)
+
+
+async def _acached(kind: str, prompt: str, section: str, compute: Callable[[], Awaitable[T]]) -> T:
+    key = _cache_key(kind, prompt, section)
+    hit = await asyncio.to_thread(_cache_get, key)
+    if hit is not None:
+        return hit
+
+    async def run() -> T:
+        result = await compute()
+        await asyncio.to_thread(_cache_put, key, result)
+        return result
+
+    return await singleflight.ado(singleflight.fingerprint("longdoc", key), run)
+
+
+# --- Merging ------------------------------------------------------------------
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[^a-z0-9 ]+", "", re.sub(r"\s+", " ", text.lower())).strip()
+
+
+def merge_risks(groups: List[List[Dict[str, str]]], limit: int = MAX_RISKS) -> List[Dict[str, str]]:
+    """Combine per-section risks: drop near-duplicate clauses (keeping the higher risk), highest risk first."""
+    merged: List[Dict[str, str]] = []
+    keys: List[str] = []
+    for risks in groups:
+        for item in risks:
+            key = _normalize(item.get("clause", ""))
+            if not key:
+                continue
+            for i, existing in enumerate(keys):
+                if key == existing or difflib.SequenceMatcher(None, key, existing).ratio() >= DUPLICATE_RATIO:
+                    if RISK_ORDER.get(item["risk"].lower(), 3) < RISK_ORDER.get(merged[i]["risk"].lower(), 3):
+                        merged[i] = item
+                    break
+            else:
+                merged.append(item)
+                keys.append(key)
+    # Stable sort keeps document order within a risk level
+    merged.sort(key=lambda r: RISK_ORDER.get(r["risk"].lower(), 3))
+    return merged[:limit]
+
+
+def merge_glossary(groups: List[List[Dict[str, str]]], limit: int = MAX_TERMS) -> List[Dict[str, str]]:
+    seen = set()
+    merged: List[Dict[str, str]] = []
+    for terms in groups:
+        for item in terms:
+            key = _normalize(item.get("term", ""))
+            if key and key not in seen:
+                seen.add(key)
+                merged.append(item)
+    return merged[:limit]
+
+
+# --- Analysis -----------------------------------------------------------------
+
+def _summarize_section(section: str) -> str:
+    def compute() -> str:
+        resp = vertex._generate(_section_parts(SECTION_SUMMARY_PROMPT, section), "vertex.summarize_section")
+        return vertex._response_text(resp)
+
+    return _cached("notes", SECTION_SUMMARY_PROMPT, section, compute)
+
+
+def _reduce_notes(batch: str) -> str:
+    return vertex._response_text(vertex._generate([REDUCE_NOTES_PROMPT, batch], "vertex.summarize_section"))
+
+
+def summarize(text: str, language: str = "en") -> str:
+    notes = _map(_summarize_section, split_sections(text))
+    batches = _note_batches(notes)
+    for _ in range(MAX_REDUCE_ROUNDS):
+        if len(batches) <= 1:
+            break
+        batches = _note_batches(_map(_reduce_notes, batches))
+    notes_text = "Section notes:\n" + "\n\n".join(batches)
+    return _limited(lambda: _cached("summary", REDUCE_SUMMARY_PROMPT, notes_text, lambda: vertex._response_text(
+        vertex._generate([REDUCE_SUMMARY_PROMPT, notes_text], "vertex.summarize_document"))))
+
+
+def analyze_risks(text: str) -> List[Dict[str, str]]:
+    def section_risks(section: str) -> List[Dict[str, str]]:
+        def compute() -> List[Dict[str, str]]:
+            resp = vertex._generate(_section_parts(SECTION_RISKS_PROMPT, section), "vertex.analyze_risks_section")
+            return vertex._clean_risks(vertex._response_text(resp, "[]"))
+
+        return _cached("risks", SECTION_RISKS_PROMPT, section, compute)
+
+    return merge_risks(_map(section_risks, split_sections(text)))
+
+
+def extract_glossary(text: str, language: str = "en") -> List[Dict[str, str]]:
+    def section_terms(section: str) -> List[Dict[str, str]]:
+        def compute() -> List[Dict[str, str]]:
+            resp = vertex._generate(_section_parts(SECTION_GLOSSARY_PROMPT, section),
+                                    "vertex.extract_glossary_section")
+            return vertex._clean_glossary(vertex._response_text(resp, "[]"))
+
+        return _cached("terms", SECTION_GLOSSARY_PROMPT, section, compute)
+
+    return merge_glossary(_map(section_terms, split_sections(text)))
+
+
+async def _asummarize_section(section: str) -> str:
+    async def compute() -> str:
+        resp = await vertex._agenerate(_section_parts(SECTION_SUMMARY_PROMPT, section), "vertex.summarize_section")
+        return vertex._response_text(resp)
+
+    return await _acached("notes", SECTION_SUMMARY_PROMPT, section, compute)
+
+
+async def _areduce_notes(batch: str) -> str:
+    return vertex._response_text(await vertex._agenerate([REDUCE_NOTES_PROMPT, batch], "vertex.summarize_section"))
+
+
+async def summarize_async(text: str, language: str = "en") -> str:
+    notes = await _amap(_asummarize_section, split_sections(text))
+    batches = _note_batches(notes)
+    for _ in range(MAX_REDUCE_ROUNDS):
+        if len(batches) <= 1:
+            break
+        batches = _note_batches(await _amap(_areduce_notes, batches))
+    notes_text = "Section notes:\n" + "\n\n".join(batches)
+
+    async def compute() -> str:
+        return vertex._response_text(
+            await vertex._agenerate([REDUCE_SUMMARY_PROMPT, notes_text], "vertex.summarize_document"))
+
+    return await _alimited(lambda: _acached("summary", REDUCE_SUMMARY_PROMPT, notes_text, compute))
+
+
+async def analyze_risks_async(text: str) -> List[Dict[str, str]]:
+    async def section_risks(section: str) -> List[Dict[str, str]]:
+        async def compute() -> List[Dict[str, str]]:
+            resp = await vertex._agenerate(_section_parts(SECTION_RISKS_PROMPT, section),
+                                           "vertex.analyze_risks_section")
+            return vertex._clean_risks(vertex._response_text(resp, "[]"))
+
+        return await _acached("risks", SECTION_RISKS_PROMPT, section, compute)
+
+    return merge_risks(await _amap(section_risks, split_sections(text)))
+
+
+async def extract_glossary_async(text: str, language: str = "en") -> List[Dict[str, str]]:
+    async def section_terms(section: str) -> List[Dict[str, str]]:
+        async def compute() -> List[Dict[str, str]]:
+            resp = await vertex._agenerate(_section_parts(SECTION_GLOSSARY_PROMPT, section),
+                                           "vertex.extract_glossary_section")
+            return vertex._clean_glossary(vertex._response_text(resp, "[]"))
+
+        return await _acached("terms", SECTION_GLOSSARY_PROMPT, section, compute)
+
+    return merge_glossary(await _amap(section_terms, split_sections(text)))
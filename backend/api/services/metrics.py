@@ -0,0 +1,247 @@
+"""Per-stage latency, bytes and token metrics in Prometheus text format.
+
+Service code wraps each outbound step in ``stage()`` (or decorates it with
+``instrument()``); the duration lands in a histogram labelled with the stage
+name, e.g. ``gcs.get_blob_bytes`` or ``vertex.summarize_document``, and, while
+a request is being served, in that request's ``Server-Timing`` header.
+``record_bytes`` and ``record_usage`` count payload sizes and model tokens.
+
+``render()`` produces the ``/metrics`` page. It also exports the counters the
+scheduler, retry budgets, model router and write-behind buffer already keep.
+Everything is in-process and lock-protected; recording a stage costs a couple
+of microseconds, so it stays on in production.
+"""
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[_LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[_LabelValues, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(tuple(labels.get(n, "") for n in self.labelnames))
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else _number(bound)
+                    labels = _labels(self.labelnames, key, 'le="%s"' % le)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> List[str]:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return lines
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "legalease_stage_duration_seconds", "Time spent in one service-layer stage.", ("stage", "outcome"))
+STAGE_BYTES = REGISTRY.counter(
+    "legalease_stage_bytes_total", "Payload bytes moved by a stage.", ("stage", "direction"))
+MODEL_TOKENS = REGISTRY.counter(
+    "legalease_model_tokens_total", "Gemini tokens reported in usage metadata.", ("op", "kind"))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "legalease_http_request_duration_seconds", "Time to produce an API response.", ("route", "method", "status"))
+
+
+# Stage timings of the request being served: (name, seconds). A list rather
+# than a tuple so coroutines and pool threads running in copies of the
+# context append to the same request's entries.
+_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("legalease_stage_timings", default=None)
+
+
+def begin_request() -> Token:
+    return _timings.set([])
+
+
+def end_request(token: Token) -> List[Tuple[str, float]]:
+    entries = _timings.get() or []
+    _timings.reset(token)
+    return entries
+
+
+def observe_stage(name: str, seconds: float, outcome: str = "ok") -> None:
+    STAGE_SECONDS.observe(seconds, stage=name, outcome=outcome)
+    entries = _timings.get()
+    if entries is not None:
+        entries.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        observe_stage(name, time.perf_counter() - start, outcome)
+
+
+def instrument(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator form of ``stage`` for plain and async functions."""
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_bytes(stage_name: str, n: int, direction: str) -> None:
+    STAGE_BYTES.inc(n, stage=stage_name, direction=direction)
+
+
+def record_usage(op: str, response: Any) -> None:
+    """Count prompt/output tokens from a Gemini response's ``usage_metadata``."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, attr in (("prompt", "prompt_token_count"), ("output", "candidates_token_count"),
+                       ("total", "total_token_count")):
+        value = getattr(usage, attr, None)
+        if isinstance(value, int) and value:
+            MODEL_TOKENS.inc(value, op=op, kind=kind)
+
+
+def server_timing(entries: List[Tuple[str, float]], total: Optional[float] = None) -> str:
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in entries]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _stats_lines(name: str, help: str, rows: Dict[Tuple[Tuple[str, str], ...], Dict[str, Any]]) -> List[str]:
+    """Export a component's ``stats()`` dicts as ``legalease_<name>_<key>`` samples."""
+    by_key: Dict[str, List[str]] = {}
+    for labels, values in rows.items():
+        label_str = _labels([k for k, _ in labels], [v for _, v in labels])
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                by_key.setdefault(key, []).append(f"legalease_{name}_{key}{label_str} {_number(value)}")
+    lines: List[str] = []
+    for key, samples in sorted(by_key.items()):
+        metric = f"legalease_{name}_{key}"
+        lines.append(f"# HELP {metric} {help}")
+        lines.append(f"# TYPE {metric} {'counter' if key.endswith('_total') else 'gauge'}")
+        lines.extend(samples)
+    return lines
+
+
+def render() -> str:
+    from . import resilience, routing, scheduler, write_behind
+
+    lines = REGISTRY.render()
+    lines += _stats_lines("scheduler", "Model-call scheduler state per priority class.",
+                          {(("priority", p),): s for p, s in scheduler.stats().items()})
+    lines += _stats_lines("retry", "Calls and retries per upstream service.",
+                          {(("service", svc),): s for svc, s in resilience.stats().items()})
+    lines += _stats_lines("model_route", "Model routing state per task.",
+                          {(("task", t),): s for t, s in routing.stats().items()})
+    wb_stats = write_behind.stats()
+    if wb_stats:
+        lines += _stats_lines("write_behind", "Firestore write-behind buffer state.", {(): wb_stats})
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,306 @@
+"""Retries, backoff and hedging for calls to Google services.
+
+``call()`` runs an operation and classifies any failure:
+
+* ``RETRY``: throttling, unavailability and timeouts (429/500/502/503/504,
+  connection errors). Retried with exponential backoff and full jitter while
+  attempts remain and the service's retry budget allows it.
+* ``REFRESH``: credential/agent errors that a fresh client usually fixes
+  (401, or the 403 Vertex returns while its service agent is provisioning).
+  The caller's ``on_refresh`` hook runs and the call is retried once.
+* ``PERMANENT``: everything else, raised immediately.
+
+Failures surface as ``UpstreamError`` (502) or ``UpstreamUnavailable`` (503)
+so views and DRF turn them into proper error responses instead of results.
+
+The retry budget caps retries at a fraction of recent calls per service, so
+an outage does not multiply load on the upstream. ``hedged()`` additionally
+races a second attempt for idempotent reads that are slower than a delay.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRY = "retry"
+REFRESH = "refresh"
+PERMANENT = "permanent"
+
+_RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamError(APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = "An upstream service request failed."
+    default_code = "upstream_error"
+
+    def __init__(self, op: str, cause: BaseException, retryable: bool = False):
+        super().__init__(detail=f"{op} failed: {cause}")
+        self.op = op
+        self.cause = cause
+        self.retryable = retryable
+
+
+class UpstreamUnavailable(UpstreamError):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "An upstream service is temporarily unavailable."
+    default_code = "upstream_unavailable"
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    # google.api_core errors carry the HTTP status in .code; HTTP client errors on .response
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def classify(exc: BaseException) -> str:
+    if isinstance(exc, APIException):
+        # Our own signals (admission rejections, already-wrapped upstream errors)
+        return PERMANENT
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return RETRY
+    try:
+        from google.api_core import exceptions as gexc  # type: ignore
+        from google.auth import exceptions as auth_exc  # type: ignore
+    except ImportError:  # pragma: no cover - google libs are in requirements
+        gexc = auth_exc = None
+    if gexc is not None:
+        if isinstance(exc, (gexc.RetryError, gexc.DeadlineExceeded, gexc.ServiceUnavailable,
+                            gexc.TooManyRequests, gexc.ResourceExhausted, gexc.InternalServerError,
+                            gexc.BadGateway, gexc.GatewayTimeout, gexc.Aborted)):
+            return RETRY
+        if isinstance(exc, gexc.Unauthenticated):
+            return REFRESH
+        if isinstance(exc, gexc.PermissionDenied):
+            # Vertex answers 403 naming its service agent (service-<number>@...) while
+            # the agent is still being provisioned for the project; a new client fixes it
+            return REFRESH if "service-" in str(exc) else PERMANENT
+    if auth_exc is not None and isinstance(exc, auth_exc.TransportError):
+        return RETRY
+    code = _status_code(exc)
+    if code in _RETRYABLE_STATUS:
+        return RETRY
+    if code in (401,):
+        return REFRESH
+    try:
+        import requests  # type: ignore
+
+        if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+            return RETRY
+    except ImportError:  # pragma: no cover
+        pass
+    return PERMANENT
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3
+    base_delay: float = 0.25
+    max_delay: float = 4.0
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        return cls(
+            max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", "3")),
+            base_delay=int(os.getenv("RETRY_BASE_DELAY_MS", "250")) / 1000,
+            max_delay=int(os.getenv("RETRY_MAX_DELAY_MS", "4000")) / 1000,
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given (1-based) failed attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class RetryBudget:
+    """Token bucket funded by successful traffic.
+
+    Every call deposits ``ratio`` tokens (up to ``cap``) and every retry spends
+    one, with a floor of ``min_per_sec`` retries so low-traffic services can
+    still recover from a blip.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_sec: float = 1.0, cap: float = 20.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.cap = cap
+        self._tokens = cap
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.exhausted = 0
+
+    def record_call(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self.cap, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.cap, self._tokens + (now - self._updated) * self.min_per_sec)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.retries += 1
+                return True
+            self.exhausted += 1
+            return False
+
+    def stats(self) -> Dict[str, float]:
+        return {"calls": self.calls, "retries": self.retries, "budget_exhausted": self.exhausted}
+
+
+_budgets: Dict[str, RetryBudget] = {}
+_budgets_lock = threading.Lock()
+
+
+def get_budget(service: str) -> RetryBudget:
+    with _budgets_lock:
+        budget = _budgets.get(service)
+        if budget is None:
+            budget = _budgets[service] = RetryBudget(ratio=float(os.getenv("RETRY_BUDGET_RATIO", "0.1")))
+        return budget
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    with _budgets_lock:
+        return {service: budget.stats() for service, budget in _budgets.items()}
+
+
+def _wrap(op: str, exc: BaseException, kind: str) -> BaseException:
+    if isinstance(exc, APIException):
+        return exc
+    if kind == RETRY:
+        return UpstreamUnavailable(op, exc, retryable=True)
+    return UpstreamError(op, exc)
+
+
+def _on_failure(op: str, exc: Exception, attempt: int, policy: RetryPolicy, budget: RetryBudget,
+                refreshable: bool) -> Optional[float]:
+    """Decide what follows a failed attempt: None to refresh and retry now,
+    a delay in seconds to back off and retry, or raise to give up."""
+    kind = classify(exc)
+    if kind == REFRESH and refreshable:
+        logger.warning(f"🔄 {op}: credential error, refreshing client and retrying: {exc}")
+        return None
+    if kind != RETRY or attempt >= policy.max_attempts:
+        logger.error(f"{op} failed after {attempt} attempt(s): {exc}")
+        raise _wrap(op, exc, kind) from exc
+    if not budget.try_spend():
+        logger.error(f"{op} failed and retry budget is exhausted: {exc}")
+        raise _wrap(op, exc, kind) from exc
+    delay = policy.backoff(attempt)
+    logger.warning(f"{op} attempt {attempt} failed ({exc}); retrying in {delay:.2f}s")
+    return delay
+
+
+def call(
+    op: str,
+    fn: Callable[[], T],
+    policy: Optional[RetryPolicy] = None,
+    on_refresh: Optional[Callable[[], None]] = None,
+) -> T:
+    """Run ``fn`` with classification, backoff and the retry budget of ``op``'s service.
+
+    ``op`` is a dotted name such as ``vertex.summarize_document``; the part
+    before the first dot selects the retry budget.
+    """
+    policy = policy or RetryPolicy.from_env()
+    budget = get_budget(op.split(".", 1)[0])
+    refreshed = False
+    attempt = 0
+    while True:
+        attempt += 1
+        budget.record_call()
+        try:
+            return fn()
+        except Exception as exc:
+            delay = _on_failure(op, exc, attempt, policy, budget, not refreshed and on_refresh is not None)
+            if delay is None:
+                refreshed = True
+                on_refresh()  # type: ignore[misc]
+                continue
+            time.sleep(delay)
+
+
+async def acall(
+    op: str,
+    fn: Callable[[], Awaitable[T]],
+    policy: Optional[RetryPolicy] = None,
+    on_refresh: Optional[Callable[[], None]] = None,
+) -> T:
+    """Coroutine version of ``call``: ``fn`` returns an awaitable and backoff uses ``asyncio.sleep``."""
+    policy = policy or RetryPolicy.from_env()
+    budget = get_budget(op.split(".", 1)[0])
+    refreshed = False
+    attempt = 0
+    while True:
+        attempt += 1
+        budget.record_call()
+        try:
+            return await fn()
+        except Exception as exc:
+            delay = _on_failure(op, exc, attempt, policy, budget, not refreshed and on_refresh is not None)
+            if delay is None:
+                refreshed = True
+                on_refresh()  # type: ignore[misc]
+                continue
+            await asyncio.sleep(delay)
+
+
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _hedge_pool_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+    return _hedge_pool
+
+
+def hedged(op: str, fn: Callable[[], T], hedge_after: float) -> T:
+    """Run an idempotent ``fn``; if it is still running after ``hedge_after`` seconds,
+    start a second attempt and return whichever succeeds first.
+
+    Only the primary attempt goes through ``call()``'s retries; the hedge is a
+    single extra try and is not charged to the retry budget.
+    """
+    if hedge_after <= 0:
+        return call(op, fn)
+    pool = _pool()
+    primary = pool.submit(contextvars.copy_context().run, call, op, fn)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+    logger.info(f"{op} slower than {hedge_after:.2f}s, sending hedged request")
+    backup = pool.submit(contextvars.copy_context().run, fn)
+    pending = {primary, backup}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    assert error is not None
+    raise _wrap(op, error, classify(error))
@@ -0,0 +1,235 @@
+"""Task-aware model routing with a latency/error SLO per task.
+
+Each model-backed operation belongs to a task (summary, risks, glossary,
+chat, voice, translate). The routing table gives every task a primary model, a faster
+fallback and a latency SLO. ``choose()`` returns the primary unless the task
+is degraded; ``observe()`` records each primary-model attempt, and once the
+recent p90 latency exceeds the SLO or the transient error rate exceeds
+``MODEL_ROUTE_ERROR_RATE``, the task is switched to its fallback for
+``MODEL_ROUTE_COOLDOWN_S`` seconds. After the cooldown the primary gets
+traffic again with a fresh window, so a still-slow primary trips again
+after ``MODEL_ROUTE_MIN_SAMPLES`` calls.
+
+Environment (task maps use the ``name=value,...`` form of the scheduler):
+
+* ``MODEL_ROUTES``: primary model per task, e.g. ``summary=gemini-2.5-pro,chat=gemini-2.5-flash``
+* ``MODEL_FALLBACKS``: fallback model per task
+* ``MODEL_SLO_MS``: p90 latency SLO per task
+* ``MODEL_ROUTE_WINDOW``, ``MODEL_ROUTE_MIN_SAMPLES``, ``MODEL_ROUTE_ERROR_RATE``,
+  ``MODEL_ROUTE_COOLDOWN_S``
+
+Summary and risk analysis default to ``VERTEX_MODEL``; glossary extraction,
+chat, voice answers and translation of finished analyses default to
+``VERTEX_FAST_MODEL``.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SUMMARY = "summary"
+RISKS = "risks"
+GLOSSARY = "glossary"
+CHAT = "chat"
+VOICE = "voice"
+TRANSLATE = "translate"
+
+TASKS = {
+    "vertex.summarize_document": SUMMARY,
+    "vertex.analyze_risks": RISKS,
+    "vertex.analyze_risk_clauses": RISKS,
+    "vertex.extract_glossary": GLOSSARY,
+    "vertex.define_terms": GLOSSARY,
+    "vertex.chat_with_gemini": CHAT,
+    "vertex.answer_question": VOICE,
+    "vertex.translate_analysis": TRANSLATE,
+    # Long-document passes (see longdoc)
+    "vertex.summarize_section": SUMMARY,
+    "vertex.analyze_risks_section": RISKS,
+    "vertex.extract_glossary_section": GLOSSARY,
+}
+
+DEFAULT_SLO_MS = {SUMMARY: 30000, RISKS: 30000, GLOSSARY: 15000, CHAT: 8000, VOICE: 5000, TRANSLATE: 10000}
+
+ROUTED = metrics.REGISTRY.counter(
+    "legalease_model_route_total", "Model calls by task, chosen model and whether the task was degraded.",
+    ("task", "model", "route"))
+SWITCHES = metrics.REGISTRY.counter(
+    "legalease_model_route_switches_total", "Times a task was switched to its fallback model.", ("task", "reason"))
+
+
+@dataclass(frozen=True)
+class Route:
+    primary: str
+    fallback: str
+    slo_seconds: float
+
+
+def _parse_map(raw: str) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for item in raw.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            out[name.strip()] = value.strip()
+    return out
+
+
+def default_model() -> str:
+    return os.getenv("VERTEX_MODEL", "gemini-2.5-pro")
+
+
+def routes_from_env() -> Dict[str, Route]:
+    pro = default_model()
+    fast = os.getenv("VERTEX_FAST_MODEL", "gemini-2.5-flash")
+    lite = os.getenv("VERTEX_FALLBACK_MODEL", "gemini-2.5-flash-lite")
+    primaries = {SUMMARY: pro, RISKS: pro, GLOSSARY: fast, CHAT: fast, VOICE: fast, TRANSLATE: fast,
+                 **_parse_map(os.getenv("MODEL_ROUTES", ""))}
+    fallbacks = {task: (fast if model == pro else lite) for task, model in primaries.items()}
+    fallbacks.update(_parse_map(os.getenv("MODEL_FALLBACKS", "")))
+    slos = {**DEFAULT_SLO_MS, **{t: float(v) for t, v in _parse_map(os.getenv("MODEL_SLO_MS", "")).items()}}
+    return {
+        task: Route(primaries[task], fallbacks.get(task) or primaries[task], slos.get(task, 30000) / 1000)
+        for task in primaries
+    }
+
+
+def _p90(samples: List[float]) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))]
+
+
+class _TaskState:
+    def __init__(self, window: int):
+        self.samples: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self.degraded_until = 0.0
+        self.switches = 0
+
+
+class Router:
+    def __init__(
+        self,
+        routes: Dict[str, Route],
+        window: int = 50,
+        min_samples: int = 10,
+        error_rate: float = 0.2,
+        cooldown: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.routes = routes
+        self.min_samples = max(1, min_samples)
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = {task: _TaskState(window) for task in routes}
+
+    def models(self) -> List[str]:
+        return sorted({m for r in self.routes.values() for m in (r.primary, r.fallback)})
+
+    def choose(self, task: Optional[str]) -> str:
+        route = self.routes.get(task or "")
+        if route is None:
+            return default_model()
+        state = self._state[task]
+        with self._lock:
+            degraded = state.degraded_until > self._clock()
+            if not degraded and state.degraded_until:
+                state.degraded_until = 0.0
+                state.samples.clear()
+                logger.info(f"Routing {task} back to {route.primary}")
+        model = route.fallback if degraded else route.primary
+        ROUTED.inc(task=task, model=model, route="fallback" if degraded else "primary")
+        return model
+
+    def current(self, task: Optional[str]) -> str:
+        """The model ``choose`` would pick now, without recording a routing decision."""
+        route = self.routes.get(task or "")
+        if route is None:
+            return default_model()
+        return route.fallback if self._state[task].degraded_until > self._clock() else route.primary
+
+    def observe(self, task: Optional[str], model: str, seconds: float, ok: bool) -> None:
+        """Record one attempt; only the primary model's attempts count towards its SLO."""
+        route = self.routes.get(task or "")
+        if route is None or model != route.primary or route.fallback == route.primary:
+            return
+        state = self._state[task]
+        with self._lock:
+            if state.degraded_until > self._clock():
+                return
+            state.samples.append((seconds, ok))
+            if len(state.samples) < self.min_samples:
+                return
+            p90 = _p90([s for s, good in state.samples if good])
+            errors = sum(1 for _, good in state.samples if not good) / len(state.samples)
+            if errors > self.error_rate:
+                reason = "errors"
+            elif p90 > route.slo_seconds:
+                reason = "latency"
+            else:
+                return
+            state.degraded_until = self._clock() + self.cooldown
+            state.switches += 1
+        SWITCHES.inc(task=task, reason=reason)
+        logger.warning(
+            f"Routing {task} to {route.fallback} for {self.cooldown:.0f}s: {route.primary} "
+            f"p90={p90:.2f}s (SLO {route.slo_seconds:.2f}s), error rate {errors:.0%}"
+        )
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        now = self._clock()
+        out: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for task, state in self._state.items():
+                samples = list(state.samples)
+                good = [s for s, ok in samples if ok]
+                out[task] = {
+                    "degraded": 1 if state.degraded_until > now else 0,
+                    "primary_p90_seconds": _p90(good),
+                    "primary_error_rate": (len(samples) - len(good)) / len(samples) if samples else 0.0,
+                    "slo_seconds": self.routes[task].slo_seconds,
+                    "switches_total": state.switches,
+                }
+        return out
+
+
+_router: Optional[Router] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> Router:
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = Router(
+                    routes_from_env(),
+                    window=int(os.getenv("MODEL_ROUTE_WINDOW", "50")),
+                    min_samples=int(os.getenv("MODEL_ROUTE_MIN_SAMPLES", "10")),
+                    error_rate=float(os.getenv("MODEL_ROUTE_ERROR_RATE", "0.2")),
+                    cooldown=float(os.getenv("MODEL_ROUTE_COOLDOWN_S", "60")),
+                )
+    return _router
+
+
+def reset() -> None:
+    global _router
+    with _router_lock:
+        _router = None
+
+
+def task_for(op: str) -> Optional[str]:
+    return TASKS.get(op)
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    return get_router().stats() if _router is not None else {}
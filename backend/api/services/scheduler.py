@@ -0,0 +1,267 @@
+"""Priority scheduler for outbound model calls.
+
+Every Vertex/Speech/TTS call asks the scheduler for a slot. Slots are handed
+out in strict priority order (interactive, then analysis, then background),
+and within a class by weighted fair queuing across users, so one user with a
+stack of analyses cannot starve another user's single request.
+
+Each class has its own concurrency budget. Non-interactive classes must also
+leave ``reserve`` slots free, so a chat turn that arrives while the pool is
+busy with analyses starts as soon as any call finishes instead of waiting
+behind the whole backlog; background work takes whatever remains.
+
+Configuration (environment):
+
+* ``MODEL_MAX_CONCURRENCY``: total slots in this process (default 8)
+* ``SCHEDULER_BUDGETS``: e.g. ``interactive=8,analysis=6,background=4``
+* ``SCHEDULER_INTERACTIVE_RESERVE``: slots held back for interactive calls
+* ``SCHEDULER_TIMEOUTS_MS``: max queue wait per class before a 429
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+from .context import ANALYSIS, BACKGROUND, INTERACTIVE, PRIORITIES
+
+# Recent queue waits kept per class for percentile estimates
+WAIT_SAMPLES = 512
+
+
+def _parse_map(raw: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for item in raw.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            out[name.strip()] = float(value)
+    return out
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class SchedulerTimeout(Exception):
+    def __init__(self, priority: str, waited: float):
+        super().__init__(f"{priority} call waited {waited:.2f}s for a model slot")
+        self.priority = priority
+        self.waited = waited
+
+
+class _Waiter:
+    __slots__ = ("priority", "user", "enqueued", "granted", "cancelled", "event")
+
+    def __init__(self, priority: str, user: str):
+        self.priority = priority
+        self.user = user
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+        self.event = threading.Event()
+
+    def notify(self) -> None:
+        self.event.set()
+
+
+class _AsyncWaiter(_Waiter):
+    """Waiter for coroutines: the grant resolves a future on the waiter's event loop."""
+
+    __slots__ = ("loop", "future")
+
+    def __init__(self, priority: str, user: str):
+        super().__init__(priority, user)
+        self.loop = asyncio.get_running_loop()
+        self.future: asyncio.Future = self.loop.create_future()
+
+    def notify(self) -> None:
+        self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class PriorityScheduler:
+    def __init__(
+        self,
+        capacity: int,
+        budgets: Optional[Dict[str, int]] = None,
+        reserve: Optional[int] = None,
+        timeouts: Optional[Dict[str, float]] = None,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        self.capacity = max(1, capacity)
+        self.reserve = min(self.capacity - 1, max(0, self.capacity // 4 if reserve is None else reserve))
+        self.budgets = {p: self.capacity for p in PRIORITIES}
+        self.budgets[ANALYSIS] = self.budgets[BACKGROUND] = self.capacity - self.reserve
+        for p, budget in (budgets or {}).items():
+            self.budgets[p] = max(1, min(int(budget), self.capacity))
+        self.timeouts = {INTERACTIVE: 2.0, ANALYSIS: 2.0, BACKGROUND: 20.0, **(timeouts or {})}
+        self.weights = weights or {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._queues: Dict[str, List[Tuple[float, int, _Waiter]]] = {p: [] for p in PRIORITIES}
+        self._running: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        # WFQ state: per-class virtual clock and each user's last finish tag
+        self._virtual: Dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        self._finish: Dict[str, Dict[str, float]] = {p: {} for p in PRIORITIES}
+        self._waits: Dict[str, Deque[float]] = {p: deque(maxlen=WAIT_SAMPLES) for p in PRIORITIES}
+        self._counters: Dict[str, Dict[str, float]] = {p: defaultdict(float) for p in PRIORITIES}
+
+    def _can_start(self, priority: str) -> bool:
+        total = sum(self._running.values())
+        if total >= self.capacity or self._running[priority] >= self.budgets[priority]:
+            return False
+        if priority != INTERACTIVE and total >= self.capacity - self.reserve:
+            return False
+        return True
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        p = waiter.priority
+        weight = self.weights.get(waiter.user, 1.0)
+        start = max(self._virtual[p], self._finish[p].get(waiter.user, 0.0))
+        finish = start + 1.0 / weight
+        self._finish[p][waiter.user] = finish
+        heapq.heappush(self._queues[p], (finish, next(self._seq), waiter))
+        self._counters[p]["queued_total"] += 1
+
+    def _dispatch(self) -> None:
+        for p in PRIORITIES:
+            queue = self._queues[p]
+            while queue and self._can_start(p):
+                finish, _, waiter = heapq.heappop(queue)
+                if waiter.cancelled:
+                    continue
+                self._virtual[p] = max(self._virtual[p], finish - 1.0 / self.weights.get(waiter.user, 1.0))
+                self._grant(waiter)
+            if not queue:
+                # Idle class: forget finish tags so they cannot grow without bound
+                self._finish[p].clear()
+                self._virtual[p] = 0.0
+
+    def _grant(self, waiter: _Waiter) -> None:
+        waiter.granted = True
+        self._running[waiter.priority] += 1
+        waited = time.monotonic() - waiter.enqueued
+        self._waits[waiter.priority].append(waited)
+        counters = self._counters[waiter.priority]
+        counters["granted_total"] += 1
+        counters["wait_seconds_sum"] += waited
+        counters["wait_seconds_max"] = max(counters["wait_seconds_max"], waited)
+        waiter.notify()
+
+    def _submit(self, priority: str, user: str, waiter_cls=_Waiter) -> _Waiter:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority class: {priority}")
+        waiter = waiter_cls(priority, user or "anonymous")
+        with self._lock:
+            self._enqueue(waiter)
+            self._dispatch()
+        return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Give up on a queued waiter; returns False if it was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            waiter.cancelled = True
+            self._counters[waiter.priority]["rejected_total"] += 1
+            return True
+
+    def release(self, priority: str) -> None:
+        with self._lock:
+            self._running[priority] -= 1
+            self._dispatch()
+
+    def acquire(self, priority: str, user: str, timeout: Optional[float] = None) -> None:
+        waiter = self._submit(priority, user)
+        limit = self.timeouts[priority] if timeout is None else timeout
+        if not waiter.event.wait(limit) and self._abandon(waiter):
+            raise SchedulerTimeout(priority, time.monotonic() - waiter.enqueued)
+
+    @contextmanager
+    def slot(self, priority: str, user: str, timeout: Optional[float] = None) -> Iterator[None]:
+        self.acquire(priority, user, timeout)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    async def aacquire(self, priority: str, user: str, timeout: Optional[float] = None) -> None:
+        """Coroutine version of ``acquire``; waits without blocking the event loop."""
+        waiter = self._submit(priority, user, _AsyncWaiter)
+        limit = self.timeouts[priority] if timeout is None else timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), limit)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise SchedulerTimeout(priority, time.monotonic() - waiter.enqueued)
+        except asyncio.CancelledError:
+            # Client went away: give the slot back if it was granted meanwhile
+            if not self._abandon(waiter):
+                self.release(priority)
+            raise
+
+    @asynccontextmanager
+    async def aslot(self, priority: str, user: str, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        await self.aacquire(priority, user, timeout)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            out: Dict[str, Dict[str, float]] = {}
+            for p in PRIORITIES:
+                samples = list(self._waits[p])
+                out[p] = {
+                    **self._counters[p],
+                    "budget": self.budgets[p],
+                    "running": self._running[p],
+                    "queued": sum(1 for _, _, w in self._queues[p] if not w.cancelled),
+                    "wait_p50_seconds": _percentile(samples, 50),
+                    "wait_p95_seconds": _percentile(samples, 95),
+                }
+            return out
+
+
+_scheduler: Optional[PriorityScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> PriorityScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                reserve = os.getenv("SCHEDULER_INTERACTIVE_RESERVE")
+                queue_timeout = int(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "2000")) / 1000
+                timeouts = {INTERACTIVE: queue_timeout, ANALYSIS: queue_timeout, BACKGROUND: queue_timeout * 10}
+                timeouts.update({p: ms / 1000 for p, ms in _parse_map(os.getenv("SCHEDULER_TIMEOUTS_MS", "")).items()})
+                _scheduler = PriorityScheduler(
+                    capacity=int(os.getenv("MODEL_MAX_CONCURRENCY", "8")),
+                    budgets={p: int(v) for p, v in _parse_map(os.getenv("SCHEDULER_BUDGETS", "")).items()},
+                    reserve=int(reserve) if reserve else None,
+                    timeouts=timeouts,
+                )
+    return _scheduler
+
+
+def reset() -> None:
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = None
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    return get_scheduler().stats()
@@ -0,0 +1,264 @@
+"""Coalescing of identical concurrent model calls ("single flight").
+
+A double-clicked Analyze, a frontend retry, or many users asking the same
+voice question at once would otherwise run the same model call several
+times. ``do`` (and ``ado`` for async code) runs the call once per key:
+callers that arrive while it is in flight wait for it and share its result,
+or its exception if the model or backend failed (``UpstreamError``,
+``TokenBudgetExceeded``). Other failures belong to the caller that ran the
+call (its quota, its cancelled request, a bug in its path), so a waiting
+caller runs the call again instead, becoming the new leader. Nothing is kept
+once the call has finished; the analysis and section caches are for that.
+
+Keys are fingerprints of what determines the answer (operation, document
+content, question, model, language); see ``fingerprint``. Coalescing is per
+process by default. ``SINGLEFLIGHT_BACKEND=cache`` also coalesces across
+workers through the Django cache, as ``ADMISSION_BACKEND=cache`` does: the
+first worker takes a lock entry and publishes its result for
+``SINGLEFLIGHT_RESULT_TTL_S``; the others poll for it and run the call
+themselves if it has not arrived within ``SINGLEFLIGHT_WAIT_S``. Results
+shared that way must be picklable.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from . import metrics, resilience, tokens
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+COALESCED = metrics.REGISTRY.counter(
+    "legalease_singleflight_total",
+    "Model calls by whether they ran (leader) or waited for an identical call in flight (shared).", ("outcome",))
+
+_OK = "ok"
+_ERROR = "error"
+
+
+def _enabled() -> bool:
+    return os.getenv("SINGLEFLIGHT", "true").lower() != "false"
+
+
+def _shareable(error: BaseException) -> bool:
+    """Whether callers waiting on a failed call get its error, rather than running the call again."""
+    return isinstance(error, (resilience.UpstreamError, tokens.TokenBudgetExceeded))
+
+
+def fingerprint(*parts: Any) -> str:
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class LocalBackend:
+    """Runs the call; coalescing within the process happens in ``do``/``ado``."""
+
+    def run(self, _key: str, fn: Callable[[], T]) -> T:
+        COALESCED.inc(outcome="leader")
+        return fn()
+
+    async def arun(self, _key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        COALESCED.inc(outcome="leader")
+        return await fn()
+
+
+class CacheBackend:
+    """Cross-worker coalescing through a lock entry and a short-lived result in the Django cache."""
+
+    POLL_INTERVAL = 0.05
+    ERROR_TTL = 1  # a retry shortly after a failure should reach the model again
+
+    def __init__(self, alias: str = "default", prefix: str = "singleflight"):
+        from django.core.cache import caches
+
+        self._cache = caches[alias]
+        self._prefix = prefix
+
+    @staticmethod
+    def _config() -> Tuple[float, int]:
+        return float(os.getenv("SINGLEFLIGHT_WAIT_S", "120")), int(os.getenv("SINGLEFLIGHT_RESULT_TTL_S", "5"))
+
+    def _publish(self, key: str, outcome: str, value: Any) -> None:
+        _, ttl = self._config()
+        try:
+            self._cache.set(f"{self._prefix}:result:{key}", (outcome, value),
+                            timeout=self.ERROR_TTL if outcome == _ERROR else ttl)
+        except Exception as e:
+            # Unpicklable result or cache outage; waiting workers fall back to running the call
+            logger.warning(f"Could not share single-flight result: {e}")
+
+    @staticmethod
+    def _unwrap(entry: Tuple[str, Any]) -> Any:
+        outcome, value = entry
+        if outcome == _ERROR:
+            raise value
+        return value
+
+    def _try_lead(self, key: str) -> bool:
+        wait, _ = self._config()
+        return bool(self._cache.add(f"{self._prefix}:lock:{key}", 1, timeout=int(wait) + 1))
+
+    def _release(self, key: str) -> None:
+        self._cache.delete(f"{self._prefix}:lock:{key}")
+
+    def _shared(self, key: str) -> Optional[Tuple[str, Any]]:
+        return self._cache.get(f"{self._prefix}:result:{key}")
+
+    def run(self, key: str, fn: Callable[[], T]) -> T:
+        wait, _ = self._config()
+        deadline = time.monotonic() + wait
+        while True:
+            entry = self._shared(key)
+            if entry is not None:
+                COALESCED.inc(outcome="shared")
+                return self._unwrap(entry)
+            if self._try_lead(key):
+                COALESCED.inc(outcome="leader")
+                try:
+                    value = fn()
+                except Exception as e:
+                    if _shareable(e):
+                        self._publish(key, _ERROR, e)
+                    raise
+                finally:
+                    self._release(key)
+                self._publish(key, _OK, value)
+                return value
+            if time.monotonic() >= deadline:
+                COALESCED.inc(outcome="leader")
+                return fn()
+            time.sleep(self.POLL_INTERVAL)
+
+    async def arun(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        wait, _ = self._config()
+        deadline = time.monotonic() + wait
+        while True:
+            entry = await asyncio.to_thread(self._shared, key)
+            if entry is not None:
+                COALESCED.inc(outcome="shared")
+                return self._unwrap(entry)
+            if await asyncio.to_thread(self._try_lead, key):
+                COALESCED.inc(outcome="leader")
+                try:
+                    value = await fn()
+                except Exception as e:
+                    if _shareable(e):
+                        await asyncio.to_thread(self._publish, key, _ERROR, e)
+                    raise
+                finally:
+                    await asyncio.to_thread(self._release, key)
+                await asyncio.to_thread(self._publish, key, _OK, value)
+                return value
+            if time.monotonic() >= deadline:
+                COALESCED.inc(outcome="leader")
+                return await fn()
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                kind = os.getenv("SINGLEFLIGHT_BACKEND", "local").lower()
+                _backend = CacheBackend() if kind == "cache" else LocalBackend()
+    return _backend
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.shared = False  # False when waiting callers must run the call themselves
+
+
+_calls: Dict[str, _Call] = {}
+_calls_lock = threading.Lock()
+# In-flight async calls, per event loop (futures belong to the loop that made them)
+_async_calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]" = weakref.WeakKeyDictionary()
+
+
+def reset() -> None:
+    """Forget the backend choice (used by tests)."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def do(key: str, fn: Callable[[], T]) -> T:
+    """``fn()``, or the outcome of the identical call already in flight under ``key``."""
+    if not _enabled():
+        return fn()
+    while True:
+        with _calls_lock:
+            call = _calls.get(key)
+            leader = call is None
+            if leader:
+                call = _calls[key] = _Call()
+        if leader:
+            break
+        COALESCED.inc(outcome="shared")
+        call.done.wait()
+        if call.shared:
+            if call.error is not None:
+                raise call.error
+            return call.result
+        # The leader's failure was its own; run the call again
+    try:
+        call.result = get_backend().run(key, fn)
+        call.shared = True
+        return call.result
+    except BaseException as e:
+        if _shareable(e):
+            call.error = e
+            call.shared = True
+        raise
+    finally:
+        with _calls_lock:
+            del _calls[key]
+        call.done.set()
+
+
+async def ado(key: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """Coroutine version of ``do``."""
+    if not _enabled():
+        return await fn()
+    calls = _async_calls.setdefault(asyncio.get_running_loop(), {})
+    while key in calls:
+        future = calls[key]
+        COALESCED.inc(outcome="shared")
+        try:
+            # Shielded: a follower whose client went away must not cancel the shared call
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            # The leader was cancelled or failed on its own; take over
+    future = asyncio.get_running_loop().create_future()
+    calls[key] = future
+    try:
+        result = await get_backend().arun(key, fn)
+    except BaseException as e:
+        if _shareable(e):
+            future.set_exception(e)
+            future.exception()  # retrieved here, so an unshared failure is not logged again
+        else:
+            future.cancel()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        calls.pop(key, None)
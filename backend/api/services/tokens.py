@@ -0,0 +1,336 @@
+"""Token budgeting and per-user/per-document usage accounting for model calls.
+
+Before a prompt is sent, ``fit()`` (or ``afit()``) estimates its size: file
+parts are measured once with the model's ``count_tokens`` and cached by part,
+text parts are estimated locally at ~4 characters per token. If the prompt is
+over the input cap for that operation, older text parts are cut from the front
+(oldest chat turns go first; the final instruction or question is never cut)
+or, when that is not enough, the attached document alone is over the cap or
+``TOKEN_OVERFLOW=reject``, the call fails fast with a 413 before it takes a
+model slot. Callers that can do better than rejecting (e.g. by processing the
+document in pieces) catch ``TokenBudgetExceeded``.
+
+After a call, ``record()`` adds the response's usage metadata to in-process
+totals for the current user and document (see ``context.request_scope``); a
+background thread adds them to the ``usage_users`` and ``usage_documents``
+Firestore collections every ``TOKEN_USAGE_FLUSH_INTERVAL_MS``.
+
+Environment:
+
+* ``TOKEN_PREFLIGHT``: ``false`` turns the size check off (default ``true``)
+* ``TOKEN_INPUT_CAPS``: per-op caps, e.g. ``chat_with_gemini=60000,answer_question=16000``
+* ``TOKEN_OVERFLOW``: ``truncate`` (default) or ``reject``
+* ``TOKEN_USAGE_FLUSH_INTERVAL_MS``: ``0`` writes usage on every call
+"""
+import asyncio
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import context, metrics, resilience
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = "[Earlier text omitted to fit the model's input limit]\n"
+
+# Gemini 1.5 accepts ~1M input tokens; stay well below so analysis latency and
+# cost stay bounded, and keep interactive calls much smaller.
+DEFAULT_CAPS = {
+    "vertex.summarize_document": 400_000,
+    "vertex.analyze_risks": 400_000,
+    "vertex.extract_glossary": 400_000,
+    "vertex.chat_with_gemini": 120_000,
+    "vertex.answer_question": 32_000,
+}
+
+PREFLIGHT = metrics.REGISTRY.counter(
+    "legalease_token_preflight_total", "Prompt size checks by outcome (ok, truncated, rejected).", ("op", "outcome"))
+
+
+class TokenBudgetExceeded(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "The document is too large to process in one request."
+    default_code = "token_budget_exceeded"
+
+    def __init__(self, op: str, tokens: int, cap: int):
+        super().__init__()
+        self.op = op
+        self.tokens = tokens
+        self.cap = cap
+
+
+def _enabled() -> bool:
+    return os.getenv("TOKEN_PREFLIGHT", "true").lower() != "false"
+
+
+def _caps() -> Dict[str, int]:
+    caps = dict(DEFAULT_CAPS)
+    for item in os.getenv("TOKEN_INPUT_CAPS", "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            name = name.strip()
+            caps[name if name.startswith("vertex.") else f"vertex.{name}"] = int(value)
+    return caps
+
+
+def cap_for(op: str) -> Optional[int]:
+    return _caps().get(op)
+
+
+def estimate_text(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _part_key(part: Any) -> str:
+    # File parts are immutable per URI (uploads get a fresh path), so the
+    # count can be reused; inline parts are keyed by their content.
+    to_dict = getattr(part, "to_dict", None)
+    raw = to_dict() if callable(to_dict) else repr(part)
+    return hashlib.sha256(json.dumps(raw, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class _CountCache:
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[int]:
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+            return count
+
+    def put(self, key: str, count: int) -> None:
+        with self._lock:
+            self._counts[key] = count
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+
+_counts = _CountCache()
+
+
+def _file_parts(parts: List[Any]) -> List[Tuple[str, Any]]:
+    return [(_part_key(p), p) for p in parts if not isinstance(p, str)]
+
+
+def _total(parts: List[Any], file_counts: Dict[str, int]) -> Tuple[int, int]:
+    files = sum(file_counts.values())
+    text = sum(estimate_text(p) for p in parts if isinstance(p, str))
+    return files, text
+
+
+def _count_file(model: Any, key: str, part: Any) -> Optional[int]:
+    count = _counts.get(key)
+    if count is not None:
+        return count
+    try:
+        with metrics.stage("vertex.count_tokens"):
+            resp = resilience.call("vertex.count_tokens", lambda: model.count_tokens([part]))
+    except Exception as e:
+        # A failed estimate should not fail the request; the model enforces its own limit
+        logger.warning(f"count_tokens failed, skipping preflight: {e}")
+        return None
+    count = int(getattr(resp, "total_tokens", 0) or 0)
+    _counts.put(key, count)
+    return count
+
+
+async def _acount_file(model: Any, key: str, part: Any) -> Optional[int]:
+    count = _counts.get(key)
+    if count is not None:
+        return count
+
+    async def attempt():
+        count_async = getattr(model, "count_tokens_async", None)
+        if count_async is None:
+            return await asyncio.to_thread(model.count_tokens, [part])
+        return await count_async([part])
+
+    try:
+        with metrics.stage("vertex.count_tokens"):
+            resp = await resilience.acall("vertex.count_tokens", attempt)
+    except Exception as e:
+        logger.warning(f"count_tokens failed, skipping preflight: {e}")
+        return None
+    count = int(getattr(resp, "total_tokens", 0) or 0)
+    _counts.put(key, count)
+    return count
+
+
+def count_part(part: Any, get_model: Callable[[], Any]) -> Optional[int]:
+    """Token count of one file part (cached), or None if it could not be counted."""
+    return _count_file(get_model(), _part_key(part), part)
+
+
+async def acount_part(part: Any, get_model: Callable[[], Any]) -> Optional[int]:
+    return await _acount_file(await get_model(), _part_key(part), part)
+
+
+def _truncate(parts: List[Any], excess: int) -> List[Any]:
+    """Drop ``excess`` tokens of text, oldest part first, never cutting the final text part.
+
+    The final text part is the instruction or the latest question; if there is
+    not enough older text to drop, the result is still over the cap.
+    """
+    out = list(parts)
+    texts = [i for i, p in enumerate(out) if isinstance(p, str)]
+    for i in texts[:-1]:
+        if excess <= 0:
+            break
+        text = out[i]
+        drop_chars = min(len(text), (excess + estimate_text(TRUNCATION_MARKER)) * CHARS_PER_TOKEN)
+        kept = text[drop_chars:]
+        out[i] = TRUNCATION_MARKER + kept if kept else ""
+        excess -= estimate_text(text) - estimate_text(out[i])
+    return [p for p in out if p != ""]
+
+
+def _apply(op: str, parts: List[Any], file_tokens: int, text_tokens: int, cap: int) -> List[Any]:
+    if file_tokens + text_tokens <= cap:
+        PREFLIGHT.inc(op=op, outcome="ok")
+        return parts
+    if file_tokens <= cap and os.getenv("TOKEN_OVERFLOW", "truncate").lower() != "reject":
+        truncated = _truncate(parts, file_tokens + text_tokens - cap)
+        if file_tokens + _total(truncated, {})[1] <= cap:
+            PREFLIGHT.inc(op=op, outcome="truncated")
+            logger.info(f"{op}: prompt of ~{file_tokens + text_tokens} tokens truncated to cap {cap}")
+            return truncated
+    PREFLIGHT.inc(op=op, outcome="rejected")
+    raise TokenBudgetExceeded(op, file_tokens + text_tokens, cap)
+
+
+def fit(op: str, parts: List[Any], get_model: Callable[[], Any]) -> List[Any]:
+    """Return ``parts`` within the input cap for ``op``, truncated if needed."""
+    cap = cap_for(op)
+    if cap is None or not _enabled():
+        return parts
+    file_counts: Dict[str, int] = {}
+    files = _file_parts(parts)
+    if files:
+        model = get_model()
+        for key, part in files:
+            count = _count_file(model, key, part)
+            if count is None:
+                return parts
+            file_counts[key] = count
+    return _apply(op, parts, *_total(parts, file_counts), cap)
+
+
+async def afit(op: str, parts: List[Any], get_model: Callable[[], Any]) -> List[Any]:
+    """``fit`` for async callers; ``get_model`` is awaited."""
+    cap = cap_for(op)
+    if cap is None or not _enabled():
+        return parts
+    file_counts: Dict[str, int] = {}
+    files = _file_parts(parts)
+    if files:
+        model = await get_model()
+        for key, part in files:
+            count = await _acount_file(model, key, part)
+            if count is None:
+                return parts
+            file_counts[key] = count
+    return _apply(op, parts, *_total(parts, file_counts), cap)
+
+
+class UsageLedger:
+    """Token and model-time totals per user and per document, added to Firestore in batches."""
+
+    def __init__(self, flush_interval: float = 10.0):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, user: Optional[str], document: Optional[str], input_tokens: int, output_tokens: int,
+            seconds: float) -> None:
+        delta = {"inputTokens": input_tokens, "outputTokens": output_tokens, "calls": 1, "modelSeconds": seconds}
+        with self._lock:
+            for key in (("usage_users", user), ("usage_documents", document)):
+                if not key[1]:
+                    continue
+                totals = self._pending.setdefault((key[0], key[1].replace("/", "_")), {})
+                for field, value in delta.items():
+                    totals[field] = totals.get(field, 0) + value
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="token-usage", daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def pending(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        with self._lock:
+            return {key: dict(totals) for key, totals in self._pending.items()}
+
+    def flush(self) -> None:
+        from . import firestore
+
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, {}
+            if not rows:
+                return
+            try:
+                firestore.add_usage(rows)
+            except Exception as e:
+                logger.warning(f"Failed to write token usage, will retry: {e}")
+                with self._lock:
+                    for key, totals in rows.items():
+                        merged = self._pending.setdefault(key, {})
+                        for field, value in totals.items():
+                            merged[field] = merged.get(field, 0) + value
+
+
+_ledger: Optional[UsageLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> UsageLedger:
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = UsageLedger(int(os.getenv("TOKEN_USAGE_FLUSH_INTERVAL_MS", "10000")) / 1000)
+                atexit.register(_ledger.flush)
+    return _ledger
+
+
+def record(response: Any, seconds: float) -> None:
+    """Attribute a response's token usage to the current user and document."""
+    usage = getattr(response, "usage_metadata", None)
+    input_tokens = int(getattr(usage, "prompt_token_count", 0) or 0)
+    output_tokens = int(getattr(usage, "candidates_token_count", 0) or 0)
+    ctx = context.current()
+    if not (ctx.user or ctx.document):
+        return
+    get_ledger().add(ctx.user, ctx.document, input_tokens, output_tokens, seconds)
@@ -0,0 +1,190 @@
+"""Direct-to-storage uploads.
+
+``POST /api/uploads/`` reserves a pending document and returns a resumable
+upload URL; the client sends the file straight to storage and then calls
+``POST /api/uploads/<id>/complete/``. Completion checks the object's size
+(and MD5, when the client declared one) against the metadata storage already
+has, copies it out of ``staging/`` within the bucket and marks the document
+uploaded. Django workers only handle the two small JSON requests, not the
+file bytes.
+
+Moving the content into the content-addressed layout of ``blobs`` needs its
+SHA-256, which means reading every byte back, so it runs in the background
+after completion (``UPLOAD_HASH_WORKERS`` threads) and then repoints the
+document. Content is only deduplicated from the bytes actually received: a
+declared SHA-256 is never trusted on its own, and no response reveals whether
+anyone uploaded the same content before.
+"""
+import logging
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import blobs, firestore, gcs, versions
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+UPLOADED = "uploaded"
+
+
+class UploadIncomplete(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The upload has not been completed."
+    default_code = "upload_incomplete"
+
+
+class UploadMismatch(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "The uploaded file does not match the declared size or hash."
+    default_code = "upload_mismatch"
+
+
+def max_bytes() -> int:
+    return int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+def _safe_name(filename: str) -> str:
+    return re.sub(r"[^\w.\-]+", "_", filename)[-100:] or "upload"
+
+
+def _staging_path(user_id: Optional[str], filename: str) -> str:
+    return f"staging/{user_id or 'None'}/{uuid.uuid4().hex}/{_safe_name(filename)}"
+
+
+def _upload_path(user_id: Optional[str], document_id: str, filename: str) -> str:
+    # Outside staging/, so the lifecycle rule there never removes a completed upload
+    return f"uploads/{user_id or 'None'}/{document_id}/{_safe_name(filename)}"
+
+
+def record_document(user_id: Optional[str], filename: str, content_type: Optional[str], category: str,
+                    sha256: Optional[str], blob: Dict[str, Any], document_id: Optional[str] = None) -> Dict[str, Any]:
+    """Create (or complete) the document record for stored content; returns the upload response."""
+    version = versions.next_version(user_id, filename)
+    fields = {
+        "filename": filename,
+        "contentType": content_type,
+        "category": category,
+        "gcsPath": blob["gcsPath"],
+        "publicUrl": blob["publicUrl"],
+        "sha256": sha256,
+        "size": blob.get("size"),
+        "status": UPLOADED,
+        **version,
+    }
+    if document_id is None:
+        document_id = firestore.save_document_metadata(user_id, fields)
+    else:
+        firestore.update_document(document_id, {**fields, "stagingPath": None})
+    return {
+        "document_id": document_id,
+        "gcs_path": blob["gcsPath"],
+        "version": version["version"],
+        "previous_version_id": version["previousVersionId"],
+    }
+
+
+def start(user_id: Optional[str], filename: str, content_type: str, size: int, category: str,
+          sha256: Optional[str] = None, origin: Optional[str] = None, md5: Optional[str] = None) -> Dict[str, Any]:
+    """Reserve a document and return where to upload its bytes."""
+    staging_path = _staging_path(user_id, filename)
+    document_id = firestore.save_document_metadata(user_id, {
+        "filename": filename,
+        "contentType": content_type,
+        "category": category,
+        "size": size,
+        "declaredSha256": sha256 or None,
+        "declaredMd5": md5 or None,
+        "stagingPath": staging_path,
+        "status": PENDING,
+    })
+    upload_url = gcs.create_upload_session(staging_path, content_type, size, origin)
+    return {"document_id": document_id, "upload_url": upload_url, "method": "PUT"}
+
+
+def complete(user_id: Optional[str], document_id: str) -> Dict[str, Any]:
+    """Verify the uploaded object and turn the pending document into an uploaded one.
+
+    Raises ``PermissionError`` for unknown documents, like ``firestore.get_document``.
+    """
+    document = firestore.get_document(user_id, document_id)
+    if document.get("status") != PENDING:
+        if document.get("status") == UPLOADED and document.get("gcsPath"):
+            # Completing twice (e.g. a retried request) returns the same result
+            return {"document_id": document_id, "gcs_path": document["gcsPath"],
+                    "version": document.get("version", 1), "previous_version_id": document.get("previousVersionId")}
+        raise UploadIncomplete("This document is not awaiting an upload.")
+
+    staging_path = document["stagingPath"]
+    try:
+        size, md5 = gcs.stat(staging_path)
+    except Exception as e:
+        logger.info(f"Upload for {document_id} not found at {staging_path}: {e}")
+        raise UploadIncomplete()
+    if size != document.get("size"):
+        raise UploadMismatch(f"Expected {document.get('size')} bytes, storage has {size}.")
+    declared = document.get("declaredMd5")
+    if declared and declared != md5:
+        raise UploadMismatch("The uploaded file's MD5 does not match the declared hash.")
+
+    user_id = document.get("userId")
+    path, public_url = gcs.copy(staging_path, _upload_path(user_id, document_id, document["filename"]))
+    blobs.discard(staging_path)
+    result = record_document(user_id, document["filename"], document.get("contentType"), document.get("category"),
+                             None, {"gcsPath": path, "publicUrl": public_url, "size": size}, document_id=document_id)
+    _schedule(document_id, {**document, "gcsPath": path})
+    return result
+
+
+def hash_workers() -> int:
+    return int(os.getenv("UPLOAD_HASH_WORKERS", "2"))
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pending: List[Future] = []
+_pool_lock = threading.Lock()
+
+
+def _schedule(document_id: str, document: Dict[str, Any]) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=hash_workers(), thread_name_prefix="upload-hash")
+        _pending[:] = [f for f in _pending if not f.done()]
+        _pending.append(_pool.submit(content_address, document_id, document))
+
+
+def drain(timeout: Optional[float] = None) -> None:
+    """Wait for the content addressing scheduled so far (tests, shutdown)."""
+    with _pool_lock:
+        pending = list(_pending)
+    wait(pending, timeout=timeout)
+
+
+def content_address(document_id: str, document: Dict[str, Any]) -> None:
+    """Move a completed direct upload into the content-addressed layout and repoint its document.
+
+    On any failure the document keeps its own copy, which stays valid; it is
+    just not deduplicated.
+    """
+    path = document["gcsPath"]
+    try:
+        sha256, size = blobs.digest_stored(path)
+        declared = document.get("declaredSha256")
+        if declared and declared != sha256:
+            logger.warning(f"Upload {document_id} does not match its declared SHA-256; kept at {path}")
+            firestore.update_document(document_id, {"sha256": sha256})
+            return
+        blob = blobs.adopt(path, sha256, document["filename"], document.get("contentType") or "", size)
+        firestore.update_document(document_id, {"gcsPath": blob["gcsPath"], "publicUrl": blob["publicUrl"],
+                                                "sha256": sha256})
+    except Exception as e:
+        logger.error(f"Content addressing of upload {document_id} failed: {e}")
+        return
+    blobs.discard(path)
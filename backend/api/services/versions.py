@@ -0,0 +1,139 @@
+"""Document versions: linking re-uploads and describing what changed.
+
+An upload with the same filename as an earlier upload by the same signed-in
+user becomes the next version of it (``version`` and ``previousVersionId`` on
+the document). Analysing a new version compares its text with the previous
+version's paragraph by paragraph, and runs the section-by-section analysis of
+``longdoc`` on it even when it is short: sections whose text did not change
+are answered from the per-section cache, so only changed sections reach the
+model. The comparison of a pair of stored versions is kept in process
+(``VERSION_COMPARE_CACHE_SIZE`` pairs), so analysing more parts of the same
+new version does not extract and diff both files again.
+"""
+import difflib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import firestore, longdoc, vertex
+
+logger = logging.getLogger(__name__)
+
+MAX_CHANGES = 50
+SNIPPET_CHARS = 300
+
+
+def next_version(user_id: Optional[str], filename: str) -> Dict[str, Any]:
+    """Version fields for a new upload of ``filename``."""
+    previous = firestore.find_latest_version(user_id, filename) if user_id else None
+    if previous is None:
+        return {"version": 1, "previousVersionId": None}
+    return {"version": int(previous.get("version") or 1) + 1, "previousVersionId": previous["id"]}
+
+
+def _snippet(text: str) -> str:
+    return text if len(text) <= SNIPPET_CHARS else text[:SNIPPET_CHARS].rstrip() + "…"
+
+
+def diff(previous_text: str, text: str) -> List[Dict[str, str]]:
+    """Added, removed and modified paragraphs between two versions, in document order."""
+    before, after = longdoc._blocks(previous_text), longdoc._blocks(text)
+    matcher = difflib.SequenceMatcher(None, [" ".join(b.split()) for b in before],
+                                      [" ".join(b.split()) for b in after], autojunk=False)
+    changes: List[Dict[str, str]] = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        old, new = before[i1:i2], after[j1:j2]
+        # Pair replaced paragraphs as modifications; any surplus was added or removed
+        for k in range(max(len(old), len(new))):
+            if k < len(old) and k < len(new):
+                changes.append({"type": "modified", "before": _snippet(old[k]), "after": _snippet(new[k])})
+            elif k < len(new):
+                changes.append({"type": "added", "after": _snippet(new[k])})
+            else:
+                changes.append({"type": "removed", "before": _snippet(old[k])})
+    return changes
+
+
+# (previous path, previous type, path, type) -> (text, changes, sections, unchanged sections).
+# Stored files never change under a path, so an entry stays valid.
+_Comparison = Tuple[str, List[Dict[str, str]], int, int]
+_compared: "OrderedDict[Tuple[str, str, str, str], _Comparison]" = OrderedDict()
+_compared_lock = threading.Lock()
+
+
+def _cache_size() -> int:
+    return int(os.getenv("VERSION_COMPARE_CACHE_SIZE", "32"))
+
+
+def _remember(key: Tuple[str, str, str, str], comparison: _Comparison) -> None:
+    with _compared_lock:
+        _compared[key] = comparison
+        _compared.move_to_end(key)
+        while len(_compared) > _cache_size():
+            _compared.popitem(last=False)
+
+
+def _recall(key: Tuple[str, str, str, str]) -> Optional[_Comparison]:
+    with _compared_lock:
+        comparison = _compared.get(key)
+        if comparison is not None:
+            _compared.move_to_end(key)
+        return comparison
+
+
+def reset() -> None:
+    with _compared_lock:
+        _compared.clear()
+
+
+def _compare_texts(previous: Dict[str, Any], document: Dict[str, Any], text: Optional[str]) -> Optional[_Comparison]:
+    key = (previous.get("gcsPath") or "", previous.get("contentType") or "",
+           document.get("gcsPath") or "", document.get("contentType") or "")
+    comparison = _recall(key)
+    if comparison is not None:
+        return comparison
+    previous_text = longdoc.extract(key[0], previous.get("contentType"))
+    current_text = text or longdoc.extract(key[2], document.get("contentType"))
+    if not previous_text or not current_text:
+        return None
+    sections = longdoc.split_sections(current_text)
+    previous_keys = {longdoc.section_key(s) for s in longdoc.split_sections(previous_text)}
+    unchanged = sum(1 for s in sections if longdoc.section_key(s) in previous_keys)
+    comparison = (current_text, diff(previous_text, current_text), len(sections), unchanged)
+    _remember(key, comparison)
+    return comparison
+
+
+def compare(document: Dict[str, Any], text: Optional[str]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Text to analyse by sections and, for a new version, what changed since the previous one.
+
+    ``text`` is the long-document text already extracted (or None). Returns
+    it unchanged, with no change report, for first versions and whenever
+    either version's text cannot be extracted.
+    """
+    previous_id = document.get("previousVersionId")
+    if not previous_id or not vertex._has_backend("model"):
+        return text, None
+    try:
+        # Versions are only linked within one owner's uploads
+        previous = firestore.get_document(document.get("userId"), previous_id)
+    except PermissionError:
+        return text, None
+    comparison = _compare_texts(previous, document, text)
+    if comparison is None:
+        return text, None
+
+    current_text, changes, sections_total, unchanged = comparison
+    report = {
+        "version": int(document.get("version") or 1),
+        "previous_version_id": previous_id,
+        "sections_total": sections_total,
+        "sections_unchanged": unchanged,
+        "changes": changes[:MAX_CHANGES],
+        "changes_total": len(changes),
+    }
+    return current_text, report
@@ -1,43 +1,81 @@
+import asyncio
 import base64
+import contextlib
 import json
+import logging
 import os
-from typing import Dict, List, Tuple, Optional
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Tuple, Optional
 import urllib
 
-import vertexai
-from vertexai.generative_models import GenerativeModel, Part
-from . import gcs as gcs_service
-from google.cloud import speech_v1 as speech
-from google.cloud import texttospeech_v1 as tts
+from . import admission, blobcache, metrics, resilience, routing, singleflight, tokens
+
+logger = logging.getLogger(__name__)
+
+# The Vertex, Speech and TTS SDKs take seconds to import, so they are loaded on
+# first use (or by the warmup endpoint) rather than when Django starts.
+if TYPE_CHECKING:
+    from vertexai.generative_models import GenerativeModel, Part
+
+
+def _speech():
+    from google.cloud import speech_v1  # type: ignore
+
+    return speech_v1
+
+
+def _tts():
+    from google.cloud import texttospeech_v1  # type: ignore
+
+    return texttospeech_v1
 
 
 def _has_gcp() -> bool:
     return bool(os.getenv("GCP_PROJECT_ID"))
 
 
+# Stand-ins for the Google clients (benchmark fakes, record/replay); see install_backends()
+_backends: Dict[str, object] = {}
+
+
+def install_backends(model=None, speech_client=None, tts_client=None) -> None:
+    """Route model, STT and TTS calls to the given objects instead of Google clients.
+
+    The objects mirror the SDK surface used here: ``generate_content`` (and
+    ``generate_content_async``) for the model, ``recognize`` and
+    ``synthesize_speech`` for the speech clients. Call with no arguments to
+    restore the defaults.
+    """
+    _backends.clear()
+    for name, obj in (("model", model), ("speech", speech_client), ("tts", tts_client)):
+        if obj is not None:
+            _backends[name] = obj
+
+
+def _has_backend(kind: str) -> bool:
+    return kind in _backends or _has_gcp()
+
+
 def reset_model_cache():
     """Reset the model cache to force reinitialization"""
-    global _model, _model_initialized
-    _model = None
-    _model_initialized = False
+    global _vertex_initialized
+    _models.clear()
+    _vertex_initialized = False
 
 
 def _ensure_credentials():
     """Check that service account credentials are available (but don't set as default)"""
     creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
     if creds_path and os.path.exists(creds_path):
-        import logging
-        logger = logging.getLogger(__name__)
         logger.info(f"🔧 Service account credentials available: {creds_path}")
     else:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"❌ Credentials not found: {creds_path}")
 
 EXPECTED_SERVICE_ACCOUNT_EMAIL = "legal-service-acc@spry-shade-471512-s6.iam.gserviceaccount.com"
 
-_model: Optional[GenerativeModel] = None
-_model_initialized: bool = False
+# Verified models by name; see routing for which task uses which model
+_models: Dict[str, "GenerativeModel"] = {}
+_vertex_initialized: bool = False
 
 
 def _load_sa_credentials():
@@ -60,28 +98,27 @@ def _load_sa_credentials():
     return credentials
 
 
-def _get_model() -> GenerativeModel:
-    global _model, _model_initialized
-    
-    # Always try to reinitialize if there was a previous failure
-    if _model is not None and _model_initialized:
-        try:
-            # Test if the model is still working
-            test_response = _model.generate_content("test")
-            return _model
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"⚠️ Cached model failed, reinitializing: {str(e)}")
-            _model = None
-            _model_initialized = False
-    
-    if _model is not None:
-        return _model
-        
+def _get_model(name: Optional[str] = None) -> "GenerativeModel":
+    if "model" in _backends:
+        backend = _backends["model"]
+        # Backends that care which model was routed to expose for_model()
+        for_model = getattr(backend, "for_model", None)
+        return for_model(name) if name and for_model else backend  # type: ignore[return-value]
+    return _live_model(name)
+
+
+def _live_model(name: Optional[str] = None) -> "GenerativeModel":
+    """The named Vertex model (default ``VERTEX_MODEL``), initialized on first use; ignores installed backends."""
+    global _vertex_initialized
+
+    model_name = name or routing.default_model()
+    # A cached model that starts failing is reset by resilience.call's refresh hook
+    cached = _models.get(model_name)
+    if cached is not None:
+        return cached
+
     project = os.getenv("GCP_PROJECT_ID")
     location = os.getenv("VERTEX_LOCATION", "us-central1")
-    model_name = os.getenv("VERTEX_MODEL", "gemini-2.5-pro")
     
     if not project:
         raise ValueError("❌ GCP_PROJECT_ID environment variable is not set")
@@ -95,51 +132,52 @@ def _get_model() -> GenerativeModel:
         )
     
     try:
-        import logging
-        from google.oauth2 import service_account
-        
-        logger = logging.getLogger(__name__)
+        import vertexai
+        from vertexai.generative_models import GenerativeModel
+
         logger.info(f"🔍 Initializing Vertex AI with project: {project}, location: {location}")
         logger.info(f"🔧 Using model: {model_name}")
         
-        # Initialize Vertex AI with service account credentials
-        try:
-            # Load credentials from file with explicit scopes and enforce expected SA email
-            credentials = _load_sa_credentials()
-            
-            # Clear any existing Vertex AI initialization
+        # Initialize Vertex AI with service account credentials (once for all models)
+        if not _vertex_initialized:
             try:
-                vertexai.uninit()
-            except:
-                pass
+                # Load credentials from file with explicit scopes and enforce expected SA email
+                credentials = _load_sa_credentials()
             
-            # Initialize Vertex AI with explicit credentials (no default environment setting)
-            vertexai.init(
-                project=project,
-                location=location,
-                credentials=credentials
-            )
+                # Clear any existing Vertex AI initialization
+                try:
+                    vertexai.uninit()
+                except:
+                    pass
             
-            logger.info("✅ Successfully initialized Vertex AI with explicit service account")
-            logger.info(f"✅ Using service account: {credentials.service_account_email}")
-            logger.info("✅ Vertex AI initialized without setting default credentials")
-        except Exception as init_error:
-            logger.error(f"❌ Failed to initialize Vertex AI: {str(init_error)}")
-            raise
+                # Initialize Vertex AI with explicit credentials (no default environment setting)
+                vertexai.init(
+                    project=project,
+                    location=location,
+                    credentials=credentials
+                )
+            
+                logger.info("✅ Successfully initialized Vertex AI with explicit service account")
+                logger.info(f"✅ Using service account: {credentials.service_account_email}")
+                logger.info("✅ Vertex AI initialized without setting default credentials")
+                _vertex_initialized = True
+            except Exception as init_error:
+                logger.error(f"❌ Failed to initialize Vertex AI: {str(init_error)}")
+                raise
         
         # Test model access
         try:
             logger.info(f"🔍 Attempting to access model: {model_name}")
             # Create model with explicit credentials to ensure it uses the right service account
-            _model = GenerativeModel(model_name)
+            model = GenerativeModel(model_name)
             # Test with a simple prompt to verify model access
             test_prompt = "Hello, can you hear me?"
-            response = _model.generate_content(test_prompt)
+            response = model.generate_content(test_prompt)
             if not getattr(response, "text", "").strip():
                 logger.warning("⚠️ Model responded with empty content")
             logger.info("✅ Successfully connected to model and received response")
-            _model_initialized = True
-            return _model
+            _models[model_name] = model
+            return model
             
         except Exception as model_error:
             logger.error(f"❌ Failed to access model {model_name}: {str(model_error)}")
@@ -173,6 +211,100 @@ def _get_model() -> GenerativeModel:
         raise
 
 
+def _observed(task: Optional[str], model_name: str, started: float, exc: Optional[BaseException] = None) -> None:
+    ok = exc is None or resilience.classify(exc) != resilience.RETRY
+    routing.get_router().observe(task, model_name, time.perf_counter() - started, ok)
+
+
+def _generate(parts, op: str):
+    """Call the routed model while holding a scheduled slot, retrying transient failures."""
+    task = routing.task_for(op)
+    model_name = routing.get_router().choose(task)
+    parts = tokens.fit(op, parts, lambda: _get_model(model_name))
+
+    def attempt():
+        model = _get_model(model_name)
+        with admission.model_slot():
+            started = time.perf_counter()
+            try:
+                resp = model.generate_content(parts)
+            except Exception as e:
+                _observed(task, model_name, started, e)
+                raise
+            _observed(task, model_name, started)
+            return resp
+
+    started = time.perf_counter()
+    with metrics.stage(op):
+        resp = resilience.call(op, attempt, on_refresh=reset_model_cache)
+    metrics.record_usage(op, resp)
+    tokens.record(resp, time.perf_counter() - started)
+    return resp
+
+
+def _flight_key(op: str, *inputs: Any) -> str:
+    """Single-flight key: the operation, the routed model and what the answer depends on.
+
+    Uploads are stored by content hash, so a document's URI identifies its content.
+    """
+    return singleflight.fingerprint(op, routing.get_router().current(routing.task_for(op)), *inputs)
+
+
+def _question_key(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def _chunk_text(resp) -> str:
+    try:
+        return getattr(resp, "text", "") or ""
+    except ValueError:
+        # Stream chunks carrying only a finish reason or usage raise on .text
+        return ""
+
+
+def _stream(parts, op: str) -> Iterator[str]:
+    """Text of a routed model call, chunk by chunk as it is generated.
+
+    Like ``_generate``, but the model slot is held until the stream ends.
+    Failures before the first chunk are retried; later ones propagate.
+    """
+    task = routing.task_for(op)
+    model_name = routing.get_router().choose(task)
+    parts = tokens.fit(op, parts, lambda: _get_model(model_name))
+
+    def attempt():
+        model = _get_model(model_name)
+        slot = contextlib.ExitStack()
+        slot.enter_context(admission.model_slot())
+        attempt_started = time.perf_counter()
+        try:
+            chunks = iter(model.generate_content(parts, stream=True))
+            first = next(chunks, None)
+        except Exception as e:
+            slot.close()
+            _observed(task, model_name, attempt_started, e)
+            raise
+        return slot, attempt_started, first, chunks
+
+    started = time.perf_counter()
+    with metrics.stage(op):
+        slot, attempt_started, last, chunks = resilience.call(op, attempt, on_refresh=reset_model_cache)
+        with slot:
+            try:
+                if last is not None:
+                    yield _chunk_text(last)
+                for chunk in chunks:
+                    last = chunk
+                    yield _chunk_text(chunk)
+            except Exception as e:
+                _observed(task, model_name, attempt_started, e)
+                raise
+            _observed(task, model_name, attempt_started)
+    # The final chunk carries the usage for the whole response
+    metrics.record_usage(op, last)
+    tokens.record(last, time.perf_counter() - started)
+
+
 def _get_mime_type(gcs_uri: str) -> str:
     """Determine MIME type based on file extension."""
     uri_lower = gcs_uri.lower()
@@ -193,12 +325,14 @@ def _get_mime_type(gcs_uri: str) -> str:
     else:
         return "application/octet-stream"  # Default to binary
 
-def _part_from_gcs_uri(gcs_uri: str) -> Part:
+def _part_from_gcs_uri(gcs_uri: str) -> "Part":
     """Create a Part pointing to GCS using Vertex service account.
     
     Automatically fixes missing bucket prefix and URL-encodes special characters
     including spaces and folder names like 'None'.
     """
+    from vertexai.generative_models import Part
+
     mime_type = _get_mime_type(gcs_uri)
     use_uri = os.getenv("VERTEX_USE_URI", "true").lower() != "false"
 
@@ -214,9 +348,11 @@ def _part_from_gcs_uri(gcs_uri: str) -> Part:
     if use_uri:
         return Part.from_uri(gcs_uri, mime_type=mime_type)
 
-    # fallback: embed bytes (not recommended if large)
-    data = gcs_service.get_blob_bytes(gcs_uri)
-    return Part.from_data(mime_type=mime_type, data=data)
+    # fallback: embed bytes (not recommended if large); hot documents come from the local blob cache.
+    # The request proto only accepts bytes (not a memoryview), so one copy is unavoidable: read the
+    # cached file straight into it rather than through a memory map.
+    with blobcache.opened(gcs_uri) as f:
+        return Part.from_data(mime_type=mime_type, data=f.read())
 
 
 def _parse_json_array(text: str) -> List[Dict[str, str]]:
@@ -242,190 +378,567 @@ def _parse_json_array(text: str) -> List[Dict[str, str]]:
             return []
     return []
 
+SUMMARY_PROMPT = (
+    "You are a legal assistant. Read the attached file and provide a concise 3-line summary "
+    "in plain language. Focus on obligations, fees, and important dates."
+)
+RISKS_PROMPT = (
+    "Identify risky clauses from the attached legal document."
+    " Return STRICT JSON array of objects with keys: clause, risk (Low|Medium|High), explanation."
+    " Output ONLY the JSON array, no extra commentary. Keep at most 6 items."
+)
+RISK_CLAUSES_PROMPT = (
+    "Below are clauses selected from a legal document, each starting with its section reference in brackets."
+    " Identify the risky ones. Return STRICT JSON array of objects with keys: clause (start it with the"
+    " reference, e.g. \"[4.2] Late payment fee\"), risk (Low|Medium|High), explanation."
+    " Output ONLY the JSON array, no extra commentary. Keep at most 6 items."
+)
+GLOSSARY_PROMPT = (
+    "From the attached document, extract up to 10 domain-specific legal terms that may be confusing."
+    " Return STRICT JSON array with objects {term, definition} in plain language."
+    " Output ONLY the JSON array, no extra commentary."
+)
+DEFINE_TERMS_PROMPT = (
+    "Below are terms found in a legal document, each with a sentence that uses it. For each term that a reader"
+    " without legal training may find confusing, give a one-sentence definition in plain language; skip ordinary"
+    " words and the names of parties, places and products. Return STRICT JSON array of objects {term, definition,"
+    " general}, where general is true when the definition holds in other documents too and false when it is"
+    " particular to this one. Output ONLY the JSON array, no extra commentary."
+)
+TRANSLATE_PROMPT = (
+    "Translate the string values of this JSON object, the analysis of a legal document, into {language}."
+    " Keep the keys, the structure and the order of list items; leave glossary terms and risk levels"
+    " (Low|Medium|High) as they are. Output ONLY the JSON object, no extra commentary.\n\n{analysis}"
+)
+ANSWER_SYSTEM_PROMPT = (
+    "You are a helpful legal assistant. Answer based on the provided document if present. "
+    "Be concise and non-technical. If unsure, say what to check in the document."
+)
+
+
+def _response_text(resp, default: str = "") -> str:
+    return (getattr(resp, "text", "") or default).strip()
+
+
+MAX_RISKS = 6
+MAX_TERMS = 10
+
+
+def _risk_item(item: Any) -> Optional[Dict[str, str]]:
+    if not isinstance(item, dict):
+        return None
+    return {
+        "clause": str(item.get("clause", "")),
+        "risk": str(item.get("risk", "")),
+        "explanation": str(item.get("explanation", "")),
+    }
+
+
+def _glossary_item(item: Any) -> Optional[Dict[str, str]]:
+    if not isinstance(item, dict):
+        return None
+    return {"term": str(item.get("term", "")), "definition": str(item.get("definition", ""))}
+
+
+def _defined_item(item: Any) -> Optional[Dict[str, Any]]:
+    glossary_item = _glossary_item(item)
+    if glossary_item is None:
+        return None
+    return {**glossary_item, "general": item.get("general") is True}
+
+
+def _clean_risks(text: str) -> List[Dict[str, str]]:
+    cleaned = (_risk_item(item) for item in _parse_json_array(text)[:MAX_RISKS])
+    return [item for item in cleaned if item is not None]
+
+
+def _clean_glossary(text: str) -> List[Dict[str, str]]:
+    cleaned = (_glossary_item(item) for item in _parse_json_array(text)[:MAX_TERMS])
+    return [item for item in cleaned if item is not None]
+
+
+def _parse_json_object(text: str) -> Dict[str, Any]:
+    """Best-effort parse for a JSON object in model output; empty when there is none."""
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _translated_items(translated: Any, source: List[Dict[str, str]], clean, keep: str) -> List[Dict[str, str]]:
+    # Item by item, falling back to the English item; ``keep`` is not translated
+    translated = translated if isinstance(translated, list) else []
+    items = []
+    for i, original in enumerate(source):
+        item = clean(translated[i]) if i < len(translated) else None
+        items.append({**item, keep: original.get(keep, "")} if item else original)
+    return items
+
+
+def _clean_translation(text: str, source: Dict[str, Any]) -> Dict[str, Any]:
+    data = _parse_json_object(text)
+    if not data:
+        raise ValueError("Model returned no translation")
+    out: Dict[str, Any] = {}
+    if "summary" in source:
+        summary = data.get("summary")
+        out["summary"] = summary.strip() if isinstance(summary, str) and summary.strip() else source["summary"]
+    if "risks" in source:
+        out["risks"] = _translated_items(data.get("risks"), source["risks"], _risk_item, "risk")
+    if "glossary" in source:
+        out["glossary"] = _translated_items(data.get("glossary"), source["glossary"], _glossary_item, "term")
+    return out
+
+
+def _chat_parts(messages: List[Dict[str, str]]) -> List[str]:
+    # Simple conversation stitching. The latest turn is its own part so the
+    # token budget can trim older turns without touching the question.
+    convo = []
+    for m in messages[-12:]:  # last 12 turns
+        role = "User" if m.get("role") == "user" else "Assistant"
+        convo.append(f"{role}: {m.get('content','')}")
+    if not convo:
+        return ["Assistant:"]
+    history, latest = convo[:-1], convo[-1] + "\nAssistant:"
+    return ["\n".join(history) + "\n", latest] if history else [latest]
+
+
+def _language_code(language: str) -> str:
+    return "en-US" if language == "en" else language
+
+
 def summarize_document(gcs_uri: str, language: str = "en") -> str:
-    if not _has_gcp():
+    if not _has_backend("model"):
         return "This is a placeholder summary generated in development mode."
-    
-    try:
-        model = _get_model()
-        part = _part_from_gcs_uri(gcs_uri)
-        prompt = (
-            "You are a legal assistant. Read the attached file and provide a concise 3-line summary "
-            "in plain language. Focus on obligations, fees, and important dates."
-        )
-        parts: List[object] = [part, prompt]
-        resp = model.generate_content(parts)
-        return (getattr(resp, "text", "") or "").strip()
-    except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.error(f"Failed to summarize document from {gcs_uri}: {str(e)}")
-        # If it's a credential error, try to reset and retry once
-        if "403" in str(e) and "service-382380612989" in str(e):
-            logger.warning("🔄 Detected credential issue, forcing model reset...")
-            # Force reset everything
-            reset_model_cache()
-            # Reset model cache to force reinitialization
-            try:
-                model = _get_model()
-                resp = model.generate_content(parts)
-                return (getattr(resp, "text", "") or "").strip()
-            except Exception as retry_error:
-                logger.error(f"Retry failed: {str(retry_error)}")
-        return f"Unable to analyze document. Error: {str(e)}"
+    op = "vertex.summarize_document"
+
+    def run() -> str:
+        parts: List[object] = [_part_from_gcs_uri(gcs_uri), SUMMARY_PROMPT]
+        return _response_text(_generate(parts, op))
+
+    return singleflight.do(_flight_key(op, gcs_uri, language), run)
 
 
 def analyze_risks(gcs_uri: str) -> List[Dict[str, str]]:
-    if not _has_gcp():
+    if not _has_backend("model"):
         return [
             {"clause": "Late payment fee", "risk": "High", "explanation": "Potential heavy penalties for delays."}
         ]
-    
-    try:
-        # Ensure credentials are set before processing
-        _ensure_credentials()
-        model = _get_model()
-        part = _part_from_gcs_uri(gcs_uri)
-        prompt = (
-            "Identify risky clauses from the attached legal document."
-            " Return STRICT JSON array of objects with keys: clause, risk (Low|Medium|High), explanation."
-            " Output ONLY the JSON array, no extra commentary. Keep at most 6 items."
-        )
-        parts = [part, prompt]
-        resp = model.generate_content(parts)
-        text = getattr(resp, "text", "") or "[]"
-        arr = _parse_json_array(text)
-        cleaned: List[Dict[str, str]] = []
-        for item in arr[:6]:
-            if isinstance(item, dict):
-                cleaned.append({
-                    "clause": str(item.get("clause", "")),
-                    "risk": str(item.get("risk", "")),
-                    "explanation": str(item.get("explanation", "")),
-                })
-        return cleaned
-    except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.error(f"Failed to analyze risks from {gcs_uri}: {str(e)}")
-        return [{"clause": "Document access error", "risk": "Unknown", "explanation": f"Unable to analyze document: {str(e)}"}]
+    op = "vertex.analyze_risks"
+
+    def run() -> List[Dict[str, str]]:
+        parts = [_part_from_gcs_uri(gcs_uri), RISKS_PROMPT]
+        return _clean_risks(_response_text(_generate(parts, op), "[]"))
+
+    return singleflight.do(_flight_key(op, gcs_uri), run)
+
+
+def analyze_risk_clauses(clauses_text: str) -> List[Dict[str, str]]:
+    """``analyze_risks`` over candidate clauses picked from the document's text (see ``clauses``)."""
+    if not _has_backend("model"):
+        return analyze_risks("")
+    op = "vertex.analyze_risk_clauses"
+
+    def run() -> List[Dict[str, str]]:
+        return _clean_risks(_response_text(_generate([RISK_CLAUSES_PROMPT, clauses_text], op), "[]"))
+
+    return singleflight.do(_flight_key(op, clauses_text), run)
 
 
 def extract_glossary(gcs_uri: str, language: str = "en") -> List[Dict[str, str]]:
-    if not _has_gcp():
+    if not _has_backend("model"):
         return [
             {"term": "EMI", "definition": "Equated Monthly Installment."},
             {"term": "Indemnity", "definition": "Security against legal liability."},
         ]
-    
-    try:
-        # Ensure credentials are set before processing
-        _ensure_credentials()
-        model = _get_model()
-        part = _part_from_gcs_uri(gcs_uri)
-        prompt = (
-            "From the attached document, extract up to 10 domain-specific legal terms that may be confusing."
-            " Return STRICT JSON array with objects {term, definition} in plain language."
-            " Output ONLY the JSON array, no extra commentary."
-        )
-        parts = [part, prompt]
-        resp = model.generate_content(parts)
-        text = getattr(resp, "text", "") or "[]"
-        arr = _parse_json_array(text)
-        out: List[Dict[str, str]] = []
-        for i in arr[:10]:
-            if isinstance(i, dict):
-                out.append({"term": str(i.get("term", "")), "definition": str(i.get("definition", ""))})
-        return out
-    except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.error(f"Failed to extract glossary from {gcs_uri}: {str(e)}")
-        return [{"term": "Document access error", "definition": f"Unable to extract terms: {str(e)}"}]
+    op = "vertex.extract_glossary"
+
+    def run() -> List[Dict[str, str]]:
+        parts = [_part_from_gcs_uri(gcs_uri), GLOSSARY_PROMPT]
+        return _clean_glossary(_response_text(_generate(parts, op), "[]"))
+
+    return singleflight.do(_flight_key(op, gcs_uri, language), run)
+
+
+def define_terms(terms_text: str) -> List[Dict[str, Any]]:
+    """Definitions of the candidate terms the local dictionary does not know (see ``glossary``)."""
+    if not _has_backend("model"):
+        return []
+    op = "vertex.define_terms"
+
+    def run() -> List[Dict[str, Any]]:
+        items = _parse_json_array(_response_text(_generate([DEFINE_TERMS_PROMPT, terms_text], op), "[]"))
+        return [item for item in map(_defined_item, items) if item is not None and item["definition"]]
+
+    return singleflight.do(_flight_key(op, terms_text), run)
 
 
 def answer_question(context_uri: str, question: str, language: str = "en") -> str:
-    if not _has_gcp():
+    if not _has_backend("model"):
         return f"For question: '{question}', please review repayment terms and late fee clauses."
-    model = _get_model()
-    system = (
-        "You are a helpful legal assistant. Answer based on the provided document if present. "
-        "Be concise and non-technical. If unsure, say what to check in the document."
-    )
-    parts: List[object] = []
-    if context_uri:
-        parts.append(_part_from_gcs_uri(context_uri))
-    parts.extend([system, f"Question: {question}"])
-    resp = model.generate_content(parts)
-    return (getattr(resp, "text", "") or "").strip()
+    op = "vertex.answer_question"
 
+    def run() -> str:
+        parts: List[object] = []
+        if context_uri:
+            parts.append(_part_from_gcs_uri(context_uri))
+        parts.extend([ANSWER_SYSTEM_PROMPT, f"Question: {question}"])
+        return _response_text(_generate(parts, op))
 
-def stt_transcribe(audio_base64: str, language: str = "en") -> str:
-    if not _has_gcp():
-        return "What happens if I don't pay my EMI?"
-    # Ensure we use the expected service account for STT
-    credentials = _load_sa_credentials()
-    client = speech.SpeechClient(credentials=credentials)
-    audio_bytes = base64.b64decode(audio_base64)
-    audio = speech.RecognitionAudio(content=audio_bytes)
+    return singleflight.do(_flight_key(op, context_uri, _question_key(question), language), run)
+
+
+def translate_analysis(parts: Dict[str, Any], language: str) -> Dict[str, Any]:
+    """``parts`` of a finished English analysis (summary/risks/glossary) translated into ``language``.
+
+    A small text-only call on the translate route, instead of reading the
+    document again. Glossary terms and risk levels stay as they are.
+    """
+    if not _has_backend("model"):
+        return dict(parts)
+    op = "vertex.translate_analysis"
+    prompt = TRANSLATE_PROMPT.format(language=language, analysis=json.dumps(parts, ensure_ascii=False))
+
+    def run() -> Dict[str, Any]:
+        return _clean_translation(_response_text(_generate([prompt], op)), parts)
+
+    return singleflight.do(_flight_key(op, parts, language), run)
+
+
+# Sync Speech/TTS clients are thread-safe and reused for the life of the process
+_clients: Dict[str, object] = {}
+
+
+def _speech_client():
+    if "speech" in _backends:
+        return _backends["speech"]
+    return _live_speech_client()
+
+
+def _live_speech_client():
+    client = _clients.get("speech")
+    if client is None:
+        # Ensure we use the expected service account for STT
+        client = _clients["speech"] = _speech().SpeechClient(credentials=_load_sa_credentials())
+    return client
+
+
+def _tts_client():
+    if "tts" in _backends:
+        return _backends["tts"]
+    return _live_tts_client()
+
+
+def _live_tts_client():
+    client = _clients.get("tts")
+    if client is None:
+        # Ensure we use the expected service account for TTS
+        client = _clients["tts"] = _tts().TextToSpeechClient(credentials=_load_sa_credentials())
+    return client
+
+
+def _recognize_request(audio_base64: str, language: str):
+    speech = _speech()
+    audio = speech.RecognitionAudio(content=base64.b64decode(audio_base64))
     config = speech.RecognitionConfig(
         encoding=speech.RecognitionConfig.AudioEncoding.WEBM_OPUS,
-        language_code="en-US" if language == "en" else language,
+        language_code=_language_code(language),
         enable_automatic_punctuation=True,
     )
-    response = client.recognize(config=config, audio=audio)
+    return config, audio
+
+
+def _transcript(response) -> str:
     for result in response.results:
         if result.alternatives:
             return result.alternatives[0].transcript
     return ""
 
 
-def tts_synthesize(text: str, language: str = "en") -> str:
-    # Ensure we use the expected service account for TTS
-    credentials = _load_sa_credentials()
-    client = tts.TextToSpeechClient(credentials=credentials)
+def _synthesis_request(text: str, language: str):
+    tts = _tts()
     input_text = tts.SynthesisInput(text=text)
     voice = tts.VoiceSelectionParams(
-        language_code="en-US" if language == "en" else language,
+        language_code=_language_code(language),
         ssml_gender=tts.SsmlVoiceGender.NEUTRAL,
     )
     audio_config = tts.AudioConfig(audio_encoding=tts.AudioEncoding.MP3)
-    resp = client.synthesize_speech(input=input_text, voice=voice, audio_config=audio_config)
-    return base64.b64encode(resp.audio_content).decode("utf-8")
+    return input_text, voice, audio_config
+
+
+def stt_transcribe(audio_base64: str, language: str = "en") -> str:
+    if not _has_backend("speech"):
+        return "What happens if I don't pay my EMI?"
+    client = _speech_client()
+    config, audio = _recognize_request(audio_base64, language)
+
+    def attempt():
+        with admission.model_slot():
+            return client.recognize(config=config, audio=audio)
+
+    metrics.record_bytes("speech.recognize", len(audio.content), "out")
+    with metrics.stage("speech.recognize"):
+        return _transcript(resilience.call("speech.recognize", attempt))
+
+
+def tts_synthesize(text: str, language: str = "en") -> str:
+    if not _has_backend("tts"):
+        return ""
+    client = _tts_client()
+    input_text, voice, audio_config = _synthesis_request(text, language)
+
+    def attempt():
+        with admission.model_slot():
+            return client.synthesize_speech(input=input_text, voice=voice, audio_config=audio_config)
+
+    def run() -> str:
+        with metrics.stage("tts.synthesize_speech"):
+            resp = resilience.call("tts.synthesize_speech", attempt)
+        metrics.record_bytes("tts.synthesize_speech", len(resp.audio_content), "in")
+        return base64.b64encode(resp.audio_content).decode("utf-8")
+
+    # The same answer read out for several listeners is synthesized once
+    return singleflight.do(_flight_key("tts.synthesize_speech", text, language), run)
 
 
 def chat_with_gemini(messages: List[Dict[str, str]], context_uri: Optional[str] = None) -> str:
-    if not _has_gcp():
+    if not _has_backend("model"):
         last = messages[-1]["content"] if messages else ""
         return f"[Dev Chat] You said: {last}."
-    
-    try:
-        model = _get_model()
+    op = "vertex.chat_with_gemini"
+
+    def run() -> str:
         parts: List[object] = []
         if context_uri:
             parts.append(_part_from_gcs_uri(context_uri))
-        # Simple conversation stitching
-        convo = []
-        for m in messages[-12:]:  # last 12 turns
-            role = "User" if m.get("role") == "user" else "Assistant"
-            convo.append(f"{role}: {m.get('content','')}")
-        parts.append("\n".join(convo) + "\nAssistant:")
-        resp = model.generate_content(parts)
-        return (getattr(resp, "text", "") or "").strip()
-    except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.error(f"Failed to chat with Gemini: {str(e)}")
-        # If it's a credential error, try to reset and retry once
-        if "403" in str(e) and "service-382380612989" in str(e):
-            logger.warning("🔄 Detected credential issue, forcing model reset...")
-            # Force reset everything
-            reset_model_cache()
-            # Reset model cache to force reinitialization
+        parts.extend(_chat_parts(messages))
+        return _response_text(_generate(parts, op))
+
+    return singleflight.do(_flight_key(op, context_uri, messages), run)
+
+
+# Async variants for the ASGI views. They share prompts and parsing with the
+# sync functions above but await the SDK's async generate/recognize/synthesize
+# calls, so an event loop can keep many model calls in flight at once.
+
+async def _aget_model(name: Optional[str] = None) -> "GenerativeModel":
+    if "model" in _backends:
+        return _get_model(name)
+    cached = _models.get(name or routing.default_model())
+    if cached is not None:
+        return cached
+    # First use initializes Vertex, which is blocking; keep it off the event loop
+    return await asyncio.to_thread(_get_model, name)
+
+
+async def _agenerate(parts, op: str):
+    task = routing.task_for(op)
+    model_name = routing.get_router().choose(task)
+    parts = await tokens.afit(op, parts, lambda: _aget_model(model_name))
+
+    async def attempt():
+        model = await _aget_model(model_name)
+        async with admission.amodel_slot():
+            started = time.perf_counter()
             try:
-                model = _get_model()
-                resp = model.generate_content(parts)
-                return (getattr(resp, "text", "") or "").strip()
-            except Exception as retry_error:
-                logger.error(f"Retry failed: {str(retry_error)}")
-        return f"Sorry, I'm having trouble responding right now. Error: {str(e)}"
+                resp = await model.generate_content_async(parts)
+            except Exception as e:
+                _observed(task, model_name, started, e)
+                raise
+            _observed(task, model_name, started)
+            return resp
+
+    started = time.perf_counter()
+    with metrics.stage(op):
+        resp = await resilience.acall(op, attempt, on_refresh=reset_model_cache)
+    metrics.record_usage(op, resp)
+    tokens.record(resp, time.perf_counter() - started)
+    return resp
+
+
+async def _astream(parts, op: str) -> AsyncIterator[str]:
+    """Async version of ``_stream``."""
+    task = routing.task_for(op)
+    model_name = routing.get_router().choose(task)
+    parts = await tokens.afit(op, parts, lambda: _aget_model(model_name))
+
+    async def attempt():
+        model = await _aget_model(model_name)
+        slot = contextlib.AsyncExitStack()
+        await slot.enter_async_context(admission.amodel_slot())
+        attempt_started = time.perf_counter()
+        try:
+            chunks = (await model.generate_content_async(parts, stream=True)).__aiter__()
+            first = await anext(chunks, None)
+        except Exception as e:
+            await slot.aclose()
+            _observed(task, model_name, attempt_started, e)
+            raise
+        return slot, attempt_started, first, chunks
+
+    started = time.perf_counter()
+    with metrics.stage(op):
+        slot, attempt_started, last, chunks = await resilience.acall(op, attempt, on_refresh=reset_model_cache)
+        async with slot:
+            try:
+                if last is not None:
+                    yield _chunk_text(last)
+                async for chunk in chunks:
+                    last = chunk
+                    yield _chunk_text(chunk)
+            except Exception as e:
+                _observed(task, model_name, attempt_started, e)
+                raise
+            _observed(task, model_name, attempt_started)
+    metrics.record_usage(op, last)
+    tokens.record(last, time.perf_counter() - started)
+
+
+async def _apart_from_gcs_uri(gcs_uri: str) -> "Part":
+    if os.getenv("VERTEX_USE_URI", "true").lower() != "false":
+        return _part_from_gcs_uri(gcs_uri)
+    # Inline mode downloads the blob; storage has no async client
+    return await asyncio.to_thread(_part_from_gcs_uri, gcs_uri)
+
+
+async def summarize_document_async(gcs_uri: str, language: str = "en") -> str:
+    if not _has_backend("model"):
+        return summarize_document(gcs_uri, language)
+    op = "vertex.summarize_document"
+
+    async def run() -> str:
+        parts: List[object] = [await _apart_from_gcs_uri(gcs_uri), SUMMARY_PROMPT]
+        return _response_text(await _agenerate(parts, op))
+
+    return await singleflight.ado(_flight_key(op, gcs_uri, language), run)
+
+
+async def analyze_risks_async(gcs_uri: str) -> List[Dict[str, str]]:
+    if not _has_backend("model"):
+        return analyze_risks(gcs_uri)
+    op = "vertex.analyze_risks"
+
+    async def run() -> List[Dict[str, str]]:
+        parts = [await _apart_from_gcs_uri(gcs_uri), RISKS_PROMPT]
+        return _clean_risks(_response_text(await _agenerate(parts, op), "[]"))
+
+    return await singleflight.ado(_flight_key(op, gcs_uri), run)
+
+
+async def analyze_risk_clauses_async(clauses_text: str) -> List[Dict[str, str]]:
+    if not _has_backend("model"):
+        return analyze_risk_clauses(clauses_text)
+    op = "vertex.analyze_risk_clauses"
+
+    async def run() -> List[Dict[str, str]]:
+        return _clean_risks(_response_text(await _agenerate([RISK_CLAUSES_PROMPT, clauses_text], op), "[]"))
+
+    return await singleflight.ado(_flight_key(op, clauses_text), run)
+
+
+async def extract_glossary_async(gcs_uri: str, language: str = "en") -> List[Dict[str, str]]:
+    if not _has_backend("model"):
+        return extract_glossary(gcs_uri, language)
+    op = "vertex.extract_glossary"
+
+    async def run() -> List[Dict[str, str]]:
+        parts = [await _apart_from_gcs_uri(gcs_uri), GLOSSARY_PROMPT]
+        return _clean_glossary(_response_text(await _agenerate(parts, op), "[]"))
+
+    return await singleflight.ado(_flight_key(op, gcs_uri, language), run)
+
+
+async def define_terms_async(terms_text: str) -> List[Dict[str, Any]]:
+    if not _has_backend("model"):
+        return []
+    op = "vertex.define_terms"
+
+    async def run() -> List[Dict[str, Any]]:
+        items = _parse_json_array(_response_text(await _agenerate([DEFINE_TERMS_PROMPT, terms_text], op), "[]"))
+        return [item for item in map(_defined_item, items) if item is not None and item["definition"]]
+
+    return await singleflight.ado(_flight_key(op, terms_text), run)
+
+
+async def answer_question_async(context_uri: str, question: str, language: str = "en") -> str:
+    if not _has_backend("model"):
+        return answer_question(context_uri, question, language)
+    op = "vertex.answer_question"
+
+    async def run() -> str:
+        parts: List[object] = []
+        if context_uri:
+            parts.append(await _apart_from_gcs_uri(context_uri))
+        parts.extend([ANSWER_SYSTEM_PROMPT, f"Question: {question}"])
+        return _response_text(await _agenerate(parts, op))
+
+    return await singleflight.ado(_flight_key(op, context_uri, _question_key(question), language), run)
+
+
+async def chat_with_gemini_async(messages: List[Dict[str, str]], context_uri: Optional[str] = None) -> str:
+    if not _has_backend("model"):
+        return chat_with_gemini(messages, context_uri)
+    op = "vertex.chat_with_gemini"
+
+    async def run() -> str:
+        parts: List[object] = []
+        if context_uri:
+            parts.append(await _apart_from_gcs_uri(context_uri))
+        parts.extend(_chat_parts(messages))
+        return _response_text(await _agenerate(parts, op))
+
+    return await singleflight.ado(_flight_key(op, context_uri, messages), run)
+
+
+async def translate_analysis_async(parts: Dict[str, Any], language: str) -> Dict[str, Any]:
+    if not _has_backend("model"):
+        return translate_analysis(parts, language)
+    op = "vertex.translate_analysis"
+    prompt = TRANSLATE_PROMPT.format(language=language, analysis=json.dumps(parts, ensure_ascii=False))
+
+    async def run() -> Dict[str, Any]:
+        return _clean_translation(_response_text(await _agenerate([prompt], op)), parts)
+
+    return await singleflight.ado(_flight_key(op, parts, language), run)
+
+
+async def stt_transcribe_async(audio_base64: str, language: str = "en") -> str:
+    if not _has_backend("speech"):
+        return stt_transcribe(audio_base64, language)
+    if "speech" in _backends:
+        return await asyncio.to_thread(stt_transcribe, audio_base64, language)
+    client = _speech().SpeechAsyncClient(credentials=await asyncio.to_thread(_load_sa_credentials))
+    config, audio = _recognize_request(audio_base64, language)
+
+    async def attempt():
+        async with admission.amodel_slot():
+            return await client.recognize(config=config, audio=audio)
+
+    metrics.record_bytes("speech.recognize", len(audio.content), "out")
+    with metrics.stage("speech.recognize"):
+        return _transcript(await resilience.acall("speech.recognize", attempt))
+
+
+async def tts_synthesize_async(text: str, language: str = "en") -> str:
+    if not _has_backend("tts"):
+        return tts_synthesize(text, language)
+    if "tts" in _backends:
+        return await asyncio.to_thread(tts_synthesize, text, language)
+    client = _tts().TextToSpeechAsyncClient(credentials=await asyncio.to_thread(_load_sa_credentials))
+    input_text, voice, audio_config = _synthesis_request(text, language)
+
+    async def attempt():
+        async with admission.amodel_slot():
+            return await client.synthesize_speech(input=input_text, voice=voice, audio_config=audio_config)
+
+    async def run() -> str:
+        with metrics.stage("tts.synthesize_speech"):
+            resp = await resilience.acall("tts.synthesize_speech", attempt)
+        metrics.record_bytes("tts.synthesize_speech", len(resp.audio_content), "in")
+        return base64.b64encode(resp.audio_content).decode("utf-8")
+
+    return await singleflight.ado(_flight_key("tts.synthesize_speech", text, language), run)
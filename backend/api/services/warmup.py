@@ -0,0 +1,153 @@
+"""Pre-initialise Google clients so the first real request does not pay for it.
+
+The SDKs are imported lazily, which keeps Django's own startup fast, but the
+first request that needs Vertex, Speech, TTS, Storage or Firestore would then
+pay for the import, the credential load and the channel setup. ``run()`` does
+that work up front, for all components concurrently, and records how long
+each one took. It runs once, in a background thread started at boot with
+``WARMUP_ON_START=true`` or by the first ``/ready`` probe (point the Cloud
+Run startup probe at it); failed components are retried by that thread with
+backoff (``WARMUP_RETRY_S``), never by the probe. ``/ready`` only reports the
+stored state, so polling it costs nothing, however often anyone calls it.
+
+Without ``GCP_PROJECT_ID`` (local dev) only the SDK imports are warmed; no
+clients are built and no model call is made.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_result: Optional[Dict[str, Dict[str, object]]] = None
+_thread: Optional[threading.Thread] = None
+_thread_lock = threading.Lock()
+
+MAX_RETRY_S = 300.0
+
+
+def retry_seconds() -> float:
+    return float(os.getenv("WARMUP_RETRY_S", "30"))
+
+
+def _vertex() -> None:
+    from . import vertex
+
+    if os.getenv("GCP_PROJECT_ID"):
+        from . import routing
+
+        # Fallbacks too, so a switch under load does not also pay for a cold model
+        for name in routing.get_router().models():
+            vertex._get_model(name)
+    else:
+        import vertexai.generative_models  # noqa: F401
+
+
+def _speech() -> None:
+    from . import vertex
+
+    if os.getenv("GCP_PROJECT_ID"):
+        vertex._speech_client()
+    else:
+        vertex._speech()
+
+
+def _tts() -> None:
+    from . import vertex
+
+    if os.getenv("GCP_PROJECT_ID"):
+        vertex._tts_client()
+    else:
+        vertex._tts()
+
+
+def _storage() -> None:
+    from . import gcs
+
+    if gcs._use_gcp():
+        gcs.get_bucket()
+    else:
+        from google.cloud import storage  # type: ignore # noqa: F401
+
+
+def _firestore() -> None:
+    from . import firestore
+
+    firestore.get_db()
+
+
+def _auth() -> None:
+    from ..auth import _ensure_firebase_initialized
+
+    _ensure_firebase_initialized()
+
+
+COMPONENTS: Dict[str, Callable[[], None]] = {
+    "vertex": _vertex,
+    "speech": _speech,
+    "tts": _tts,
+    "storage": _storage,
+    "firestore": _firestore,
+    "auth": _auth,
+}
+
+
+def _timed(fn: Callable[[], None]) -> Dict[str, object]:
+    start = time.perf_counter()
+    try:
+        fn()
+        return {"ok": True, "seconds": round(time.perf_counter() - start, 3)}
+    except Exception as exc:
+        return {"ok": False, "seconds": round(time.perf_counter() - start, 3), "error": str(exc)}
+
+
+def run(force: bool = False) -> Dict[str, Dict[str, object]]:
+    """Warm every component once and return per-component timings.
+
+    Concurrent callers wait for the same run. A run with failures is retried
+    on the next call; a fully successful one is cached unless ``force``.
+    """
+    global _result
+    with _lock:
+        if _result is not None and not force and all(r["ok"] for r in _result.values()):
+            return _result
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(COMPONENTS), thread_name_prefix="warmup") as pool:
+            futures = {name: pool.submit(_timed, fn) for name, fn in COMPONENTS.items()}
+            _result = {name: future.result() for name, future in futures.items()}
+        for name, outcome in _result.items():
+            if not outcome["ok"]:
+                logger.warning(f"Warmup of {name} failed: {outcome['error']}")
+        logger.info(f"Warmup finished in {time.perf_counter() - start:.2f}s")
+        return _result
+
+
+def is_ready() -> bool:
+    return _result is not None and all(r["ok"] for r in _result.values())
+
+
+def status() -> Dict[str, object]:
+    """The stored warmup state; never starts any work itself."""
+    return {"ready": is_ready(), "warming": _thread is not None and _thread.is_alive(),
+            "components": dict(_result or {})}
+
+
+def _run_until_ready() -> None:
+    delay = retry_seconds()
+    while not all(r["ok"] for r in run().values()):
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_RETRY_S)
+
+
+def start_background() -> threading.Thread:
+    """Start the warmup thread, once per process; later calls return the same thread."""
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run_until_ready, name="warmup", daemon=True)
+            _thread.start()
+        return _thread
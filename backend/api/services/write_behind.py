@@ -0,0 +1,291 @@
+"""Write-behind buffer for single-document Firestore writes.
+
+When ``FIRESTORE_WRITE_BEHIND=true`` the service layer hands new documents to a
+process-wide buffer instead of calling ``set()`` in the request path. Ids are
+generated client-side, so callers get them back immediately; a background
+thread commits queued writes in Firestore batches once ``max_batch`` writes are
+waiting or ``flush_interval`` seconds have passed.
+
+Pending writes are visible to ``get()`` until they are committed, so a request
+that reads back what this process just wrote still sees it. Whatever cannot be
+committed at shutdown is spooled to a JSONL file and replayed on next start.
+"""
+import atexit
+import base64
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_LIMIT = 500
+
+_Key = Tuple[str, str]
+
+
+def _enabled() -> bool:
+    return os.getenv("FIRESTORE_WRITE_BEHIND", "false").lower() == "true"
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    # Firestore sentinels (SERVER_TIMESTAMP, Increment, ...) have no meaning outside a live write
+    raise TypeError(f"Unserializable value: {type(value).__name__}")
+
+
+def _decode(obj: Dict[str, Any]) -> Any:
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    if "__date__" in obj:
+        return date.fromisoformat(obj["__date__"])
+    if "__bytes__" in obj:
+        return base64.b64decode(obj["__bytes__"])
+    return obj
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        get_db: Callable[[], Any],
+        max_batch: int = 100,
+        flush_interval: float = 0.2,
+        spool_path: Optional[str] = None,
+    ):
+        self._get_db = get_db
+        self.max_batch = max(1, min(max_batch, MAX_BATCH_LIMIT))
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending: "OrderedDict[_Key, Dict[str, Any]]" = OrderedDict()
+        self._inflight: Dict[_Key, Dict[str, Any]] = {}
+        self._enqueued_at: Dict[_Key, float] = {}
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            "enqueued_total": 0,
+            "flushed_total": 0,
+            "flush_batches_total": 0,
+            "flush_errors_total": 0,
+            "flush_seconds_sum": 0.0,
+            "flush_seconds_max": 0.0,
+            "max_queue_delay_seconds": 0.0,
+            "spooled_total": 0,
+            "spool_dropped_total": 0,
+        }
+
+    def start(self) -> None:
+        self.replay_spool()
+        self._thread = threading.Thread(target=self._run, name="firestore-write-behind", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, collection: str, doc_id: str, data: Dict[str, Any]) -> None:
+        key = (collection, doc_id)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write-behind buffer is closed")
+            self._pending[key] = data
+            self._pending.move_to_end(key)
+            self._enqueued_at.setdefault(key, time.monotonic())
+            self._stats["enqueued_total"] += 1
+            depth = len(self._pending)
+        if depth >= self.max_batch:
+            self._wake.set()
+
+    def get(self, collection: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Return a write this process has queued but not yet committed."""
+        key = (collection, doc_id)
+        with self._lock:
+            data = self._pending.get(key)
+            if data is None:
+                data = self._inflight.get(key)
+            return dict(data) if data is not None else None
+
+    def flush(self) -> int:
+        """Commit everything queued so far; returns the number of writes committed."""
+        committed = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return committed
+                    keys = list(self._pending.keys())[: self.max_batch]
+                    batch_items = [(key, self._pending.pop(key)) for key in keys]
+                    self._inflight.update(batch_items)
+                started = time.monotonic()
+                try:
+                    db = self._get_db()
+                    batch = db.batch()
+                    for (collection, doc_id), data in batch_items:
+                        batch.set(db.collection(collection).document(doc_id), data)
+                    batch.commit()
+                except Exception as e:
+                    logger.error(f"Write-behind flush of {len(batch_items)} writes failed: {str(e)}")
+                    with self._lock:
+                        self._stats["flush_errors_total"] += 1
+                        for key, data in reversed(batch_items):
+                            self._inflight.pop(key, None)
+                            # A newer write for the same key supersedes the failed one
+                            if key not in self._pending:
+                                self._pending[key] = data
+                                self._pending.move_to_end(key, last=False)
+                    raise
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    for key, _ in batch_items:
+                        self._inflight.pop(key, None)
+                        if key not in self._pending:
+                            queued = self._enqueued_at.pop(key, started)
+                            self._stats["max_queue_delay_seconds"] = max(
+                                self._stats["max_queue_delay_seconds"], started - queued
+                            )
+                    self._stats["flushed_total"] += len(batch_items)
+                    self._stats["flush_batches_total"] += 1
+                    self._stats["flush_seconds_sum"] += elapsed
+                    self._stats["flush_seconds_max"] = max(self._stats["flush_seconds_max"], elapsed)
+                committed += len(batch_items)
+
+    def _run(self) -> None:
+        backoff = self.flush_interval
+        while not self._closed:
+            self._wake.wait(backoff)
+            self._wake.clear()
+            try:
+                self.flush()
+                backoff = self.flush_interval
+            except Exception:
+                # Keep writes queued and back off while Firestore is unavailable
+                backoff = min(max(backoff * 2, self.flush_interval), 5.0)
+
+    def close(self) -> None:
+        """Stop the flusher and commit what is left, spooling to disk on failure."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        try:
+            self.flush()
+        except Exception:
+            self._spool()
+
+    def _spool(self) -> None:
+        # Wait out a flush in progress (its failed writes go back to pending) and keep the
+        # spool file to one writer, so no write is missed or written twice
+        with self._flush_lock, self._spool_lock:
+            with self._lock:
+                items = list(self._pending.items())
+                self._pending.clear()
+            if not items or not self.spool_path:
+                if items:
+                    logger.error(f"Dropping {len(items)} unflushed Firestore writes: no spool path configured")
+                return
+            lines, dropped = [], 0
+            for (collection, doc_id), data in items:
+                try:
+                    lines.append(json.dumps({"collection": collection, "id": doc_id, "data": data}, default=_encode))
+                except (TypeError, ValueError) as e:
+                    # Only this write is lost, not the whole spool
+                    logger.error(f"Cannot spool write to {collection}/{doc_id}: {e}")
+                    dropped += 1
+            os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                f.writelines(line + "\n" for line in lines)
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                self._stats["spooled_total"] += len(lines)
+                self._stats["spool_dropped_total"] += dropped
+        logger.warning(f"Spooled {len(lines)} unflushed Firestore writes to {self.spool_path}")
+
+    def replay_spool(self) -> int:
+        """Queue writes spooled by a previous process; returns how many were found."""
+        if not self.spool_path:
+            return 0
+        replay_path = f"{self.spool_path}.replay"
+        with self._spool_lock:
+            if os.path.exists(self.spool_path):
+                if os.path.exists(replay_path):
+                    # A previous replay was interrupted: keep its writes, older ones first
+                    with open(self.spool_path, encoding="utf-8") as src, open(replay_path, "a", encoding="utf-8") as dst:
+                        dst.write(src.read())
+                    os.remove(self.spool_path)
+                else:
+                    os.replace(self.spool_path, replay_path)
+            if not os.path.exists(replay_path):
+                return 0
+            count = 0
+            with open(replay_path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line, object_hook=_decode)
+                    except ValueError:
+                        logger.error(f"Skipping unreadable spooled write in {replay_path}")
+                        continue
+                    self.enqueue(entry["collection"], entry["id"], entry["data"])
+                    count += 1
+            os.remove(replay_path)
+        logger.info(f"Replaying {count} spooled Firestore writes")
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            oldest = min(self._enqueued_at.values(), default=now)
+            return {
+                **self._stats,
+                "queue_depth": len(self._pending),
+                "inflight": len(self._inflight),
+                "oldest_pending_seconds": now - oldest,
+            }
+
+
+_buffer: Optional[WriteBehindBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer(get_db: Callable[[], Any]) -> Optional[WriteBehindBuffer]:
+    """Return the process-wide buffer, or None when write-behind is disabled."""
+    global _buffer
+    if not _enabled():
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                buffer = WriteBehindBuffer(
+                    get_db,
+                    max_batch=int(os.getenv("FIRESTORE_WRITE_BEHIND_MAX_BATCH", "100")),
+                    flush_interval=int(os.getenv("FIRESTORE_WRITE_BEHIND_INTERVAL_MS", "200")) / 1000,
+                    spool_path=os.getenv(
+                        "FIRESTORE_WRITE_BEHIND_SPOOL",
+                        os.path.join(tempfile.gettempdir(), "legalease-write-behind.jsonl"),
+                    ),
+                )
+                buffer.start()
+                atexit.register(buffer.close)
+                _buffer = buffer
+    return _buffer
+
+
+def stats() -> Dict[str, Any]:
+    return _buffer.stats() if _buffer is not None else {}
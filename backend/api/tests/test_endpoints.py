@@ -1,12 +1,37 @@
+from unittest import mock
+import os
+
 from django.test import TestCase
 from rest_framework.test import APIClient
 from django.core.files.uploadedfile import SimpleUploadedFile
 import base64
 
+from api.services import admission, metrics
+
+
+def long_clauses(count: int = 40) -> list:
+    """Numbered clauses long enough together to take the long-document path."""
+    return [f"{i}. The borrower shall pay a late fee of {i}% on any overdue instalment. " * 6
+            for i in range(1, count + 1)]
+
 
 class ApiEndpointsTest(TestCase):
     def setUp(self):
         self.client = APIClient()
+        admission.reset()
+
+    def install_fakes(self, model_latency_ms: int = 0) -> dict:
+        """Serve the endpoints from the benchmark fakes for the rest of the test."""
+        from benchmarks import fakes
+        from api import auth
+        from api.services import firestore, gcs, vertex
+
+        installed = fakes.install(fakes.BenchConfig(model_latency_ms=model_latency_ms, seed=1))
+        self.addCleanup(auth.install_verifier)
+        self.addCleanup(firestore.install_backends)
+        self.addCleanup(gcs.install_backend)
+        self.addCleanup(vertex.install_backends)
+        return installed
 
     def test_upload_and_analyze_flow(self):
         # Upload a small text file
@@ -27,6 +52,113 @@ class ApiEndpointsTest(TestCase):
         self.assertIn("risks", analyze_resp.data)
         self.assertIn("glossary", analyze_resp.data)
 
+    def test_repeat_upload_reuses_stored_blob_and_analysis(self):
+        from benchmarks import fakes
+
+        installed = self.install_fakes()
+
+        def upload(name: str, body: bytes):
+            upload_file = SimpleUploadedFile(name, body, content_type="text/plain")
+            return self.client.post("/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart").data
+
+        first = upload("loan.txt", b"The borrower shall pay a late fee of 2%.")
+        again = upload("copy-of-loan.txt", b"The borrower shall pay a late fee of 2%.")
+        other = upload("loan.txt", b"The lender may change the interest rate.")
+
+        # Whether the content was stored already is not disclosed to the uploader
+        self.assertNotIn("deduplicated", again)
+        self.assertEqual(again["gcs_path"], first["gcs_path"])
+        self.assertNotEqual(again["document_id"], first["document_id"])
+        # Same name, different content: stored separately rather than overwritten
+        self.assertNotEqual(other["gcs_path"], first["gcs_path"])
+        self.assertEqual(len([k for k in installed["bucket"].objects if k.startswith("blobs/")]), 2)
+
+        self.assertEqual(self.client.get(f"/api/analyze/{first['document_id']}/").status_code, 200)
+        calls = installed["model"].calls
+        resp = self.client.get(f"/api/analyze/{again['document_id']}/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["summary"], fakes.SUMMARY)
+        self.assertEqual(installed["model"].calls, calls)
+
+    def test_direct_upload_through_resumable_session(self):
+        import base64
+        import hashlib
+
+        from api.services import firestore, gcs, uploads
+
+        body = b"Direct upload: the borrower shall repay in 12 instalments."
+        slot = self.client.post("/api/uploads/", {
+            "category": "Bank", "filename": "direct.txt", "content_type": "text/plain", "size": len(body),
+        }, format="json")
+        self.assertEqual(slot.status_code, 201)
+        url, document_id = slot.data["upload_url"], slot.data["document_id"]
+
+        # Not uploaded yet
+        self.assertEqual(self.client.post(f"/api/uploads/{document_id}/complete/").status_code, 409)
+
+        # A chunk whose range does not match its length or the declared size is refused
+        for bad_range in (f"bytes 0-29/{len(body)}", f"bytes 0-19/{len(body) + 1}"):
+            resp = self.client.put(url, body[:20], content_type="text/plain", HTTP_CONTENT_RANGE=bad_range)
+            self.assertEqual(resp.status_code, 400)
+        first = self.client.put(url, body[:20], content_type="text/plain", HTTP_CONTENT_RANGE=f"bytes 0-19/{len(body)}")
+        self.assertEqual((first.status_code, first["Range"]), (308, "bytes=0-19"))
+        status_query = self.client.put(url, b"", content_type="text/plain", HTTP_CONTENT_RANGE=f"bytes */{len(body)}")
+        self.assertEqual(status_query["Range"], "bytes=0-19")
+        rest = self.client.put(url, body[20:], content_type="text/plain",
+                               HTTP_CONTENT_RANGE=f"bytes 20-{len(body) - 1}/{len(body)}")
+        self.assertEqual(rest.status_code, 200)
+
+        # Completion checks the storage metadata; the bytes are hashed afterwards, off the request
+        with mock.patch.object(gcs, "download_to_file", side_effect=AssertionError("read during completion")):
+            with mock.patch.object(uploads, "_schedule") as schedule:
+                done = self.client.post(f"/api/uploads/{document_id}/complete/")
+        self.assertEqual(done.status_code, 200)
+        self.assertEqual(done.data["document_id"], document_id)
+        self.assertTrue(done.data["gcs_path"].startswith("uploads/"))
+        self.assertEqual(self.client.get(f"/api/analyze/{document_id}/").status_code, 200)
+        uploads.content_address(*schedule.call_args.args)
+        stored = firestore.get_document(None, document_id)
+        self.assertEqual(stored["sha256"], hashlib.sha256(body).hexdigest())
+        self.assertTrue(stored["gcsPath"].startswith("blobs/sha256/"))
+
+        # A declared MD5 is checked against what storage reports
+        md5 = base64.b64encode(hashlib.md5(body).digest()).decode()
+        for declared, expected in ((base64.b64encode(b"x" * 16).decode(), 400), (md5, 200)):
+            slot = self.client.post("/api/uploads/", {
+                "category": "Bank", "filename": "checked.txt", "content_type": "text/plain", "size": len(body),
+                "md5": declared,
+            }, format="json").data
+            self.client.put(slot["upload_url"], body, content_type="text/plain")
+            self.assertEqual(self.client.post(f"/api/uploads/{slot['document_id']}/complete/").status_code, expected)
+
+        # Declaring a hash that is already stored proves nothing: the bytes are still
+        # uploaded, and deduplicated when the upload completes
+        again = self.client.post("/api/uploads/", {
+            "category": "Bank", "filename": "again.txt", "content_type": "text/plain", "size": len(body),
+            "sha256": hashlib.sha256(body).hexdigest(),
+        }, format="json")
+        self.assertEqual(again.status_code, 201)
+        self.assertTrue(again.data["upload_url"])
+        self.assertEqual(self.client.put(again.data["upload_url"], body, content_type="text/plain").status_code, 200)
+        self.assertEqual(self.client.post(f"/api/uploads/{again.data['document_id']}/complete/").status_code, 200)
+        uploads.drain()
+        self.assertEqual(firestore.get_document(None, again.data["document_id"])["gcsPath"], stored["gcsPath"])
+
+    def test_direct_upload_accepts_chunks_over_the_request_body_limit(self):
+        body = b"The borrower shall repay in 12 instalments.\n" * 80000  # 3.5 MB
+        chunk = 3 * 1024 * 1024  # over DATA_UPLOAD_MAX_MEMORY_SIZE, as the client's 8 MiB chunks are
+        slot = self.client.post("/api/uploads/", {
+            "category": "Bank", "filename": "large.txt", "content_type": "text/plain", "size": len(body),
+        }, format="json").data
+        first = self.client.put(slot["upload_url"], body[:chunk], content_type="text/plain",
+                                HTTP_CONTENT_RANGE=f"bytes 0-{chunk - 1}/{len(body)}")
+        self.assertEqual((first.status_code, first["Range"]), (308, f"bytes=0-{chunk - 1}"))
+        rest = self.client.put(slot["upload_url"], body[chunk:], content_type="text/plain",
+                               HTTP_CONTENT_RANGE=f"bytes {chunk}-{len(body) - 1}/{len(body)}")
+        self.assertEqual(rest.status_code, 200)
+        done = self.client.post(f"/api/uploads/{slot['document_id']}/complete/")
+        self.assertEqual(done.status_code, 200)
+
     def test_reminders(self):
         resp = self.client.post(
             "/api/reminders/",
@@ -51,3 +183,369 @@ class ApiEndpointsTest(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertIn("answer", resp.data)
         self.assertIn("answer_audio_base64", resp.data)
+
+    def test_chat_is_throttled_per_client(self):
+        limits = {"MODEL_BURST": "1", "MODEL_RATE_PER_MINUTE": "1", "ADMISSION_QUEUE_TIMEOUT_MS": "0"}
+        with mock.patch.dict(os.environ, limits):
+            first = self.client.post("/api/chat/", {"message": "hello"}, format="json")
+            second = self.client.post("/api/chat/", {"message": "hello again"}, format="json")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+        self.assertIn("Retry-After", second.headers)
+
+    def test_async_endpoints(self):
+        upload_file = SimpleUploadedFile("async.txt", b"Loan agreement text.", content_type="text/plain")
+        document_id = self.client.post(
+            "/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart"
+        ).data["document_id"]
+
+        analyze_resp = self.client.get(f"/api/async/analyze/{document_id}/")
+        self.assertEqual(analyze_resp.status_code, 200)
+        self.assertTrue({"summary", "risks", "glossary"} <= set(analyze_resp.json()))
+
+        chat_resp = self.client.post(
+            "/api/async/chat/", {"message": "hello", "document_id": document_id}, format="json"
+        )
+        self.assertEqual(chat_resp.status_code, 200)
+        self.assertIn("reply", chat_resp.json())
+
+        voice_resp = self.client.post("/api/async/voice-qna/", {"question": "What is EMI?"}, format="json")
+        self.assertEqual(voice_resp.status_code, 200)
+        self.assertIn("answer_audio_base64", voice_resp.json())
+
+    def test_async_endpoints_throttle_signed_in_users_by_uid(self):
+        from api.services import admission
+
+        self.install_fakes()
+        upload_file = SimpleUploadedFile("async.txt", b"Loan agreement text.", content_type="text/plain")
+        document_id = self.client.post(
+            "/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart",
+            HTTP_AUTHORIZATION="Bearer alice",
+        ).data["document_id"]
+
+        take = admission.LocalBackend.take
+        keys = []
+
+        def spy(backend, key, *args):
+            keys.append(key)
+            return take(backend, key, *args)
+
+        with mock.patch.object(admission.LocalBackend, "take", spy):
+            for resp in (
+                self.client.get(f"/api/async/analyze/{document_id}/", HTTP_AUTHORIZATION="Bearer alice"),
+                self.client.post("/api/async/chat/", {"message": "hello", "document_id": document_id},
+                                 format="json", HTTP_AUTHORIZATION="Bearer alice"),
+                self.client.post("/api/async/voice-qna/", {"question": "What is EMI?"}, format="json",
+                                 HTTP_AUTHORIZATION="Bearer alice"),
+            ):
+                self.assertEqual(resp.status_code, 200)
+            self.client.post("/api/async/chat/", {"message": "hello"}, format="json")
+        self.assertEqual(keys[:3], ["user:alice"] * 3)
+        self.assertTrue(keys[3].startswith("ip:"))  # anonymous callers still go by address
+
+    def test_ready_reports_component_timings(self):
+        from api.services import warmup
+
+        self.client.get("/ready")
+        warmup.start_background().join(timeout=30)  # the probe only started it
+        with mock.patch.object(warmup, "run", side_effect=AssertionError("probe ran warmup")):
+            resp = self.client.get("/ready")
+        self.assertEqual(resp.status_code, 200)
+        body = resp.json()
+        self.assertTrue(body["ready"])
+        self.assertEqual(set(body["components"]), {"vertex", "speech", "tts", "storage", "firestore", "auth"})
+
+    def test_metrics_and_server_timing(self):
+        sent_before = metrics.STAGE_BYTES.value(stage="gcs.upload_file", direction="out")
+        upload_file = SimpleUploadedFile("timed.txt", b"Timed loan agreement", content_type="text/plain")
+        resp = self.client.post("/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart")
+        self.assertIn("gcs.upload_file;dur=", resp["Server-Timing"])
+        self.assertIn("firestore.save_document_metadata;dur=", resp["Server-Timing"])
+
+        body = self.client.get("/metrics").content.decode()
+        self.assertIn('legalease_stage_duration_seconds_count{stage="gcs.upload_file",outcome="ok"}', body)
+        self.assertIn('legalease_stage_bytes_total{stage="gcs.upload_file",direction="out"}', body)
+        self.assertEqual(metrics.STAGE_BYTES.value(stage="gcs.upload_file", direction="out") - sent_before, 20)
+        self.assertIn('legalease_http_request_duration_seconds_bucket{route="api/upload/"', body)
+
+    def test_benchmark_fakes_serve_the_endpoints(self):
+        from benchmarks import fakes
+
+        installed = self.install_fakes()
+
+        upload_file = SimpleUploadedFile("fake.pdf", b"%PDF-1.4 terms", content_type="application/pdf")
+        document_id = self.client.post(
+            "/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart"
+        ).data["document_id"]
+        self.assertIn(document_id, installed["db"].data["documents"])
+        self.assertEqual(len(installed["bucket"].objects), 2)  # seeded file + upload
+
+        resp = self.client.get(f"/api/analyze/{document_id}/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["risks"], fakes.RISKS)
+        self.assertEqual(installed["model"].calls, 3)
+
+        faq = self.client.get("/api/faq/", HTTP_AUTHORIZATION="Bearer bench-user")
+        self.assertEqual(faq.status_code, 200)
+        self.assertEqual(faq.data["faqs"][0]["popularity"], 20)
+
+    def test_selected_fields_are_computed_once_and_revalidated_by_etag(self):
+        from benchmarks import fakes
+
+        installed = self.install_fakes()
+        model, db = installed["model"], installed["db"]
+
+        upload_file = SimpleUploadedFile("card.txt", b"Loan agreement for a document card", content_type="text/plain")
+        document_id = self.client.post(
+            "/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart"
+        ).data["document_id"]
+
+        card = self.client.get(f"/api/analyze/{document_id}/?fields=summary")
+        self.assertEqual(card.data, {"document_id": document_id, "summary": fakes.SUMMARY})
+        self.assertEqual(model.calls, 1)
+        full = self.client.get(f"/api/analyze/{document_id}/")
+        self.assertEqual(full.data["risks"], fakes.RISKS)
+        self.assertEqual(model.calls, 3)  # only risks and glossary were missing
+
+        reads = db.calls
+        again = self.client.get(f"/api/analyze/{document_id}/", HTTP_IF_NONE_MATCH=full["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], full["ETag"])
+        self.assertEqual(db.calls, reads + 1)  # the document read, nothing else
+        self.assertEqual(model.calls, 3)
+
+        async_again = self.client.get(f"/api/async/analyze/{document_id}/?fields=summary",
+                                      HTTP_IF_NONE_MATCH=card["ETag"])
+        self.assertEqual(async_again.status_code, 304)
+        self.assertEqual(self.client.get(f"/api/analyze/{document_id}/?fields=summary,price").status_code, 400)
+
+    def test_stored_analysis_is_not_charged_against_the_model_quota(self):
+        self.install_fakes()
+
+        def upload(body: bytes) -> str:
+            upload_file = SimpleUploadedFile("quota.txt", body, content_type="text/plain")
+            return self.client.post("/api/upload/", {"category": "Bank", "file": upload_file},
+                                    format="multipart").data["document_id"]
+
+        first, second = upload(b"Loan agreement, first copy"), upload(b"Loan agreement, second copy")
+        env = {"MODEL_BURST": "3", "MODEL_RATE_PER_MINUTE": "0.001", "ADMISSION_QUEUE_TIMEOUT_MS": "0"}
+        with mock.patch.dict(os.environ, env):
+            full = self.client.get(f"/api/analyze/{first}/")  # three parts computed: the whole burst
+            self.assertEqual(full.status_code, 200)
+            for path in (f"/api/analyze/{first}/", f"/api/async/analyze/{first}/?fields=risks",
+                         f"/api/analyze/{first}/stream/"):
+                self.assertEqual(self.client.get(path).status_code, 200)
+            self.assertEqual(self.client.get(f"/api/analyze/{first}/", HTTP_IF_NONE_MATCH=full["ETag"]).status_code, 304)
+            self.assertEqual(self.client.get(f"/api/analyze/{second}/").status_code, 429)
+
+    def test_other_languages_translate_the_english_analysis_once(self):
+        from benchmarks import fakes
+        from api.services import firestore
+
+        installed = self.install_fakes()
+        model = installed["model"]
+
+        upload_file = SimpleUploadedFile("loan.txt", b"Loan agreement to read in Hindi", content_type="text/plain")
+        document_id = self.client.post(
+            "/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart"
+        ).data["document_id"]
+
+        hindi = self.client.get(f"/api/analyze/{document_id}/?language=hi")
+        self.assertEqual(hindi.data["language"], "hi")
+        self.assertEqual(hindi.data["summary"], fakes.TRANSLATED + fakes.SUMMARY)
+        self.assertEqual(hindi.data["risks"][0]["risk"], fakes.RISKS[0]["risk"])  # levels stay as they are
+        self.assertEqual(hindi.data["glossary"][0]["term"], fakes.GLOSSARY[0]["term"])
+        self.assertEqual(model.calls, 4)  # English analysis, then one translation
+
+        self.assertEqual(self.client.get(f"/api/analyze/{document_id}/?language=hi").data, hindi.data)
+        tamil = self.client.get(f"/api/async/analyze/{document_id}/?language=ta&fields=summary")
+        self.assertEqual(tamil.status_code, 200)
+        self.assertEqual(model.calls, 5)  # the second language costs one small call
+        self.assertEqual(firestore.get_document(None, document_id)["analysisSummary"], fakes.SUMMARY)
+        self.assertEqual(self.client.get(f"/api/async/analyze/{document_id}/?language=fr").status_code, 400)
+
+    def test_translations_without_a_model_are_not_stored(self):
+        from benchmarks import fakes
+        from api.services import firestore, vertex
+
+        self.install_fakes()
+        upload_file = SimpleUploadedFile("lease.txt", b"Lease agreement to read in Tamil", content_type="text/plain")
+        document_id = self.client.post(
+            "/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart"
+        ).data["document_id"]
+        self.assertEqual(self.client.get(f"/api/analyze/{document_id}/").status_code, 200)
+
+        model = vertex._backends.pop("model")
+        try:
+            untranslated = self.client.get(f"/api/analyze/{document_id}/?language=ta")
+            self.assertEqual(untranslated.status_code, 200)
+            self.assertEqual(untranslated.data["summary"], fakes.SUMMARY)
+            self.assertNotIn("ta", firestore.get_document(None, document_id).get("analysisTranslations") or {})
+        finally:
+            vertex._backends["model"] = model
+
+        # Once a model is back, the language is translated rather than served the cached English
+        tamil = self.client.get(f"/api/analyze/{document_id}/?language=ta")
+        self.assertEqual(tamil.data["summary"], fakes.TRANSLATED + fakes.SUMMARY)
+
+    def test_document_library_pages_with_cursors(self):
+        from datetime import datetime, timedelta
+
+        installed = self.install_fakes()
+        db = installed["db"]
+        start = datetime(2026, 1, 1)
+        for i in range(7):
+            category = "Bank" if i % 2 else "Health"
+            db.collection("documents").document(f"doc-{i}").set({
+                "userId": "owner", "filename": f"f{i}.pdf", "category": category, "status": "uploaded",
+                "gcsPath": f"blobs/{i}", "createdAt": start + timedelta(minutes=i),
+            })
+        db.collection("documents").document("other").set({"userId": "someone-else", "createdAt": start})
+
+        def page(query=""):
+            resp = self.client.get(f"/api/documents/?limit=3{query}", HTTP_AUTHORIZATION="Bearer owner")
+            self.assertEqual(resp.status_code, 200)
+            return resp.data
+
+        seen, cursor, queries = [], "", db.calls
+        while True:
+            data = page(f"&cursor={cursor}" if cursor else "")
+            seen += [d["document_id"] for d in data["documents"]]
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(seen, [f"doc-{i}" for i in range(6, -1, -1)])
+        self.assertEqual(db.calls - queries, 3)  # one query per page
+
+        bank = page("&category=Bank")["documents"]
+        self.assertEqual([d["document_id"] for d in bank], ["doc-5", "doc-3", "doc-1"])
+        self.assertEqual(self.client.get("/api/documents/?cursor=nonsense",
+                                         HTTP_AUTHORIZATION="Bearer owner").status_code, 400)
+
+    def test_analysis_streams_items_as_events(self):
+        import json
+        from benchmarks import fakes
+
+        installed = self.install_fakes()
+
+        def events(resp):
+            body = b"".join(resp.streaming_content).decode()
+            out = []
+            for block in body.strip().split("\n\n"):
+                event, data = block.split("\n", 1)
+                out.append((event[len("event: "):], json.loads(data[len("data: "):])))
+            return out
+
+        upload_file = SimpleUploadedFile("stream.txt", b"Streamed loan agreement", content_type="text/plain")
+        document_id = self.client.post(
+            "/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart"
+        ).data["document_id"]
+
+        resp = self.client.get(f"/api/analyze/{document_id}/stream/")
+        self.assertEqual(resp["Content-Type"], "text/event-stream")
+        streamed = events(resp)
+        self.assertEqual(streamed[-1], ("done", {"document_id": document_id}))
+        self.assertEqual([d for e, d in streamed if e == "risk"], fakes.RISKS)
+        self.assertEqual([d for e, d in streamed if e == "term"], fakes.GLOSSARY)
+        self.assertEqual([d["summary"] for e, d in streamed if e == "summary"], [fakes.SUMMARY])
+        self.assertEqual(installed["model"].calls, 3)
+
+        # The streamed result is stored; both endpoints reuse it without model calls
+        self.assertEqual(self.client.get(f"/api/analyze/{document_id}/").data["risks"], fakes.RISKS)
+        cached = events(self.client.get(f"/api/analyze/{document_id}/stream/"))
+        self.assertEqual([d for e, d in cached if e == "term"], fakes.GLOSSARY)
+        self.assertEqual(installed["model"].calls, 3)
+
+    def test_long_documents_are_analyzed_in_parallel_sections(self):
+        from benchmarks import fakes
+        from api.services import longdoc
+
+        installed = self.install_fakes(model_latency_ms=20)
+
+        clauses = long_clauses()
+        text = "\n\n".join(clauses).encode()
+        upload_file = SimpleUploadedFile("long.txt", text, content_type="text/plain")
+        document_id = self.client.post(
+            "/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart"
+        ).data["document_id"]
+
+        env = {"LONGDOC_THRESHOLD_TOKENS": "1000", "LONGDOC_CHUNK_TOKENS": "800", "LONGDOC_MAX_PARALLEL": "3"}
+        with mock.patch.dict(os.environ, env):
+            sections = len(longdoc.split_sections(text.decode()))
+            resp = self.client.get(f"/api/analyze/{document_id}/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater(sections, 4)
+        # Map calls for summary and risks plus one reduce call; "late fee" is in the local glossary
+        self.assertEqual(installed["model"].calls, 2 * sections + 1)
+        self.assertEqual(resp.data["glossary"][0]["term"], "Late payment fee")
+        self.assertEqual(resp.data["risks"], fakes.RISKS)
+        self.assertEqual(resp.data["summary"], fakes.SUMMARY)
+        # Sections run in parallel, never more than the limit at once
+        self.assertEqual(installed["model"].max_in_flight, 3)
+
+    def test_new_version_reanalyzes_only_changed_sections(self):
+        from api.services import firestore, longdoc, versions
+
+        installed = self.install_fakes()
+
+        clauses = long_clauses()
+
+        def upload(text: str):
+            upload_file = SimpleUploadedFile("loan.txt", text.encode(), content_type="text/plain")
+            return self.client.post("/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart",
+                                    HTTP_AUTHORIZATION="Bearer bench-user").data
+
+        env = {"LONGDOC_THRESHOLD_TOKENS": "1000", "LONGDOC_CHUNK_TOKENS": "1500"}
+        with mock.patch.dict(os.environ, env):
+            first = upload("\n\n".join(clauses))
+            self.assertEqual(self.client.get(f"/api/analyze/{first['document_id']}/").status_code, 200)
+            first_calls = installed["model"].calls
+
+            clauses[19] = "20. The lender may change the interest rate at any time without notice."
+            second = upload("\n\n".join(clauses))
+            resp = self.client.get(f"/api/analyze/{second['document_id']}/")
+
+        self.assertEqual((second["version"], second["previous_version_id"]), (2, first["document_id"]))
+        self.assertEqual(resp.status_code, 200)
+        changes = resp.data["changes"]
+        self.assertEqual(changes["previous_version_id"], first["document_id"])
+        self.assertEqual([c["type"] for c in changes["changes"]], ["modified"])
+        self.assertIn("interest rate", changes["changes"][0]["after"])
+        self.assertGreater(changes["sections_unchanged"], 0)
+        # Only the changed sections' three prompts (and the summary reduce, unless the
+        # fake's identical notes hit the cache) reach the model
+        changed = changes["sections_total"] - changes["sections_unchanged"]
+        self.assertLessEqual(installed["model"].calls - first_calls, 3 * changed + 1)
+
+        # The comparison of this pair of versions is reused, not extracted again
+        document = firestore.get_document("bench-user", second["document_id"])
+        with mock.patch.object(longdoc, "extract", wraps=longdoc.extract) as extract:
+            self.assertEqual(versions.compare(document, None)[1], changes)
+        extract.assert_not_called()
+        self.assertLess(installed["model"].calls - first_calls, first_calls / 2)
+
+    def test_invalid_optional_token_is_treated_as_anonymous(self):
+        from api import auth
+
+        self.install_fakes()
+
+        def verify(token):
+            if token == "expired":
+                raise ValueError("Token expired")
+            return {"uid": token}
+
+        auth.install_verifier(verify)
+
+        def upload(token: str):
+            upload_file = SimpleUploadedFile("loan.txt", b"Loan agreement with a late fee", content_type="text/plain")
+            return self.client.post("/api/upload/", {"category": "Bank", "file": upload_file}, format="multipart",
+                                    HTTP_AUTHORIZATION=f"Bearer {token}")
+
+        resp = upload("expired")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data["version"], 1)
+        # A valid token scopes the synchronous analyze endpoint to the owner's documents
+        document_id = upload("owner").data["document_id"]
+        statuses = {token: self.client.get(f"/api/analyze/{document_id}/", HTTP_AUTHORIZATION=f"Bearer {token}").status_code
+                    for token in ("owner", "other", "expired")}
+        self.assertEqual(statuses, {"owner": 200, "other": 404, "expired": 200})
@@ -0,0 +1,808 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from google.api_core import exceptions as gexc
+
+from api.services import (
+    admission, analysis_stream, blobcache, cassette, clauses, context, firestore, gcs, glossary, jsonstream, longdoc,
+    metrics, resilience, routing, singleflight, tokens, vertex,
+)
+from api.services.scheduler import PriorityScheduler, SchedulerTimeout
+from api.services.write_behind import WriteBehindBuffer
+
+
+class WriteBehindBufferTest(SimpleTestCase):
+    def setUp(self):
+        self.spool_path = os.path.join(tempfile.mkdtemp(), "spool.jsonl")
+
+    def test_read_your_writes_then_flush(self):
+        buffer = WriteBehindBuffer(firestore.get_db, max_batch=10, spool_path=self.spool_path)
+        buffer.enqueue("documents", "wb-1", {"userId": "u1", "filename": "a.pdf"})
+        self.assertEqual(buffer.get("documents", "wb-1")["filename"], "a.pdf")
+        self.assertEqual(buffer.stats()["queue_depth"], 1)
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertIsNone(buffer.get("documents", "wb-1"))
+        self.assertEqual(firestore.get_document("u1", "wb-1")["filename"], "a.pdf")
+        self.assertEqual(buffer.stats()["flushed_total"], 1)
+
+    def test_unflushed_writes_are_spooled_and_replayed(self):
+        class _DownDB:
+            def batch(self):
+                raise ConnectionError("firestore unavailable")
+
+        buffer = WriteBehindBuffer(lambda: _DownDB(), spool_path=self.spool_path)
+        created = datetime(2024, 1, 2, 3, 4, 5)
+        buffer.enqueue("reminders", "wb-2", {"title": "Renew", "createdAt": created})
+        buffer.enqueue("reminders", "wb-3", {"title": "Sentinel", "updatedAt": object()})
+        buffer.close()
+        self.assertTrue(os.path.exists(self.spool_path))
+        self.assertEqual(buffer.stats()["spool_dropped_total"], 1)  # only the write that cannot be encoded
+
+        replayed = WriteBehindBuffer(firestore.get_db, spool_path=self.spool_path)
+        self.assertEqual(replayed.replay_spool(), 1)
+        self.assertEqual(replayed.get("reminders", "wb-2")["createdAt"], created)
+        self.assertFalse(os.path.exists(self.spool_path))
+        self.assertEqual(replayed.replay_spool(), 0)  # nothing is replayed twice
+
+
+class DocumentCacheTest(SimpleTestCase):
+    def test_repeat_reads_are_cached_until_written(self):
+        from benchmarks import fakes
+
+        db = fakes.FakeFirestore()
+        firestore.install_backends(db=db)
+        self.addCleanup(firestore.install_backends)
+        document_id = firestore.save_document_metadata("owner", {"filename": "loan.pdf", "status": "uploaded"})
+        hits = firestore.DOCUMENT_CACHE.value(outcome="hit")
+
+        reads = db.calls
+        for _ in range(10):
+            self.assertEqual(firestore.get_document("owner", document_id)["filename"], "loan.pdf")
+        self.assertEqual(db.calls - reads, 1)
+        self.assertEqual(firestore.DOCUMENT_CACHE.value(outcome="hit") - hits, 9)
+        with self.assertRaises(PermissionError):
+            firestore.get_document("someone-else", document_id)  # checked against the cached record
+
+        firestore.update_document(document_id, {"status": "archived"})
+        self.assertEqual(firestore.get_document("owner", document_id)["status"], "archived")
+        with mock.patch.dict(os.environ, {"DOCUMENT_CACHE_TTL_S": "0"}):
+            reads = db.calls
+            firestore.get_document("owner", document_id)
+            self.assertEqual(db.calls - reads, 1)
+
+
+class BlobCacheTest(SimpleTestCase):
+    def setUp(self):
+        from benchmarks import fakes
+
+        self.bucket = fakes.FakeBucket("bench-bucket")
+        gcs.install_backend(self.bucket)
+        self.addCleanup(gcs.install_backend)
+        env = mock.patch.dict(os.environ, {"BLOB_CACHE_DIR": tempfile.mkdtemp(), "BLOB_CACHE_MAX_BYTES": "250"})
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(blobcache.reset)
+
+    def read(self, path):
+        with blobcache.mapped(path) as data:
+            return bytes(data)
+
+    def test_repeat_reads_skip_storage_until_the_object_changes(self):
+        self.bucket.blob("blobs/sha256/ab/abc.txt").upload_from_string(b"x" * 100)
+        self.bucket.blob("uploads/u1/notes.txt").upload_from_string(b"first")
+
+        calls = self.bucket.calls
+        self.assertEqual(self.read("gs://bench-bucket/blobs/sha256/ab/abc.txt"), b"x" * 100)
+        self.assertEqual(self.read("blobs/sha256/ab/abc.txt"), b"x" * 100)
+        self.assertEqual(self.bucket.calls - calls, 1)  # content-addressed: no metadata read either
+
+        self.assertEqual(self.read("uploads/u1/notes.txt"), b"first")
+        calls = self.bucket.calls
+        self.assertEqual(self.read("uploads/u1/notes.txt"), b"first")
+        self.assertEqual(self.bucket.calls - calls, 1)  # generation check only
+        self.bucket.blob("uploads/u1/notes.txt").upload_from_string(b"second")
+        self.assertEqual(self.read("uploads/u1/notes.txt"), b"second")
+
+    def test_inline_model_parts_are_read_from_the_cached_copy(self):
+        self.bucket.blob("blobs/sha256/cd/cdef.pdf").upload_from_string(b"%PDF-1.4 inline")
+        with mock.patch.dict(os.environ, {"VERTEX_USE_URI": "false"}):
+            vertex._part_from_gcs_uri("gs://bench-bucket/blobs/sha256/cd/cdef.pdf")
+            calls = self.bucket.calls
+            part = vertex._part_from_gcs_uri("gs://bench-bucket/blobs/sha256/cd/cdef.pdf")
+        self.assertEqual(self.bucket.calls, calls)
+        self.assertEqual(part.inline_data.data, b"%PDF-1.4 inline")
+        self.assertEqual(part.inline_data.mime_type, "application/pdf")
+
+    def test_least_recently_used_copies_are_evicted_over_the_cap(self):
+        for name in ("a", "b", "c"):
+            self.bucket.blob(f"blobs/sha256/00/{name}").upload_from_string(name.encode() * 100)
+        self.read("blobs/sha256/00/a")
+        self.read("blobs/sha256/00/b")
+        time.sleep(0.01)
+        self.read("blobs/sha256/00/a")  # a is now more recent than b
+        self.read("blobs/sha256/00/c")
+
+        calls = self.bucket.calls
+        self.assertEqual(self.read("blobs/sha256/00/a"), b"a" * 100)
+        self.assertEqual(self.bucket.calls, calls)
+        self.assertEqual(self.read("blobs/sha256/00/b"), b"b" * 100)
+        self.assertEqual(self.bucket.calls - calls, 1)
+
+
+class BatchReanalysisTest(SimpleTestCase):
+    def test_local_batch_job_replaces_stored_analyses(self):
+        from django.core.management import call_command
+        from benchmarks import fakes
+
+        installed = fakes.install(fakes.BenchConfig(model_latency_ms=0, seed=1))
+        self.addCleanup(firestore.install_backends)
+        self.addCleanup(gcs.install_backend)
+        self.addCleanup(vertex.install_backends)
+        model, bucket = installed["model"], installed["bucket"]
+        bucket.objects["blobs/sha256/ab/ab12.pdf"] = b"%PDF-1.4 loan agreement"
+        ids = [firestore.save_document_metadata("u1", {"gcsPath": "blobs/sha256/ab/ab12.pdf", "category": "Bank",
+                                                       "analysisSummary": "old", "analysisTranslations": {"hi": {}}})
+               for _ in range(2)]
+        firestore.save_document_metadata("u2", {"gcsPath": "uploads/u2/other.pdf", "category": "Bank"})
+
+        out = io.StringIO()
+        call_command("reanalyze", runner="local", user="u1", fields="summary,risks", poll_interval=0, stdout=out)
+        self.assertIn("Updated 2 of 2 document(s) with 2 request(s)", out.getvalue())
+        self.assertEqual(model.calls, 2)  # one request per part for the shared content
+        for document_id in ids:
+            document = firestore.get_document("u1", document_id)
+            self.assertEqual(document["analysisSummary"], fakes.SUMMARY)
+            self.assertEqual(document["analysisRisks"], fakes.RISKS)
+            self.assertEqual(document["analysisTranslations"], {})
+        self.assertTrue(any(p.endswith("/predictions.jsonl") for p in bucket.objects))
+
+
+class AdmissionTest(SimpleTestCase):
+    def setUp(self):
+        admission.reset()
+
+    def test_token_bucket_refills_at_rate(self):
+        backend = admission.LocalBackend()
+        self.assertEqual(backend.take("user:a", rate_per_sec=2, burst=1), 0)
+        self.assertAlmostEqual(backend.take("user:a", rate_per_sec=2, burst=1), 0.5, places=1)
+        self.assertEqual(backend.take("user:b", rate_per_sec=2, burst=1), 0)
+
+    def test_model_slot_rejects_when_saturated(self):
+        with mock.patch.dict(os.environ, {"MODEL_MAX_CONCURRENCY": "1", "ADMISSION_QUEUE_TIMEOUT_MS": "10"}):
+            with admission.model_slot():
+                with self.assertRaises(admission.AdmissionRejected):
+                    with admission.model_slot():
+                        pass
+            with admission.model_slot():
+                self.assertEqual(admission.get_backend().in_flight(), 1)
+
+
+class SingleFlightTest(SimpleTestCase):
+    def _slow(self, calls, result=None, error=None):
+        def fn():
+            calls.append(1)
+            time.sleep(0.1)
+            if error:
+                raise error
+            return result
+        return fn
+
+    def _concurrently(self, n, target):
+        outcomes = []
+
+        def run():
+            try:
+                outcomes.append(target())
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return outcomes
+
+    def test_concurrent_duplicates_share_one_call_and_its_error(self):
+        calls = []
+        self.assertEqual(self._concurrently(5, lambda: singleflight.do("k1", self._slow(calls, "answer"))), ["answer"] * 5)
+        self.assertEqual(len(calls), 1)
+
+        calls = []
+        error = resilience.UpstreamError("vertex.test", ValueError("boom"))
+        outcomes = self._concurrently(5, lambda: singleflight.do("k2", self._slow(calls, error=error)))
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(o is error for o in outcomes))
+
+        # Finished calls are not remembered
+        singleflight.do("k1", self._slow(calls, "again"))
+        self.assertEqual(len(calls), 2)
+
+    def test_callers_own_failures_are_not_shared(self):
+        calls = []
+        quota = iter([admission.AdmissionRejected(wait=1)])
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.1)
+            # Only the first leader is over its quota; whoever runs next succeeds
+            error = next(quota, None)
+            if error:
+                raise error
+            return "answer"
+
+        outcomes = self._concurrently(3, lambda: singleflight.do("k5", fn))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len([o for o in outcomes if isinstance(o, admission.AdmissionRejected)]), 1)
+        self.assertEqual(outcomes.count("answer"), 2)  # the followers ran it again instead
+
+    def test_async_follower_takes_over_from_a_cancelled_leader(self):
+        import asyncio
+
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        async def main():
+            leader = asyncio.create_task(singleflight.ado("k6", fn))
+            await asyncio.sleep(0.01)
+            followers = [asyncio.create_task(singleflight.ado("k6", fn)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            leader.cancel()  # e.g. its client disconnected
+            return await asyncio.gather(*followers)
+
+        self.assertEqual(asyncio.run(main()), ["answer"] * 3)
+        self.assertEqual(len(calls), 2)
+
+    def test_async_duplicates_share_one_call(self):
+        import asyncio
+
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        async def main():
+            return await asyncio.gather(*(singleflight.ado("k3", fn) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(main()), ["answer"] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_cache_backend_shares_results_across_workers(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+        calls = []
+        # A backend per thread stands in for separate workers sharing the cache
+        outcomes = self._concurrently(2, lambda: singleflight.CacheBackend().run("k4", self._slow(calls, {"a": 1})))
+        self.assertEqual(outcomes, [{"a": 1}, {"a": 1}])
+        self.assertEqual(len(calls), 1)
+
+
+class PrioritySchedulerTest(SimpleTestCase):
+    def _drain_order(self, sched, submissions):
+        """Hold the only slot, queue ``submissions`` behind it, and return grant order."""
+        order = []
+        sched.acquire("interactive", "holder")
+        threads = []
+        for priority, user in submissions:
+            def run(priority=priority, user=user):
+                with sched.slot(priority, user, timeout=5):
+                    order.append((priority, user))
+            t = threading.Thread(target=run)
+            t.start()
+            threads.append(t)
+            time.sleep(0.02)  # deterministic enqueue order
+        sched.release("interactive")
+        for t in threads:
+            t.join()
+        return order
+
+    def test_interactive_before_analysis_before_background(self):
+        sched = PriorityScheduler(capacity=1, reserve=0)
+        order = self._drain_order(sched, [("background", "a"), ("analysis", "a"), ("interactive", "b")])
+        self.assertEqual([p for p, _ in order], ["interactive", "analysis", "background"])
+        self.assertEqual(sched.stats()["background"]["granted_total"], 1)
+
+    def test_fair_queuing_across_users(self):
+        sched = PriorityScheduler(capacity=1, reserve=0)
+        order = self._drain_order(sched, [("analysis", "heavy")] * 3 + [("analysis", "light")])
+        self.assertEqual([u for _, u in order][:2], ["heavy", "light"])
+
+    def test_reserve_keeps_a_slot_for_interactive(self):
+        sched = PriorityScheduler(capacity=2, reserve=1, timeouts={"analysis": 0.01})
+        sched.acquire("analysis", "a")
+        with self.assertRaises(SchedulerTimeout):
+            sched.acquire("analysis", "b")
+        sched.acquire("interactive", "c", timeout=0.01)
+        self.assertEqual(sched.stats()["analysis"]["rejected_total"], 1)
+
+
+class ResilienceTest(SimpleTestCase):
+    no_wait = resilience.RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+
+    def test_classification(self):
+        self.assertEqual(resilience.classify(gexc.ServiceUnavailable("down")), resilience.RETRY)
+        self.assertEqual(resilience.classify(gexc.TooManyRequests("slow down")), resilience.RETRY)
+        self.assertEqual(resilience.classify(gexc.InvalidArgument("bad prompt")), resilience.PERMANENT)
+        self.assertEqual(
+            resilience.classify(gexc.PermissionDenied("service-123@gcp-sa-aiplatform has no access")),
+            resilience.REFRESH,
+        )
+        self.assertEqual(resilience.classify(admission.AdmissionRejected(wait=1)), resilience.PERMANENT)
+
+    def test_retries_transient_errors_then_succeeds(self):
+        outcomes = [gexc.ServiceUnavailable("down"), gexc.DeadlineExceeded("slow"), "ok"]
+
+        def flaky():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.assertEqual(resilience.call("test.flaky", flaky, policy=self.no_wait), "ok")
+
+    def test_permanent_errors_are_not_retried(self):
+        calls = []
+
+        def broken():
+            calls.append(1)
+            raise gexc.InvalidArgument("bad prompt")
+
+        with self.assertRaises(resilience.UpstreamError) as ctx:
+            resilience.call("test.broken", broken, policy=self.no_wait)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(ctx.exception.status_code, 502)
+
+    def test_refresh_hook_runs_once(self):
+        refreshed = []
+        outcomes = [gexc.Unauthenticated("expired"), "ok"]
+
+        def fn():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        result = resilience.call("test.refresh", fn, policy=self.no_wait, on_refresh=lambda: refreshed.append(1))
+        self.assertEqual((result, refreshed), ("ok", [1]))
+
+    def test_retry_budget_limits_retries(self):
+        budget = resilience.RetryBudget(ratio=0, min_per_sec=0, cap=1)
+        self.assertTrue(budget.try_spend())
+        self.assertFalse(budget.try_spend())
+
+    def test_hedged_read_returns_faster_attempt(self):
+        calls = []
+
+        def read():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return b"slow"
+            return b"fast"
+
+        self.assertEqual(resilience.hedged("test.read", read, hedge_after=0.05), b"fast")
+
+
+class StartupImportTest(SimpleTestCase):
+    def test_heavy_sdks_are_not_imported_at_startup(self):
+        code = (
+            "import os, sys, django; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'legalease.settings'); "
+            "django.setup(); import legalease.urls; "
+            "print(','.join(m for m in ('vertexai', 'google.cloud.speech_v1', 'google.cloud.texttospeech_v1', "
+            "'google.cloud.storage', 'google.cloud.firestore', 'firebase_admin') if m in sys.modules))"
+        )
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.strip(), "")
+
+    def test_missing_sdk_is_logged_and_raised(self):
+        creds = tempfile.NamedTemporaryFile(suffix=".json")
+        self.addCleanup(creds.close)
+        env = {"GCP_PROJECT_ID": "p", "GOOGLE_APPLICATION_CREDENTIALS": creds.name}
+        with mock.patch.dict(os.environ, env), mock.patch.dict(sys.modules, {"vertexai": None}), \
+                self.assertLogs("api.services.vertex", "ERROR") as logs:
+            with self.assertRaises(ImportError):
+                vertex._live_model("gemini-test")
+        self.assertIn("Critical error initializing Vertex AI", logs.output[0])
+
+
+class MetricsTest(SimpleTestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        hist = metrics.Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            hist.observe(value, stage="a")
+        lines = hist.render()
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{stage="a"} 3', lines)
+
+    def test_token_usage_is_counted(self):
+        usage = mock.Mock(prompt_token_count=120, candidates_token_count=30, total_token_count=150)
+        before = metrics.MODEL_TOKENS.value(op="vertex.test", kind="prompt")
+        metrics.record_usage("vertex.test", mock.Mock(usage_metadata=usage))
+        self.assertEqual(metrics.MODEL_TOKENS.value(op="vertex.test", kind="prompt") - before, 120)
+
+
+class CassetteTest(SimpleTestCase):
+    def test_record_then_replay(self):
+        from vertexai.generative_models import Part
+        from benchmarks.fakes import FakeModel
+
+        def parts(uri):
+            return [Part.from_uri(uri, mime_type="application/pdf"), "Summarize."]
+
+        path = os.path.join(tempfile.mkdtemp(), "calls.jsonl.gz")
+        recorder = cassette.RecordingModel(lambda: FakeModel(), cassette.Cassette(path))
+        recorded = recorder.generate_content(parts("gs://bucket/a.pdf"))
+
+        replay = cassette.ReplayModel(cassette.Cassette.load(path), latency_scale=0)
+        replayed = replay.generate_content(parts("gs://bucket/a.pdf"))
+        self.assertEqual(replayed.text, recorded.text)
+        self.assertEqual(replayed.usage_metadata.total_token_count, recorded.usage_metadata.total_token_count)
+        with self.assertRaises(cassette.CassetteMiss):
+            replay.generate_content(parts("gs://bucket/b.pdf"))
+
+        # Loose matching ignores the file and keys on the prompt text
+        loose = cassette.ReplayModel(cassette.Cassette.load(path), latency_scale=0, loose=True)
+        self.assertEqual(loose.generate_content(parts("gs://bucket/b.pdf")).text, recorded.text)
+        with self.assertRaises(cassette.CassetteMiss):
+            loose.generate_content(["A different prompt."])
+
+
+class TokenBudgetTest(SimpleTestCase):
+    def setUp(self):
+        from benchmarks.fakes import FILE_PART_TOKENS, FakeModel
+
+        self.file_tokens = FILE_PART_TOKENS
+        self.model = FakeModel()
+        self.model.count_tokens = mock.Mock(wraps=self.model.count_tokens)
+        tokens._counts.clear()
+
+    def test_truncates_oldest_text_and_caches_file_counts(self):
+        from vertexai.generative_models import Part
+
+        doc = Part.from_uri("gs://bucket/loan.pdf", mime_type="application/pdf")
+        messages = [{"role": "user", "content": f"old question {i}"} for i in range(11)]
+        messages.append({"role": "user", "content": "latest question"})
+        convo = vertex._chat_parts(messages)
+        convo[0] = "User: older turn\n" * 400 + convo[0]
+        cap = self.file_tokens + 500
+        with mock.patch.dict(os.environ, {"TOKEN_INPUT_CAPS": f"chat_with_gemini={cap}"}):
+            parts = tokens.fit("vertex.chat_with_gemini", [doc, *convo], lambda: self.model)
+            tokens.fit("vertex.chat_with_gemini", [doc, "short"], lambda: self.model)
+        self.assertIs(parts[0], doc)
+        self.assertTrue(parts[1].startswith(tokens.TRUNCATION_MARKER))
+        self.assertTrue(parts[1].endswith("User: old question 10\n"))  # the newest history survives
+        self.assertEqual(parts[2], "User: latest question\nAssistant:")
+        self.assertLessEqual(self.file_tokens + sum(tokens.estimate_text(p) for p in parts[1:]), cap)
+        self.model.count_tokens.assert_called_once()
+
+    def test_final_instruction_is_never_cut(self):
+        instruction = "Summarize. " * 20
+        with mock.patch.dict(os.environ, {"TOKEN_INPUT_CAPS": "summarize_document=100"}):
+            parts = tokens.fit("vertex.summarize_document", ["x" * 2000, instruction], lambda: self.model)
+            self.assertEqual(parts[-1], instruction)
+            self.assertTrue(parts[0].startswith(tokens.TRUNCATION_MARKER))
+            self.assertLessEqual(sum(tokens.estimate_text(p) for p in parts), 100)
+            # Not enough older text to drop: rejected rather than cutting the instruction
+            with self.assertRaises(tokens.TokenBudgetExceeded):
+                tokens.fit("vertex.summarize_document", ["x" * 2000, instruction * 4], lambda: self.model)
+
+    def test_async_preflight_truncates_against_a_replayed_model(self):
+        import asyncio
+        from vertexai.generative_models import Part
+
+        replay = cassette.ReplayModel(cassette.Cassette(os.path.join(tempfile.mkdtemp(), "empty.jsonl.gz")))
+
+        async def get_model():
+            return replay
+
+        doc = Part.from_uri("gs://bucket/replayed.pdf", mime_type="application/pdf")
+        parts = ["User: old\n" * 400, "User: latest\nAssistant:"]
+        with mock.patch.dict(os.environ, {"TOKEN_INPUT_CAPS": "chat_with_gemini=200"}):
+            fitted = asyncio.run(tokens.afit("vertex.chat_with_gemini", [doc, *parts], get_model))
+        self.assertTrue(fitted[1].startswith(tokens.TRUNCATION_MARKER))
+        self.assertEqual(fitted[2], parts[1])
+
+    def test_rejects_documents_over_the_cap(self):
+        from vertexai.generative_models import Part
+
+        doc = Part.from_uri("gs://bucket/big.pdf", mime_type="application/pdf")
+        with mock.patch.dict(os.environ, {"TOKEN_INPUT_CAPS": f"analyze_risks={self.file_tokens - 1}"}):
+            with self.assertRaises(tokens.TokenBudgetExceeded) as ctx:
+                tokens.fit("vertex.analyze_risks", [doc, "Find risks."], lambda: self.model)
+        self.assertEqual(ctx.exception.status_code, 413)
+
+    def test_usage_is_attributed_to_user_and_document(self):
+        ledger = tokens.UsageLedger(flush_interval=0)
+        resp = self.model.generate_content(["How much is the late fee?"])
+        with mock.patch.object(tokens, "get_ledger", return_value=ledger):
+            with context.request_scope(user="user:u-tokens", document="doc-tokens"):
+                tokens.record(resp, 0.5)
+                tokens.record(resp, 0.5)
+        usage = firestore.get_db().collection("usage_documents").document("doc-tokens").get().to_dict()
+        self.assertEqual(usage["calls"], 2)
+        self.assertEqual(usage["inputTokens"], 2 * resp.usage_metadata.prompt_token_count)
+        user_usage = firestore.get_db().collection("usage_users").document("user:u-tokens").get().to_dict()
+        self.assertEqual(user_usage["outputTokens"], 2 * resp.usage_metadata.candidates_token_count)
+
+
+class ModelRoutingTest(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        routes = {"chat": routing.Route("pro", "flash", slo_seconds=1.0)}
+        self.router = routing.Router(routes, window=10, min_samples=5, error_rate=0.3, cooldown=30,
+                                     clock=lambda: self.now)
+
+    def test_switches_to_fallback_when_slo_is_missed_then_recovers(self):
+        for _ in range(5):
+            self.assertEqual(self.router.choose("chat"), "pro")
+            self.router.observe("chat", "pro", 2.5, ok=True)
+        self.assertEqual(self.router.choose("chat"), "flash")
+        self.assertEqual(self.router.stats()["chat"]["switches_total"], 1)
+
+        self.now += 31
+        self.assertEqual(self.router.choose("chat"), "pro")
+        self.assertEqual(self.router.stats()["chat"]["degraded"], 0)
+
+    def test_error_rate_trips_and_fallback_samples_are_ignored(self):
+        for ok in (True, False, True, False, True):
+            self.router.observe("chat", "pro", 0.2, ok=ok)
+        self.assertEqual(self.router.choose("chat"), "flash")
+        self.router.observe("chat", "flash", 9.0, ok=False)
+        self.assertEqual(self.router.stats()["chat"]["switches_total"], 1)
+
+    def test_routes_from_env(self):
+        env = {"VERTEX_MODEL": "big", "VERTEX_FAST_MODEL": "small", "MODEL_SLO_MS": "chat=1500",
+               "MODEL_ROUTES": "glossary=big"}
+        with mock.patch.dict(os.environ, env):
+            routes = routing.routes_from_env()
+        self.assertEqual((routes["summary"].primary, routes["summary"].fallback), ("big", "small"))
+        self.assertEqual(routes["chat"].primary, "small")
+        self.assertEqual(routes["chat"].slo_seconds, 1.5)
+        self.assertEqual(routes["glossary"].primary, "big")
+
+
+class LongDocumentTest(SimpleTestCase):
+    def test_sections_respect_the_size_limit_and_break_at_headings(self):
+        text = "\n".join(f"Clause {i}\n" + "The lender may charge interest. " * 20 for i in range(1, 13))
+        sections = longdoc.split_sections(text, max_tokens=400)
+        self.assertGreater(len(sections), 1)
+        self.assertTrue(all(len(s) <= 400 * tokens.CHARS_PER_TOKEN for s in sections))
+        self.assertTrue(all(s.startswith("Clause ") for s in sections))
+        self.assertEqual("".join(sections).count("Clause "), 12)
+
+    def test_merge_risks_deduplicates_and_keeps_the_higher_risk(self):
+        merged = longdoc.merge_risks([
+            [{"clause": "Late payment fee of 2% per month", "risk": "Medium", "explanation": "a"},
+             {"clause": "Prepayment penalty", "risk": "Low", "explanation": "b"}],
+            [{"clause": "Late payment fee of 2% per month.", "risk": "High", "explanation": "c"},
+             {"clause": "Lender may assign the loan", "risk": "Medium", "explanation": "d"}],
+        ])
+        self.assertEqual([r["explanation"] for r in merged], ["c", "d", "b"])
+
+    def test_maps_of_one_analysis_share_the_parallel_limit(self):
+        import asyncio
+        from benchmarks import fakes
+
+        installed = fakes.install(fakes.BenchConfig(model_latency_ms=20, seed=1))
+        self.addCleanup(firestore.install_backends)
+        self.addCleanup(gcs.install_backend)
+        self.addCleanup(vertex.install_backends)
+        text = "\n\n".join(f"{i}. The lender may charge interest of {i}% on the amount due. " * 6 for i in range(30))
+
+        async def analyze():
+            with longdoc.shared_limit():
+                await asyncio.gather(longdoc.summarize_async(text), longdoc.analyze_risks_async(text),
+                                     longdoc.extract_glossary_async(text))
+
+        env = {"LONGDOC_CHUNK_TOKENS": "400", "LONGDOC_MAX_PARALLEL": "2", "SECTION_CACHE": "false"}
+        with mock.patch.dict(os.environ, env):
+            self.assertGreater(len(longdoc.split_sections(text)), 2)
+            asyncio.run(analyze())
+        self.assertEqual(installed["model"].max_in_flight, 2)
+
+
+class ClausePrefilterTest(SimpleTestCase):
+    TEXT = (
+        "LOAN AGREEMENT\n\n"
+        "1. The Borrower shall repay the loan in equal monthly instalments.\n\n"
+        "2. Charges\n"
+        "2.1 A late payment fee of 2% per month applies to overdue amounts.\n"
+        "(a) Foreclosure within a year attracts charges of 4%.\n"
+        "(b) Statements are sent every quarter.\n\n"
+        "The Bank may revise the rate at its sole discretion.\n\n"
+        "3. Notices shall be sent to the registered address.\n"
+    )
+
+    def test_segments_carry_section_references(self):
+        refs = [c.ref for c in clauses.segment(self.TEXT)]
+        self.assertEqual(refs, ["¶1", "1", "2", "2.1", "2.1(a)", "2.1(b)", "2.1 ¶1", "3"])
+
+    def test_terms_match_at_word_starts_only(self):
+        matcher = clauses.Matcher(["lien", "penalt*"])
+        self.assertEqual([p for _, p in matcher.find("Client pays penalties; a lien applies.")],
+                         ["penalt*", "lien"])
+        self.assertEqual(list(matcher.find("The liens and alien terms")), [])
+
+    def test_only_candidate_clauses_are_selected(self):
+        selected = clauses.select(self.TEXT)
+        self.assertEqual(selected.splitlines()[0], "[2.1] A late payment fee of 2% per month applies to overdue amounts.")
+        self.assertIn("[2.1(a)] Foreclosure", selected)
+        self.assertIn("[2.1 ¶1] The Bank", selected)
+        self.assertNotIn("Notices", selected)
+        self.assertIsNone(clauses.select("1. Notices shall be sent to the registered address."))
+        with mock.patch.dict(os.environ, {"CLAUSE_PREFILTER_MAX_RATIO": "0.1"}):
+            self.assertIsNone(clauses.select(self.TEXT))
+
+    def test_streamed_risks_read_only_the_candidate_clauses(self):
+        import asyncio
+
+        from benchmarks import fakes
+        from api import auth
+
+        bucket = fakes.install(fakes.BenchConfig(model_latency_ms=0, seed=1))["bucket"]
+        self.addCleanup(auth.install_verifier)
+        self.addCleanup(firestore.install_backends)
+        self.addCleanup(gcs.install_backend)
+        self.addCleanup(vertex.install_backends)
+        bucket.blob("docs/loan.txt").upload_from_string(self.TEXT)
+        document = {"gcsPath": "docs/loan.txt", "contentType": "text/plain"}
+        document_id = firestore.save_document_metadata(None, dict(document))
+        prompts = []
+        stream, astream = vertex._stream, vertex._astream
+
+        def spy(parts, op):
+            prompts.append((op, parts))
+            return stream(parts, op)
+
+        def aspy(parts, op):
+            prompts.append((op, parts))
+            return astream(parts, op)
+
+        async def drain():
+            return [e async for e in analysis_stream.astream(document_id, dict(document), "gs://bench/docs/loan.txt", None)]
+
+        with mock.patch.object(vertex, "_stream", spy), mock.patch.object(vertex, "_astream", aspy):
+            events = list(analysis_stream.stream(document_id, dict(document), "gs://bench/docs/loan.txt", None))
+            asyncio.run(drain())
+        self.assertTrue(any(e.startswith("event: risk") for e in events))
+        risk_calls = [parts for op, parts in prompts if "risk" in op]
+        self.assertEqual(len(risk_calls), 2)
+        for parts in risk_calls:
+            self.assertEqual(parts, [vertex.RISK_CLAUSES_PROMPT, clauses.select(self.TEXT)])
+
+
+class GlossaryDictionaryTest(SimpleTestCase):
+    TEXT = (
+        "1. \"Step-up Instalment\" means an EMI that rises every year. The emi of the first year is fixed.\n"
+        "2. The Borrower and the Co-borrower are jointly and severally liable, and the Bank has a lien.\n"
+        "3. Any breach of clause 2 is an event of default. The FOIR must stay under 50%.\n"
+    )
+
+    def setUp(self):
+        from benchmarks import fakes
+        from api import auth
+
+        self.model = fakes.install(fakes.BenchConfig(model_latency_ms=0, seed=1))["model"]
+        self.addCleanup(auth.install_verifier)
+        self.addCleanup(firestore.install_backends)
+        self.addCleanup(gcs.install_backend)
+        self.addCleanup(vertex.install_backends)
+        self.addCleanup(glossary.reset)
+
+    def test_lookup_prefers_longer_terms_and_capitalized_acronyms(self):
+        dictionary = glossary.get_dictionary()
+        terms = [e.term for e in dictionary.lookup(self.TEXT)]
+        self.assertIn("Joint and several liability", terms)
+        self.assertNotIn("Liability", terms)
+        self.assertEqual(terms[-2:], ["Breach", "Default"])  # drafting vocabulary comes last
+        self.assertEqual(terms[0], "EMI")
+        self.assertEqual([c.term for c in glossary.candidates(self.TEXT, dictionary)], ["Step-up Instalment", "FOIR"])
+
+    @mock.patch.dict(os.environ, {"GLOSSARY_LEARN_CONFIRMATIONS": "2"})
+    def test_only_unknown_terms_reach_the_model_and_are_learned(self):
+        from benchmarks import fakes
+
+        terms = glossary.extract_glossary(self.TEXT, "gs://bucket/loan.txt")
+        self.assertEqual(self.model.calls, 1)
+        self.assertEqual(terms[0], {"term": "Step-up Instalment", "definition": fakes.DEFINED + "Step-up Instalment"})
+        self.assertIn("Lien", [t["term"] for t in terms])
+        self.assertEqual(firestore.list_glossary_terms(), [])  # one document confirms nothing
+
+        glossary.extract_glossary(self.TEXT, "gs://bucket/copy-of-loan.txt")
+        self.assertEqual(self.model.calls, 2)
+        self.assertEqual(firestore.list_glossary_terms(), [])  # nor does the same content uploaded again
+
+        glossary.extract_glossary(self.TEXT + "4. Interest is charged on the EMI.\n", "gs://bucket/loan-2.txt")
+        self.assertEqual(self.model.calls, 3)
+        self.assertEqual(len(firestore.list_glossary_terms()), 2)
+
+        glossary.reset()  # another worker, reading the learned terms back
+        again = glossary.extract_glossary(self.TEXT, "gs://bucket/loan.txt")
+        self.assertEqual(self.model.calls, 3)
+        self.assertEqual({t["term"] for t in again}, {t["term"] for t in terms})
+
+        self.assertEqual(glossary.extract_glossary("Nothing to define here.", "gs://bucket/loan.txt"), fakes.GLOSSARY)
+        self.assertEqual(self.model.calls, 4)  # read whole
+
+    @mock.patch.dict(os.environ, {"GLOSSARY_LEARN_CONFIRMATIONS": "2"})
+    def test_streamed_glossary_comes_from_the_dictionary(self):
+        import asyncio
+        import json
+
+        from benchmarks import fakes
+
+        gcs.get_bucket().blob("docs/terms.txt").upload_from_string(self.TEXT)
+        document = {"gcsPath": "docs/terms.txt", "contentType": "text/plain"}
+        prompts = []
+        stream, astream = vertex._stream, vertex._astream
+
+        def spy(parts, op):
+            prompts.append(parts)
+            return stream(parts, op)
+
+        def aspy(parts, op):
+            prompts.append(parts)
+            return astream(parts, op)
+
+        async def drain(document_id):
+            return [e async for e in analysis_stream.astream(document_id, dict(document), "gs://bench/docs/terms.txt", None)]
+
+        with mock.patch.object(vertex, "_stream", spy), mock.patch.object(vertex, "_astream", aspy):
+            events = list(analysis_stream.stream(firestore.save_document_metadata(None, dict(document)),
+                                                 dict(document), "gs://bench/docs/terms.txt", None))
+            asyncio.run(drain(firestore.save_document_metadata(None, dict(document))))
+        terms = [json.loads(e.split("data: ", 1)[1])["term"] for e in events if e.startswith("event: term")]
+        self.assertIn("Lien", terms)  # from the dictionary
+        self.assertIn({"term": "Step-up Instalment", "definition": fakes.DEFINED + "Step-up Instalment"},
+                      [json.loads(e.split("data: ", 1)[1]) for e in events if e.startswith("event: term")])
+        self.assertFalse([parts for parts in prompts if vertex.GLOSSARY_PROMPT in parts])
+        # Unknown terms were asked about by name (once per stream) and count towards learning
+        self.assertEqual(self.model.calls - len(prompts), 2)
+        self.assertFalse(firestore.list_glossary_terms())  # one document's content confirms nothing
+
+    @mock.patch.dict(os.environ, {"GLOSSARY_LEARN_CONFIRMATIONS": "2"})
+    def test_different_definitions_do_not_confirm_each_other(self):
+        self.assertEqual(glossary.learn([{"term": "Grace Fee", "definition": "A period without prepayment."}], "a"), 0)
+        self.assertEqual(glossary.learn([{"term": "Grace Fee", "definition": "Free money for everyone."}], "b"), 0)
+        self.assertFalse(glossary.get_dictionary().knows("Grace Fee"))
+        self.assertEqual(glossary.learn([{"term": "Grace Fee", "definition": "A period  without prepayment."}], "c"), 1)
+        self.assertEqual([t["term"] for t in firestore.list_glossary_terms()], ["Grace Fee"])
+
+
+class JsonStreamTest(SimpleTestCase):
+    def test_elements_are_returned_as_soon_as_they_complete(self):
+        text = '```json\n[{"term": "EMI", "definition": "Monthly [fixed] {payment}, \\"equated\\""}, 3, {"term": "APR"}]\n```'
+        parser = jsonstream.ArrayParser()
+        first = parser.feed(text[:text.index(", 3")])
+        self.assertEqual(first, [])  # the first object ends only at the next comma
+        emi, three = parser.feed(text[text.index(", 3"):text.index("{\"term\": \"APR")])
+        self.assertEqual((emi["term"], three), ("EMI", 3))
+        self.assertEqual(parser.feed(text[text.index("{\"term\": \"APR"):]), [{"term": "APR"}])
+        self.assertTrue(parser.done)
+
+    def test_any_split_gives_the_same_elements(self):
+        text = '[{"a": "x,}]"}, {"b": [1, 2]}, nonsense, {"c": null}]'
+        for cut in range(len(text)):
+            parser = jsonstream.ArrayParser()
+            items = parser.feed(text[:cut]) + parser.feed(text[cut:])
+            self.assertEqual(items, [{"a": "x,}]"}, {"b": [1, 2]}, {"c": None}])
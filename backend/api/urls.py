@@ -1,13 +1,25 @@
 from django.urls import path
-from .views import UploadView, AnalyzeView, FAQView, ReminderView, VoiceQnAView, ChatView, chat_endpoint
+from . import async_views, local_storage
+from .views import UploadView, UploadSessionView, UploadCompleteView, DocumentListView, AnalyzeView, AnalyzeStreamView, FAQView, ReminderView, VoiceQnAView, ChatView, chat_endpoint
 
 urlpatterns = [
     path("upload/", UploadView.as_view(), name="upload"),
+    # Direct-to-storage uploads: reserve, send the file to upload_url, then complete
+    path("uploads/", UploadSessionView.as_view(), name="upload_session"),
+    path("uploads/<str:document_id>/complete/", UploadCompleteView.as_view(), name="upload_complete"),
+    path("local-storage/upload/<str:token>/", local_storage.resumable_upload, name="local_upload"),
+    path("documents/", DocumentListView.as_view(), name="documents"),
     path("analyze/<str:document_id>/", AnalyzeView.as_view(), name="analyze"),
+    path("analyze/<str:document_id>/stream/", AnalyzeStreamView.as_view(), name="analyze_stream"),
     path("faq/", FAQView.as_view(), name="faq"),
     path("reminders/", ReminderView.as_view(), name="reminders"),
     path("voice-qna/", VoiceQnAView.as_view(), name="voice_qna"),
     # Function-based endpoint for CSRF-exempt connectivity test
     path("chat/", chat_endpoint, name="chat"),
+    # Native async variants; serve with uvicorn (legalease.asgi) to benefit
+    path("async/analyze/<str:document_id>/", async_views.analyze, name="analyze_async"),
+    path("async/analyze/<str:document_id>/stream/", async_views.analyze_stream, name="analyze_stream_async"),
+    path("async/chat/", async_views.chat, name="chat_async"),
+    path("async/voice-qna/", async_views.voice_qna, name="voice_qna_async"),
 ]
 
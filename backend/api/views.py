@@ -2,58 +2,125 @@ import base64
 from datetime import datetime
 from typing import Any, Dict
 
-from django.utils.timezone import now
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
+from rest_framework.decorators import api_view, permission_classes, authentication_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework import status
+from rest_framework.exceptions import APIException
 
-from .serializers import UploadSerializer, AnalyzeRequestSerializer, ReminderSerializer, VoiceQnASerializer
-from .services import gcs, firestore
+from .serializers import (
+    UploadSerializer, UploadSessionSerializer, DocumentListSerializer, AnalyzeRequestSerializer, ReminderSerializer, VoiceQnASerializer,
+)
+from .services import analysis, analysis_stream, blobs, documents, gcs, firestore, uploads
 from .services import vertex
+from .services import context
+from .services.admission import ModelCallThrottle, throttle, user_key
+from .auth import OptionalFirebaseAuthentication
 from django.core.files.uploadedfile import UploadedFile
 
 
 @method_decorator(csrf_exempt, name="dispatch")
 class UploadView(APIView):
     permission_classes = [AllowAny]
-    authentication_classes: list = []  # Avoid SessionAuthentication -> CSRF enforcement
+    # Avoid SessionAuthentication -> CSRF enforcement; a bearer token links re-uploads as versions
+    authentication_classes = [OptionalFirebaseAuthentication]
 
     def post(self, request):
+        # Hash the file while Django reads it off the request, before the body is parsed
+        hashing = blobs.install_hashing(request._request)
         serializer = UploadSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         file_obj = serializer.validated_data["file"]
         category = serializer.validated_data["category"]
         user_id = getattr(getattr(request, "user", None), "uid", None)
 
-        # Use literal "None" folder if user_id is falsy to match existing bucket structure
-        folder = str(user_id) if user_id else "None"
-        destination_path = f"uploads/{folder}/{now().strftime('%Y/%m/%d')}/{file_obj.name}"
-        _, public_url = gcs.upload_file(file_obj, destination_path, file_obj.content_type or "application/octet-stream")
-
-        doc_id = firestore.save_document_metadata(
-            user_id,
-            {
-                "filename": file_obj.name,
-                "contentType": file_obj.content_type,
-                "category": category,
-                "gcsPath": destination_path,
-                "publicUrl": public_url,
-                "status": "uploaded",
-            },
+        # Content-addressed: the same bytes are stored once, however often they are uploaded
+        content_type = file_obj.content_type or "application/octet-stream"
+        sha256 = blobs.digest(file_obj, hashing)
+        blob = blobs.store(file_obj, sha256, file_obj.name, content_type)
+        return Response(uploads.record_document(user_id, file_obj.name, file_obj.content_type, category, sha256, blob))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class UploadSessionView(APIView):
+    """Reserve a document and get a URL to upload its bytes to, bypassing the app server."""
+    permission_classes = [AllowAny]
+    authentication_classes = [OptionalFirebaseAuthentication]
+
+    def post(self, request):
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        user_id = getattr(getattr(request, "user", None), "uid", None)
+        result = uploads.start(
+            user_id, data["filename"], data["content_type"], data["size"], data["category"],
+            sha256=data.get("sha256"), origin=request.META.get("HTTP_ORIGIN"), md5=data.get("md5"),
         )
-        return Response({"document_id": doc_id, "gcs_path": destination_path})
+        if (result.get("upload_url") or "").startswith("/"):
+            # Local stand-in storage is served by this app
+            result["upload_url"] = request.build_absolute_uri(result["upload_url"])
+        return Response(result, status=status.HTTP_201_CREATED)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class UploadCompleteView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = [OptionalFirebaseAuthentication]
+
+    def post(self, request, document_id: str):
+        user_id = getattr(getattr(request, "user", None), "uid", None)
+        try:
+            return Response(uploads.complete(user_id, document_id))
+        except PermissionError:
+            return Response({"error": "Document not found"}, status=status.HTTP_404_NOT_FOUND)
+
+
+class DocumentListView(APIView):
+    """The signed-in user's documents, newest first, a page at a time."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = DocumentListSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        user_id = getattr(getattr(request, "user", None), "uid", None)
+        try:
+            rows, next_cursor = firestore.list_documents(
+                user_id, limit=params["limit"], cursor=params.get("cursor"),
+                category=params.get("category"), status=params.get("status"),
+            )
+        except ValueError:
+            return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        documents = [{
+            "document_id": row["id"],
+            "filename": row.get("filename"),
+            "category": row.get("category"),
+            "content_type": row.get("contentType"),
+            "size": row.get("size"),
+            "status": row.get("status"),
+            "version": row.get("version", 1),
+            "created_at": row.get("createdAt"),
+            "summary": row.get("analysisSummary"),
+        } for row in rows]
+        return Response({"documents": documents, "next_cursor": next_cursor})
 
 
 @method_decorator(csrf_exempt, name="dispatch")
 class AnalyzeView(APIView):
+    """Summary, risks and glossary; ``?fields=`` selects a subset, computing only parts not stored yet,
+    and ``?language=`` translates them."""
     permission_classes = [AllowAny]
-    authentication_classes: list = []  # Ensure no SessionAuthentication
+    # No SessionAuthentication; a bearer token scopes the lookup to its owner, as in the async view
+    authentication_classes = [OptionalFirebaseAuthentication]
+    # Throttled in get() once it is known how many parts need the model; stored answers are free
 
     def get(self, request, document_id: str):
+        fields = analysis.parse_fields(request.query_params.get("fields"))
+        language = analysis.parse_language(request.query_params.get("language"))
         user_id = getattr(getattr(request, "user", None), "uid", None)
         try:
             document = firestore.get_document(user_id, document_id)
@@ -67,53 +134,93 @@ class AnalyzeView(APIView):
         gcs_path = document.get("gcsPath")
         if not gcs_path:
             return Response({"error": "Document path missing"}, status=status.HTTP_400_BAD_REQUEST)
-        # Determine if original file was a Word doc and convert if needed
-        original_ct = (document.get("contentType") or "").lower()
+        todo = analysis.missing(document, fields)
+        # The same content was analyzed before (a repeat upload)
+        if todo and analysis.reuse(document_id, document):
+            todo = []
+        throttle(request, analysis.model_calls(document, fields, todo, language))
+        if todo:
+            # Word documents are converted to plain text before analysis
+            try:
+                gcs_uri = documents.analysis_uri(gcs_path, document.get("contentType"))
+            except ImportError:
+                return Response({"error": "Word file conversion not available on server (python-docx missing)"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            except APIException:
+                raise
+            except Exception as conv_err:
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.error(f"Document conversion failed: {str(conv_err)}")
+                return Response({"error": "Failed to convert document for analysis"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            try:
+                analysis.compute(document_id, document, gcs_uri, todo, user_key(request))
+            except APIException:
+                raise
+            except Exception as e:
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.error(f"Vertex analysis failed for {gcs_uri}: {str(e)}")
+                return Response({"error": "Analysis failed", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         try:
-            if original_ct in ("application/msword", "application/vnd.openxmlformats-officedocument.wordprocessingml.document") or gcs_path.lower().endswith((".doc", ".docx")):
-                # Fetch original bytes, convert to plain text using python-docx
-                try:
-                    from docx import Document  # type: ignore
-                except Exception:
-                    return Response({"error": "Word file conversion not available on server (python-docx missing)"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-                file_bytes = gcs.get_blob_bytes(gcs_path)
-                # Write to temp and read via python-docx
-                import tempfile
-                with tempfile.NamedTemporaryFile(suffix=".docx", delete=True) as tmp:
-                    tmp.write(file_bytes)
-                    tmp.flush()
-                    docx_doc = Document(tmp.name)
-                    text = "\n".join([p.text for p in docx_doc.paragraphs])
-                text_bytes = text.encode("utf-8")
-                converted_path = gcs_path.rsplit(".", 1)[0] + ".txt"
-                _, gcs_uri = gcs.upload_bytes(text_bytes, converted_path, "text/plain")
-                mime_type = "text/plain"
-            else:
-                gcs_uri = gcs.path_to_uri(gcs_path)
-                mime_type = vertex._get_mime_type(gcs_uri)
-        except Exception as conv_err:
+            # Other languages are translated from the English parts
+            analysis.translate(document_id, document, fields, language, user_key(request))
+        except APIException:
+            raise
+        except Exception as e:
             import logging
             logger = logging.getLogger(__name__)
-            logger.error(f"Document conversion failed: {str(conv_err)}")
-            return Response({"error": "Failed to convert document for analysis"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            logger.error(f"Translating analysis of {document_id} to {language} failed: {str(e)}")
+            return Response({"error": "Translation failed", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        body = analysis.result(document_id, document, fields, language)
+        tag = analysis.etag(body)
+        if analysis.not_modified(request.META.get("HTTP_IF_NONE_MATCH"), tag):
+            resp = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            resp = Response(body)
+        resp["ETag"] = tag
+        resp["Cache-Control"] = "private, no-cache"  # revalidate with If-None-Match
+        return resp
+
+
+def _event_stream(events) -> StreamingHttpResponse:
+    resp = StreamingHttpResponse(events, content_type="text/event-stream")
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"  # deliver each event through buffering proxies
+    return resp
 
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AnalyzeStreamView(APIView):
+    """``AnalyzeView`` as server-sent events: the summary, each risk and each term as soon as it is ready."""
+    permission_classes = [AllowAny]
+    authentication_classes = [OptionalFirebaseAuthentication]
+
+    def get(self, request, document_id: str):
+        user_id = getattr(getattr(request, "user", None), "uid", None)
         try:
-            summary = vertex.summarize_document(gcs_uri)
-            risks = vertex.analyze_risks(gcs_uri)
-            glossary = vertex.extract_glossary(gcs_uri)
-        except Exception as e:
+            document = firestore.get_document(user_id, document_id)
+        except PermissionError:
+            return Response({"error": "Document not found"}, status=status.HTTP_404_NOT_FOUND)
+        gcs_path = document.get("gcsPath")
+        if not gcs_path:
+            return Response({"error": "Document path missing"}, status=status.HTTP_400_BAD_REQUEST)
+        todo = analysis.missing(document, analysis.FIELDS)
+        if not todo or analysis.reuse(document_id, document):
+            return _event_stream(analysis_stream.stored_events(document_id, document))
+        throttle(request, len(todo))
+        try:
+            gcs_uri = documents.analysis_uri(gcs_path, document.get("contentType"))
+        except ImportError:
+            return Response({"error": "Word file conversion not available on server (python-docx missing)"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except APIException:
+            raise
+        except Exception as conv_err:
             import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Vertex analysis failed for {gcs_uri}: {str(e)}")
-            return Response({"error": "Analysis failed", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        return Response({
-            "document_id": document_id,
-            "summary": summary,
-            "risks": risks,
-            "glossary": glossary,
-        })
+            logging.getLogger(__name__).error(f"Document conversion failed: {str(conv_err)}")
+            return Response({"error": "Failed to convert document for analysis"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Analysis failures after this point are sent as ``error`` events
+        return _event_stream(analysis_stream.stream(document_id, document, gcs_uri, user_key(request)))
 
 
 @method_decorator(csrf_exempt, name="dispatch")
@@ -147,6 +254,7 @@ class FAQView(APIView):
 @method_decorator(csrf_exempt, name="dispatch")
 class VoiceQnAView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [ModelCallThrottle]
 
     def post(self, request):
         serializer = VoiceQnASerializer(data=request.data)
@@ -157,11 +265,12 @@ class VoiceQnAView(APIView):
         question = data.get("question", "")
         audio_b64 = data.get("audio_base64", "")
 
-        if not question and audio_b64:
-            question = vertex.stt_transcribe(audio_b64, language=language)
+        with context.request_scope(priority=context.INTERACTIVE, user=user_key(request)):
+            if not question and audio_b64:
+                question = vertex.stt_transcribe(audio_b64, language=language)
 
-        answer = vertex.answer_question(context_uri="", question=question, language=language)
-        answer_audio_b64 = vertex.tts_synthesize(answer, language=language)
+            answer = vertex.answer_question(context_uri="", question=question, language=language)
+            answer_audio_b64 = vertex.tts_synthesize(answer, language=language)
 
         return Response({
             "question": question,
@@ -173,6 +282,7 @@ class VoiceQnAView(APIView):
 @method_decorator(csrf_exempt, name="dispatch")
 class ChatView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [ModelCallThrottle]
 
     def post(self, request):
         data = request.data or {}
@@ -184,7 +294,9 @@ class ChatView(APIView):
             doc = firestore.get_document(user_id, document_id)
             gcs_path = doc.get("gcsPath")
             context_uri = gcs.path_to_uri(gcs_path)
-        reply = vertex.chat_with_gemini(messages, context_uri)
+        with context.request_scope(priority=context.INTERACTIVE, user=user_key(request),
+                                   document=document_id if context_uri else None):
+            reply = vertex.chat_with_gemini(messages, context_uri)
         return Response({"reply": reply})
 
 
@@ -193,6 +305,7 @@ class ChatView(APIView):
 @api_view(["POST"])  # DRF view handling JSON POST
 @permission_classes([AllowAny])  # Public access; add auth later if needed
 @authentication_classes([])  # Remove SessionAuthentication to avoid CSRF enforcement
+@throttle_classes([ModelCallThrottle])
 def chat_endpoint(request):
     # Accept { "message": "..." } or { "messages": [...], "document_id"?: str }
     try:
@@ -215,7 +328,11 @@ def chat_endpoint(request):
                     context_uri = f"gs://{gcs_path}" if not gcs_path.startswith("gs://") else gcs_path
                 except Exception:
                     context_uri = None
-            reply_text = vertex.chat_with_gemini(messages, context_uri)
+            with context.request_scope(priority=context.INTERACTIVE, user=user_key(request),
+                                       document=document_id if context_uri else None):
+                reply_text = vertex.chat_with_gemini(messages, context_uri)
+        except APIException:
+            raise
         except Exception as vertex_error:
             import logging
             logger = logging.getLogger(__name__)
@@ -224,6 +341,8 @@ def chat_endpoint(request):
 
         return Response({"reply": reply_text or ""})
 
+    except APIException:
+        raise
     except Exception as e:
         import logging
         logger = logging.getLogger(__name__)
@@ -0,0 +1,87 @@
+"""Compare the async (uvicorn/ASGI) endpoints with the gunicorn sync deployment.
+
+Both servers run the real Django app against a fake model with a fixed
+latency, so the difference is purely how many in-flight calls each
+deployment can hold. Run from ``backend/``:
+
+    python -m benchmarks.async_load --endpoint chat --concurrency 10 50 200
+
+Results are printed as a table and written as JSON with ``--output``.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Dict
+
+from benchmarks import loadgen
+
+ENDPOINTS = {
+    # name: (method, sync path, async path, payload)
+    "chat": ("POST", "/api/chat/", "/api/async/chat/", {"message": "What is the late fee?"}),
+    "analyze": ("GET", "/api/analyze/bench-doc/", "/api/async/analyze/bench-doc/", None),
+    "voice": ("POST", "/api/voice-qna/", "/api/async/voice-qna/", {"question": "Can I prepay?", "language": "en"}),
+}
+
+
+def _server_env(latency_ms: float) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.pop("GCP_PROJECT_ID", None)
+    env.update({
+        "BENCH_MODEL_LATENCY_MS": str(latency_ms),
+        # Measure the deployment, not our own admission limits
+        "MODEL_MAX_CONCURRENCY": "100000",
+        "MODEL_RATE_PER_MINUTE": "100000000",
+        "MODEL_BURST": "100000000",
+        "LOGGING_LEVEL": "WARNING",
+    })
+    return env
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="chat")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--latency-ms", type=float, default=1000.0, help="fake model latency")
+    parser.add_argument("--sync-workers", type=int, default=2, help="matches the Dockerfile gunicorn command")
+    parser.add_argument("--sync-threads", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    method, sync_path, async_path, payload = ENDPOINTS[args.endpoint]
+    env = _server_env(args.latency_ms)
+    deployments = [
+        ("gunicorn-sync", [
+            sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{args.port}",
+            "--workers", str(args.sync_workers), "--threads", str(args.sync_threads),
+            "--timeout", "120", "benchmarks.serve:wsgi_application",
+        ], sync_path),
+        ("uvicorn-async", [
+            sys.executable, "-m", "uvicorn", "benchmarks.serve:asgi_application",
+            "--host", "127.0.0.1", "--port", str(args.port), "--workers", "1", "--log-level", "warning",
+        ], async_path),
+    ]
+
+    results = []
+    for name, cmd, path in deployments:
+        with loadgen.running_server(cmd, args.port, env) as base:
+            for concurrency in args.concurrency:
+                run = asyncio.run(loadgen.run(base + path, concurrency, args.duration, method, payload))
+                row = {"deployment": name, "endpoint": args.endpoint, "concurrency": concurrency, **run.summary()}
+                results.append(row)
+                print(
+                    f"{name:14} c={concurrency:<4} {row['throughput_rps']:8.1f} req/s  "
+                    f"p50={row['p50_ms']:7.0f}ms  p99={row['p99_ms']:7.0f}ms  errors={row['errors']}"
+                )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"latency_ms": args.latency_ms, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""Prompt size and latency of risk analysis with the clause pre-filter.
+
+For each document of a sample corpus, compares the full-document risk
+prompt with the pre-filtered one (``api.services.clauses``): prompt tokens,
+time spent filtering locally, and the latency of the model call on the fake
+model, whose time to first token grows with the prompt
+(``--prefill-tokens-per-sec``). The built-in corpus is generated loan,
+insurance and tenancy agreements, mostly boilerplate with a few risky
+clauses planted in each, so it also reports how many of those the filter
+kept (recall). ``--corpus DIR`` reads ``*.txt`` files instead. Run from
+``backend/``:
+
+    python -m benchmarks.clauses
+    python -m benchmarks.clauses --documents 30 --clauses 120 --output clauses.json
+    python -m benchmarks.clauses --corpus ~/contracts --prefill-tokens-per-sec 2000
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+BOILERPLATE = (
+    "This Agreement is made on the date stated in the Schedule between the parties named in it.",
+    "Words defined in the Schedule have the same meaning when used in this Agreement.",
+    "Headings are for convenience only and do not affect the meaning of any provision.",
+    "The Borrower confirms that the information given in the application form is true and complete.",
+    "Each instalment shall be paid on the due date by electronic transfer to the account notified.",
+    "Notices under this Agreement shall be in writing and sent to the address in the Schedule.",
+    "The Insured shall keep the policy documents in a safe place and produce them when requested.",
+    "The Tenant shall use the premises for residential purposes only and keep them clean.",
+    "A reference to a person includes a company, trust, partnership or other body.",
+    "The singular includes the plural and a reference to one gender includes every gender.",
+    "Payments shall be made in Indian Rupees unless the Schedule states another currency.",
+    "The Company shall send an account statement every quarter to the registered email address.",
+    "The parties shall act in good faith and cooperate to give effect to this Agreement.",
+    "This Agreement may be signed in counterparts, which together form one instrument.",
+    "The Schedule forms part of this Agreement and shall be read together with it.",
+    "The premium shall be paid annually in advance on or before the renewal date shown in the Schedule.",
+)
+
+RISKY = {
+    "loan": (
+        "If any instalment is not paid on the due date, the Borrower shall pay a late payment fee of 2% per month "
+        "on the overdue amount until it is paid.",
+        "Foreclosure of the loan within the first 12 months attracts foreclosure charges of 4% of the outstanding "
+        "principal.",
+        "The Bank may revise the interest rate at its sole discretion and the revised rate applies from the next "
+        "instalment.",
+        "The Borrower shall indemnify the Bank against all losses, costs and expenses arising from any breach.",
+        "Any dispute shall be referred to arbitration by a sole arbitrator appointed by the Bank.",
+        "The Bank shall have a lien and right of set-off over all deposits of the Borrower.",
+        "A cheque bounce charge of Rs. 500 applies each time a payment instrument is dishonoured.",
+    ),
+    "insurance": (
+        "Claims arising from pre-existing diseases are not covered during a waiting period of 48 months.",
+        "The policy shall auto-renew every year and the premium is charged to the card on file.",
+        "A co-payment of 20% applies to every claim made by an insured person above 60 years of age.",
+        "The exclusions listed in Annexure II apply in addition to any other conditions of this policy.",
+        "The Company may cancel the policy without notice on grounds of misrepresentation.",
+    ),
+    "tenancy": (
+        "The security deposit is non-refundable if the Tenant leaves before the lock-in period ends.",
+        "The rent shall be subject to an escalation of 10% every year on the anniversary of this Agreement.",
+        "The Landlord may terminate this Agreement by giving one month's notice for any reason.",
+        "The Tenant is liable for all damage to the premises, including damage caused by fire or flood.",
+    ),
+}
+
+
+def sample_corpus(documents: int, clauses: int, risky: int, seed: int) -> List[Tuple[str, str, Set[str]]]:
+    """(name, text, references of the planted risky clauses) for generated agreements."""
+    rng = random.Random(seed)
+    corpus = []
+    kinds = sorted(RISKY)
+    for n in range(documents):
+        kind = kinds[n % len(kinds)]
+        planted = rng.sample(RISKY[kind], min(risky, len(RISKY[kind])))
+        positions = set(rng.sample(range(1, clauses + 1), len(planted)))
+        lines, refs = [f"{kind.upper()} AGREEMENT", ""], set()
+        for number in range(1, clauses + 1):
+            if number in positions:
+                body = planted.pop()
+                refs.add(str(number))
+            else:
+                body = " ".join(rng.sample(BOILERPLATE, 3))
+            lines.extend([f"{number}. {body}", ""])
+        corpus.append((f"{kind}-{n}", "\n".join(lines), refs))
+    return corpus
+
+
+def read_corpus(directory: str) -> List[Tuple[str, str, Optional[Set[str]]]]:
+    corpus: List[Tuple[str, str, Optional[Set[str]]]] = []
+    for path in sorted(glob.glob(os.path.join(os.path.expanduser(directory), "*.txt"))):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            corpus.append((os.path.basename(path), f.read(), None))
+    return corpus
+
+
+def _timed_call(model, parts: List[object]) -> float:
+    started = time.perf_counter()
+    model.generate_content(parts)
+    return time.perf_counter() - started
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def run(corpus, model) -> Dict[str, Any]:
+    from api.services import clauses, tokens, vertex
+
+    rows = []
+    for name, text, planted in corpus:
+        started = time.perf_counter()
+        selected = clauses.select(text)
+        filter_s = time.perf_counter() - started
+        full_parts: List[object] = [text, vertex.RISKS_PROMPT]
+        filtered_parts: List[object] = [vertex.RISK_CLAUSES_PROMPT, selected] if selected else full_parts
+        kept = {c.ref for c in clauses.candidates(text)} if selected else None
+        rows.append({
+            "document": name,
+            "full_tokens": tokens.estimate_text(text + vertex.RISKS_PROMPT),
+            "filtered_tokens": sum(tokens.estimate_text(p) for p in filtered_parts if isinstance(p, str)),
+            "filter_ms": filter_s * 1000,
+            "full_s": _timed_call(model, full_parts),
+            "filtered_s": filter_s + _timed_call(model, filtered_parts),
+            "fallback": selected is None,
+            "recall": (len(planted & kept) / len(planted) if kept is not None else 1.0) if planted else None,
+        })
+    full = sum(r["full_tokens"] for r in rows)
+    filtered = sum(r["filtered_tokens"] for r in rows)
+    recalls = [r["recall"] for r in rows if r["recall"] is not None]
+    summary = {
+        "documents": len(rows),
+        "fallbacks": sum(r["fallback"] for r in rows),
+        "full_tokens_mean": full / max(1, len(rows)),
+        "filtered_tokens_mean": filtered / max(1, len(rows)),
+        "token_reduction": 1 - filtered / full if full else 0.0,
+        "filter_ms_p50": _percentile([r["filter_ms"] for r in rows], 0.5),
+        "full_s_p50": _percentile([r["full_s"] for r in rows], 0.5),
+        "full_s_p90": _percentile([r["full_s"] for r in rows], 0.9),
+        "filtered_s_p50": _percentile([r["filtered_s"] for r in rows], 0.5),
+        "filtered_s_p90": _percentile([r["filtered_s"] for r in rows], 0.9),
+        "recall_mean": statistics.mean(recalls) if recalls else None,
+    }
+    return {"summary": summary, "documents": rows}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory of .txt documents (default: generated agreements)")
+    parser.add_argument("--documents", type=int, default=12, help="generated documents")
+    parser.add_argument("--clauses", type=int, default=80, help="numbered clauses per generated document")
+    parser.add_argument("--risky", type=int, default=4, help="risky clauses planted per generated document")
+    parser.add_argument("--model-latency-ms", type=float, default=300.0, help="fake model first-token latency")
+    parser.add_argument("--prefill-tokens-per-sec", type=float, default=4000.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="fake model output speed (0 = instant)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "legalease.settings")
+    import django
+
+    django.setup()
+    from benchmarks.fakes import FakeModel, Latency
+
+    corpus = read_corpus(args.corpus) if args.corpus else sample_corpus(args.documents, args.clauses, args.risky,
+                                                                         args.seed)
+    if not corpus:
+        print("no documents", file=sys.stderr)
+        return 1
+    model = FakeModel(Latency(args.model_latency_ms), args.tokens_per_sec,
+                      prefill_tokens_per_sec=args.prefill_tokens_per_sec)
+    result = run(corpus, model)
+    s = result["summary"]
+    print(f"documents          {s['documents']} ({s['fallbacks']} sent whole)")
+    print(f"prompt tokens      full={s['full_tokens_mean']:8.0f}  filtered={s['filtered_tokens_mean']:8.0f}  "
+          f"reduction={s['token_reduction'] * 100:5.1f}%")
+    print(f"filtering          p50={s['filter_ms_p50']:8.2f}ms")
+    print(f"risk call latency  full p50={s['full_s_p50'] * 1000:7.0f}ms p90={s['full_s_p90'] * 1000:7.0f}ms  "
+          f"filtered p50={s['filtered_s_p50'] * 1000:7.0f}ms p90={s['filtered_s_p90'] * 1000:7.0f}ms")
+    if s["recall_mean"] is not None:
+        print(f"planted clauses    recall={s['recall_mean'] * 100:5.1f}%")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), **result}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Compare two ``benchmarks.suite`` result files.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.10
+
+Prints p50/p99/throughput per scenario and concurrency with the relative
+change, and exits 1 if any p50 or p99 got slower, or throughput dropped, by
+more than the threshold (so it can gate CI).
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Tuple
+
+
+def _load(path: str) -> Tuple[dict, Dict[Tuple[str, int], dict]]:
+    with open(path) as f:
+        report = json.load(f)
+    return report.get("meta", {}), {(r["scenario"], r["concurrency"]): r for r in report["results"]}
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before if before else 0.0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args()
+
+    base_meta, base = _load(args.baseline)
+    cand_meta, cand = _load(args.candidate)
+    print(f"baseline {base_meta.get('commit', '?')}  vs  candidate {cand_meta.get('commit', '?')}")
+    if base_meta.get("fakes") != cand_meta.get("fakes"):
+        print("warning: fake backend settings differ between runs")
+
+    regressions = []
+    for key in sorted(base.keys() & cand.keys()):
+        b, c = base[key], cand[key]
+        changes = {
+            "p50": _change(b["p50_ms"], c["p50_ms"]),
+            "p99": _change(b["p99_ms"], c["p99_ms"]),
+            "rps": _change(b["throughput_rps"], c["throughput_rps"]),
+        }
+        worse = [m for m in ("p50", "p99") if changes[m] > args.threshold]
+        if changes["rps"] < -args.threshold:
+            worse.append("rps")
+        if worse:
+            regressions.append((key, worse))
+        print(
+            f"{key[0]:8} c={key[1]:<4} p50 {b['p50_ms']:7.0f} -> {c['p50_ms']:7.0f}ms ({changes['p50']:+.0%})  "
+            f"p99 {b['p99_ms']:7.0f} -> {c['p99_ms']:7.0f}ms ({changes['p99']:+.0%})  "
+            f"rps {b['throughput_rps']:7.1f} -> {c['throughput_rps']:7.1f} ({changes['rps']:+.0%})"
+            + ("  REGRESSION" if worse else "")
+        )
+    for key in sorted(base.keys() ^ cand.keys()):
+        print(f"{key[0]:8} c={key[1]:<4} only in {'baseline' if key in base else 'candidate'}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
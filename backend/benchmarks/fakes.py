@@ -0,0 +1,608 @@
+"""Offline stand-ins for Google services used by the benchmarks.
+
+Each fake mirrors the slice of the SDK the service layer uses and is plugged
+in through that module's seam (``vertex.install_backends``,
+``gcs.install_backend``, ``firestore.install_backends``,
+``auth.install_verifier``), so the real views, scheduler, retries and
+metrics all run; only the network is simulated. Django is only imported
+when the fakes are installed, so the load-driving side can use ``BenchConfig``
+without settings.
+
+Every fake draws its latency from a ``Latency`` (log-normal around a median,
+so tails look like a real service) and fails a configurable fraction of calls
+with ``ServiceUnavailable``, which the retry layer treats as transient.
+``FakeModel`` also models generation speed: output arrives at
+``tokens_per_sec`` after the first-token latency, and ``stream=True`` yields
+it in chunks. With ``prefill_tokens_per_sec`` the first token also waits for
+the prompt to be read, so longer prompts are slower.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, fields
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+RISKS = [
+    {"clause": "Late payment fee", "risk": "High", "explanation": "2% per month on overdue EMIs."},
+    {"clause": "Foreclosure charges", "risk": "Medium", "explanation": "4% of outstanding principal."},
+]
+GLOSSARY = [
+    {"term": "EMI", "definition": "Equated Monthly Instalment."},
+    {"term": "Lien", "definition": "The lender's right to hold your asset until the loan is repaid."},
+]
+SUMMARY = "You repay monthly.\nLate payments cost 2% a month.\nClosing early costs 4%."
+ANSWER = "Check the repayment schedule and late fee clauses."
+TRANSCRIPT = "What happens if I don't pay my EMI?"
+
+# Rough token accounting, enough for usage metrics and token-rate timing
+CHARS_PER_TOKEN = 4
+FILE_PART_TOKENS = 1500
+STREAM_CHUNK_TOKENS = 8
+
+
+class Latency:
+    """Log-normal delay: ``median_ms`` with spread ``sigma`` (0 = fixed)."""
+
+    def __init__(self, median_ms: float = 0.0, sigma: float = 0.0, rng: Optional[random.Random] = None):
+        self.median = median_ms / 1000
+        self.sigma = sigma
+        self.rng = rng or random.Random()
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self.sigma * self.rng.gauss(0, 1)) if self.sigma else self.median
+
+
+class _Faulty:
+    def __init__(self, latency: Latency, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0  # most calls seen waiting at once
+        self._lock = threading.Lock()
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.calls += 1
+            if self.error_rate and self.latency.rng.random() < self.error_rate:
+                self.failures += 1
+                return True
+            return False
+
+    @staticmethod
+    def _error(what: str) -> Exception:
+        from google.api_core import exceptions as gexc  # type: ignore
+
+        return gexc.ServiceUnavailable(f"fake {what} unavailable")
+
+    def _enter(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _exit(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def _call(self, what: str, extra: float = 0.0) -> None:
+        delay = self.latency.sample() + extra
+        failed = self._should_fail()
+        self._enter()
+        try:
+            time.sleep(delay / 2 if failed else delay)
+        finally:
+            self._exit()
+        if failed:
+            raise self._error(what)
+
+    async def _acall(self, what: str, extra: float = 0.0) -> None:
+        delay = self.latency.sample() + extra
+        failed = self._should_fail()
+        self._enter()
+        try:
+            await asyncio.sleep(delay / 2 if failed else delay)
+        finally:
+            self._exit()
+        if failed:
+            raise self._error(what)
+
+
+# --- Vertex / Speech / TTS -------------------------------------------------
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+TRANSLATED = "[translated] "
+DEFINED = "[defined] "
+
+
+def _translated(value: Any) -> Any:
+    if isinstance(value, str):
+        return TRANSLATED + value
+    if isinstance(value, list):
+        return [_translated(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _translated(v) for k, v in value.items()}
+    return value
+
+
+class FakeModel(_Faulty):
+    def __init__(self, latency: Optional[Latency] = None, tokens_per_sec: float = 0.0, error_rate: float = 0.0,
+                 prefill_tokens_per_sec: float = 0.0):
+        super().__init__(latency or Latency(), error_rate)
+        self.tokens_per_sec = tokens_per_sec
+        self.prefill_tokens_per_sec = prefill_tokens_per_sec
+
+    def _text(self, parts: List[object]) -> str:
+        from api.services import longdoc, vertex
+
+        prompts = [p for p in parts if isinstance(p, str)]
+        translate = vertex.TRANSLATE_PROMPT.split("{")[0]
+        for prompt in prompts:
+            if prompt.startswith(translate):
+                return json.dumps(_translated(json.loads(prompt.split("\n\n", 1)[1])), ensure_ascii=False)
+        if {vertex.RISKS_PROMPT, vertex.RISK_CLAUSES_PROMPT, longdoc.SECTION_RISKS_PROMPT} & set(prompts):
+            return json.dumps(RISKS)
+        if vertex.DEFINE_TERMS_PROMPT in prompts:
+            # Defines every term it is asked about
+            terms = re.findall(r"^Term: (.+)$", prompts[-1], re.MULTILINE)
+            return json.dumps([{"term": t, "definition": DEFINED + t, "general": True} for t in terms])
+        if vertex.GLOSSARY_PROMPT in prompts or longdoc.SECTION_GLOSSARY_PROMPT in prompts:
+            return json.dumps(GLOSSARY)
+        if {vertex.SUMMARY_PROMPT, longdoc.SECTION_SUMMARY_PROMPT, longdoc.REDUCE_SUMMARY_PROMPT} & set(prompts):
+            return SUMMARY
+        return ANSWER
+
+    def _prompt_tokens(self, parts: List[object]) -> int:
+        return sum(_tokens(p) if isinstance(p, str) else FILE_PART_TOKENS for p in parts)
+
+    def _generation_time(self, text: str) -> float:
+        return _tokens(text) / self.tokens_per_sec if self.tokens_per_sec else 0.0
+
+    def _prefill_time(self, parts: List[object]) -> float:
+        return self._prompt_tokens(parts) / self.prefill_tokens_per_sec if self.prefill_tokens_per_sec else 0.0
+
+    def _response(self, text: str, prompt_tokens: int, output_tokens: int) -> SimpleNamespace:
+        usage = SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+                                total_token_count=prompt_tokens + output_tokens)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def _chunks(self, text: str) -> List[str]:
+        size = STREAM_CHUNK_TOKENS * CHARS_PER_TOKEN
+        return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+    def generate_content(self, parts, stream: bool = False, **_kwargs):
+        parts = parts if isinstance(parts, list) else [parts]
+        text = self._text(parts)
+        if stream:
+            return self._stream(parts, text)
+        self._call("model", self._prefill_time(parts) + self._generation_time(text))
+        return self._response(text, self._prompt_tokens(parts), _tokens(text))
+
+    def _stream(self, parts: List[object], text: str) -> Iterator[SimpleNamespace]:
+        self._call("model", self._prefill_time(parts))
+        for chunk in self._chunks(text):
+            time.sleep(self._generation_time(chunk))
+            yield self._response(chunk, self._prompt_tokens(parts), _tokens(chunk))
+
+    async def generate_content_async(self, parts, stream: bool = False, **_kwargs):
+        parts = parts if isinstance(parts, list) else [parts]
+        text = self._text(parts)
+        if stream:
+            return self._astream(parts, text)
+        await self._acall("model", self._prefill_time(parts) + self._generation_time(text))
+        return self._response(text, self._prompt_tokens(parts), _tokens(text))
+
+    async def _astream(self, parts: List[object], text: str):
+        await self._acall("model", self._prefill_time(parts))
+        for chunk in self._chunks(text):
+            await asyncio.sleep(self._generation_time(chunk))
+            yield self._response(chunk, self._prompt_tokens(parts), _tokens(chunk))
+
+    def count_tokens(self, parts, **_kwargs):
+        parts = parts if isinstance(parts, list) else [parts]
+        return SimpleNamespace(total_tokens=self._prompt_tokens(parts))
+
+    async def count_tokens_async(self, parts, **_kwargs):
+        return self.count_tokens(parts)
+
+
+class FakeSpeechClient(_Faulty):
+    def recognize(self, config=None, audio=None, **_kwargs):
+        self._call("speech")
+        alternative = SimpleNamespace(transcript=TRANSCRIPT)
+        return SimpleNamespace(results=[SimpleNamespace(alternatives=[alternative])])
+
+
+class FakeTTSClient(_Faulty):
+    # ~1 KiB of "MP3" per 10 characters of input
+    def synthesize_speech(self, input=None, voice=None, audio_config=None, **_kwargs):
+        self._call("tts")
+        text = getattr(input, "text", "") or ""
+        return SimpleNamespace(audio_content=b"\0" * (len(text) * 100))
+
+
+# --- Cloud Storage ---------------------------------------------------------
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.generation: Optional[int] = None
+        self.size: Optional[int] = None
+        self.md5_hash: Optional[str] = None
+
+    def _transfer_time(self, size: int) -> float:
+        return size / (self.bucket.mbps * 1_000_000) if self.bucket.mbps else 0.0
+
+    def upload_from_string(self, data, content_type: Optional[str] = None, **_kwargs):
+        data = data.encode() if isinstance(data, str) else bytes(data)
+        self.bucket._call("storage", self._transfer_time(len(data)))
+        self.bucket.objects[self.name] = data
+        self.bucket.generations[self.name] = self.bucket.generations.get(self.name, 0) + 1
+
+    def upload_from_file(self, file_obj, content_type: Optional[str] = None, **_kwargs):
+        self.upload_from_string(file_obj.read(), content_type)
+
+    def download_as_bytes(self, **_kwargs) -> bytes:
+        data = self.bucket.objects.get(self.name)
+        if data is None:
+            from google.api_core import exceptions as gexc  # type: ignore
+
+            raise gexc.NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        self.bucket._call("storage", self._transfer_time(len(data)))
+        return data
+
+    def download_to_file(self, file_obj, if_generation_match: Optional[int] = None, **_kwargs) -> None:
+        if if_generation_match is not None and self.bucket.generations.get(self.name, 1) != if_generation_match:
+            from google.api_core import exceptions as gexc  # type: ignore
+
+            raise gexc.PreconditionFailed(f"Generation mismatch: {self.bucket.name}/{self.name}")
+        file_obj.write(self.download_as_bytes())
+
+    def reload(self, **_kwargs) -> None:
+        self.bucket._call("storage")
+        if self.name not in self.bucket.objects:
+            from google.api_core import exceptions as gexc  # type: ignore
+
+            raise gexc.NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        self.generation = self.bucket.generations.get(self.name, 1)
+        data = self.bucket.objects[self.name]
+        self.size = len(data)
+        self.md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+    def exists(self, **_kwargs) -> bool:
+        return self.name in self.bucket.objects
+
+    def delete(self, **_kwargs) -> None:
+        self.bucket._call("storage")
+        self.bucket.objects.pop(self.name, None)
+
+
+class FakeBucket(_Faulty):
+    def __init__(self, name: str, latency: Optional[Latency] = None, mbps: float = 0.0, error_rate: float = 0.0):
+        super().__init__(latency or Latency(), error_rate)
+        self.name = name
+        self.mbps = mbps
+        self.objects: Dict[str, bytes] = {}
+        self.generations: Dict[str, int] = {}
+
+    @property
+    def client(self) -> "FakeBucket":
+        return self
+
+    def bucket(self, _name: str) -> "FakeBucket":
+        return self
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix: str = "", **_kwargs) -> List[FakeBlob]:
+        self._call("storage")
+        return [FakeBlob(self, name) for name in sorted(self.objects) if name.startswith(prefix)]
+
+    def copy_blob(self, blob: FakeBlob, destination: "FakeBucket", new_name: str, **_kwargs) -> FakeBlob:
+        # Server-side copy: latency, but no transfer time
+        self._call("storage")
+        destination.objects[new_name] = self.objects[blob.name]
+        destination.generations[new_name] = destination.generations.get(new_name, 0) + 1
+        return FakeBlob(destination, new_name)
+
+
+# --- Firestore -------------------------------------------------------------
+
+class FakeSnapshot:
+    def __init__(self, doc_id: str, data: Optional[Dict[str, Any]]):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return dict(self._data) if self._data is not None else None
+
+
+_OPS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "array_contains": lambda a, b: b in (a or []),
+}
+
+
+class FakeQuery:
+    def __init__(self, db: "FakeFirestore", collection: str):
+        self._db = db
+        self._collection = collection
+        self._filters: List[tuple] = []
+        self._order: List[tuple] = []
+        self._limit: Optional[int] = None
+        self._fields: Optional[List[str]] = None
+        self._after: Optional[Dict[str, Any]] = None
+
+    def _copy(self) -> "FakeQuery":
+        query = FakeQuery(self._db, self._collection)
+        query._filters, query._order, query._limit = list(self._filters), list(self._order), self._limit
+        query._fields, query._after = self._fields, self._after
+        return query
+
+    def where(self, field_path: str, op_string: str, value: Any) -> "FakeQuery":
+        query = self._copy()
+        query._filters.append((field_path, _OPS[op_string], value))
+        return query
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "FakeQuery":
+        query = self._copy()
+        query._order.append((field_path, str(direction).upper().endswith("DESCENDING")))
+        return query
+
+    def limit(self, count: int) -> "FakeQuery":
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def select(self, field_paths: List[str]) -> "FakeQuery":
+        query = self._copy()
+        query._fields = list(field_paths)
+        return query
+
+    def start_after(self, values: Dict[str, Any]) -> "FakeQuery":
+        """Continue after the row with these ordered-field values (``__name__`` may be a doc ref)."""
+        query = self._copy()
+        query._after = {f: getattr(v, "id", v) if f == "__name__" else v for f, v in values.items()}
+        return query
+
+    @staticmethod
+    def _value(doc_id: str, data: Dict[str, Any], field_path: str) -> Any:
+        return doc_id if field_path == "__name__" else data.get(field_path)
+
+    def _is_after(self, doc_id: str, data: Dict[str, Any]) -> bool:
+        for field_path, descending in self._order:
+            value, bound = self._value(doc_id, data, field_path), self._after[field_path]
+            if value != bound:
+                return value < bound if descending else value > bound
+        return False
+
+    def _results(self) -> List[FakeSnapshot]:
+        rows = [(doc_id, data) for doc_id, data in self._db.data.get(self._collection, {}).items()
+                if all(op(data.get(f), v) for f, op, v in self._filters)]
+        for field_path, descending in reversed(self._order):
+            rows.sort(key=lambda row: (self._value(*row, field_path) is None, self._value(*row, field_path)),
+                      reverse=descending)
+        if self._after is not None:
+            rows = [row for row in rows if self._is_after(*row)]
+        if self._limit is not None:
+            rows = rows[: self._limit]
+        if self._fields is not None:
+            rows = [(doc_id, {f: data[f] for f in self._fields if f in data}) for doc_id, data in rows]
+        return [FakeSnapshot(doc_id, data) for doc_id, data in rows]
+
+    def stream(self, **_kwargs) -> Iterator[FakeSnapshot]:
+        self._db._call("firestore")
+        return iter(self._results())
+
+    def get(self, **_kwargs) -> List[FakeSnapshot]:
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id: Optional[str] = None) -> "FakeDocRef":
+        return FakeDocRef(self._db, self._collection, doc_id or uuid.uuid4().hex[:20])
+
+
+class FakeDocRef:
+    def __init__(self, db: "FakeFirestore", collection: str, doc_id: str):
+        self._db = db
+        self._collection = collection
+        self.id = doc_id
+
+    def _apply(self, data: Dict[str, Any], merge: bool = False) -> None:
+        docs = self._db.data.setdefault(self._collection, {})
+        docs[self.id] = {**docs.get(self.id, {}), **data} if merge else dict(data)
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        self._db._call("firestore")
+        self._apply(data, merge)
+
+    def update(self, data: Dict[str, Any]) -> None:
+        self.set(data, merge=True)
+
+    def get(self, **_kwargs) -> FakeSnapshot:
+        self._db._call("firestore")
+        return FakeSnapshot(self.id, self._db.data.get(self._collection, {}).get(self.id))
+
+    def delete(self) -> None:
+        self._db._call("firestore")
+        self._db.data.get(self._collection, {}).pop(self.id, None)
+
+
+class FakeBatch:
+    def __init__(self, db: "FakeFirestore"):
+        self._db = db
+        self._writes: List[tuple] = []
+
+    def set(self, ref: FakeDocRef, data: Dict[str, Any], merge: bool = False) -> None:
+        self._writes.append((ref, data, merge))
+
+    def commit(self) -> None:
+        # One round trip for the whole batch
+        self._db._call("firestore")
+        for ref, data, merge in self._writes:
+            ref._apply(data, merge)
+        self._writes = []
+
+
+class FakeFirestore(_Faulty):
+    def __init__(self, latency: Optional[Latency] = None, error_rate: float = 0.0):
+        super().__init__(latency or Latency(), error_rate)
+        self.data: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+
+class _AsyncDocRef:
+    def __init__(self, ref: FakeDocRef):
+        self._ref = ref
+        self.id = ref.id
+
+    async def get(self, **_kwargs) -> FakeSnapshot:
+        await self._ref._db._acall("firestore")
+        return FakeSnapshot(self.id, self._ref._db.data.get(self._ref._collection, {}).get(self.id))
+
+    async def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        await self._ref._db._acall("firestore")
+        self._ref._apply(data, merge)
+
+
+class _AsyncCollection:
+    def __init__(self, collection: FakeCollection):
+        self._collection = collection
+
+    def document(self, doc_id: Optional[str] = None) -> _AsyncDocRef:
+        return _AsyncDocRef(self._collection.document(doc_id))
+
+
+class FakeAsyncFirestore:
+    """Async client view over the same data as a ``FakeFirestore``."""
+
+    def __init__(self, db: FakeFirestore):
+        self._db = db
+
+    def collection(self, name: str) -> _AsyncCollection:
+        return _AsyncCollection(self._db.collection(name))
+
+
+# --- Wiring ----------------------------------------------------------------
+
+@dataclass
+class BenchConfig:
+    """Latency (median ms, log-normal sigma) and error rate of each fake service."""
+
+    model_latency_ms: float = 1000.0
+    model_sigma: float = 0.0
+    model_tokens_per_sec: float = 0.0
+    model_prefill_tokens_per_sec: float = 0.0
+    model_error_rate: float = 0.0
+    speech_latency_ms: float = 0.0
+    storage_latency_ms: float = 0.0
+    storage_mbps: float = 0.0
+    firestore_latency_ms: float = 0.0
+    service_sigma: float = 0.0
+    service_error_rate: float = 0.0
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_env(cls) -> "BenchConfig":
+        """Read ``BENCH_<FIELD>`` overrides, e.g. ``BENCH_MODEL_LATENCY_MS=800``."""
+        values: Dict[str, Any] = {}
+        for f in fields(cls):
+            raw = os.getenv(f"BENCH_{f.name.upper()}")
+            if raw:
+                values[f.name] = int(raw) if f.name == "seed" else float(raw)
+        return cls(**values)
+
+    def env(self) -> Dict[str, str]:
+        return {f"BENCH_{f.name.upper()}": str(getattr(self, f.name))
+                for f in fields(self) if getattr(self, f.name) is not None}
+
+
+BENCH_DOCUMENT_ID = "bench-doc"
+
+
+def seed(db: FakeFirestore, bucket: FakeBucket, faqs: int = 20) -> None:
+    """Create the document (and its file) and FAQs the benchmarks reference.
+
+    Writes go straight into the fakes so seeding never sees injected latency or errors.
+    """
+    gcs_path = "uploads/None/bench/loan-agreement.pdf"
+    db.data.setdefault("documents", {})[BENCH_DOCUMENT_ID] = {
+        "userId": None,
+        "filename": "loan-agreement.pdf",
+        "contentType": "application/pdf",
+        "category": "Bank",
+        "gcsPath": gcs_path,
+        "status": "uploaded",
+    }
+    bucket.objects[gcs_path] = b"%PDF-1.4 bench loan agreement"
+    db.data["faqs"] = {
+        f"faq-{i}": {"question": f"Question {i}?", "answer": f"Answer {i}.", "popularity": faqs - i}
+        for i in range(faqs)
+    }
+
+
+def install(config: BenchConfig) -> Dict[str, Any]:
+    """Plug fakes for every Google service into the service layer and seed test data."""
+    from api import auth
+    from api.services import firestore, gcs, glossary, versions, vertex
+
+    rng = random.Random(config.seed)
+
+    def service_latency(ms: float) -> Latency:
+        return Latency(ms, config.service_sigma, rng)
+
+    fakes: Dict[str, Any] = {
+        "model": FakeModel(Latency(config.model_latency_ms, config.model_sigma, rng),
+                           config.model_tokens_per_sec, config.model_error_rate,
+                           config.model_prefill_tokens_per_sec),
+        "speech": FakeSpeechClient(service_latency(config.speech_latency_ms), config.service_error_rate),
+        "tts": FakeTTSClient(service_latency(config.speech_latency_ms), config.service_error_rate),
+        "bucket": FakeBucket(gcs.get_bucket_name(), service_latency(config.storage_latency_ms),
+                             config.storage_mbps, config.service_error_rate),
+        "db": FakeFirestore(service_latency(config.firestore_latency_ms), config.service_error_rate),
+    }
+    if os.getenv("VERTEX_CASSETTE_MODE", "").lower() != "replay":
+        # Otherwise the recorded responses installed at startup answer model/speech/TTS calls
+        vertex.install_backends(model=fakes["model"], speech_client=fakes["speech"], tts_client=fakes["tts"])
+    gcs.install_backend(fakes["bucket"])
+    firestore.install_backends(db=fakes["db"], async_db=FakeAsyncFirestore(fakes["db"]))
+    # Learned glossary terms and compared versions refer to the stores just replaced
+    glossary.reset()
+    versions.reset()
+    # Any bearer token is accepted and used as the uid, so load can be spread over users
+    auth.install_verifier(lambda token: {"uid": token})
+    seed(fakes["db"], fakes["bucket"])
+    return fakes
+
+
+def install_from_env() -> Dict[str, Any]:
+    return install(BenchConfig.from_env())
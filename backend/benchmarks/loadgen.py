@@ -0,0 +1,135 @@
+"""Minimal asyncio HTTP/1.1 load generator (no third-party dependencies)."""
+import asyncio
+import json
+import subprocess
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+# A request body, or a function returning one per request (e.g. unique upload names)
+Body = Union[None, bytes, Callable[[int], bytes]]
+
+
+@dataclass
+class Result:
+    latencies: List[float] = field(default_factory=list)
+    statuses: Dict[int, int] = field(default_factory=dict)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.latencies)
+
+        def pct(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+        ok = sum(n for code, n in self.statuses.items() if 200 <= code < 300)
+        return {
+            "requests": len(self.latencies),
+            "ok": ok,
+            "errors": self.errors + len(self.latencies) - ok,
+            "throughput_rps": ok / self.elapsed if self.elapsed else 0.0,
+            "p50_ms": pct(50),
+            "p90_ms": pct(90),
+            "p99_ms": pct(99),
+            "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+        }
+
+
+def multipart(fields: Dict[str, str], files: Dict[str, Tuple[str, str, bytes]]) -> Tuple[bytes, str]:
+    """Encode form fields and ``name: (filename, content_type, data)`` files; returns (body, content type)."""
+    boundary = uuid.uuid4().hex
+    chunks: List[bytes] = []
+    for name, value in fields.items():
+        chunks.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content_type, data) in files.items():
+        chunks.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n".encode() + data + b"\r\n"
+        )
+    chunks.append(f"--{boundary}--\r\n".encode())
+    return b"".join(chunks), f"multipart/form-data; boundary={boundary}"
+
+
+async def _request(host: str, port: int, method: str, path: str, body: Optional[bytes],
+                   headers: Optional[Dict[str, str]] = None) -> int:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n"
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        if body is None:
+            headers.pop("Content-Type")
+        else:
+            headers["Content-Length"] = str(len(body))
+        head += "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        writer.write(head.encode() + b"\r\n" + (body or b""))
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()  # drain until the server closes
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def run(url: str, concurrency: int, duration: float, method: str = "GET",
+              payload: Optional[dict] = None, timeout: float = 120.0, body: Body = None,
+              headers: Optional[Dict[str, str]] = None,
+              headers_for: Optional[Callable[[int], Dict[str, str]]] = None) -> Result:
+    """Keep ``concurrency`` requests in flight against ``url`` for ``duration`` seconds.
+
+    ``payload`` is sent as JSON; ``body`` (with a ``Content-Type`` in
+    ``headers``) sends raw bytes instead. ``headers_for(worker)`` adds
+    per-worker headers, e.g. a distinct user per connection.
+    """
+    parts = urlsplit(url)
+    if payload is not None:
+        body = json.dumps(payload).encode()
+    target = parts.path + (f"?{parts.query}" if parts.query else "")
+    result = Result()
+    deadline = time.monotonic() + duration
+    counter = iter(range(1 << 62))
+
+    async def worker(index: int):
+        worker_headers = {**(headers or {}), **(headers_for(index) if headers_for else {})}
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            request_body = body(next(counter)) if callable(body) else body
+            try:
+                code = await asyncio.wait_for(
+                    _request(parts.hostname, parts.port or 80, method, target, request_body, worker_headers), timeout
+                )
+                result.statuses[code] = result.statuses.get(code, 0) + 1
+                result.latencies.append(time.monotonic() - started)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                result.errors += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    result.elapsed = time.monotonic() - started
+    return result
+
+
+@contextmanager
+def running_server(cmd: List[str], port: int, env: Dict[str, str]) -> Iterator[str]:
+    """Start a server subprocess, wait until it answers on ``port`` and yield its base URL."""
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(base + "/", timeout=1)
+                break
+            except OSError:
+                time.sleep(0.2)
+        else:
+            raise RuntimeError(f"Server did not start: {' '.join(cmd)}")
+        yield base
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
@@ -0,0 +1,22 @@
+"""WSGI/ASGI entry points with fake Google backends, for load benchmarks.
+
+    gunicorn benchmarks.serve:wsgi_application
+    uvicorn benchmarks.serve:asgi_application
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "legalease.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.asgi import get_asgi_application  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+
+from benchmarks import fakes  # noqa: E402
+
+fakes.install_from_env()
+
+wsgi_application = get_wsgi_application()
+asgi_application = get_asgi_application()
@@ -0,0 +1,109 @@
+"""Measure cold start: process boot to URLconf loaded, then the first request.
+
+Each run is a fresh interpreter, as on a new Cloud Run instance. Run from
+``backend/``:
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --importtime 15   # slowest imports
+
+``--warmup`` also polls ``/ready`` until it reports ready before the first
+request, to show how much of the first-request latency moves into the
+startup probe.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+HEAVY_MODULES = ("vertexai", "google.cloud.speech_v1", "google.cloud.texttospeech_v1",
+                 "google.cloud.storage", "google.cloud.firestore", "firebase_admin")
+
+# Runs in the child interpreter; prints one JSON line
+_PROBE = r"""
+import json, os, sys, time
+t0 = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "legalease.settings")
+import django
+django.setup()
+import legalease.urls  # noqa: F401
+boot = time.perf_counter() - t0
+loaded = [m for m in HEAVY if m in sys.modules]
+from django.test import Client
+client = Client()
+ready = None
+if WARMUP:
+    t1 = time.perf_counter()
+    while client.get("/ready").status_code != 200 and time.perf_counter() - t1 < 60:
+        time.sleep(0.01)
+    ready = time.perf_counter() - t1
+t2 = time.perf_counter()
+client.post("/api/chat/", data={"message": "What is the late fee?"}, content_type="application/json")
+first = time.perf_counter() - t2
+t3 = time.perf_counter()
+client.post("/api/chat/", data={"message": "And the deposit?"}, content_type="application/json")
+second = time.perf_counter() - t3
+print(json.dumps({"boot_s": boot, "ready_s": ready, "first_request_s": first,
+                  "second_request_s": second, "heavy_loaded_at_boot": loaded}))
+"""
+
+
+def _child_env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.pop("GCP_PROJECT_ID", None)
+    env.setdefault("LOGGING_LEVEL", "WARNING")
+    return env
+
+
+def _run_once(warmup: bool) -> Dict[str, object]:
+    code = f"HEAVY = {HEAVY_MODULES!r}\nWARMUP = {warmup!r}\n" + _PROBE
+    out = subprocess.run([sys.executable, "-c", code], env=_child_env(), capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _importtime(top: int) -> List[str]:
+    code = "import django, os; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'legalease.settings'); " \
+           "django.setup(); import legalease.urls"
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=_child_env(),
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(.*)", line)
+        if m:
+            rows.append((int(m.group(2)), m.group(3).rstrip()))
+    rows.sort(reverse=True)
+    return [f"{cumulative / 1000:8.1f}ms {name}" for cumulative, name in rows[:top]]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmup", action="store_true", help="wait for /ready before the first request")
+    parser.add_argument("--importtime", type=int, metavar="N", help="print the N slowest imports instead")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    if args.importtime:
+        print("\n".join(_importtime(args.importtime)))
+        return 0
+
+    runs = [_run_once(args.warmup) for _ in range(args.runs)]
+    summary = {}
+    for key in ("boot_s", "ready_s", "first_request_s", "second_request_s"):
+        values = [r[key] for r in runs if r[key] is not None]
+        if values:
+            summary[key] = {"median": statistics.median(values), "max": max(values)}
+            print(f"{key:18} median={summary[key]['median'] * 1000:8.1f}ms  max={summary[key]['max'] * 1000:8.1f}ms")
+    print(f"heavy SDKs loaded at boot: {runs[-1]['heavy_loaded_at_boot'] or 'none'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"warmup": args.warmup, "runs": runs, "summary": summary}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
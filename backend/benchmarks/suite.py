@@ -0,0 +1,187 @@
+"""Offline benchmark suite for the API endpoints.
+
+Starts the real Django app with fake Vertex, Speech/TTS, Cloud Storage and
+Firestore backends (see ``benchmarks.fakes``), drives each scenario at each
+concurrency level, and writes latency percentiles and throughput as JSON.
+Run from ``backend/``:
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --scenarios analyze chat --concurrency 1 20 --model-error-rate 0.05
+    python -m benchmarks.suite --cassette prod.jsonl.gz --latency-scale 0.5
+    python -m benchmarks.compare baseline.json bench.json
+
+Fake service behaviour defaults to something Cloud-Run-like (1.2s Gemini
+calls, 40ms storage, 15ms Firestore, with log-normal tails); every knob is a
+flag. Use ``--seed`` for repeatable latency and error sequences. With
+``--cassette``, model, Speech and TTS calls are answered from a recording of
+real traffic (see ``api.services.cassette``) instead of the fake model.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+from dataclasses import asdict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from benchmarks import loadgen
+from benchmarks.fakes import BENCH_DOCUMENT_ID, BenchConfig
+
+
+class Scenario(NamedTuple):
+    method: str
+    path: str
+    async_path: Optional[str]  # used with --server asgi when a native async view exists
+    payload: Optional[dict] = None
+    body: Optional[bytes] = None
+    content_type: Optional[str] = None
+    # Send a bench user's bearer token. Off for endpoints that read the seeded
+    # public document, which a signed-in user does not own.
+    authenticated: bool = False
+
+
+def _upload_scenario() -> Scenario:
+    pdf = b"%PDF-1.4\n" + b"Loan agreement clause text. " * 2000  # ~56 KB
+    body, content_type = loadgen.multipart({"category": "Bank"}, {"file": ("loan.pdf", "application/pdf", pdf)})
+    return Scenario("POST", "/api/upload/", None, body=body, content_type=content_type)
+
+
+def scenarios() -> Dict[str, Scenario]:
+    return {
+        "upload": _upload_scenario(),
+        "analyze": Scenario("GET", f"/api/analyze/{BENCH_DOCUMENT_ID}/", f"/api/async/analyze/{BENCH_DOCUMENT_ID}/"),
+        "chat": Scenario("POST", "/api/chat/", "/api/async/chat/",
+                         {"message": "What is the late fee?", "document_id": BENCH_DOCUMENT_ID}),
+        "voice": Scenario("POST", "/api/voice-qna/", "/api/async/voice-qna/",
+                          {"audio_base64": "AAAA", "language": "en"}, authenticated=True),
+        "faq": Scenario("GET", "/api/faq/", None, authenticated=True),
+    }
+
+
+def _server_cmd(server: str, port: int, workers: int, threads: int) -> List[str]:
+    if server == "asgi":
+        return [sys.executable, "-m", "uvicorn", "benchmarks.serve:asgi_application", "--host", "127.0.0.1",
+                "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    return [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+            "--threads", str(threads), "--timeout", "120", "benchmarks.serve:wsgi_application"]
+
+
+def _server_env(config: BenchConfig, extra: Dict[str, str]) -> Dict[str, str]:
+    env = dict(os.environ)
+    for key in ("GCP_PROJECT_ID", "GCS_BUCKET_NAME"):
+        env.pop(key, None)
+    env.update({
+        # Measure the app, not our own admission limits, unless the caller asks
+        "MODEL_MAX_CONCURRENCY": "100000",
+        "MODEL_RATE_PER_MINUTE": "100000000",
+        "MODEL_BURST": "100000000",
+        "LOGGING_LEVEL": "WARNING",
+        **config.env(),
+        **extra,
+    })
+    return env
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True).stdout.strip()
+        return out.stdout.strip() + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> int:
+    all_scenarios = scenarios()
+    defaults = BenchConfig(model_latency_ms=1200, model_sigma=0.35, model_tokens_per_sec=0,
+                           speech_latency_ms=300, storage_latency_ms=40, storage_mbps=100,
+                           firestore_latency_ms=15, service_sigma=0.3)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(all_scenarios), default=list(all_scenarios))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario and level")
+    parser.add_argument("--warmup", type=float, default=3.0,
+                        help="unmeasured seconds per scenario first (imports, worker start-up)")
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi")
+    parser.add_argument("--workers", type=int, default=2, help="matches the Dockerfile gunicorn command")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker (wsgi)")
+    parser.add_argument("--users", type=int, default=1,
+                        help="spread voice/faq load over N bearer-token users (0 = anonymous; they then get 403)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra server environment, e.g. MODEL_MAX_CONCURRENCY=8")
+    parser.add_argument("--cassette", help="replay recorded model/speech/TTS responses from this cassette")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="replay delay multiplier (--cassette)")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int if name == "seed" else float, default=value)
+    args = parser.parse_args()
+
+    config = BenchConfig(**{name: getattr(args, name) for name in asdict(defaults)})
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    if args.cassette:
+        extra_env.update({
+            "VERTEX_CASSETTE_MODE": "replay",
+            "VERTEX_CASSETTE_PATH": os.path.abspath(args.cassette),
+            "VERTEX_CASSETTE_LATENCY_SCALE": str(args.latency_scale),
+            "VERTEX_CASSETTE_MATCH": "loose",
+        })
+    env = _server_env(config, extra_env)
+    cmd = _server_cmd(args.server, args.port, args.workers, args.threads)
+
+    def headers_for(worker: int) -> Dict[str, str]:
+        return {"Authorization": f"Bearer bench-user-{worker % args.users}"} if args.users else {}
+
+    results: List[Dict[str, Any]] = []
+    with loadgen.running_server(cmd, args.port, env) as base:
+        for name in args.scenarios:
+            scenario = all_scenarios[name]
+            path = scenario.async_path if args.server == "asgi" and scenario.async_path else scenario.path
+            headers = {"Content-Type": scenario.content_type} if scenario.content_type else None
+
+            def drive(concurrency: int, duration: float) -> loadgen.Result:
+                return asyncio.run(loadgen.run(
+                    base + path, concurrency, duration, scenario.method, scenario.payload,
+                    body=scenario.body, headers=headers,
+                    headers_for=headers_for if scenario.authenticated else None,
+                ))
+
+            if args.warmup:
+                drive(max(args.concurrency), args.warmup)
+            for concurrency in args.concurrency:
+                run = drive(concurrency, args.duration)
+                row = {"scenario": name, "path": path, "concurrency": concurrency, **run.summary(),
+                       "statuses": {str(k): v for k, v in sorted(run.statuses.items())}}
+                results.append(row)
+                print(
+                    f"{name:8} c={concurrency:<4} {row['throughput_rps']:8.1f} req/s  p50={row['p50_ms']:7.0f}ms  "
+                    f"p90={row['p90_ms']:7.0f}ms  p99={row['p99_ms']:7.0f}ms  errors={row['errors']}"
+                )
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "server": args.server,
+            "workers": args.workers,
+            "threads": args.threads,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "fakes": asdict(config),
+            "env": extra_env,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -25,6 +25,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -109,7 +110,10 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'content-range',  # resumable uploads to the local storage stand-in
 ]
+# Lets browsers read how much of a resumable upload arrived
+CORS_EXPOSE_HEADERS = ['range']
 
 # Security settings for production
 SECURE_BROWSER_XSS_FILTER = True
@@ -172,13 +176,19 @@ GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "")
 # Handle Google Cloud credentials from environment or file
 if os.getenv("GOOGLE_CREDENTIALS"):
     # Production: Use credentials from Secret Manager (as environment variable)
+    # Written once to a path derived from the content, so every worker and
+    # restart in the same container reuses the file instead of adding another
+    import hashlib
     import tempfile
-    import json
     credentials_json = os.getenv("GOOGLE_CREDENTIALS")
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-        f.write(credentials_json)
-        GOOGLE_APPLICATION_CREDENTIALS = f.name
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = f.name
+    digest = hashlib.sha256(credentials_json.encode()).hexdigest()[:16]
+    GOOGLE_APPLICATION_CREDENTIALS = os.path.join(tempfile.gettempdir(), f"legalease-sa-{digest}.json")
+    if not os.path.exists(GOOGLE_APPLICATION_CREDENTIALS):
+        tmp_path = f"{GOOGLE_APPLICATION_CREDENTIALS}.{os.getpid()}"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            f.write(credentials_json)
+        os.replace(tmp_path, GOOGLE_APPLICATION_CREDENTIALS)
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = GOOGLE_APPLICATION_CREDENTIALS
 elif os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
     # Development: Use file path
     GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "")
@@ -1,5 +1,7 @@
+import os
+
 from django.contrib import admin
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
@@ -7,8 +9,30 @@ from django.conf.urls.static import static
 def root_view(_request):
     return JsonResponse({"status": "ok", "service": "LegalEase API", "routes": ["/api/"]})
 
+
+def ready_view(_request):
+    # Startup/readiness probe: the first call starts warming the Google clients in the
+    # background; every call only reports the stored state
+    from api.services import warmup
+
+    warmup.start_background()
+    state = warmup.status()
+    return JsonResponse(state, status=200 if state["ready"] else 503)
+
+
+def metrics_view(request):
+    # Prometheus scrape target; set METRICS_TOKEN to require "Authorization: Bearer <token>"
+    from api.services import metrics
+
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.META.get("HTTP_AUTHORIZATION", "") != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 urlpatterns = [
     path("", root_view),
+    path("ready", ready_view),
+    path("metrics", metrics_view),
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),
 ]
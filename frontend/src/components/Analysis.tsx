@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from "react";
 import { useParams } from "react-router-dom";
-import { analyzeDocument } from "../services/api";
+import { analyzeDocument, analyzeDocumentStream } from "../services/api";
 import type { AnalyzeResponse } from "../services/api";
 import { useT } from "../i18n";
 
@@ -23,16 +23,40 @@ const Analysis: React.FC = () => {
   useEffect(() => {
     if (!documentId) return;
     (async () => {
+      if (lang !== "en") {
+        // Translations of the stored English analysis come back in one response
+        try {
+          setData(await analyzeDocument(documentId, undefined, lang));
+        } catch {
+          alert("Failed to analyze");
+        } finally {
+          setLoading(false);
+        }
+        return;
+      }
+      let partial: AnalyzeResponse = { document_id: documentId, summary: "", risks: [], glossary: [] };
       try {
-        const res = await analyzeDocument(documentId);
+        // Render each part as it arrives; fall back to the single response if streaming fails
+        const res = await analyzeDocumentStream(documentId, (e) => {
+          if (e.event === "summary") partial = { ...partial, summary: e.data.summary };
+          else if (e.event === "risk") partial = { ...partial, risks: [...partial.risks, e.data] };
+          else if (e.event === "term") partial = { ...partial, glossary: [...partial.glossary, e.data] };
+          else return;
+          setData(partial);
+          setLoading(false);
+        });
         setData(res);
       } catch (e) {
-        alert("Failed to analyze");
+        try {
+          setData(await analyzeDocument(documentId));
+        } catch {
+          alert("Failed to analyze");
+        }
       } finally {
         setLoading(false);
       }
     })();
-  }, [documentId]);
+  }, [documentId, lang]);
 
   if (loading) return <div className="p-6">Loading...</div>;
   if (!data) return <div className="p-6">No data</div>;
@@ -47,7 +71,7 @@ const Analysis: React.FC = () => {
           {t("summary")}
         </h2>
         <div className="bg-gray-50 border rounded-2xl shadow p-6 text-lg leading-relaxed whitespace-pre-wrap text-center">
-          {data.summary}
+          {data.summary || "…"}
         </div>
       </section>
 
@@ -1,13 +1,18 @@
 export type UploadResponse = {
   document_id: string;
   gcs_path: string;
+  version?: number;
+  previous_version_id?: string | null;
 };
 
+type UploadSession = { document_id: string; upload_url: string };
+
 export type AnalyzeResponse = {
   document_id: string;
   summary: string;
   risks: { clause: string; risk: string; explanation: string }[];
   glossary: { term: string; definition: string }[];
+  language?: string;
 };
 
 export type VoiceQnAResponse = {
@@ -40,25 +45,150 @@ async function authorizedFetch(input: RequestInfo | URL, init: RequestInit = {})
   return fetch(input, { ...init, headers });
 }
 
-export async function uploadDocument(category: string, file: File): Promise<UploadResponse> {
-  const form = new FormData();
-  form.append("category", category);
-  form.append("file", file);
+// Resumable upload chunks must be multiples of 256 KiB (except the last)
+const UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024;
+const UPLOAD_MAX_RETRIES = 5;
+
+async function sha256Hex(file: File): Promise<string | undefined> {
+  if (!globalThis.crypto?.subtle) return undefined;
+  const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+}
 
-  const resp = await authorizedFetch(`${API_BASE}/api/upload/`, {
+// Sends the file straight to storage, resuming from what arrived after a dropped connection
+async function sendResumable(url: string, file: File): Promise<void> {
+  let offset = 0;
+  let failures = 0;
+  for (;;) {
+    const end = Math.min(offset + UPLOAD_CHUNK_BYTES, file.size);
+    let resp: Response;
+    try {
+      resp = await fetch(url, {
+        method: "PUT",
+        headers: { "Content-Range": `bytes ${offset}-${end - 1}/${file.size}` },
+        body: file.slice(offset, end),
+      });
+    } catch (e) {
+      if (++failures > UPLOAD_MAX_RETRIES) throw e;
+      resp = await fetch(url, { method: "PUT", headers: { "Content-Range": `bytes */${file.size}` } });
+    }
+    if (resp.ok) return;
+    if (resp.status !== 308) throw new Error(`Upload failed: ${resp.status}`);
+    const range = resp.headers.get("Range");
+    offset = range ? Number(range.split("-")[1]) + 1 : 0;
+  }
+}
+
+export async function uploadDocument(category: string, file: File): Promise<UploadResponse> {
+  const slotResp = await authorizedFetch(`${API_BASE}/api/uploads/`, {
     method: "POST",
-    body: form,
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      category,
+      filename: file.name,
+      content_type: file.type || "application/octet-stream",
+      size: file.size,
+      // Checked against the stored bytes when the server hashes them after the upload completes
+      sha256: await sha256Hex(file),
+    }),
   });
+  if (!slotResp.ok) throw new Error(`Upload failed: ${slotResp.status}`);
+  const slot: UploadSession = await slotResp.json();
+  await sendResumable(slot.upload_url, file);
+  const resp = await authorizedFetch(`${API_BASE}/api/uploads/${slot.document_id}/complete/`, { method: "POST" });
   if (!resp.ok) throw new Error(`Upload failed: ${resp.status}`);
   return resp.json();
 }
 
-export async function analyzeDocument(documentId: string): Promise<AnalyzeResponse> {
-  const resp = await authorizedFetch(`${API_BASE}/api/analyze/${documentId}/`);
+export type DocumentSummary = {
+  document_id: string;
+  filename: string;
+  category: string;
+  content_type?: string | null;
+  size?: number | null;
+  status?: "pending" | "uploaded" | null;
+  version: number;
+  created_at: string;
+  summary?: string | null;
+};
+
+// One page of the signed-in user's documents, newest first; pass next_cursor back for the following page.
+export async function listDocuments(
+  options: { limit?: number; cursor?: string | null; category?: string; status?: "pending" | "uploaded" } = {}
+): Promise<{ documents: DocumentSummary[]; next_cursor: string | null }> {
+  const params = new URLSearchParams();
+  if (options.limit) params.set("limit", String(options.limit));
+  if (options.cursor) params.set("cursor", options.cursor);
+  if (options.category) params.set("category", options.category);
+  if (options.status) params.set("status", options.status);
+  const query = params.toString();
+  const resp = await authorizedFetch(`${API_BASE}/api/documents/${query ? `?${query}` : ""}`);
+  if (!resp.ok) throw new Error(`Listing documents failed: ${resp.status}`);
+  return resp.json();
+}
+
+export type AnalysisField = "summary" | "risks" | "glossary";
+
+// Pass fields to fetch only some parts (e.g. ["summary"] for a card); parts never requested are not computed.
+// A language other than "en" returns a translation of the English analysis.
+// Responses carry an ETag, so the browser cache revalidates repeat calls instead of refetching.
+export async function analyzeDocument(
+  documentId: string,
+  fields?: AnalysisField[],
+  language?: string
+): Promise<AnalyzeResponse> {
+  const params = new URLSearchParams();
+  if (fields?.length) params.set("fields", fields.join(","));
+  if (language && language !== "en") params.set("language", language);
+  const query = params.toString() ? `?${params}` : "";
+  const resp = await authorizedFetch(`${API_BASE}/api/analyze/${documentId}/${query}`);
   if (!resp.ok) throw new Error(`Analyze failed: ${resp.status}`);
   return resp.json();
 }
 
+export type AnalyzeEvent =
+  | { event: "summary"; data: { summary: string } }
+  | { event: "risk"; data: AnalyzeResponse["risks"][number] }
+  | { event: "term"; data: AnalyzeResponse["glossary"][number] }
+  | { event: "changes" | "error" | "done"; data: any };
+
+// Streams the analysis as server-sent events; onEvent sees each risk and term as soon as it is ready.
+// Resolves with the complete analysis once the server sends "done".
+export async function analyzeDocumentStream(
+  documentId: string,
+  onEvent: (e: AnalyzeEvent) => void
+): Promise<AnalyzeResponse> {
+  const resp = await authorizedFetch(`${API_BASE}/api/analyze/${documentId}/stream/`, {
+    headers: { Accept: "text/event-stream" },
+  });
+  if (!resp.ok || !resp.body) throw new Error(`Analyze failed: ${resp.status}`);
+  const result: AnalyzeResponse = { document_id: documentId, summary: "", risks: [], glossary: [] };
+  const reader = resp.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+  let done = false;
+  while (!done) {
+    const chunk = await reader.read();
+    if (chunk.done) break;
+    buffer += chunk.value;
+    let end: number;
+    while ((end = buffer.indexOf("\n\n")) >= 0) {
+      const block = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      const event = /^event: (.*)$/m.exec(block)?.[1];
+      const data = /^data: (.*)$/m.exec(block)?.[1];
+      if (!event || data === undefined) continue;
+      const e = { event, data: JSON.parse(data) } as AnalyzeEvent;
+      if (e.event === "summary") result.summary = e.data.summary;
+      else if (e.event === "risk") result.risks.push(e.data);
+      else if (e.event === "term") result.glossary.push(e.data);
+      else if (e.event === "done") done = true;
+      onEvent(e);
+    }
+  }
+  if (!done) throw new Error("Analysis stream ended early");
+  return result;
+}
+
 export async function voiceQnA(payload: { question?: string; audio_base64?: string; language?: string }): Promise<VoiceQnAResponse> {
   const resp = await authorizedFetch(`${API_BASE}/api/voice-qna/`, {
     method: "POST",